@@ -85,6 +85,7 @@ class Automata:
 		self.monitor = None
 		self.flags = flags or []
 		self.job_method = None
+		self.pending = False # submitted without waiting
 		# Workspaces should be per Automata
 		from accelerator.job import WORKDIRS
 		WORKDIRS.update(self.list_workdirs())
@@ -145,6 +146,9 @@ class Automata:
 		"""
 		Submit job to server and conditionaly wait for completion.
 		"""
+		if wait and self.pending:
+			# This job may use what the jobs we didn't wait for build.
+			self.wait()
 		self.job_method = method
 		if not why_build and 'why_build' in self.flags:
 			why_build = 'on_build'
@@ -160,11 +164,14 @@ class Automata:
 		if workdir:
 			data.workdir = workdir
 		t0 = time.time()
-		self.job_retur = self._server_submit(data)
+		self.job_retur = self._server_submit(data, wait)
 		self.history.append((data, self.job_retur))
 		#
-		if wait and not self.job_retur.done:
-			self.wait(t0)
+		if not self.job_retur.done:
+			if wait:
+				self.wait(t0)
+			else:
+				self.pending = True
 		if self.monitor and not why_build:
 			self.monitor.done()
 		return self.jobid(method), self.job_retur
@@ -232,6 +239,8 @@ class Automata:
 			path.append('full')
 		path.append('?subjob_cookie=%s&timeout=%d' % (self.subjob_cookie or '', timeout,))
 		resp = self._url_json(*path)
+		if resp.idle:
+			self.pending = False
 		if 'last_error' in resp and not ignore_errors:
 			print("\nFailed to build jobs:", file=sys.stderr)
 			for jobid, method, status in resp.last_error:
@@ -240,9 +249,12 @@ class Automata:
 			raise e
 		return resp.idle, resp.get('status_stacks'), resp.get('current'), resp.get('last_time')
 
-	def _server_submit(self, json):
+	def _server_submit(self, json, wait=True):
 		# submit json to server
-		postdata = urlencode({'json': setupfile.encode_setup(json)})
+		postdata = {'json': setupfile.encode_setup(json)}
+		if not wait:
+			postdata['wait'] = 'no'
+		postdata = urlencode(postdata)
 		res = self._url_json('submit', data=postdata)
 		if 'error' in res:
 			raise DaemonError('Submit failed: ' + res.error)
@@ -287,8 +299,8 @@ class Automata:
 	def list_workdirs(self):
 		return self._url_json('list_workdirs')
 
-	def call_method(self, method, options={}, datasets={}, jobids={}, record_in=None, record_as=None, why_build=False, caption=None, workdir=None):
-		jid, res = self._submit(method, options, datasets, jobids, caption, why_build=why_build, workdir=workdir)
+	def call_method(self, method, options={}, datasets={}, jobids={}, record_in=None, record_as=None, why_build=False, caption=None, workdir=None, wait=True):
+		jid, res = self._submit(method, options, datasets, jobids, caption, wait=wait, why_build=why_build, workdir=workdir)
 		if why_build: # specified by caller
 			return res.why_build
 		if 'why_build' in res: # done by server anyway (because --flags why_build)
@@ -592,6 +604,7 @@ class Urd(object):
 		path = self._path(path)
 		assert self._current, 'Tried to finish %s with nothing running' % (path,)
 		assert path == self._current, 'Tried to finish %s while running %s' % (path, self._current,)
+		self.wait()
 		user, build = path.split('/')
 		self._current = None
 		caption = caption or self._current_caption or ''
@@ -618,16 +631,25 @@ class Urd(object):
 		"""Build jobs in this workdir, None to restore default"""
 		self.workdir = workdir
 
-	def build(self, method, options={}, datasets={}, jobids={}, name=None, caption=None, why_build=False, workdir=None):
-		return self._a.call_method(method, options=options, datasets=datasets, jobids=jobids, record_as=name, caption=caption, why_build=why_build, workdir=workdir or self.workdir)
+	def build(self, method, options={}, datasets={}, jobids={}, name=None, caption=None, why_build=False, workdir=None, wait=True):
+		"""Build (or find) a job. With wait=False this returns without
+		waiting for the job to finish, so several independent jobs can run
+		at the same time (as the daemon concurrency allows). The next build
+		with wait=True (or .wait() or .finish()) waits for them first."""
+		return self._a.call_method(method, options=options, datasets=datasets, jobids=jobids, record_as=name, caption=caption, why_build=why_build, workdir=workdir or self.workdir, wait=wait)
+
+	def wait(self):
+		"""Wait for the jobs that were built with wait=False"""
+		if self._a.pending:
+			self._a.wait()
 
-	def build_chained(self, method, options={}, datasets={}, jobids={}, name=None, caption=None, why_build=False, workdir=None):
+	def build_chained(self, method, options={}, datasets={}, jobids={}, name=None, caption=None, why_build=False, workdir=None, wait=True):
 		datasets = dict(datasets or {})
 		assert 'previous' not in datasets, "Don't specify previous dataset to build_chained"
 		assert name, "build_chained must have 'name'"
 		assert self._latest_joblist is not None, "Can't build_chained without a dependency to chain from"
 		datasets['previous'] = self._latest_joblist.get(name)
-		return self.build(method, options, datasets, jobids, name, caption, why_build, workdir)
+		return self.build(method, options, datasets, jobids, name, caption, why_build, workdir, wait)
 
 	def warn(self, line=''):
 		"""Add a warning message to be displayed at the end of the build"""
@@ -743,6 +765,7 @@ def run_automata(options, cfg):
 	else:
 		a.update_methods()
 	module_ref.main(urd)
+	urd.wait()
 	urd._show_warnings()
 
 
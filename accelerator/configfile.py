@@ -64,7 +64,7 @@ def load_config(filename):
 	key = None
 	multivalued = {'workdirs', 'method packages', 'interpreters'}
 	required = {'slices', 'logfile', 'workdirs', 'method packages'}
-	known = {'target workdir', 'listen', 'urd', 'result directory', 'source directory', 'project directory'} | required | multivalued
+	known = {'target workdir', 'listen', 'urd', 'result directory', 'source directory', 'project directory', 'concurrency'} | required | multivalued
 	cfg = {key: [] for key in multivalued}
 	cfg['listen'] = '.socket.dir/daemon', None
 
@@ -80,9 +80,13 @@ def load_config(filename):
 			raise _E("Don't override DEFAULT interpreter")
 		if not os.path.isfile(val[1]):
 			raise _E('%r does not exist' % (val,))
+	def check_concurrency(val):
+		if val < 1:
+			raise _E('concurrency must be at least 1, not %d' % (val,))
 
 	parsers = dict(
 		slices=int,
+		concurrency=int,
 		workdirs=partial(parse_pair, 'workdir'),
 		interpreters=partial(parse_pair, 'interpreter'),
 		listen=resolve_listen,
@@ -90,6 +94,7 @@ def load_config(filename):
 	)
 	checkers = dict(
 		interpreter=check_interpreter,
+		concurrency=check_concurrency,
 	)
 
 	try:
@@ -20,7 +20,7 @@
 from __future__ import print_function
 from __future__ import division
 
-from threading import Thread
+from threading import Thread, RLock
 from os import unlink
 from os.path import join
 import time
@@ -54,6 +54,10 @@ class Main:
 		self.config = config
 		self.debug = options.debug
 		self.daemon_url = daemon_url
+		# Jobs in a build can run concurrently, and each can submit subjobs.
+		# Everything that looks at or changes the workspaces or the
+		# database holds this.
+		self.lock = RLock()
 		self._update_methods()
 		self.target_workdir = self.config['target_workdir']
 		self.workspaces = {}
@@ -72,20 +76,21 @@ class Main:
 		self.Methods = methods.SubMethods(method_directories, METHODS_CONFIGFILENAME, self.config)
 
 	def update_methods(self):
-		try:
-			self._update_methods()
-			self.update_database()
-			self.broken = False
-		except methods.MethodLoadException as e:
-			self.broken = e.module_list
-			return {'broken': e.module_list}
+		with self.lock:
+			try:
+				self._update_methods()
+				self.update_database()
+				self.broken = False
+			except methods.MethodLoadException as e:
+				self.broken = e.module_list
+				return {'broken': e.module_list}
 
 
 	def get_workspace_details(self):
 		""" Some information about main workspace, some parts of config """
 		return dict(
 			[(key, getattr(self.workspaces[self.target_workdir], key),) for key in ('slices',)] +
-			[(key, self.config.get(key),) for key in ('source_directory', 'result_directory', 'common_directory', 'urd',)]
+			[(key, self.config.get(key),) for key in ('source_directory', 'result_directory', 'common_directory', 'urd', 'concurrency',)]
 		)
 
 
@@ -111,14 +116,19 @@ class Main:
 
 
 	def add_single_jobid(self, jobid):
-		ws = self.workspaces[jobid.rsplit('-', 1)[0]]
-		ws.add_single_jobid(jobid)
-		return self.DataBase.add_single_jobid(jobid)
+		with self.lock:
+			ws = self.workspaces[jobid.rsplit('-', 1)[0]]
+			ws.add_single_jobid(jobid)
+			return self.DataBase.add_single_jobid(jobid)
 
 	def update_database(self):
 		"""Insert all new jobids (from all workdirs) in database,
 		discard all deleted or with incorrect hash.
 		"""
+		with self.lock:
+			self._update_database()
+
+	def _update_database(self):
 		t_l = []
 		for name in self.workspaces:
 			# Run all updates in parallel. This gets all (sync) listdir calls
@@ -150,12 +160,13 @@ class Main:
 		ws = workdir or self.target_workdir
 		if ws not in self.workspaces:
 			raise Exception("Workdir %s does not exist" % (ws,))
-		return dependency.initialise_jobs(
-			setup,
-			self.workspaces[ws],
-			self.DataBase,
-			self.Methods,
-		)
+		with self.lock:
+			return dependency.initialise_jobs(
+				setup,
+				self.workspaces[ws],
+				self.DataBase,
+				self.Methods,
+			)
 
 
 	def run_job(self, jobid, subjob_cookie=None, parent_pid=0):
@@ -30,7 +30,7 @@ import os
 import resource
 import time
 from stat import S_ISSOCK
-from threading import Thread, Lock as TLock, Lock as JLock
+from threading import Thread, Condition, Lock as TLock
 from string import ascii_letters
 import random
 import atexit
@@ -54,9 +54,72 @@ DEBUG_WRITE_JSON = False
 def gen_cookie(size=16):
 	return ''.join(random.choice(ascii_letters) for _ in range(size))
 
-# This contains cookie: {lock, last_error, last_time, workdir}
+class Budget(object):
+	"""How many processes the jobs may use together (concurrency in the
+	config). A job uses one per slice. When nothing is running a job can
+	always start."""
+
+	def __init__(self):
+		self.cond = Condition()
+		self.size = 1
+		self.used = 0
+
+	def take(self, n):
+		with self.cond:
+			while n and self.used and self.used + n > self.size:
+				self.cond.wait()
+			self.used += n
+
+	def give(self, n):
+		if n:
+			with self.cond:
+				self.used -= n
+				self.cond.notify_all()
+
+budget = Budget()
+
+def new_tracking(workdir, depth, slots=0):
+	return DotDict(
+		running=0,
+		idle=Condition(),
+		slots=slots,
+		last_error=None,
+		last_time=0,
+		workdir=workdir,
+		depth=depth,
+	)
+
+def acquire(data):
+	"""Count a build for this cookie. A job that builds subjobs waits for
+	them, so it lends its slots to them in the meantime."""
+	with data.idle:
+		if not data.running:
+			budget.give(data.slots)
+		data.running += 1
+
+def release(data):
+	"""Count a build as done and wake everyone waiting for it in status"""
+	with data.idle:
+		data.running -= 1
+		if not data.running:
+			budget.take(data.slots)
+			data.idle.notify_all()
+
+def drop_slots(data):
+	"""The job is done, give back its slots (unless they are lent out)"""
+	with data.idle:
+		if not data.running:
+			budget.give(data.slots)
+		data.slots = 0
+
+# This contains cookie: {running, idle, slots, last_error, last_time, workdir, depth}
 # for all jobs, main jobs have cookie None.
-job_tracking = {None: DotDict(lock=JLock(), last_error=None, last_time=0, workdir=None)}
+# running counts the builds for the cookie, idle protects it (and the
+# last_* values). Always count with acquire() and release(), so status
+# waiters wake up.
+# Jobs can run concurrently, so cookie_lock protects adding and removing.
+job_tracking = {None: new_tracking(None, 0)}
+cookie_lock = TLock()
 
 
 # This needs .ctrl to work. It is set from main()
@@ -89,19 +152,21 @@ class XtdHandler(BaseWebHandler):
 				self.do_response(400, 'text/plain', 'bad subjob_cookie!\n' )
 				return
 			timeout = min(float(args.get('timeout', 0)), 128)
-			status = DotDict(idle=data.lock.acquire(False))
 			deadline = time.time() + timeout
-			while not status.idle and time.time() < deadline:
-				time.sleep(0.1)
-				status.idle = data.lock.acquire(False)
-			if status.idle:
-				if data.last_error:
-					status.last_error = data.last_error
-					data.last_error = None
-				else:
-					status.last_time = data.last_time
-				data.lock.release()
-			elif path == ['status', 'full']:
+			with data.idle:
+				while data.running:
+					remaining = deadline - time.time()
+					if remaining <= 0:
+						break
+					data.idle.wait(remaining)
+				status = DotDict(idle=not data.running)
+				if status.idle:
+					if data.last_error:
+						status.last_error = data.last_error
+						data.last_error = None
+					else:
+						status.last_time = data.last_time
+			if not status.idle and path == ['status', 'full']:
 				status.status_stacks, status.current = status_stacks_export()
 			self.do_response(200, "text/json", status)
 			return
@@ -146,101 +211,136 @@ class XtdHandler(BaseWebHandler):
 				if not data:
 					self.do_response(403, 'text/plain', 'bad subjob_cookie!\n' )
 					return
-				if len(job_tracking) - 1 > 5: # max five levels
+				if data.depth > 5: # max five levels
 					print('Too deep subjob nesting!')
 					self.do_response(403, 'text/plain', 'Too deep subjob nesting')
 					return
-				if data.lock.acquire(False):
-					still_locked = True
-					respond_after = True
-					try:
-						if self.DEBUG:  print('@daemon.py:  Got the lock!', file=sys.stderr)
-						workdir = setup.get('workdir', data.workdir)
-						jobidv, job_res = self.ctrl.initialise_jobs(setup, workdir)
-						job_res['done'] = False
-						if jobidv:
-							error = []
-							tlock = TLock()
-							link2job = {j['link']: j for j in job_res['jobs'].values()}
-							def run(jobidv, tlock):
-								for jobid in jobidv:
-									passed_cookie = None
-									# This is not a race - all higher locks are locked too.
-									while passed_cookie in job_tracking:
-										passed_cookie = gen_cookie()
-									job_tracking[passed_cookie] = DotDict(
-										lock=JLock(),
-										last_error=None,
-										last_time=0,
-										workdir=workdir,
-									)
-									try:
-										self.ctrl.run_job(jobid, subjob_cookie=passed_cookie, parent_pid=setup.get('parent_pid', 0))
-										# update database since a new jobid was just created
-										job = self.ctrl.add_single_jobid(jobid)
-										with tlock:
-											link2job[jobid]['make'] = 'DONE'
-											link2job[jobid]['total_time'] = job.total
-									except JobError as e:
-										error.append([e.jobid, e.method, e.status])
-										with tlock:
-											link2job[jobid]['make'] = 'FAIL'
+				# Builds for the same cookie can run at the same time, they
+				# share the budget with everything else.
+				acquire(data)
+				still_running = True
+				respond_after = True
+				try:
+					workdir = setup.get('workdir', data.workdir)
+					jobidv, depends, job_res = self.ctrl.initialise_jobs(setup, workdir)
+					job_res['done'] = False
+					if jobidv:
+						error = []
+						tlock = TLock()
+						link2job = {j['link']: j for j in job_res['jobs'].values()}
+						# Each job uses one process per slice, but never more
+						# than the whole budget.
+						slots = min(self.ctrl.config.slices, budget.size)
+						def run_one(jobid, cond, running, built):
+							budget.take(slots)
+							with cookie_lock:
+								passed_cookie = None
+								while passed_cookie in job_tracking:
+									passed_cookie = gen_cookie()
+								tracking = job_tracking[passed_cookie] = new_tracking(workdir, data.depth + 1, slots)
+							try:
+								with cond:
+									if error:
+										# Something failed while this waited for its slots.
 										return
-									finally:
-										del job_tracking[passed_cookie]
-								# everything was built ok, update symlink
+								self.ctrl.run_job(jobid, subjob_cookie=passed_cookie, parent_pid=setup.get('parent_pid', 0))
+								# update database since a new jobid was just created
+								job = self.ctrl.add_single_jobid(jobid)
+								with tlock:
+									link2job[jobid]['make'] = 'DONE'
+									link2job[jobid]['total_time'] = job.total
+								with cond:
+									built.add(jobid)
+							except JobError as e:
+								with cond:
+									error.append([e.jobid, e.method, e.status])
+								with tlock:
+									link2job[jobid]['make'] = 'FAIL'
+							finally:
+								with cookie_lock:
+									del job_tracking[passed_cookie]
+								drop_slots(tracking)
+								with cond:
+									running.discard(jobid)
+									cond.notify()
+						def run(jobidv):
+							# Start each job when everything it depends on is built,
+							# run_one waits for room in the budget.
+							# After a failure no more jobs are started.
+							cond = Condition()
+							todo = list(jobidv)
+							running = set()
+							built = set()
+							with cond:
+								while todo and not error:
+									ready = [jobid for jobid in todo if depends[jobid] <= built]
+									if not ready and not running:
+										error.append([todo[0], "unknown", {"INTERNAL": "Unbuildable dependencies"}])
+										break
+									for jobid in ready:
+										todo.remove(jobid)
+										running.add(jobid)
+										t = Thread(target=run_one, name="job runner " + jobid, args=(jobid, cond, running, built,))
+										t.daemon = True
+										t.start()
+									cond.wait()
+								while running:
+									cond.wait()
+							if error:
+								return
+							# everything was built ok, update symlink
+							try:
+								dn = self.ctrl.workspaces[workdir].path
+								ln = os.path.join(dn, workdir + "-LATEST_")
 								try:
-									dn = self.ctrl.workspaces[workdir].path
-									ln = os.path.join(dn, workdir + "-LATEST_")
-									try:
-										os.unlink(ln)
-									except OSError:
-										pass
-									os.symlink(jobid, ln)
-									os.rename(ln, os.path.join(dn, workdir + "-LATEST"))
+									os.unlink(ln)
 								except OSError:
-									traceback.print_exc()
-							t = Thread(target=run, name="job runner", args=(jobidv, tlock,))
-							t.daemon = True
-							t.start()
-							t.join(2) # give job two seconds to complete
-							with tlock:
-								for j in link2job.values():
-									if j['make'] in (True, 'FAIL',):
-										respond_after = False
-										job_res_json = json_encode(job_res)
-										break
-							if not respond_after: # not all jobs are done yet, give partial response
-								self.do_response(200, "text/json", job_res_json)
-							t.join() # wait until actually complete
-							del tlock
-							del t
-							# verify that all jobs got built.
-							total_time = 0
+									pass
+								os.symlink(jobidv[-1], ln)
+								os.rename(ln, os.path.join(dn, workdir + "-LATEST"))
+							except OSError:
+								traceback.print_exc()
+						t = Thread(target=run, name="job runner", args=(jobidv,))
+						t.daemon = True
+						t.start()
+						# give job two seconds to complete, unless the client isn't waiting
+						t.join(2 if args.get('wait') != 'no' else 0)
+						with tlock:
 							for j in link2job.values():
-								jobid = j['link']
-								if j['make'] == True:
-									# Well, crap.
-									error.append([jobid, "unknown", {"INTERNAL": "Not built"}])
-									print("INTERNAL ERROR IN JOB BUILDING!", file=sys.stderr)
-								total_time += j.get('total_time', 0)
-							data.last_error = error
+								if j['make'] in (True, 'FAIL',):
+									respond_after = False
+									job_res_json = json_encode(job_res)
+									break
+						if not respond_after: # not all jobs are done yet, give partial response
+							self.do_response(200, "text/json", job_res_json)
+						t.join() # wait until actually complete
+						del t
+						# verify that all jobs got built.
+						total_time = 0
+						for j in link2job.values():
+							jobid = j['link']
+							if j['make'] == True and not error:
+								# Well, crap.
+								error.append([jobid, "unknown", {"INTERNAL": "Not built"}])
+								print("INTERNAL ERROR IN JOB BUILDING!", file=sys.stderr)
+							total_time += j.get('total_time', 0)
+						with data.idle:
+							# Several builds can fail before anyone asks.
+							if error:
+								data.last_error = (data.last_error or []) + error
 							data.last_time = total_time
-					except Exception as e:
-						if respond_after:
-							data.lock.release()
-							still_locked = False
-							self.do_response(500, "text/json", {'error': str(e)})
-						raise
-					finally:
-						if still_locked:
-							data.lock.release()
+				except Exception as e:
 					if respond_after:
-						job_res['done'] = True
-						self.do_response(200, "text/json", job_res)
-					if self.DEBUG:  print("@daemon.py:  Process releases lock!", file=sys.stderr) # note: has already done http response
-				else:
-					self.do_response(503, 'text/plain', 'Busy doing work for you...\n')
+						release(data)
+						still_running = False
+						self.do_response(500, "text/json", {'error': str(e)})
+					raise
+				finally:
+					if still_running:
+						release(data)
+				if respond_after:
+					job_res['done'] = True
+					self.do_response(200, "text/json", job_res)
 			else:
 				self.do_response(400, 'text/plain', 'Missing json input!\n' )
 		else:
@@ -363,6 +463,7 @@ def main(argv, config):
 
 	XtdHandler.ctrl = ctrl
 	job_tracking[None].workdir = ctrl.target_workdir
+	budget.size = config.get('concurrency', config.slices)
 
 	for n in ("project_directory", "result_directory", "source_directory", "urd_listen"):
 		if n == "urd_listen":
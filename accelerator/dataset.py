@@ -130,6 +130,8 @@ _new_dataset_marker = _New_dataset_marker('new')
 _no_override = object()
 
 _ds_cache = {}
+_rehash_cstuff = None # the dataset_rehash backend, loaded when needed
+
 def _ds_load(obj):
 	n = unicode(obj)
 	if n not in _ds_cache:
@@ -348,6 +350,88 @@ class Dataset(unicode):
 		from accelerator.g import slices
 		return compress(it, self._column_iterator(None, hashlabel, hashfilter=(sliceno, slices)))
 
+	def _can_share_rehash(self, hashlabel):
+		# Only analysis has several processes that can share the work.
+		from accelerator.g import running
+		if running != 'analysis':
+			return False
+		from accelerator.standard_methods.dataset_rehash import hashable_types
+		return self.columns[hashlabel].backing_type in hashable_types
+
+	def _shared_rehash_iterator(self, sliceno, hashlabel, columns):
+		"""Like _hashfilter, but every source slice is only read once.
+		Whichever analysis process gets to a source slice first splits
+		it (in C) into one temp file per destination slice, and the
+		other processes just read their part. Lines come in the same
+		order as with _hashfilter."""
+		from accelerator.sourcedata import type2iter
+		from itertools import chain
+		filenames = self._shared_rehash(sliceno, hashlabel, columns)
+		res = []
+		for col in columns:
+			mkiter = type2iter[self.columns[col].backing_type]
+			res.append(chain.from_iterable(imap(mkiter, filenames[col])))
+		return res
+
+	def _shared_rehash(self, sliceno, hashlabel, columns):
+		from accelerator.g import slices
+		from accelerator.extras import saved_files, Temp
+		from accelerator.standard_methods.dataset_rehash import rehashfuncs
+		from fcntl import flock, LOCK_EX
+		from hashlib import md5
+		from itertools import chain
+		from resource import getpagesize
+		global _rehash_cstuff
+		if not _rehash_cstuff:
+			from accelerator.standard_methods import dataset_rehash
+			_rehash_cstuff = dataset_rehash.init()
+		cstuff = _rehash_cstuff
+		key = 'rehash-' + md5(('%s\0%s' % (self, hashlabel,)).encode('utf-8')).hexdigest()
+		colnums = {col: ix for ix, col in enumerate(sorted(self.columns))}
+		# The hashlabel builds the slicemap the other columns follow.
+		todo = [hashlabel] + sorted(set(columns) - {hashlabel})
+		pagesize = getpagesize()
+		def spill(src, lock_fh):
+			flock(lock_fh, LOCK_EX) # released when lock_fh is closed
+			slicemap_fn = '%s.%d.slicemap' % (key, src,)
+			slicemap_size = (self.lines[src] * 2 // pagesize + 1) * pagesize
+			for col in todo:
+				base = '%s.%d.%d' % (key, src, colnums[col],)
+				if os.path.exists(base + '.done'):
+					continue
+				dc = self.columns[col]
+				build_slicemap = (col == hashlabel)
+				with open(slicemap_fn, 'w+b' if build_slicemap else 'rb') as slicemap_fh:
+					if build_slicemap:
+						saved_files[slicemap_fn] = Temp.TEMP
+						slicemap_fh.truncate(slicemap_size)
+					if dc.offsets:
+						offset, max_count = dc.offsets[src], self.lines[src]
+					else:
+						offset, max_count = 0, -1
+					out_fns = ['%s.%d' % (base, dst,) for dst in range(slices)]
+					line_count = cstuff.mk_uint64(slices)
+					c = getattr(cstuff.backend, rehashfuncs[dc.backing_type])
+					res = c(*cstuff.bytesargs([self.column_filename(col, src)], 1, [offset], [max_count], out_fns, 'wb1', None, slices, slicemap_fh.fileno(), slicemap_size, build_slicemap, line_count))
+					assert not res, 'Failed to rehash %s in %s' % (col, self,)
+				for fn in out_fns:
+					saved_files[fn] = Temp.TEMP
+				with open(base + '.done', 'wb'):
+					saved_files[base + '.done'] = Temp.TEMP
+		# Start with our own slice so all processes start out working
+		# in parallel. Only one lock is held at a time, so whatever
+		# slices are actually iterating there is no deadlock.
+		for src in chain(range(sliceno, slices), range(sliceno)):
+			if self.lines[src]:
+				lock_fn = '%s.%d.lock' % (key, src,)
+				with open(lock_fn, 'ab') as lock_fh:
+					saved_files[lock_fn] = Temp.TEMP
+					spill(src, lock_fh)
+		return {
+			col: ['%s.%d.%d.%d' % (key, src, colnums[col], sliceno,) for src in range(slices) if self.lines[src]]
+			for col in columns
+		}
+
 	def column_filename(self, colname, sliceno=None):
 		dc = self.columns[colname]
 		jid, name = dc.location.split('/', 1)
@@ -641,7 +725,12 @@ class Dataset(unicode):
 						continue
 					except StopIteration:
 						return
-				it = d._iterator(None if rehash else sliceno, columns)
+				if rehash and d._can_share_rehash(rehash):
+					it = d._shared_rehash_iterator(sliceno, rehash, columns)
+					shared_rehash, rehash = rehash, False
+				else:
+					it = d._iterator(None if rehash else sliceno, columns)
+					shared_rehash = False
 				for ix, trans in translators.items():
 					it[ix] = imap(trans, it[ix])
 				if want_tuple:
@@ -660,6 +749,8 @@ class Dataset(unicode):
 						else:
 							if rehash:
 								filter_it = d._hashfilter(sliceno, rehash, d._column_iterator(None, range_k))
+							elif shared_rehash:
+								filter_it = d._shared_rehash_iterator(sliceno, shared_rehash, [range_k])[0]
 							else:
 								filter_it = d._column_iterator(sliceno, range_k)
 							it = compress(it, imap(range_check, filter_it))
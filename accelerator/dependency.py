@@ -94,7 +94,7 @@ def initialise_jobs(setup, target_WorkSpace, DataBase, Methods, verbose=False):
 				res[job['method']] = find_possible_jobs(DataBase, Methods, job)
 			else:
 				res[job['method']] = {job['link']: {}}
-		return [], {'why_build': res}
+		return [], {}, {'why_build': res}
 
 	if num_new_jobs:
 		new_jobid_list = target_WorkSpace.allocate_jobs(num_new_jobs)
@@ -125,5 +125,10 @@ def initialise_jobs(setup, target_WorkSpace, DataBase, Methods, verbose=False):
 	else:
 		new_jobid_list = []
 
+	# {jobid: set(jobids that have to be built before it)}
+	depends = {}
+	for data in newjoblist:
+		depends[data['link']] = set(DepTree.tree[dep]['link'] for dep in data['dep'] if DepTree.tree[dep]['make'])
+
 	res = {j['method']: {k: v for k, v in j.items() if k in ('link', 'make', 'total_time')} for j in joblist}
-	return new_jobid_list, {'jobs': res}
+	return new_jobid_list, depends, {'jobs': res}
@@ -73,6 +73,12 @@ result directory: {prefix}/results
 source directory: {source}
 logfile: {prefix}/daemon.log
 
+# Jobs built with urd.build(..., wait=False) (and jobs from several build
+# scripts) can run at the same time. This is how many processes they may
+# use together, and each job counts as slices processes. Defaults to slices
+# (one job at a time).
+# concurrency: {concurrency}
+
 # If you want to run methods on different python interpreters you can
 # specify names for other interpreters here, and put that name after
 # the method in methods.conf.
@@ -164,6 +170,7 @@ def main(argv):
 			prefix=options.prefix,
 			workdir=cfg_workdir,
 			slices=options.slices,
+			concurrency=options.slices * 2,
 			source=options.source,
 			major=version_info.major,
 			minor=version_info.minor,
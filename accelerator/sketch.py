@@ -0,0 +1,217 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import print_function
+from __future__ import division
+
+# Small mergeable summaries of a stream of values, as made by the
+# dataset_sketch method. Both use memory that depends only on their
+# parameters, not on how many values they have seen, and can be merged
+# with sketches of other values (from other slices or datasets).
+
+from math import ceil
+from bisect import bisect_right
+from collections import Counter
+from itertools import islice
+
+__all__ = ('QuantileSketch', 'TopK',)
+
+
+class QuantileSketch(object):
+	"""KLL quantile sketch. Ranks (and so quantiles) are accurate to
+	within about 1.7 / k of the count (with high probability).
+
+	None and NaN are not included, they are only counted in skipped.
+	Min and max are exact.
+	"""
+
+	def __init__(self, k=200, seed=0):
+		self.k = k
+		self.count = 0
+		self.skipped = 0
+		self._min = None
+		self._max = None
+		# level h holds items that each stand for 2**h values
+		self._levels = [[]]
+		self._size = 0
+		self._max_size = self._capacity(0)
+		# state for the coin flips in _compress
+		self._state = seed & 0xffffffffffffffff
+
+	def _capacity(self, h):
+		depth = len(self._levels) - h - 1
+		return int(ceil((2 / 3) ** depth * self.k)) + 1
+
+	def _coin(self):
+		self._state = (self._state * 6364136223846793005 + 1442695040888963407) & 0xffffffffffffffff
+		return self._state >> 63
+
+	def _minmax(self, items):
+		# items is sorted
+		if items:
+			if self._min is None or items[0] < self._min:
+				self._min = items[0]
+			if self._max is None or items[-1] > self._max:
+				self._max = items[-1]
+
+	@property
+	def min(self):
+		self._minmax(sorted(self._levels[0]))
+		return self._min
+
+	@property
+	def max(self):
+		self._minmax(sorted(self._levels[0]))
+		return self._max
+
+	def _compress(self):
+		while self._size >= self._max_size:
+			for h, items in enumerate(self._levels):
+				if len(items) >= self._capacity(h):
+					if h + 1 == len(self._levels):
+						self._levels.append([])
+					items.sort()
+					if h == 0:
+						self._minmax(items)
+					# An odd item out stays, every other one of the rest moves up.
+					odd = len(items) % 2
+					self._levels[h + 1].extend(items[odd + self._coin()::2])
+					self._levels[h] = items[:odd]
+					break
+			self._size = sum(len(items) for items in self._levels)
+			self._max_size = sum(self._capacity(h) for h in range(len(self._levels)))
+
+	def update(self, values):
+		"""Add all values (an iterable)"""
+		it = iter(values)
+		while True:
+			chunk = list(islice(it, self._max_size - self._size))
+			if not chunk:
+				return
+			kept = [v for v in chunk if v is not None and v == v]
+			self.skipped += len(chunk) - len(kept)
+			self.count += len(kept)
+			self._levels[0].extend(kept)
+			self._size += len(kept)
+			self._compress()
+
+	def merge(self, other):
+		"""Add everything other has seen to this sketch"""
+		assert self.k == other.k, "Can't merge sketches with different k"
+		while len(self._levels) < len(other._levels):
+			self._levels.append([])
+		for h, items in enumerate(other._levels):
+			self._levels[h].extend(items)
+		self.count += other.count
+		self.skipped += other.skipped
+		for v in (other._min, other._max):
+			if v is not None:
+				self._minmax([v])
+		self._state ^= other._state
+		self._size = sum(len(items) for items in self._levels)
+		self._max_size = sum(self._capacity(h) for h in range(len(self._levels)))
+		self._compress()
+
+	def _weighted(self):
+		# sorted [(value, weight)]
+		res = []
+		for h, items in enumerate(self._levels):
+			res.extend((v, 1 << h) for v in items)
+		res.sort(key=lambda item: item[0])
+		return res
+
+	def rank(self, value):
+		"""About how many values are <= value"""
+		return sum(sum(1 for v in items if v <= value) << h for h, items in enumerate(self._levels))
+
+	def quantile(self, q):
+		"""About the value with q (0 to 1) of the values <= it"""
+		return self.quantiles([q])[0]
+
+	def quantiles(self, qs):
+		"""quantile() for each q in qs"""
+		weighted = self._weighted()
+		if not weighted:
+			return [None] * len(qs)
+		cumulative = []
+		total = 0
+		for _, weight in weighted:
+			total += weight
+			cumulative.append(total)
+		res = []
+		for q in qs:
+			if q <= 0:
+				res.append(self.min)
+			elif q >= 1:
+				res.append(self.max)
+			else:
+				ix = bisect_right(cumulative, q * total)
+				res.append(weighted[min(ix, len(weighted) - 1)][0])
+		return res
+
+	def __repr__(self):
+		return '<QuantileSketch k=%d count=%d>' % (self.k, self.count,)
+
+
+class TopK(object):
+	"""Misra-Gries heavy hitters with counters counters. Every value
+	seen more than count / (counters + 1) times is in it, and each
+	estimated count is at most error too low (never too high).
+	"""
+
+	def __init__(self, counters=100):
+		self.counters = counters
+		self.count = 0
+		self.error = 0
+		self._counts = {}
+
+	def _add(self, counts):
+		# counts is {value: count}, this is also how merging works.
+		for v, c in counts.items():
+			self._counts[v] = self._counts.get(v, 0) + c
+		if len(self._counts) > self.counters:
+			cut = sorted(self._counts.values(), reverse=True)[self.counters]
+			self._counts = {v: c - cut for v, c in self._counts.items() if c > cut}
+			self.error += cut
+
+	def update(self, values):
+		"""Add all values (an iterable)"""
+		it = iter(values)
+		while True:
+			# Counting a chunk is much faster than one value at a time,
+			# and it's just a merge with a (very accurate) sketch.
+			chunk = Counter(islice(it, 100000))
+			if not chunk:
+				return
+			self.count += sum(chunk.values())
+			self._add(chunk)
+
+	def merge(self, other):
+		"""Add everything other has seen to this sketch"""
+		assert self.counters == other.counters, "Can't merge sketches with different counters"
+		self.count += other.count
+		self.error += other.error
+		self._add(other._counts)
+
+	def top(self, n=None):
+		"""[(value, estimated count)] with the highest counts first"""
+		res = sorted(self._counts.items(), key=lambda item: -item[1])
+		return res[:n] if n else res
+
+	def __repr__(self):
+		return '<TopK counters=%d count=%d>' % (self.counters, self.count,)
@@ -20,26 +20,49 @@
 from __future__ import division
 from __future__ import absolute_import
 
+description = r"""
+Export datasets as CSV (or TSV, with separator '\t') or as JSON lines.
+
+Values are written as str() of the value, except floats which are
+written as repr(). With format=jsonl each line is a JSON object with
+the labels as keys, None becomes null (as do NaN and infinities), dates
+and times become strings and json columns are included as they are.
+
+When none of the columns are json the lines are formatted in C,
+directly from the stored values.
+"""
+
 from shutil import copyfileobj
+import os
 from os import unlink
 from contextlib import contextmanager
+from math import isnan, isinf
+from json import dumps as json_dumps
 from ujson import dumps
 
 from accelerator.compat import PY3, PY2, izip, imap
 
-from accelerator.extras import OptionString, job_params
+from accelerator.extras import OptionString, OptionEnum, job_params
 from accelerator.status import status
 
 from accelerator.gzutil import GzWriteUnicodeLines, GzWriteBytesLines
+from . import csvexport
+
+depend_extra = (csvexport,)
+
+cstuff = csvexport.init()
+
+FormatEnum = OptionEnum('csv jsonl')
 
 options = dict(
-	filename          = OptionString, # .csv or .gz
+	filename          = OptionString, # .csv, .tsv, .jsonl or .gz
 	separator         = ',',
 	labelsonfirstline = True,
 	chain_source      = False, # everything in source is replaced by datasetchain(self, stop=from previous)
 	quote_fields      = '', # can be ' or "
 	labels            = [], # empty means all labels in (first) dataset
 	sliced            = False, # one output file per slice, put %02d or similar in filename
+	format            = FormatEnum.csv,
 )
 
 datasets = (['source'],) # normally just one, but you can specify several
@@ -68,7 +91,99 @@ if PY3:
 else:
 	enc = lambda s: s.encode('utf-8')
 
-def csvexport(sliceno, filename, labelsonfirstline):
+def json_str(v):
+	return json_dumps(v, ensure_ascii=False)
+
+def json_float(v):
+	if isnan(v) or isinf(v):
+		return 'null'
+	return repr(v)
+
+def json_number(v):
+	if isinstance(v, float):
+		return json_float(v)
+	return str(v)
+
+if PY3:
+	json_bytes = lambda v: json_str(v.decode('utf-8', errors='backslashreplace'))
+else:
+	json_bytes = lambda v: json_str(v.decode('utf-8', 'replace'))
+
+# How each type is formatted for jsonl (None is handled separately).
+json_formatters = {
+	'float64' : json_float,
+	'float32' : json_float,
+	'number'  : json_number,
+	'bool'    : lambda v: 'true' if v else 'false',
+	'json'    : dumps,
+	'bytes'   : json_bytes,
+	'ascii'   : json_str,
+	'unicode' : json_str,
+	'datetime': lambda v: json_str(str(v)),
+	'date'    : lambda v: json_str(str(v)),
+	'time'    : lambda v: json_str(str(v)),
+}
+
+def json_formatter(t):
+	f = json_formatters.get(t, str)
+	return lambda v: 'null' if v is None else f(v)
+
+def native_export(sliceno, filename, labelsonfirstline, d):
+	# Returns False if the C version can't export these columns (or
+	# refused, because the python version raises an error).
+	jsonl = (options.format == 'jsonl')
+	gzip = filename.lower().endswith('.gz')
+	for label in options.labels:
+		t = d.columns[label].type
+		if t not in csvexport.native_types:
+			return False
+		if any(ds.columns[label].type != t for ds in datasets.source):
+			return False
+		if t == 'bytes' and jsonl and PY2:
+			return False
+		if t == 'number' and not jsonl and PY2:
+			return False # repr() gives longs an L suffix
+	if gzip and not jsonl and '\n' in options.separator + ''.join(options.labels):
+		return False # GzWriteUnicodeLines refuses newlines
+	in_fns = []
+	offsets = []
+	max_counts = []
+	for ds in datasets.source:
+		if not ds.lines[sliceno]:
+			continue
+		for label in options.labels:
+			in_fns.append(ds.column_filename(label, sliceno))
+			offsets.append(ds.columns[label].offsets[sliceno] if ds.columns[label].offsets else 0)
+		max_counts.append(ds.lines[sliceno])
+	types = [csvexport.native_types[d.columns[label].type] for label in options.labels]
+	flags = 0
+	if gzip:
+		flags |= csvexport.FLAG_GZIP
+		if not jsonl:
+			flags |= csvexport.FLAG_REFUSE_NEWLINE
+	if PY3 or jsonl:
+		flags |= csvexport.FLAG_DECODE_BYTES
+	header = None
+	if jsonl:
+		flags |= csvexport.FLAG_JSONL
+		prefixes = [', ' + json_str(label) + ': ' for label in options.labels]
+		prefixes[0] = '{' + prefixes[0][2:]
+		suffix = '}\n'
+		quote_char = 0
+	else:
+		prefixes = [''] + [options.separator] * (len(options.labels) - 1)
+		suffix = '\n'
+		q = options.quote_fields
+		quote_char = ord(q) if q else 0
+		if labelsonfirstline:
+			header = options.separator.join(q + n.replace(q, q + q) + q for n in options.labels) + '\n'
+	failed = cstuff.backend.export(*cstuff.bytesargs(in_fns, offsets, max_counts, len(max_counts), len(options.labels), types, prefixes, suffix, header, filename, flags, quote_char))
+	if failed == csvexport.REFUSED:
+		return False
+	assert not failed, 'Failed to export slice %d' % (sliceno,)
+	return True
+
+def export_slice(sliceno, filename, labelsonfirstline):
 	assert len(options.separator) == 1
 	assert options.quote_fields in ('', "'", '"',)
 	d = datasets.source[0]
@@ -86,17 +201,23 @@ def csvexport(sliceno, filename, labelsonfirstline):
 		datasets.source = lst
 	if filename.lower().endswith('.gz'):
 		mkwrite = mkwrite_gz
-	elif filename.lower().endswith('.csv'):
+	elif filename.lower().endswith(('.csv', '.tsv', '.jsonl',)):
 		mkwrite = mkwrite_uncompressed
 	else:
-		raise Exception("Filename should end with .gz for compressed or .csv for uncompressed")
+		raise Exception("Filename should end with .gz for compressed or .csv, .tsv or .jsonl for uncompressed")
+	if native_export(sliceno, filename, labelsonfirstline, d):
+		return
 	iters = []
 	first = True
 	for label in options.labels:
 		it = d.iterate_list(sliceno, label, datasets.source, status_reporting=first)
 		first = False
 		t = d.columns[label].type
-		if t == 'unicode' and PY2:
+		if options.format == 'jsonl':
+			it = imap(json_formatter(t), it)
+			if PY2:
+				it = imap(enc, it)
+		elif t == 'unicode' and PY2:
 			it = imap(enc, it)
 		elif t == 'bytes' and PY3:
 			it = imap(lambda s: s.decode('utf-8', errors='backslashreplace'), it)
@@ -111,7 +232,11 @@ def csvexport(sliceno, filename, labelsonfirstline):
 	with mkwrite(filename) as write:
 		q = options.quote_fields
 		sep = options.separator
-		if q:
+		if options.format == 'jsonl':
+			keys = [enc(json_str(label) + ': ') for label in options.labels]
+			for data in it:
+				write('{' + ', '.join(k + v for k, v in izip(keys, data)) + '}')
+		elif q:
 			qq = q + q
 			if labelsonfirstline:
 				write(enc(sep.join(q + n.replace(q, qq) + q for n in options.labels)))
@@ -125,11 +250,36 @@ def csvexport(sliceno, filename, labelsonfirstline):
 
 def analysis(sliceno):
 	if options.sliced:
-		csvexport(sliceno, options.filename % (sliceno,), options.labelsonfirstline)
+		export_slice(sliceno, options.filename % (sliceno,), options.labelsonfirstline)
 	else:
 		labelsonfirstline = (sliceno == 0 and options.labelsonfirstline)
 		filename = '%d.gz' if options.filename.lower().endswith('.gz') else '%d.csv'
-		csvexport(sliceno, filename % (sliceno,), labelsonfirstline)
+		export_slice(sliceno, filename % (sliceno,), labelsonfirstline)
+
+def copy_file(infh, outfh):
+	# Let the kernel copy if possible, otherwise copyfileobj.
+	copied = 0
+	try:
+		size = os.fstat(infh.fileno()).st_size
+		outfh.flush()
+		infd, outfd = infh.fileno(), outfh.fileno()
+		if hasattr(os, 'copy_file_range'):
+			while copied < size:
+				n = os.copy_file_range(infd, outfd, size - copied, copied)
+				if not n:
+					break
+				copied += n
+		elif hasattr(os, 'sendfile'):
+			while copied < size:
+				n = os.sendfile(outfd, infd, copied, size - copied)
+				if not n:
+					break
+				copied += n
+	except (OSError, IOError):
+		pass
+	infh.seek(copied)
+	outfh.seek(0, os.SEEK_END)
+	copyfileobj(infh, outfh)
 
 def synthesis(params):
 	if not options.sliced:
@@ -138,5 +288,5 @@ def synthesis(params):
 			for sliceno in range(params.slices):
 				with status("Assembling %s (%d/%d)" % (options.filename, sliceno, params.slices)):
 					with open(filename % sliceno, "rb") as infh:
-						copyfileobj(infh, outfh)
+						copy_file(infh, outfh)
 					unlink(filename % sliceno)
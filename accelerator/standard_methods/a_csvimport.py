@@ -35,27 +35,57 @@ If comment or skip_lines is set also creates a "skipped" dataset containing
 lineno and data from skipped lines.
 
 If you want lineno for good lines too set lineno_label.
+
+Several files can be imported in one job, either with a glob pattern in
+filename or by listing more files in extra_filenames. They must all have
+the same labels. Uncompressed files are split in one range of lines per
+slice (so each slice gets consecutive lines), each compressed file is read
+by a single slice. You get one dataset with all the files, or a
+chain with one dataset per file if you set as_chain. Set filename_column
+to know which file each line came from. (The bad and skipped datasets
+always get a filename column when importing several files.) With as_chain
+the files can have different labels.
+
+If you set column2type those columns are converted while importing, with
+the same types (and defaults and filter_bad) as in dataset_type. All
+other columns are still bytes. This saves writing (and compressing) the
+columns twice when you would otherwise run dataset_type directly after.
+With filter_bad lines where some column fails to convert (and has no
+default) are left out, you find the count in num_filtered_lines. (The
+per file counts in files are from before filtering.)
+
+If you set hashlabel lines are sliced by the hash of that column, so the
+dataset is hashed just as if it was rehashed on that (bytes) column. A
+reader process then reads all files (compressed ones too) and sends each
+line to its slice. The hashlabel can't be in column2type, as the hash is
+of the bytes.
 '''
 
 
 import os
+from glob import glob
 from multiprocessing import Process
 from threading import Thread
 import struct
 import locale
+from os import unlink
 
-from accelerator.extras import OptionString, DotDict
+from accelerator.extras import OptionString, OptionDefault, DotDict
 from accelerator.dataset import DatasetWriter
 from accelerator.sourcedata import typed_reader
+from accelerator.gzwrite import typed_writer
 from accelerator.compat import setproctitle, uni
 from accelerator import blob
 from accelerator.report import Report
 from . import csvimport
+from . import dataset_type
+from . import a_dataset_type
 
-depend_extra = (csvimport,)
+depend_extra = (csvimport, dataset_type, a_dataset_type,)
 
 options = dict(
-	filename          = OptionString,
+	filename          = OptionString, # Can be a glob pattern, matching files are imported in sorted order.
+	extra_filenames   = [],    # More filenames (or glob patterns) to import after filename.
 	separator         = ',',   # Single iso-8859-1 character or empty for a single field.
 	comment           = '',    # Single iso-8859-1 character or empty, lines beginning with this character are ignored.
 	newline           = '',    # Empty means \n or \r\n, or you can specify any single iso-8859-1 character.
@@ -65,9 +95,15 @@ options = dict(
 	rename            = {},    # Labels to replace (if they are in the file) (happens first)
 	discard           = set(), # Labels to not include (if they are in the file)
 	lineno_label      = "",    # Label of column to store line number in (not stored if empty).
+	filename_column   = "",    # Label of column to store filename in (not stored if empty).
+	as_chain          = False, # One dataset per file (chained in order) instead of one for all files.
 	allow_bad         = False, # Still succeed if some lines have too few/many fields or bad quotes
 	                           # creates a "bad" dataset containing lineno and data from the bad lines.
 	skip_lines        = 0,     # skip this many lines at the start of the file.
+	column2type       = OptionDefault({'COLNAME': a_dataset_type.TYPENAME}, {}), # Convert these columns while importing (like dataset_type).
+	defaults          = {},    # {'COLNAME': value} for values that fail to convert, like dataset_type.
+	filter_bad        = False, # Leave out lines that fail to convert (instead of failing), like dataset_type.
+	hashlabel         = "",    # Slice by the hash of this column instead of round robin.
 	compression       = 6,     # gzip level
 )
 
@@ -90,14 +126,11 @@ def reader_status(status_fd, update):
 			break
 		count = struct.unpack("=Q", data)[0]
 
-def reader_process(slices, filename, write_fds, labels_fd, success_fd, status_fd, comment_char, lf_char):
+def close_other_fds(keep_fds):
 	# Terrible hack - try to close FDs we didn't want in this process.
 	# (This is important, if the main process dies this won't be
 	# detected if we still have these open.)
-	keep_fds = set(write_fds)
-	keep_fds.add(labels_fd)
-	keep_fds.add(success_fd)
-	keep_fds.add(status_fd)
+	keep_fds = set(keep_fds)
 	# a few extra to be safe.
 	for fd in range(3, max(keep_fds) + 32):
 		if fd not in keep_fds:
@@ -105,11 +138,25 @@ def reader_process(slices, filename, write_fds, labels_fd, success_fd, status_fd
 				os.close(fd)
 			except OSError:
 				pass
+
+def reader_process(slices, filename, write_fds, labels_fd, success_fd, status_fd, comment_char, lf_char):
+	close_other_fds(write_fds + [labels_fd, success_fd, status_fd])
 	setproctitle("reader")
 	res = cstuff.backend.reader(filename.encode("ascii"), slices, options.skip_lines, write_fds, labels_fd, status_fd, comment_char, lf_char)
 	os.write(success_fd, b"\x01" if res else b"\0")
 	os.close(success_fd)
 
+def hash_reader_process(slices, files, hash_ixes, write_fds, success_fd, status_fd, separator, quote_char, comment_char, lf_char):
+	close_other_fds(write_fds + [success_fd, status_fd])
+	setproctitle("reader")
+	rr = cstuff.mk_uint64() # round robin position for lines that can't be hashed
+	for (filename, labels_lineno, _, _, _), hash_ix in zip(files, hash_ixes):
+		res = cstuff.backend.hash_reader(*cstuff.bytesargs(filename, slices, options.skip_lines, comment_char, labels_lineno, write_fds, status_fd, separator, quote_char, lf_char, hash_ix, rr))
+		if res:
+			break
+	os.write(success_fd, b"\x01" if res else b"\0")
+	os.close(success_fd)
+
 def char2int(name, empty_value, specials="empty"):
 	char = options.get(name)
 	if not char:
@@ -124,6 +171,41 @@ def char2int(name, empty_value, specials="empty"):
 	assert len(char) == 1, msg
 	return cstuff.backend.char2int(char)
 
+def find_files(source_directory):
+	res = []
+	for name in [options.filename] + options.extra_filenames:
+		filename = os.path.join(source_directory, name)
+		if os.path.exists(filename):
+			res.append(filename)
+		else:
+			matches = sorted(glob(filename))
+			assert matches, "No files matching %r" % (filename,)
+			res.extend(matches)
+	assert len(res) == len(set(res)), "Some files are specified more than once: %r" % (res,)
+	return res
+
+def is_plain_file(filename):
+	# Uncompressed regular files can be split between the slices,
+	# anything else (compressed or not seekable) goes through the reader
+	# (or through a single slice when there are several files).
+	if not os.path.isfile(filename):
+		return False
+	with open(filename, "rb") as fh:
+		return fh.read(2) != b"\x1f\x8b"
+
+def read_labels():
+	with typed_reader("bytes")("labels") as fh:
+		labels = [lab.decode("utf-8", "backslashreplace") for lab in fh]
+	os.unlink("labels")
+	return labels
+
+def column_type(colname):
+	coltype = options.column2type.get(colname, 'bytes').split(':', 1)[0]
+	return dataset_type.typerename.get(coltype, coltype)
+
+def tmp_filename(dwix, colix, sliceno):
+	return 'typing.%d.%d.%d' % (dwix, colix, sliceno,)
+
 def prepare(job, slices):
 	# use 256 as a marker value, because that's not a possible char value (assuming 8 bit chars)
 	lf_char = char2int("newline", 256)
@@ -136,62 +218,154 @@ def prepare(job, slices):
 		quote_char = 257
 	else:
 		quote_char = char2int("quotes", 257, "True/False/empty")
-	filename = os.path.join(job.source_directory, options.filename)
-	orig_filename = filename
+	filenames = find_files(job.source_directory)
+	orig_filename = os.path.join(job.source_directory, options.filename)
+	as_chain = options.as_chain and len(filenames) > 1
 	assert 1 <= options.compression <= 9
+	if options.column2type:
+		a_dataset_type.cstuff.backend.init()
+
+	labels_from_file = None
+	if len(filenames) == 1 and not is_plain_file(filenames[0]) and not options.hashlabel:
+		files = None
+		fds = [os.pipe() for _ in range(slices)]
+		read_fds = [t[0] for t in fds]
+		write_fds = [t[1] for t in fds]
 
-	fds = [os.pipe() for _ in range(slices)]
-	read_fds = [t[0] for t in fds]
-	write_fds = [t[1] for t in fds]
+		if options.labelsonfirstline:
+			labels_rfd, labels_wfd = os.pipe()
+		else:
+			labels_wfd = -1
+		success_rfd, success_wfd = os.pipe()
+		status_rfd, status_wfd = os.pipe()
+
+		p = Process(target=reader_process, name="reader", args=(slices, filenames[0], write_fds, labels_wfd, success_wfd, status_wfd, comment_char, lf_char))
+		p.start()
+		for fd in write_fds:
+			os.close(fd)
+		os.close(success_wfd)
+		os.close(status_wfd)
+		status_wfd = None
 
-	if options.labelsonfirstline:
-		labels_rfd, labels_wfd = os.pipe()
+		if options.labelsonfirstline:
+			os.close(labels_wfd)
+			# re-use import logic
+			out_fns = ["labels"]
+			r_num = cstuff.mk_uint64(3)
+			res = cstuff.backend.import_slice(*cstuff.bytesargs(labels_rfd, -1, -1, -1, out_fns, b"wb1", b"wb1", separator, r_num, quote_char, lf_char, 0, None, 0))
+			os.close(labels_rfd)
+			assert res == 0, "c backend failed in label parsing"
+			labels_from_file = read_labels()
 	else:
-		labels_wfd = -1
-	success_rfd, success_wfd = os.pipe()
-	status_rfd, status_wfd = os.pipe()
-
-	p = Process(target=reader_process, name="reader", args=(slices, filename, write_fds, labels_wfd, success_wfd, status_wfd, comment_char, lf_char))
-	p.start()
-	for fd in write_fds:
-		os.close(fd)
-	os.close(success_wfd)
-	os.close(status_wfd)
-
-	if options.labelsonfirstline:
-		os.close(labels_wfd)
-		# re-use import logic
-		out_fns = ["labels"]
-		r_num = cstuff.mk_uint64(3)
-		res = cstuff.backend.import_slice(*cstuff.bytesargs(labels_rfd, -1, -1, -1, out_fns, b"wb1", separator, r_num, quote_char, lf_char, 0))
-		os.close(labels_rfd)
-		assert res == 0, "c backend failed in label parsing"
-		with typed_reader("bytes")("labels") as fh:
-			labels_from_file = [lab.decode("utf-8", "backslashreplace") for lab in fh]
-		os.unlink("labels")
+		# Every slice reads the files directly, no reader process needed.
+		# Uncompressed files are split in byte ranges (on line boundaries),
+		# one per slice, compressed files are read by a single slice each
+		# (spread by compressed size).
+		# Except with hashlabel, then a reader process is started below.
+		read_fds = success_rfd = None
+		status_rfd, status_wfd = os.pipe()
+		files = []
+		slice_sizes = [0] * slices
+		for filename in filenames:
+			if options.hashlabel or is_plain_file(filename):
+				owner = None
+			else:
+				owner = slice_sizes.index(min(slice_sizes))
+				slice_sizes[owner] += os.path.getsize(filename)
+			labels_lineno = 0
+			if options.labelsonfirstline:
+				out_fns = ["labels"]
+				r_num = cstuff.mk_uint64(3)
+				res = cstuff.backend.import_file(*cstuff.bytesargs(filename, -1, 0, -1, 0, options.skip_lines, comment_char, 0, -1, -1, out_fns, b"wb1", b"wb1", separator, r_num, quote_char, lf_char, 0, None))
+				assert res == 0, "c backend failed in label parsing"
+				labels_lineno = r_num[0] or -1
+				labels = read_labels()
+				if labels_lineno != -1:
+					if labels_from_file is None:
+						labels_from_file = labels
+						labels_filename = filename
+					elif not options.labels and not as_chain:
+						assert labels == labels_from_file, "%s has labels %r, but %s has %r" % (filename, labels, labels_filename, labels_from_file,)
+				else:
+					labels = None
+			else:
+				labels = None
+			if owner is None and not options.hashlabel and labels_lineno != -1:
+				starts = cstuff.mk_uint64(slices + 1)
+				counts = cstuff.mk_uint64(slices)
+				res = cstuff.backend.file_ranges(*cstuff.bytesargs(filename, slices, lf_char, starts, counts))
+				assert res == 0, "c backend failed splitting %s" % (filename,)
+				ranges = (list(starts), list(counts))
+			else:
+				ranges = None
+			files.append((filename, labels_lineno, owner, labels, ranges,))
+
+	def fix_labels(labels):
+		labels = options.labels or labels
+		assert labels, "No labels"
+		labels = [options.rename.get(x, x) for x in labels]
+		assert '' not in labels, "Empty label for column %d" % (labels.index(''),)
+		assert len(labels) == len(set(labels)), "Duplicate labels: %r" % (labels,)
+		assert options.filename_column not in labels, "filename_column %r is also a label" % (options.filename_column,)
+		for colname in options.column2type:
+			assert colname in labels and colname not in options.discard, "Column %r in column2type is not in %r" % (colname, labels,)
+		if options.hashlabel:
+			assert options.hashlabel in labels and options.hashlabel not in options.discard, "hashlabel %r is not in %r" % (options.hashlabel, labels,)
+			assert options.hashlabel not in options.column2type, "hashlabel %r can't be typed, use dataset_type to hash on typed values" % (options.hashlabel,)
+		return labels
+
+	if as_chain:
+		# Each file can have different labels when they are separate datasets.
+		chain = [(filename, fix_labels(labels or labels_from_file)) for filename, _, _, labels, _ in files]
 	else:
-		labels_from_file = None
-
-	labels = options.labels or labels_from_file
-	assert labels, "No labels"
-	labels = [options.rename.get(x, x) for x in labels]
-	assert '' not in labels, "Empty label for column %d" % (labels.index(''),)
-	assert len(labels) == len(set(labels)), "Duplicate labels: %r" % (labels,)
-
-	dw = DatasetWriter(
-		columns={n: 'bytes' for n in labels if n not in options.discard},
-		filename=orig_filename,
-		caption='csvimport of ' + orig_filename,
-		previous=datasets.previous,
-		meta_only=True,
-	)
-	if options.lineno_label:
-		dw.add(options.lineno_label, "int64")
+		chain = [(orig_filename, fix_labels(labels_from_file))]
+	dws = []
+	dw_labels = []
+	previous = datasets.previous
+	for ix, (filename, labels) in enumerate(chain):
+		name = "default" if ix == len(chain) - 1 else str(ix)
+		dw = DatasetWriter(
+			columns={n: column_type(n) for n in labels if n not in options.discard},
+			filename=filename,
+			hashlabel=options.hashlabel or None,
+			caption='csvimport of ' + filename,
+			previous=previous,
+			name=name,
+			meta_only=True,
+		)
+		if options.lineno_label:
+			dw.add(options.lineno_label, "int64")
+		if options.filename_column:
+			dw.add(options.filename_column, "unicode")
+		previous = (job, name)
+		dws.append(dw)
+		dw_labels.append(labels)
+
+	if options.hashlabel:
+		# One process reads all the files and sends each line to the
+		# slice it hashes to, like the reader for a single file.
+		fds = [os.pipe() for _ in range(slices)]
+		read_fds = [t[0] for t in fds]
+		write_fds = [t[1] for t in fds]
+		success_rfd, success_wfd = os.pipe()
+		hash_ixes = [dw_labels[ix if len(dws) > 1 else 0].index(options.hashlabel) for ix in range(len(files))]
+		p = Process(target=hash_reader_process, name="reader", args=(slices, files, hash_ixes, write_fds, success_wfd, status_wfd, separator, quote_char, comment_char, lf_char))
+		p.start()
+		for fd in write_fds:
+			os.close(fd)
+		os.close(success_wfd)
+		os.close(status_wfd)
+		status_wfd = None
+
+	# bad and skipped lines go in one dataset each even if there are several files.
+	extra_columns = dict(lineno="int64", data="bytes")
+	if len(filenames) > 1:
+		extra_columns["filename"] = "unicode"
 
 	if options.allow_bad:
 		bad_dw = DatasetWriter(
 			name="bad",
-			columns=dict(lineno="int64", data="bytes"),
+			columns=extra_columns,
 			caption='bad lines from csvimport of ' + orig_filename,
 			meta_only=True,
 		)
@@ -201,17 +375,17 @@ def prepare(job, slices):
 	if options.comment or options.skip_lines:
 		skipped_dw = DatasetWriter(
 			name="skipped",
-			columns=dict(lineno="int64", data="bytes"),
+			columns=extra_columns,
 			caption='skipped lines from csvimport of ' + orig_filename,
 			meta_only=True,
 		)
 	else:
 		skipped_dw = None
 
-	return separator, quote_char, lf_char, filename, orig_filename, labels, dw, bad_dw, skipped_dw, read_fds, success_rfd, status_rfd,
+	return separator, quote_char, lf_char, comment_char, filenames, files, dw_labels, dws, bad_dw, skipped_dw, read_fds, success_rfd, status_rfd, status_wfd,
 
 def analysis(sliceno, slices, prepare_res, update_top_status):
-	separator, quote_char, lf_char, filename, _, labels, dw, bad_dw, skipped_dw, fds, _, status_fd, = prepare_res
+	separator, quote_char, lf_char, comment_char, filenames, files, dw_labels, dws, bad_dw, skipped_dw, fds, _, status_fd, status_wfd, = prepare_res
 	if sliceno == 0:
 		t = Thread(
 			target=reader_status,
@@ -222,58 +396,206 @@ def analysis(sliceno, slices, prepare_res, update_top_status):
 		t.start()
 	else:
 		os.close(status_fd)
-	# Close the FDs for all other slices.
-	# Not techically necessary, but it feels like a good idea.
-	for ix, fd in enumerate(fds):
-		if ix != sliceno:
-			os.close(fd)
-	out_fns = []
-	for label in labels:
-		if label in options.discard:
-			out_fns.append(cstuff.NULL)
-		else:
-			out_fns.append(dw.column_filename(label))
-	for extra_dw in (bad_dw, skipped_dw):
-		if extra_dw:
-			for n in ("lineno", "data"):
-				out_fns.append(extra_dw.column_filename(n))
+		if status_wfd is not None:
+			os.close(status_wfd)
+			status_wfd = None
+	if fds:
+		# Close the FDs for all other slices.
+		# Not techically necessary, but it feels like a good idea.
+		for ix, fd in enumerate(fds):
+			if ix != sliceno:
+				os.close(fd)
+	def mk_out_fns(dwix, labels):
+		dw = dws[dwix]
+		out_fns = []
+		for colix, label in enumerate(labels):
+			if label in options.discard:
+				out_fns.append(cstuff.NULL)
+			elif options.column2type:
+				# Uncompressed, converted to the real columns by type_columns.
+				out_fns.append(tmp_filename(dwix, colix, sliceno))
+			else:
+				out_fns.append(dw.column_filename(label))
+		for extra_dw in (bad_dw, skipped_dw):
+			if extra_dw:
+				for n in ("lineno", "data"):
+					out_fns.append(extra_dw.column_filename(n))
+			else:
+				out_fns.append(cstuff.NULL)
+				out_fns.append(cstuff.NULL)
+		if options.lineno_label:
+			out_fns.append(dw.column_filename(options.lineno_label))
 		else:
 			out_fns.append(cstuff.NULL)
-			out_fns.append(cstuff.NULL)
-	if options.lineno_label:
-		out_fns.append(dw.column_filename(options.lineno_label))
+		return out_fns
+	if files is None:
+		r_num = cstuff.mk_uint64(3) # [good_count, bad_count, comment_count]
+		gzip_mode = b"wb%d" % (options.compression,)
+		label_mode = b"wbT" if options.column2type else gzip_mode
+		labels = dw_labels[0]
+		res = cstuff.backend.import_slice(*cstuff.bytesargs(fds[sliceno], sliceno, slices, len(labels), mk_out_fns(0, labels), gzip_mode, label_mode, separator, r_num, quote_char, lf_char, options.allow_bad, None, 0))
+		os.close(fds[sliceno])
+		assert res == 0, "c backend failed in slice %d" % (sliceno,)
+		return [list(r_num)], type_all(sliceno, slices, dws, dw_labels, [r_num[0]])
+	# All files append to the same output files (unless as_chain),
+	# concatenated gzip files are fine. With hashlabel the lines of each
+	# file come from the reader process (ending with a marker per file).
+	gzip_mode = b"ab%d" % (options.compression,)
+	label_mode = b"abT" if options.column2type else gzip_mode
+	status = -1 if status_wfd is None else status_wfd
+	per_file = []
+	for ix, (filename, labels_lineno, owner, _, ranges) in enumerate(files):
+		dwix = ix if len(dws) > 1 else 0
+		dw, labels = dws[dwix], dw_labels[dwix]
+		out_fns = mk_out_fns(dwix, labels)
+		out_fns.append(dw.column_filename(options.filename_column) if options.filename_column else cstuff.NULL)
+		for extra_dw in (bad_dw, skipped_dw):
+			out_fns.append(extra_dw.column_filename("filename") if extra_dw and len(filenames) > 1 else cstuff.NULL)
+		r_num = cstuff.mk_uint64(3) # [good_count, bad_count, comment_count]
+		if fds:
+			res = cstuff.backend.import_slice(*cstuff.bytesargs(fds[sliceno], sliceno, slices, len(labels), out_fns, gzip_mode, label_mode, separator, r_num, quote_char, lf_char, options.allow_bad, filename, 1))
+		else:
+			if ranges:
+				starts, counts = ranges
+				# (start, end, first_lineno)
+				args = (starts[sliceno], starts[sliceno + 1], sum(counts[:sliceno]), labels_lineno)
+			elif owner == sliceno:
+				args = (0, -1, 0, labels_lineno)
+			else:
+				# Not ours, but we need (empty) output files.
+				args = (0, 0, 0, -1)
+			res = cstuff.backend.import_file(*cstuff.bytesargs(filename, sliceno, args[0], args[1], args[2], options.skip_lines, comment_char, args[3], status, len(labels), out_fns, gzip_mode, label_mode, separator, r_num, quote_char, lf_char, options.allow_bad, filename))
+		assert res == 0, "c backend failed in slice %d on %s" % (sliceno, filename,)
+		per_file.append(list(r_num))
+	if fds:
+		os.close(fds[sliceno])
+	if status_wfd is not None:
+		os.close(status_wfd)
+	if len(dws) == 1:
+		dw_lines = [sum(counts[0] for counts in per_file)]
+	else:
+		dw_lines = [counts[0] for counts in per_file]
+	return per_file, type_all(sliceno, slices, dws, dw_labels, dw_lines)
+
+def type_all(sliceno, slices, dws, dw_labels, dw_lines):
+	# Returns [(filtered_count, default_count, minmax)] per dw
+	if not options.column2type:
+		return [(0, {}, {})] * len(dws)
+	return [type_columns(sliceno, slices, dwix, dw, labels, lines) for dwix, (dw, labels, lines) in enumerate(zip(dws, dw_labels, dw_lines))]
+
+def type_columns(sliceno, slices, dwix, dw, labels, lines):
+	# Convert the uncompressed bytes from the C importer using the
+	# dataset_type machinery. Untyped columns are converted as bytes
+	# (which just compresses them, or filters them with filter_bad).
+	tmp_fns = {}
+	column2type = {}
+	for colix, colname in enumerate(labels):
+		if colname not in options.discard:
+			tmp_fns[colname] = tmp_filename(dwix, colix, sliceno)
+			column2type[colname] = options.column2type.get(colname, 'bytes')
+	def sources(vars, colname):
+		fn = tmp_fns[colname]
+		return [fn], [0], [-1], lambda: typed_reader('bytes')(fn)
+	vars = DotDict(
+		sliceno=sliceno,
+		slices=slices,
+		badmap_size=0,
+		badmap_fd=-1,
+		slicemap_size=0,
+		slicemap_fd=-1,
+		map_fhs=[],
+		res_bad_count={},
+		res_default_count={},
+		res_minmax={},
+		first_lap=True,
+		rehashing=False,
+		lines={sliceno: lines},
+		sources=sources,
+		defaults=options.defaults,
+		filter_bad=options.filter_bad,
+		compression=options.compression,
+		threads=1,
+	)
+	def convert(colname):
+		a_dataset_type.one_column(vars, colname, column2type[colname], [dw.column_filename(colname)])
+		return colname
+	filtered = 0
+	if options.filter_bad:
+		badmap_fn = 'badmap%d.%d' % (dwix, sliceno,)
+		vars.badmap_fd = a_dataset_type.map_init(vars, badmap_fn)
+		_, bad_count = a_dataset_type.filter_bad_lap(vars, convert, list(column2type))
+		filtered = bad_count[0]
+		if filtered:
+			vars.first_lap = False
+			filter_extra_columns(vars, dw, tmp_fns, badmap_fn)
+		for fh in vars.map_fhs:
+			fh.close()
+		unlink(badmap_fn)
 	else:
-		out_fns.append(cstuff.NULL)
-	r_num = cstuff.mk_uint64(3) # [good_count, bad_count, comment_count]
-	gzip_mode = b"wb%d" % (options.compression,)
-	res = cstuff.backend.import_slice(*cstuff.bytesargs(fds[sliceno], sliceno, slices, len(labels), out_fns, gzip_mode, separator, r_num, quote_char, lf_char, options.allow_bad))
-	assert res == 0, "c backend failed in slice %d" % (sliceno,)
-	os.close(fds[sliceno])
-	return list(r_num)
+		for colname in column2type:
+			convert(colname)
+	for fn in tmp_fns.values():
+		unlink(fn)
+	minmax = {k: v for k, v in vars.res_minmax.items() if k in column2type}
+	return filtered, vars.res_default_count, minmax
+
+def filter_extra_columns(vars, dw, tmp_fns, badmap_fn):
+	# The lineno and filename columns were written directly, but need
+	# the filtered lines removed too.
+	if options.filename_column:
+		fn = dw.column_filename(options.filename_column)
+		tmp_fns[options.filename_column] = fn + '.unfiltered'
+		os.rename(fn, fn + '.unfiltered')
+		a_dataset_type.one_column(vars, options.filename_column, 'bytes', [fn])
+	if options.lineno_label:
+		with open(badmap_fn, 'rb') as fh:
+			badmap = bytearray(fh.read())
+		fn = dw.column_filename(options.lineno_label)
+		os.rename(fn, fn + '.unfiltered')
+		with typed_writer('int64')(fn) as w:
+			write = w.write
+			for ix, v in enumerate(typed_reader('int64')(fn + '.unfiltered')):
+				if not badmap[ix // 8] & (1 << (ix % 8)):
+					write(v)
+		unlink(fn + '.unfiltered')
 
 def synthesis(prepare_res, analysis_res):
-	separator, _, _, filename, _, labels, dw, bad_dw, skipped_dw, fds, success_fd, _, = prepare_res
-	# Analysis may have gotten a perfectly legitimate EOF if something
-	# went wrong in the reader process, so we need to check that all
-	# went well.
-	try:
-		reader_res = os.read(success_fd, 1)
-	except OSError:
-		reader_res = None
-	if reader_res != b"\0":
-		raise Exception("Reader process failed")
-	good_counts = []
-	bad_counts = []
-	skipped_counts = []
-	for sliceno, (good_count, bad_count, skipped_count) in enumerate(analysis_res):
-		dw.set_lines(sliceno, good_count)
+	_, _, _, _, filenames, _, dw_labels, dws, bad_dw, skipped_dw, fds, success_fd, _, _, = prepare_res
+	if fds:
+		# Analysis may have gotten a perfectly legitimate EOF if something
+		# went wrong in the reader process, so we need to check that all
+		# went well.
+		try:
+			reader_res = os.read(success_fd, 1)
+		except OSError:
+			reader_res = None
+		if reader_res != b"\0":
+			raise Exception("Reader process failed")
+	analysis_res = list(analysis_res)
+	typing_res = [slice_res[1] for slice_res in analysis_res]
+	analysis_res = [slice_res[0] for slice_res in analysis_res]
+	def per_slice(fileix, countix):
+		if fileix is None:
+			return [sum(counts[countix] for counts in slice_res) for slice_res in analysis_res]
+		else:
+			return [slice_res[fileix][countix] for slice_res in analysis_res]
+	filtered_counts = [sum(dw_res[0] for dw_res in slice_res) for slice_res in typing_res]
+	good_counts = [cnt - filtered for cnt, filtered in zip(per_slice(None, 0), filtered_counts)]
+	bad_counts = per_slice(None, 1)
+	skipped_counts = per_slice(None, 2)
+	for sliceno in range(len(analysis_res)):
+		if len(dws) == 1:
+			dws[0].set_lines(sliceno, good_counts[sliceno])
+		else:
+			for fileix, dw in enumerate(dws):
+				dw.set_lines(sliceno, analysis_res[sliceno][fileix][0] - typing_res[sliceno][fileix][0])
+		if options.column2type:
+			for dw, (_, _, minmax) in zip(dws, typing_res[sliceno]):
+				dw.set_minmax(sliceno, minmax)
 		if bad_dw:
-			bad_dw.set_lines(sliceno, bad_count)
+			bad_dw.set_lines(sliceno, bad_counts[sliceno])
 		if skipped_dw:
-			skipped_dw.set_lines(sliceno, skipped_count)
-		good_counts.append(good_count)
-		bad_counts.append(bad_count)
-		skipped_counts.append(skipped_count)
+			skipped_dw.set_lines(sliceno, skipped_counts[sliceno])
 	res = DotDict(
 		num_lines=sum(good_counts),
 		lines_per_slice=good_counts,
@@ -281,34 +603,69 @@ def synthesis(prepare_res, analysis_res):
 		broken_lines_per_slice=bad_counts,
 		num_skipped_lines=sum(skipped_counts),
 		skipped_lines_per_slice=skipped_counts,
+		num_filtered_lines=sum(filtered_counts),
+		filtered_lines_per_slice=filtered_counts,
+		files=[DotDict(
+			filename=filename,
+			num_lines=sum(per_slice(fileix, 0)),
+			num_broken_lines=sum(per_slice(fileix, 1)),
+			num_skipped_lines=sum(per_slice(fileix, 2)),
+		) for fileix, filename in enumerate(filenames)],
 	)
 	blob.save(res, 'import')
-	write_report(res, labels)
+	write_report(res, dw_labels[0])
+	if options.defaults:
+		print_defaulted(typing_res)
+
+def print_defaulted(typing_res):
+	# Like dataset_type, so you can tell when defaults were used.
+	defaulted = {}
+	for slice_res in typing_res:
+		for _, default_count, _ in slice_res:
+			for colname, cnt in default_count.items():
+				defaulted[colname] = defaulted.get(colname, 0) + cnt
+	if sum(defaulted.values()):
+		print('Defaulted values')
+		for colname, cnt in sorted(defaulted.items()):
+			if cnt:
+				print('    %s: %d' % (colname, cnt,))
 
 def write_report(res, labels):
 	with Report() as r:
-		divider = (res.num_lines + res.num_broken_lines + res.num_skipped_lines) or 1
+		divider = (res.num_lines + res.num_broken_lines + res.num_skipped_lines + res.num_filtered_lines) or 1
 		r.println("Number of rows read\n")
 		r.write("  slice           lines")
 		if res.num_broken_lines:
 			r.write("               broken")
 		if res.num_skipped_lines:
 			r.write("              skipped")
+		if res.num_filtered_lines:
+			r.write("             filtered")
 		r.write("\n")
-		for sliceno, (good_cnt, bad_cnt, skipped_cnt) in enumerate(zip(res.lines_per_slice, res.broken_lines_per_slice, res.skipped_lines_per_slice)):
+		for sliceno, (good_cnt, bad_cnt, skipped_cnt, filtered_cnt) in enumerate(zip(res.lines_per_slice, res.broken_lines_per_slice, res.skipped_lines_per_slice, res.filtered_lines_per_slice)):
 			r.write("  %5d       %9d  (%6.2f%%)" % (sliceno, good_cnt, 100 * good_cnt / divider,))
 			if res.num_broken_lines:
 				r.write(" %9d  (%6.2f%%)" % (bad_cnt, 100 * bad_cnt / divider,))
 			if res.num_skipped_lines:
 				r.write(" %9d  (%6.2f%%)" % (skipped_cnt, 100 * skipped_cnt / divider,))
+			if res.num_filtered_lines:
+				r.write(" %9d  (%6.2f%%)" % (filtered_cnt, 100 * filtered_cnt / divider,))
 			r.write("\n")
 		r.write("  total       %9d" % (res.num_lines,))
-		if res.num_broken_lines or res.num_skipped_lines:
+		if res.num_broken_lines or res.num_skipped_lines or res.num_filtered_lines:
 			r.write("  (%6.2f%%)" % (100 * res.num_lines / divider,))
 		if res.num_broken_lines:
 			r.write(" %9d  (%6.2f%%)" % (res.num_broken_lines, 100 * res.num_broken_lines / divider,))
 		if res.num_skipped_lines:
 			r.write(" %9d  (%6.2f%%)" % (res.num_skipped_lines, 100 * res.num_skipped_lines / divider,))
+		if res.num_filtered_lines:
+			r.write(" %9d  (%6.2f%%)" % (res.num_filtered_lines, 100 * res.num_filtered_lines / divider,))
 		r.write("\n")
+		if len(res.files) > 1:
+			r.line()
+			r.println("Number of rows read per file\n")
+			r.write("      lines     broken    skipped  filename\n")
+			for f in res.files:
+				r.write("  %9d  %9d  %9d  %s\n" % (f.num_lines, f.num_broken_lines, f.num_skipped_lines, f.filename,))
 		r.line()
 		r.println('Number of columns %5d' % len(labels,))
@@ -57,10 +57,19 @@ to make it easy to find. Naming a non-last dataset "default" is an error.
 If you set strip_dirs the filename (as used for both sorting and naming
 datasets, but not when matching regexes) will not include directories. The
 default is to include directories.
+
+If you set one_dataset all the files are imported as a single dataset
+(named "default"). They must then all have the same labels.
+
+The files are extracted in parallel (gzipped files are decompressed while
+extracting) and then all imported by a single csvimport job, so all slices
+take part in parsing every file. If you use filename_column it will
+contain the name of the extracted file, not the name inside the zip.
 '''
 
 from zipfile import ZipFile
 from shutil import copyfileobj
+from gzip import GzipFile
 from os.path import join
 import re
 
@@ -79,6 +88,7 @@ options.chaining = OptionEnum('off on by_filename by_dsname').on
 options.include_re = "" # Regex of files to include. (Matches anywhere, use ^$ as needed.)
 options.exclude_re = "" # Regex of files to exclude, takes priority over include.
 options.strip_dirs = False # Strip directories from filename (a/b/c -> c)
+options.one_dataset = False # Import all files as one dataset (named "default")
 
 datasets = ('previous', )
 
@@ -128,26 +138,47 @@ def prepare(job):
 		res.sort(key=lambda x: x[3])
 	if options.chaining == 'by_dsname':
 		res.sort(key=lambda x: x[2])
-	if options.chaining != 'off':
+	if options.chaining != 'off' and not options.one_dataset:
 		assert 'default' not in (x[2] for x in res[:-1]), 'When chaining the dataset named "default" must be last (or non-existant)'
 	return [x[:3] for x in res]
 
 def analysis(sliceno, slices, prepare_res, job):
 	with ZipFile(join(job.source_directory, options.filename), 'r') as z:
 		for tmpfn, zfn, dsn in prepare_res[sliceno::slices]:
+			with z.open(zfn) as rfh:
+				compressed = (rfh.read(2) == b'\x1f\x8b')
 			with z.open(zfn) as rfh:
 				with job.open(tmpfn, 'wb', temp=True) as wfh:
+					# Decompress here (in parallel) so csvimport can
+					# read all files in all slices.
+					if compressed:
+						rfh = GzipFile(fileobj=rfh, mode='rb')
 					copyfileobj(rfh, wfh)
 
-def synthesis(prepare_res):
+def synthesis(prepare_res, job):
 	opts = DotDict((k, v) for k, v in options.items() if k in a_csvimport.options)
 	lst = prepare_res
+	assert lst, "No files to import in %s" % (options.filename,)
+	opts.filename = lst[0][0]
+	opts.extra_filenames = [fn for fn, _, _ in lst[1:]]
+	opts.as_chain = (len(lst) > 1 and not options.one_dataset)
 	previous = datasets.previous
-	for fn, info, dsn in lst:
-		opts.filename = fn
-		jid = subjobs.build('csvimport', options=opts, datasets=dict(previous=previous), caption="Import of %s from %s" % (info.filename, options.filename,))
-		previous = Dataset(jid).link_to_here(dsn)
+	jid = subjobs.build('csvimport', options=opts, datasets=dict(previous=previous), caption="Import of %d files from %s" % (len(lst), options.filename,))
+	if not opts.as_chain:
+		dsn = 'default' if options.one_dataset else lst[0][2]
+		Dataset(jid).link_to_here(dsn)
+		if dsn != 'default':
+			Dataset(jid).link_to_here('default')
+		return
+	for ix, (fn, info, dsn) in enumerate(lst):
+		name = 'default' if ix == len(lst) - 1 else str(ix)
+		# Chain to the dataset linked here (or nothing), just like
+		# when the files were imported one at a time.
+		Dataset((jid, name)).link_to_here(dsn, override_previous=previous)
+		last_previous = previous
 		if options.chaining == 'off':
 			previous = None
-	if (len(lst) == 1 or options.chaining != 'off') and dsn != 'default':
-		Dataset(jid).link_to_here('default')
+		else:
+			previous = (job, dsn)
+	if options.chaining != 'off' and dsn != 'default':
+		Dataset(jid).link_to_here('default', override_previous=last_previous)
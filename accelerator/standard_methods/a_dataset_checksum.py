@@ -34,17 +34,28 @@ options.columns defaults to all columns in the source dataset.
 
 Note that this uses about 64 bytes of RAM per line, so you can't sum huge
 datasets. (So one GB per 20M lines or so.)
+
+If you set options.hash_sum=True a 128 bit hash of each line is summed
+(modulo 2**128) instead. This is done in C, uses constant memory and
+never depends on the order of the lines (so options.sort is ignored).
+The sum for each slice is also returned, as slice_sums. The hashes are
+of the values as they are stored, so this gives a different sum than
+the default and columns must have the same types to compare equal.
 '''
 
-from hashlib import md5
 from itertools import chain
 
 from accelerator.extras import DotDict
-from accelerator.compat import PY2
+from . import dataset_checksum
+
+depend_extra = (dataset_checksum,)
+
+cstuff = dataset_checksum.init()
 
 options = dict(
 	columns      = set(),
 	sort         = True,
+	hash_sum     = False,
 )
 
 datasets = ('source',)
@@ -54,18 +65,16 @@ def prepare():
 
 def analysis(sliceno, prepare_res):
 	columns = prepare_res
-	if len(columns) == 1:
-		columns = columns[0]
-	src = datasets.source.iterate(sliceno, columns)
-	if PY2:
-		return [md5(repr(line)).digest() for line in src]
-	else:
-		return [md5(repr(line).encode("utf-8")).digest() for line in src]
+	if options.hash_sum:
+		return dataset_checksum.hash_sum(cstuff, datasets.source, sliceno, columns)
+	return dataset_checksum.line_digests(datasets.source, sliceno, columns)
 
 def synthesis(prepare_res, analysis_res):
-	all = chain.from_iterable(analysis_res)
-	if options.sort:
-		all = sorted(all)
-	res = md5(b''.join(all)).hexdigest()
+	if options.hash_sum:
+		slice_sums = list(analysis_res)
+		res = sum(slice_sums) % (1 << 128)
+		print("%s: %032x" % (datasets.source, res,))
+		return DotDict(sum=res, slice_sums=slice_sums, hash_sum=True, sort=options.sort, columns=prepare_res, source=datasets.source)
+	res = dataset_checksum.digest_sum(chain.from_iterable(analysis_res), options.sort)
 	print("%s: %s" % (datasets.source, res,))
-	return DotDict(sum=int(res, 16), sort=options.sort, columns=prepare_res, source=datasets.source)
+	return DotDict(sum=int(res, 16), hash_sum=False, sort=options.sort, columns=prepare_res, source=datasets.source)
@@ -29,26 +29,89 @@ datasets.source is mandatory, datasets.stop is optional.
 options.chain_length defaults to -1.
 
 Sort does not sort across datasets.
+
+If you pass a previous dataset_checksum_chain job (with the same
+options) as jobids.previous only the datasets after its source are
+checksummed, and combined with the sum from previous. (datasets.stop is
+not used then.) The source of previous has to be in the chain of
+datasets.source. All datasets are checksummed in this job, each slice
+doing its part of every dataset. Without hash_sum each slice saves the
+line digests of each dataset, and synthesis combines one dataset at a
+time.
 '''
 
-from accelerator.subjobs import build
-from accelerator.extras import DotDict
+from itertools import chain
+
+from accelerator.extras import DotDict, job_params
+from accelerator.dataset import Dataset
 from accelerator import blob
+from . import dataset_checksum
+
+depend_extra = (dataset_checksum,)
+
+cstuff = dataset_checksum.init()
 
 options = dict(
 	chain_length = -1,
 	columns      = set(),
 	sort         = True,
+	hash_sum     = False,
 )
 
 datasets = ('source', 'stop',)
 
-def synthesis():
-	sum = 0
-	jobs = datasets.source.chain(length=options.chain_length, stop_ds=datasets.stop)
-	for src in jobs:
-		jid = build('dataset_checksum', options=dict(columns=options.columns, sort=options.sort), datasets=dict(source=src))
-		data = blob.load(jobid=jid)
-		sum ^= data.sum
-	print("Total: %016x" % (sum,))
-	return DotDict(sum=sum, columns=data.columns, sort=options.sort, sources=jobs)
+jobids = ('previous',)
+
+def prepare():
+	if jobids.previous:
+		previous = blob.load(jobid=jobids.previous)
+		assert previous.sort == options.sort, 'previous was made with sort=%r' % (previous.sort,)
+		assert previous.get('hash_sum', False) == options.hash_sum, 'previous was made with hash_sum=%r' % (previous.get('hash_sum', False),)
+		assert previous.get('options_columns') == sorted(options.columns), 'previous was made with other columns'
+		stop_ds = {jobids.previous: 'source'}
+	else:
+		previous = None
+		stop_ds = datasets.stop
+	jobs = datasets.source.chain(length=options.chain_length, stop_ds=stop_ds)
+	if previous:
+		# If the source of previous isn't in the chain it goes to the start,
+		# and the sum would be wrong.
+		prev_source = job_params(jobids.previous).datasets.source
+		if jobs:
+			ok = jobs[0].previous and Dataset(jobs[0].previous) == prev_source
+		else:
+			ok = datasets.source == prev_source
+		assert ok, '%s (the source of %s) is not in the chain of %s' % (prev_source, jobids.previous, datasets.source,)
+	return previous, [(src, sorted(options.columns or src.columns)) for src in jobs]
+
+def analysis(sliceno, prepare_res):
+	_, jobs = prepare_res
+	if options.hash_sum:
+		return [dataset_checksum.hash_sum(cstuff, src, sliceno, columns) for src, columns in jobs]
+	else:
+		for ix, (src, columns) in enumerate(jobs):
+			blob.save(dataset_checksum.line_digests(src, sliceno, columns), 'digests.%d' % (ix,), sliceno=sliceno, temp=True)
+
+def synthesis(params, prepare_res, analysis_res):
+	previous, jobs = prepare_res
+	if previous:
+		total = previous.sum
+		sources = list(previous.sources)
+		columns = previous.columns
+	else:
+		total = 0
+		sources = []
+		columns = None
+	if options.hash_sum:
+		# one list per slice, with one item per dataset
+		analysis_res = list(analysis_res)
+	for ix, (src, columns) in enumerate(jobs):
+		if options.hash_sum:
+			res = sum(part[ix] for part in analysis_res) % (1 << 128)
+		else:
+			parts = (blob.load('digests.%d' % (ix,), sliceno=sliceno) for sliceno in range(params.slices))
+			res = int(dataset_checksum.digest_sum(chain.from_iterable(parts), options.sort), 16)
+		total ^= res
+		sources.append(src)
+	print("Total: %016x" % (total,))
+	return DotDict(sum=total, columns=columns, options_columns=sorted(options.columns), sort=options.sort, hash_sum=options.hash_sum, sources=sources)
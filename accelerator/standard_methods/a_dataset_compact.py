@@ -0,0 +1,111 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import division
+from __future__ import absolute_import
+
+description = r'''
+Compact a dataset chain (to previous.source) into a single dataset.
+
+The column files are concatenated as is, so nothing is decompressed
+or recompressed. Data stays in the same slice, so the result is only
+hashed if all datasets in the chain have the same hashlabel.
+
+Columns that are not in all datasets (or that have different types in
+different datasets) are dropped with column_mismatch=intersect, or
+cause an error with column_mismatch=fail.
+'''
+
+import os
+from shutil import copyfileobj
+
+from accelerator.extras import OptionEnum
+from accelerator.dataset import DatasetWriter
+
+options = {
+	'caption'                   : '"%(caption)s" compacted',
+	'length'                    : -1, # Go back at most this many datasets. You almost always want -1 (which goes until previous.source)
+	'column_mismatch'           : OptionEnum('intersect fail').intersect,
+}
+
+datasets = ('source', 'previous',)
+
+def copy_slice(ds, colname, sliceno, out_fh):
+	"""Copy the raw (compressed) data for one slice of a column"""
+	dc = ds.columns[colname]
+	fn = ds.column_filename(colname, sliceno)
+	with open(fn, 'rb') as in_fh:
+		if dc.offsets:
+			start = dc.offsets[sliceno]
+			if sliceno + 1 < len(dc.offsets):
+				size = dc.offsets[sliceno + 1] - start
+			else:
+				size = os.fstat(in_fh.fileno()).st_size - start
+			in_fh.seek(start)
+			while size:
+				data = in_fh.read(min(size, 1024 * 1024))
+				assert data, "%s ended early" % (fn,)
+				out_fh.write(data)
+				size -= len(data)
+		else:
+			copyfileobj(in_fh, out_fh)
+
+def prepare():
+	chain = datasets.source.chain(stop_ds={datasets.previous: 'source'}, length=options.length)
+	columns = {}
+	for n, c in chain[0].columns.items():
+		if all(n in ds.columns and ds.columns[n].backing_type == c.backing_type for ds in chain):
+			columns[n] = c.type
+		elif options.column_mismatch == 'fail':
+			raise Exception('Column %r is not %s in all of %r' % (n, c.type, chain,))
+	if options.column_mismatch == 'fail':
+		for ds in chain:
+			extra = set(ds.columns) - set(columns)
+			if extra:
+				raise Exception('%s has columns %r not in %s' % (ds, sorted(extra), chain[0],))
+	assert columns, "No common columns in %r" % (chain,)
+	hashlabels = set(ds.hashlabel for ds in chain)
+	hashlabel = hashlabels.pop() if len(hashlabels) == 1 else None
+	if hashlabel not in columns:
+		# column_mismatch dropped it.
+		hashlabel = None
+	filenames = set(ds.filename for ds in chain)
+	filename = filenames.pop() if len(filenames) == 1 else None
+	dw = DatasetWriter(
+		caption=options.caption % dict(caption=datasets.source.caption),
+		hashlabel=hashlabel,
+		filename=filename,
+		previous=datasets.previous,
+		meta_only=True,
+		columns=columns,
+	)
+	return dw, chain, sorted(columns)
+
+def analysis(sliceno, prepare_res):
+	dw, chain, names = prepare_res
+	for n in names:
+		with open(dw.column_filename(n, sliceno=sliceno), 'wb') as out_fh:
+			for ds in chain:
+				copy_slice(ds, n, sliceno, out_fh)
+
+def synthesis(prepare_res, params):
+	dw, chain, names = prepare_res
+	for sliceno in range(params.slices):
+		dw.set_lines(sliceno, sum(ds.lines[sliceno] for ds in chain))
+	for dsno, ds in enumerate(chain):
+		dw.set_minmax(('ds', dsno), {n: (ds.columns[n].min, ds.columns[n].max) for n in names})
@@ -0,0 +1,249 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import division
+from __future__ import absolute_import
+
+description = r'''
+Remove duplicate lines from a dataset chain (to previous.source).
+
+Lines are duplicates if they have the same values in options.columns
+(all columns if not set). keep=first keeps the first of them in chain
+order, keep=last the last.
+
+If the hashlabel is one of the key columns all duplicates are in the
+same slice, so each slice does its own lines. Otherwise the lines are
+rehashed on one of the key columns while reading, and the result is
+hashed on that column.
+
+Each slice sorts the keys of its lines on a hash of the key, so only
+keys with the same hash are compared. If you set memory_budget (in
+bytes, per process) the sorted keys are spilled to runs on disk when
+they don't fit, and the runs are merged.
+
+If you pass a previous dataset_dedup job (with the same columns) lines
+with keys that are in its output (or further back in that chain) are
+also removed, so you can dedup a feed incrementally. This only works
+with keep=first. Each job saves the sorted keys of its whole output
+chain, so the next job doesn't have to read the old lines again.
+'''
+
+from os import unlink
+from os.path import exists
+from heapq import merge
+from itertools import compress, count
+from functools import partial
+from json import dumps
+
+from accelerator.compat import izip, pickle, PY3
+from accelerator.extras import OptionEnum, job_params
+from accelerator.dataset import DatasetWriter, Dataset
+from accelerator.gzwrite import typed_writer
+from accelerator.status import status
+from .dataset_rehash import hashable_types
+
+options = {
+	'columns'                   : set(), # key columns, empty for all columns
+	'keep'                      : OptionEnum('first last').first,
+	'memory_budget'             : 0, # bytes per process for the sorted keys, 0 for no limit
+	'caption'                   : '"%(caption)s" deduplicated',
+	'length'                    : -1, # Go back at most this many datasets. You almost always want -1 (which goes until previous.source)
+}
+
+datasets = ('source', 'previous',)
+
+# About how much memory each line uses while sorting, besides the key.
+ENTRY_SIZE = 120
+# Entries per pickle in the run files.
+CHUNK_SIZE = 1024
+# Merge runs when there are this many, to not have too many files open.
+MAX_RUNS = 64
+# Per slice, the keys of the whole output chain as a sorted run.
+STATE_NAME = 'dedup.state'
+
+def prepare(params):
+	d = datasets.source
+	ds_list = d.chain(stop_ds={datasets.previous: 'source'}, length=options.length)
+	columns = {n: c.type for n, c in d.columns.items()}
+	for ds in ds_list:
+		for n, t in columns.items():
+			if n not in ds.columns or ds.columns[n].type != t:
+				raise Exception('Column %r is not %s in all of %r' % (n, t, ds_list,))
+	key = sorted(options.columns or columns)
+	for n in key:
+		if n not in columns:
+			raise Exception("Dataset %s doesn't have a column named %r" % (d, n,))
+	hashlabels = set(ds.hashlabel for ds in ds_list)
+	if len(hashlabels) == 1 and d.hashlabel in key:
+		hashlabel = d.hashlabel
+	else:
+		candidates = [n for n in key if columns[n] in hashable_types]
+		if not candidates:
+			raise Exception("None of the key columns %r can be hashed on" % (key,))
+		hashlabel = d.hashlabel if d.hashlabel in candidates else candidates[0]
+	old_list = []
+	old_state = None
+	if datasets.previous:
+		assert options.keep == 'first', "Only keep=first can be used with previous"
+		prev_options = job_params(datasets.previous.jobid).options
+		assert sorted(prev_options.columns) == sorted(options.columns), 'previous was made with columns=%r' % (prev_options.columns,)
+		# The saved keys are only in the right slices with the same hashlabel.
+		if datasets.previous.hashlabel == hashlabel and exists(datasets.previous.jobid.filename(STATE_NAME, 0)):
+			old_state = datasets.previous.jobid
+		else:
+			old_list = datasets.previous.chain()
+	filenames = set(ds.filename for ds in ds_list)
+	filename = filenames.pop() if len(filenames) == 1 else None
+	dw = DatasetWriter(
+		caption=options.caption % dict(caption=d.caption),
+		hashlabel=hashlabel,
+		filename=filename,
+		previous=datasets.previous,
+		columns=columns,
+	)
+	return dw, ds_list, old_list, old_state, key, hashlabel
+
+def iterate(sliceno, columns, ds_list, hashlabel, json_columns=()):
+	translators = {n: partial(dumps, sort_keys=True) for n in json_columns}
+	return Dataset.iterate_list(sliceno, columns, ds_list, hashlabel=hashlabel, rehash=True, translators=translators)
+
+def key_hasher(types):
+	"""A hash of the whole key that is the same in every process (unlike
+	hash() of strings), so it can be saved for the next job."""
+	funcs = [typed_writer(t).hash for t in types]
+	def hasher(key):
+		h = 0
+		for f, v in izip(funcs, key):
+			h = ((h * 1000003) ^ f(v)) & 0xffffffffffffffff
+		return h
+	return hasher
+
+def write_run(entries, fn):
+	with open(fn, 'wb') as fh:
+		chunk = []
+		for entry in entries:
+			chunk.append(entry)
+			if len(chunk) == CHUNK_SIZE:
+				pickle.dump(chunk, fh, 2)
+				chunk = []
+		if chunk:
+			pickle.dump(chunk, fh, 2)
+	return fn
+
+def read_run(fn):
+	with open(fn, 'rb') as fh:
+		while True:
+			try:
+				chunk = pickle.load(fh)
+			except EOFError:
+				return
+			for entry in chunk:
+				yield entry
+
+def sort_keys(parts, hasher, budget, basename):
+	"""Sort (hash, part number, index, pickled key) for all keys in parts.
+	When the entries use more than budget bytes they are spilled to sorted
+	runs on disk. Returns how many keys each part had, the runs and the
+	sorted entries that are still in memory."""
+	counts = []
+	runs = []
+	entries = []
+	used = 0
+	names = ('%s.%d' % (basename, ix,) for ix in count())
+	for partno, keys in enumerate(parts):
+		lines = 0
+		for lines, line in enumerate(keys, 1):
+			kb = pickle.dumps(line, 2)
+			entries.append((hasher(line), partno, lines - 1, kb))
+			used += ENTRY_SIZE + len(kb)
+			if used >= budget:
+				entries.sort()
+				runs.append(write_run(entries, next(names)))
+				entries = []
+				used = 0
+				if len(runs) == MAX_RUNS:
+					merged = write_run(merge(*[read_run(fn) for fn in runs]), next(names))
+					for fn in runs:
+						unlink(fn)
+					runs = [merged]
+		counts.append(lines)
+	entries.sort()
+	return counts, runs, entries
+
+def dedup_sorted(entries, keep, keep_last):
+	"""entries are sorted (hash, part number, index, pickled key), with
+	the old keys (already in previous) in part 0. Clear keep (for part 1)
+	for the duplicates. Yields (hash, pickled key) for the keys that are
+	kept, in sorted order."""
+	group_h = None
+	group = [] # [[part number, index, pickled key]], usually just one
+	for h, partno, ix, kb in entries:
+		if h != group_h:
+			for item in group:
+				yield group_h, item[2]
+			group = []
+			group_h = h
+		for item in group:
+			if item[2] == kb or pickle.loads(item[2]) == pickle.loads(kb):
+				if keep_last:
+					keep[item[1]] = 0
+					item[1] = ix
+				elif partno:
+					keep[ix] = 0
+				break
+		else:
+			group.append([partno, ix, kb])
+	for item in group:
+		yield group_h, item[2]
+
+def analysis(sliceno, prepare_res):
+	dw, ds_list, old_list, old_state, key, hashlabel = prepare_res
+	json_columns = [n for n in key if dw.columns[n][0] == 'json']
+	# json is compared (and hashed) as the sorted dump.
+	types = [('unicode' if PY3 else 'bytes') if n in json_columns else dw.columns[n][0] for n in key]
+	# The old lines (already in previous) first, then the new ones.
+	parts = [
+		iterate(sliceno, key, old_list, hashlabel, json_columns),
+		iterate(sliceno, key, ds_list, hashlabel, json_columns),
+	]
+	with status('Sorting keys'):
+		(_, new_count), runs, entries = sort_keys(parts, key_hasher(types), options.memory_budget or float('inf'), 'dedup.%d' % (sliceno,))
+	sorted_runs = [read_run(fn) for fn in runs] + [entries]
+	if old_state:
+		sorted_runs.append(read_run(old_state.filename(STATE_NAME, sliceno)))
+	keep = bytearray(b'\x01') * new_count
+	with status('Finding duplicates'):
+		kept = dedup_sorted(merge(*sorted_runs), keep, options.keep == 'last')
+		write_run(((h, 0, n, kb) for n, (h, kb) in enumerate(kept)), '%s.%d' % (STATE_NAME, sliceno,))
+	for fn in runs:
+		unlink(fn)
+	names = sorted(dw.columns)
+	writers = [dw.writers[n].write for n in names]
+	lines = compress(iterate(sliceno, names, ds_list, hashlabel), keep)
+	with status('Writing unique lines'):
+		for line in lines:
+			for w, v in izip(writers, line):
+				w(v)
+	return new_count, sum(keep)
+
+def synthesis(analysis_res):
+	total = kept = 0
+	for slice_total, slice_kept in analysis_res:
+		total += slice_total
+		kept += slice_kept
+	print('Kept %d of %d lines.' % (kept, total,))
@@ -0,0 +1,194 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+description = r'''
+Find the lines that were added, removed and changed between two
+datasets (for example two snapshots of the same table).
+
+options.key are the columns that identify a line, and must be unique
+in both datasets. Lines with a key that is only in datasets.new are
+written to the "added" dataset, lines with a key that is only in
+datasets.old to "removed", and lines from new where options.columns
+(default all columns in both datasets) differ from old to "changed".
+
+Without options.key whole lines are compared (as a multiset), so
+nothing is "changed", lines are only added or removed.
+
+If both datasets are hashed on a key column each slice compares its
+own lines. Otherwise both are rehashed on a key column while reading,
+and the results are hashed on that column.
+
+Each slice keeps the old keys and an md5 of the other values of each
+old line in memory, not the whole lines.
+
+The result has the number of added, removed, changed and unchanged
+lines.
+'''
+
+from hashlib import md5
+from collections import Counter
+
+from accelerator.compat import PY2
+from accelerator.extras import DotDict
+from accelerator.dataset import DatasetWriter, Dataset
+from accelerator.status import status
+from .dataset_rehash import hashable_types
+
+options = dict(
+	key          = set(),
+	columns      = set(),
+	caption      = 'diff of %(old)s and %(new)s',
+)
+
+datasets = ('old', 'new',)
+
+def digest(values):
+	if PY2:
+		return md5(repr(values)).digest()
+	else:
+		return md5(repr(values).encode('utf-8')).digest()
+
+def prepare():
+	old, new = datasets.old, datasets.new
+	key = sorted(options.key)
+	for n in key:
+		if n not in old.columns or n not in new.columns:
+			raise Exception('Key column %r must be in both %s and %s' % (n, old, new,))
+	if options.columns:
+		compare = sorted(options.columns)
+		for n in compare:
+			if n not in old.columns or n not in new.columns:
+				raise Exception('Column %r must be in both %s and %s' % (n, old, new,))
+	else:
+		compare = sorted(set(old.columns) & set(new.columns))
+	compare = [n for n in compare if n not in key]
+	if old.hashlabel == new.hashlabel and old.hashlabel in (key or compare):
+		hashlabel = old.hashlabel
+	else:
+		candidates = [n for n in key or compare if new.columns[n].type in hashable_types and old.columns[n].type in hashable_types]
+		if not candidates:
+			raise Exception("None of the columns %r can be hashed on" % (key or compare,))
+		hashlabel = new.hashlabel if new.hashlabel in candidates else candidates[0]
+	caption = options.caption % dict(old=old, new=new)
+	dws = {}
+	for name, src in (('added', new), ('removed', old), ('changed', new)):
+		dws[name] = DatasetWriter(
+			name=name,
+			caption='%s (%s)' % (caption, name,),
+			hashlabel=hashlabel,
+			columns={n: c.type for n, c in src.columns.items()},
+		)
+	return dws, key, compare, hashlabel
+
+def iterate(ds, sliceno, columns, hashlabel):
+	return Dataset.iterate_list(sliceno, columns, ds, hashlabel=hashlabel, rehash=True)
+
+def writer(dw):
+	writers = [dw.writers[n].write for n in sorted(dw.columns)]
+	def write(line):
+		for w, v in zip(writers, line):
+			w(v)
+	return write
+
+def diff_keyed(sliceno, dws, key, compare, hashlabel):
+	old, new = datasets.old, datasets.new
+	# {key: digest of the compared values}, None once the key is in new.
+	seen = {}
+	with status('Reading old keys'):
+		for line in iterate(old, sliceno, key + compare, hashlabel):
+			k = line[:len(key)]
+			if k in seen:
+				raise Exception('Key %r is not unique in %s' % (k, old,))
+			seen[k] = digest(line[len(key):])
+	names = sorted(new.columns)
+	key_ix = [names.index(n) for n in key]
+	compare_ix = [names.index(n) for n in compare]
+	added, changed = writer(dws['added']), writer(dws['changed'])
+	counts = Counter()
+	with status('Comparing new lines'):
+		for line in iterate(new, sliceno, names, hashlabel):
+			k = tuple(line[ix] for ix in key_ix)
+			old_digest = seen.get(k, False)
+			if old_digest is None:
+				raise Exception('Key %r is not unique in %s' % (k, new,))
+			seen[k] = None
+			if old_digest is False:
+				added(line)
+				counts['added'] += 1
+			elif old_digest != digest(tuple(line[ix] for ix in compare_ix)):
+				changed(line)
+				counts['changed'] += 1
+			else:
+				counts['unchanged'] += 1
+	names = sorted(old.columns)
+	key_ix = [names.index(n) for n in key]
+	removed = writer(dws['removed'])
+	with status('Finding removed lines'):
+		for line in iterate(old, sliceno, names, hashlabel):
+			if seen[tuple(line[ix] for ix in key_ix)] is not None:
+				removed(line)
+				counts['removed'] += 1
+	return counts
+
+def diff_lines(sliceno, dws, compare, hashlabel):
+	old, new = datasets.old, datasets.new
+	with status('Reading old lines'):
+		left = Counter(digest(line) for line in iterate(old, sliceno, compare, hashlabel))
+	names = sorted(new.columns)
+	compare_ix = [names.index(n) for n in compare]
+	added = writer(dws['added'])
+	counts = Counter()
+	with status('Comparing new lines'):
+		for line in iterate(new, sliceno, names, hashlabel):
+			d = digest(tuple(line[ix] for ix in compare_ix))
+			if left[d]:
+				left[d] -= 1
+				counts['unchanged'] += 1
+			else:
+				added(line)
+				counts['added'] += 1
+	names = sorted(old.columns)
+	compare_ix = [names.index(n) for n in compare]
+	removed = writer(dws['removed'])
+	with status('Finding removed lines'):
+		for line in iterate(old, sliceno, names, hashlabel):
+			d = digest(tuple(line[ix] for ix in compare_ix))
+			if left[d]:
+				left[d] -= 1
+				removed(line)
+				counts['removed'] += 1
+	return counts
+
+def analysis(sliceno, prepare_res):
+	dws, key, compare, hashlabel = prepare_res
+	if key:
+		return diff_keyed(sliceno, dws, key, compare, hashlabel)
+	else:
+		return diff_lines(sliceno, dws, compare, hashlabel)
+
+def synthesis(analysis_res):
+	counts = Counter()
+	for part in analysis_res:
+		counts.update(part)
+	res = DotDict((name, counts[name]) for name in ('added', 'removed', 'changed', 'unchanged'))
+	print('%(added)d added, %(removed)d removed, %(changed)d changed, %(unchanged)d unchanged' % res)
+	return res
@@ -22,12 +22,24 @@ from __future__ import absolute_import
 
 description = r'''
 Rewrite a dataset (or chain to previous) with new hashlabel.
+
+The values are never decoded, each column is copied as it is stored
+(in C) to the slice the hashlabel column says the line belongs in.
 '''
 
+from os import unlink
+from os.path import exists
+from resource import getpagesize
 from shutil import copyfileobj
 
 from accelerator.extras import OptionString
 from accelerator.dataset import DatasetWriter
+from accelerator.sourcedata import type2iter
+from . import dataset_rehash
+
+depend_extra = (dataset_rehash,)
+
+cstuff = dataset_rehash.init()
 
 options = {
 	'hashlabel'                 : OptionString,
@@ -40,8 +52,14 @@ datasets = ('source', 'previous',)
 
 def prepare(params):
 	d = datasets.source
+	chain = d.chain(stop_ds={datasets.previous: 'source'}, length=options.length)
+	if options.hashlabel not in d.columns:
+		raise Exception("Dataset %s doesn't have a column named %r" % (d, options.hashlabel,))
+	hashtype = d.columns[options.hashlabel].type
+	if hashtype not in dataset_rehash.hashable_types:
+		raise Exception("Can't hash on column of type %s." % (hashtype,))
 	caption = options.caption % dict(caption=d.caption, hashlabel=options.hashlabel)
-	if len(d.chain(stop_ds={datasets.previous: 'source'}, length=options.length)) == 1:
+	if len(chain) == 1:
 		filename = d.filename
 	else:
 		filename = None
@@ -59,35 +77,69 @@ def prepare(params):
 			previous=previous,
 			name=name,
 			for_single_slice=sliceno,
+			meta_only=True,
 		)
 		previous = (params.jobid, name)
 		dws.append(dw)
-	names = []
-	for n, c in d.columns.items():
-		# names has to be in the same order as the add calls
-		# so the iterator returns the same order the writer expects.
-		names.append(n)
+	# The hashlabel goes first, it decides where the other columns go.
+	names = [options.hashlabel] + sorted(n for n in d.columns if n != options.hashlabel)
+	for n in names:
 		for dw in dws:
-			dw.add(n, c.type)
-	return dws, names, caption, filename
+			dw.add(n, d.columns[n].type)
+	return dws, names, caption, filename, chain
 
-def analysis(sliceno, prepare_res):
-	dws, names = prepare_res[:2]
-	it = datasets.source.iterate_chain(
-		sliceno,
-		names,
-		stop_ds={datasets.previous: 'source'},
-		length=options.length,
-	)
-	write = dws[sliceno].get_split_write_list()
-	for values in it:
-		write(values)
+def analysis(sliceno, slices, prepare_res):
+	dws, names, _, _, chain = prepare_res
+	dw = dws[sliceno]
+	chain = [d for d in chain if d.lines[sliceno]]
+	pagesize = getpagesize()
+	slicemap_size = (sum(d.lines[sliceno] for d in chain) * 2 // pagesize + 1) * pagesize
+	minmax = {}
+	with open('slicemap%d' % (sliceno,), 'w+b') as slicemap_fh:
+		slicemap_fh.truncate(slicemap_size)
+		for n in names:
+			coltype = chain[0].columns[n].type if chain else dw.columns[n][0]
+			in_fns = []
+			offsets = []
+			max_counts = []
+			for d in chain:
+				assert d.columns[n].type == coltype, '%s has type %s in %s, not %s' % (n, d.columns[n].type, d, coltype,)
+				in_fns.append(d.column_filename(n, sliceno))
+				if d.columns[n].offsets:
+					offsets.append(d.columns[n].offsets[sliceno])
+					max_counts.append(d.lines[sliceno])
+				else:
+					offsets.append(0)
+					max_counts.append(-1)
+			out_fns = [dw.column_filename(n, sliceno=s) for s in range(slices)]
+			if coltype == 'json': # the writer doesn't do minmax for json
+				minmax_fn = None
+			else:
+				minmax_fn = 'minmax%d' % (sliceno,)
+			line_count = cstuff.mk_uint64(slices)
+			c = getattr(cstuff.backend, dataset_rehash.rehashfuncs[coltype])
+			res = c(*cstuff.bytesargs(in_fns, len(in_fns), offsets, max_counts, out_fns, 'wb', minmax_fn, slices, slicemap_fh.fileno(), slicemap_size, n == options.hashlabel, line_count))
+			assert not res, 'Failed to rehash ' + n
+			if n == options.hashlabel:
+				lines = list(line_count)
+			else:
+				assert list(line_count) == lines, 'Column %s has a different number of lines than %s' % (n, options.hashlabel,)
+			if minmax_fn and exists(minmax_fn): # not written without values
+				with type2iter[coltype](minmax_fn) as it:
+					minmax[n] = list(it)
+				unlink(minmax_fn)
+			else:
+				minmax[n] = [None, None]
+	unlink('slicemap%d' % (sliceno,))
+	for s, count in enumerate(lines):
+		dw.set_lines(s, count)
+	dw.set_minmax(sliceno, minmax)
 
 def synthesis(prepare_res, params):
 	if not options.as_chain:
 		# If we don't want a chain we abuse our knowledge of dataset internals
 		# to avoid recompressing. Don't do this stuff yourself.
-		dws, names, caption, filename = prepare_res
+		dws, names, caption, filename, _ = prepare_res
 		merged_dw = DatasetWriter(
 			caption=caption,
 			hashlabel=options.hashlabel,
@@ -96,10 +148,10 @@ def synthesis(prepare_res, params):
 			meta_only=True,
 			columns=datasets.source.columns,
 		)
+		for dwno, dw in enumerate(dws):
+			merged_dw.set_minmax(dwno, dw._minmax[dwno])
 		for sliceno in range(params.slices):
 			merged_dw.set_lines(sliceno, sum(dw._lens[sliceno] for dw in dws))
-			for dwno, dw in enumerate(dws):
-				merged_dw.set_minmax((sliceno, dwno), dw._minmax[sliceno])
 			for n in names:
 				fn = merged_dw.column_filename(n, sliceno=sliceno)
 				with open(fn, "wb") as out_fh:
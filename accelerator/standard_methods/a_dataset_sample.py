@@ -0,0 +1,238 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import division
+from __future__ import absolute_import
+
+description = r'''
+Random sample of a dataset chain (to previous.source).
+
+mode=bernoulli keeps each line with probability fraction.
+mode=reservoir keeps exactly count lines (or all lines if there are
+fewer), every line equally likely.
+
+With stratify=COLUMN the sample is made separately for each value in
+that column, keeping round(fraction * lines) (bernoulli) or count
+(reservoir) lines with that value. This has to read the stratify
+column, the other modes only use the line counts.
+
+Which lines are kept is decided from the job seed, so it's the same
+every time the job is run. Lines stay in their slice and order, and
+are copied (in C) as they are stored, without decoding them. Slices of
+datasets where no line is kept are not read at all, and each slice is
+only read up to the last kept line.
+'''
+
+from os import unlink
+from os.path import exists
+from random import Random
+from math import log1p
+from array import array
+from collections import Counter
+from resource import getpagesize
+
+from accelerator.extras import OptionEnum
+from accelerator.dataset import DatasetWriter
+from accelerator.sourcedata import type2iter
+from accelerator.status import status
+from . import dataset_rehash
+
+depend_extra = (dataset_rehash,)
+
+cstuff = dataset_rehash.init()
+
+options = {
+	'mode'                      : OptionEnum('bernoulli reservoir').bernoulli,
+	'fraction'                  : 0.001, # for mode=bernoulli
+	'count'                     : 1000,  # for mode=reservoir
+	'stratify'                  : str,   # column to sample each value of separately
+	'caption'                   : '"%(caption)s" sampled',
+	'length'                    : -1, # Go back at most this many datasets. You almost always want -1 (which goes until previous.source)
+}
+
+datasets = ('source', 'previous',)
+
+def rng(params, *key):
+	# Random numbers that only depend on the seed and key.
+	return Random(repr((params.seed,) + key))
+
+def bernoulli_positions(rnd, lines, fraction):
+	"""Sorted positions of the kept lines out of lines, each line kept
+	with probability fraction. Jumps directly to the next kept line."""
+	if fraction >= 1:
+		return list(range(lines))
+	if fraction <= 0:
+		return []
+	# log1p because 1.0 - fraction is exactly 1.0 for tiny fractions.
+	logq = log1p(-fraction)
+	res = []
+	pos = -1
+	while True:
+		# The gap can be too big for an int (even inf), so check first.
+		gap = log1p(-rnd.random()) / logq
+		if pos + 1 + gap >= lines:
+			return res
+		pos += 1 + int(gap)
+		res.append(pos)
+
+def sample_positions(rnd, lines, count):
+	"""Sorted positions of count lines out of lines (Floyd's algorithm)"""
+	if count >= lines:
+		return list(range(lines))
+	chosen = set()
+	for top in range(lines - count, lines):
+		pos = rnd.randint(0, top)
+		chosen.add(top if pos in chosen else pos)
+	return sorted(chosen)
+
+def split_positions(positions, parts):
+	"""Split sorted positions in all parts (one after the other) into
+	{part: sorted positions within part}"""
+	res = {}
+	positions = iter(positions)
+	pos = next(positions, None)
+	start = 0
+	for part, lines in parts:
+		end = start + lines
+		while pos is not None and pos < end:
+			res.setdefault(part, []).append(pos - start)
+			pos = next(positions, None)
+		start = end
+	return res
+
+def stratified(params, chain, parts):
+	with status('Counting %s values' % (options.stratify,)):
+		counts = Counter()
+		for (dsix, sliceno), _ in parts:
+			counts.update(chain[dsix].iterate(sliceno, options.stratify))
+	wanted = {}
+	for value, lines in counts.items():
+		if options.mode == 'bernoulli':
+			count = int(round(options.fraction * lines))
+		else:
+			count = options.count
+		# reversed, so the next one is at the end
+		wanted[value] = sample_positions(rng(params, value), lines, count)[::-1]
+	res = {}
+	with status('Finding sampled lines'):
+		seen = dict.fromkeys(counts, 0)
+		for part, _ in parts:
+			dsix, sliceno = part
+			for pos, value in enumerate(chain[dsix].iterate(sliceno, options.stratify)):
+				want = wanted[value]
+				if want and want[-1] == seen[value]:
+					res.setdefault(part, []).append(pos)
+					want.pop()
+				seen[value] += 1
+	return res
+
+def prepare(params):
+	d = datasets.source
+	chain = d.chain(stop_ds={datasets.previous: 'source'}, length=options.length)
+	assert options.mode in ('bernoulli', 'reservoir')
+	assert 0 <= options.fraction <= 1, 'fraction must be between 0 and 1'
+	assert options.count >= 0, 'count must not be negative'
+	columns = {n: c.type for n, c in d.columns.items()}
+	for ds in chain:
+		for n, t in columns.items():
+			if n not in ds.columns or ds.columns[n].type != t:
+				raise Exception('Column %r is not %s in all of %r' % (n, t, chain,))
+	if options.stratify:
+		if options.stratify not in columns:
+			raise Exception("Dataset %s doesn't have a column named %r" % (d, options.stratify,))
+		if columns[options.stratify] == 'json':
+			raise Exception("Can't stratify on json column %r" % (options.stratify,))
+	# All slices of all datasets, one after the other
+	parts = [((dsix, sliceno), ds.lines[sliceno]) for dsix, ds in enumerate(chain) for sliceno in range(params.slices)]
+	if options.stratify:
+		positions = stratified(params, chain, parts)
+	elif options.mode == 'reservoir':
+		total = sum(lines for _, lines in parts)
+		positions = split_positions(sample_positions(rng(params), total, options.count), parts)
+	else:
+		# Each slice does its own, see analysis.
+		positions = None
+	hashlabels = set(ds.hashlabel for ds in chain)
+	hashlabel = hashlabels.pop() if len(hashlabels) == 1 else None
+	filenames = set(ds.filename for ds in chain)
+	filename = filenames.pop() if len(filenames) == 1 else None
+	dw = DatasetWriter(
+		caption=options.caption % dict(caption=d.caption),
+		hashlabel=hashlabel,
+		filename=filename,
+		previous=datasets.previous,
+		meta_only=True,
+		columns=columns,
+	)
+	return dw, chain, sorted(columns), positions
+
+def write_slicemap(fh, keep, lines):
+	"""Slice 0 for the positions in keep, skip_line for the other lines"""
+	slicemap = array('H', [dataset_rehash.skip_line]) * lines
+	for pos in keep:
+		slicemap[pos] = 0
+	slicemap.tofile(fh)
+
+def analysis(sliceno, params, prepare_res):
+	dw, chain, names, positions = prepare_res
+	if positions is None:
+		rnd = rng(params, sliceno)
+		keep = [bernoulli_positions(rnd, ds.lines[sliceno], options.fraction) for ds in chain]
+	else:
+		keep = [positions.get((dsix, sliceno)) for dsix in range(len(chain))]
+	# Only the datasets where something is kept, up to the last kept line.
+	parts = [(ds, pos) for ds, pos in zip(chain, keep) if pos]
+	total = sum(pos[-1] + 1 for _, pos in parts)
+	pagesize = getpagesize()
+	slicemap_size = (total * 2 // pagesize + 1) * pagesize
+	minmax = {}
+	lines = 0
+	with open('slicemap%d' % (sliceno,), 'w+b') as slicemap_fh:
+		for _, pos in parts:
+			write_slicemap(slicemap_fh, pos, pos[-1] + 1)
+		slicemap_fh.truncate(slicemap_size)
+		slicemap_fh.flush()
+		for n in names:
+			coltype = dw.columns[n][0]
+			in_fns = []
+			offsets = []
+			max_counts = []
+			for ds, pos in parts:
+				in_fns.append(ds.column_filename(n, sliceno))
+				offsets.append(ds.columns[n].offsets[sliceno] if ds.columns[n].offsets else 0)
+				max_counts.append(pos[-1] + 1)
+			out_fns = [dw.column_filename(n, sliceno=sliceno)]
+			if coltype == 'json': # the writer doesn't do minmax for json
+				minmax_fn = None
+			else:
+				minmax_fn = 'minmax%d' % (sliceno,)
+			line_count = cstuff.mk_uint64(1)
+			c = getattr(cstuff.backend, dataset_rehash.rehashfuncs[coltype])
+			res = c(*cstuff.bytesargs(in_fns, len(in_fns), offsets, max_counts, out_fns, 'wb', minmax_fn, 1, slicemap_fh.fileno(), slicemap_size, False, line_count))
+			assert not res, 'Failed to sample ' + n
+			lines = line_count[0]
+			if minmax_fn and exists(minmax_fn): # not written without values
+				with type2iter[coltype](minmax_fn) as it:
+					minmax[n] = list(it)
+				unlink(minmax_fn)
+			else:
+				minmax[n] = [None, None]
+	unlink('slicemap%d' % (sliceno,))
+	assert lines == sum(len(pos) for _, pos in parts), 'Wrong number of lines sampled'
+	dw.set_lines(sliceno, lines)
+	dw.set_minmax(sliceno, minmax)
@@ -0,0 +1,142 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+description = r'''
+Approximate quantiles and most common values of columns in a dataset
+chain (to datasets.stop), without sorting or keeping all values.
+
+The result is {column: DotDict(quantiles=QuantileSketch, top=TopK)}
+(see accelerator.sketch), or with group_by=COLUMN a dict like that for
+each value in that column. For example res.price.quantiles.quantile(0.99)
+or res.price.top.top(10).
+
+options.columns defaults to all columns in the source dataset (except
+json columns and group_by). Quantiles are ranked to within about
+1.7 / k of the line count, and every value that is more than
+1 / (counters + 1) of the lines is in top. Memory use depends on k,
+counters and the number of groups, not on the number of lines.
+
+Each slice makes its own sketches, which are merged in synthesis. The
+sketches can also be merged with sketches from other jobs.
+'''
+
+from itertools import islice
+
+from accelerator.compat import izip, iteritems
+from accelerator.extras import DotDict
+from accelerator.dataset import Dataset
+from accelerator.sketch import QuantileSketch, TopK
+
+options = dict(
+	columns      = set(),
+	group_by     = str,
+	k            = 200, # quantile accuracy
+	counters     = 100, # values tracked for top
+	chain_length = -1,
+)
+
+datasets = ('source', 'stop',)
+
+# Values are handled this many at a time.
+CHUNK = 100000
+
+def prepare():
+	d = datasets.source
+	ds_list = d.chain(length=options.chain_length, stop_ds=datasets.stop)
+	for n in [options.group_by] + sorted(options.columns):
+		if n and n not in d.columns:
+			raise Exception("Dataset %s doesn't have a column named %r" % (d, n,))
+		if n and d.columns[n].type == 'json':
+			raise Exception("Can't sketch json column %r" % (n,))
+	if options.columns:
+		columns = sorted(options.columns)
+	else:
+		columns = sorted(n for n, c in d.columns.items() if c.type != 'json' and n != options.group_by)
+	return ds_list, columns
+
+def new_sketches(params, sliceno, columns):
+	return DotDict((n, DotDict(quantiles=QuantileSketch(options.k, params.seed + sliceno), top=TopK(options.counters))) for n in columns)
+
+def add(sketches, values):
+	sketches.quantiles.update(values)
+	sketches.top.update(values)
+
+def analysis(sliceno, params, prepare_res):
+	ds_list, columns = prepare_res
+	if not options.group_by:
+		res = new_sketches(params, sliceno, columns)
+		for n in columns:
+			it = Dataset.iterate_list(sliceno, n, ds_list)
+			while True:
+				values = list(islice(it, CHUNK))
+				if not values:
+					break
+				add(res[n], values)
+		return res
+	res = {}
+	# {group: [values for each column]}, added to the sketches now and then
+	pending = {}
+	def flush():
+		for group, lists in iteritems(pending):
+			if group not in res:
+				res[group] = new_sketches(params, sliceno, columns)
+			for n, values in izip(columns, lists):
+				add(res[group][n], values)
+		pending.clear()
+	count = 0
+	for line in Dataset.iterate_list(sliceno, [options.group_by] + columns, ds_list):
+		lists = pending.get(line[0])
+		if lists is None:
+			lists = pending[line[0]] = [[] for _ in columns]
+		for values, v in izip(lists, line[1:]):
+			values.append(v)
+		count += 1
+		if count == CHUNK:
+			flush()
+			count = 0
+	flush()
+	return res
+
+def merge(a, b):
+	for n, sketches in iteritems(b):
+		a[n].quantiles.merge(sketches.quantiles)
+		a[n].top.merge(sketches.top)
+
+def synthesis(prepare_res, analysis_res):
+	_, columns = prepare_res
+	res = {}
+	for part in analysis_res:
+		if not options.group_by:
+			part = {None: part}
+		for group, sketches in iteritems(part):
+			if group in res:
+				merge(res[group], sketches)
+			else:
+				res[group] = sketches
+	if not options.group_by:
+		res = res[None]
+		for n in columns:
+			q = res[n].quantiles
+			print('%s: %d values, min %r, median %r, p99 %r, max %r' % (n, q.count, q.min, q.quantile(0.5), q.quantile(0.99), q.max,))
+		return res
+	print('%d groups' % (len(res),))
+	return res
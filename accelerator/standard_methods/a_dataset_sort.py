@@ -27,17 +27,59 @@ You'll have to type the sort column(s) approprietly.
 
 None and NaN values will sort the same as the smallest/largest
 value possible in a comparable type.
+
+If you set memory_budget (in bytes, per process) the sort is done in
+runs of about that size which are written to disk and then merged, so
+big datasets don't need to fit in memory. With sort_across_slices each
+dataset in the chain is first sorted within slices (as subjobs) and then
+each slice merges its part of the result from all of them. The result is
+the same as when sorting in memory, except that with sort_across_slices
+the slices only get about the same number of lines: the slice boundaries
+are picked from where the blocks of the sorted parts start (see below),
+so this doesn't read all the data an extra time.
+
+These sorts write the sorted lines in blocks, and save where each block
+starts. That lets a later sort_across_slices start reading each part
+at the block before the lines it needs instead of at the start. Set
+write_blocks to always sort this way (in memory if there is no
+memory_budget), the subjobs of sort_across_slices do.
+
+With incremental set and previous given, only the new datasets in the
+chain are sorted, and then merged with everything previous sorted. The
+result is a single dataset (not chained to previous) with all lines,
+the same as sorting the whole chain would give. Previous must have been
+sorted with the same options.
+
+When all sort columns are numbers (not the number type), bools or
+dates/times (and no memory_budget or write_blocks is set) the sort order is found in C
+(with the same None/NaN handling), and the values are copied to the
+sorted dataset as they are stored, without decoding them.
 '''
 
 from functools import partial
 import datetime
 from math import isnan
+from heapq import heapify, heapreplace, heappop
+from itertools import islice
+from os import unlink
+from os.path import exists, getsize
+from tempfile import TemporaryFile
+import struct
+import sys
 
 from accelerator.compat import PY2, izip
 
-from accelerator.extras import OptionEnum, OptionString
+from accelerator.extras import OptionEnum, OptionString, job_params
 from accelerator.dataset import Dataset, DatasetWriter
+from accelerator.gzwrite import typed_writer, typed_reader
 from accelerator.status import status
+from accelerator import subjobs
+from accelerator import blob
+from . import dataset_sort
+
+depend_extra = (dataset_sort,)
+
+cstuff = dataset_sort.init()
 
 OrderEnum = OptionEnum('ascending descending')
 
@@ -45,10 +87,16 @@ options = {
 	'sort_columns'           : [OptionString],
 	'sort_order'             : OrderEnum.ascending,
 	'sort_across_slices'     : False, # normally only sort within slices
+	'memory_budget'          : 0, # bytes per process, sort in runs on disk and merge them. 0 sorts everything in memory.
+	'incremental'            : False, # merge the new lines with the (sorted) lines from previous
+	'write_blocks'           : False, # write in blocks even without memory_budget or incremental
 }
 
 datasets = ('source', 'previous',)
 
+# Lines per block of sorted output (fewer with a small memory_budget).
+BLOCK_LINES = 65536
+
 
 # These types don't need/can't use any special handling of None-values.
 nononehandling_types = ('json', 'bits64', 'bits32',)
@@ -56,8 +104,12 @@ if PY2:
 	# These types sort None before everything else on py2.
 	nononehandling_types += ('bytes', 'ascii', 'unicode', 'int64', 'int32', 'bool',)
 
-def filter_unsortable(column, it):
+def unsortable_fixer(column):
+	# Returns a function that replaces unsortable values, or None if the
+	# column can't have any.
 	coltype = datasets.source.columns[column].type
+	if coltype in nononehandling_types:
+		return None
 	if coltype == 'bytes':
 		nonev = b''
 	elif coltype in ('ascii', 'unicode',):
@@ -75,8 +127,12 @@ def filter_unsortable(column, it):
 	else:
 		nanv = float('inf')
 		nonev = float('-inf')
-		return (nonev if v is None else nanv if isnan(v) else v for v in it)
-	return (nonev if v is None else v for v in it)
+		return lambda v: nonev if v is None else nanv if isnan(v) else v
+	return lambda v: nonev if v is None else v
+
+def filter_unsortable(column, it):
+	fixer = unsortable_fixer(column)
+	return (fixer(v) for v in it)
 
 def sort(columniter):
 	with status('Determining sort order'):
@@ -106,23 +162,375 @@ def sort(columniter):
 		with status('Creating sort list'):
 			return sorted(range(len(lst)), key=lst.__getitem__, reverse=reverse)
 
+class Descending(object):
+	# Reverses the order of a key, for merging descending runs.
+	__slots__ = ('v',)
+	def __init__(self, v):
+		self.v = v
+	def __lt__(self, other):
+		return other.v < self.v
+	def __eq__(self, other):
+		# Tuple comparison needs this to get to the next element on ties.
+		return self.v == other.v
+
+def mk_keyfunc(columns):
+	# Sort key for lines (tuples) with these columns.
+	parts = [(columns.index(column), unsortable_fixer(column)) for column in options.sort_columns]
+	if len(parts) == 1:
+		# Special case to not make tuples when there is only one column.
+		(ix, fixer), = parts
+		if fixer:
+			return lambda line: fixer(line[ix])
+		else:
+			return lambda line: line[ix]
+	return lambda line: tuple(fixer(line[ix]) if fixer else line[ix] for ix, fixer in parts)
+
+def merge(runs, key):
+	# Merge sorted runs, yielding (runno, line). Equal lines come from
+	# the earlier run first, so this is stable when the runs are in the
+	# original order.
+	if options.sort_order == 'descending':
+		ascending_key = key
+		key = lambda line: Descending(ascending_key(line))
+	heap = []
+	for runno, it in enumerate(runs):
+		it = iter(it)
+		for line in it:
+			heap.append((key(line), runno, line, it))
+			break
+	heapify(heap)
+	while heap:
+		_, runno, line, it = heap[0]
+		yield runno, line
+		for line in it:
+			heapreplace(heap, (key(line), runno, line, it))
+			break
+		else:
+			heappop(heap)
+
+def write_run(lines, coltypes, name):
+	writers = [typed_writer(coltype)(name % (ix,)) for ix, coltype in enumerate(coltypes)]
+	try:
+		for line in lines:
+			for w, v in izip(writers, line):
+				w.write(v)
+	finally:
+		for w in writers:
+			w.close()
+
+def read_run(coltypes, name):
+	return izip(*[typed_reader(coltype)(name % (ix,)) for ix, coltype in enumerate(coltypes)])
+
+def external_sort(lines, columns, coltypes, basename):
+	"""Sort lines in runs of about memory_budget bytes, spill the runs
+	to disk and then merge them."""
+	key = mk_keyfunc(columns)
+	reverse = (options.sort_order == 'descending')
+	lines = iter(lines)
+	# Estimate how many lines fit in the budget from the first ones.
+	sample = list(islice(lines, 100))
+	if not sample:
+		return
+	linesize = sum(
+		sys.getsizeof(line) + sum(sys.getsizeof(v) for v in line) + sys.getsizeof(key(line))
+		for line in sample
+	) // len(sample)
+	if options.memory_budget:
+		per_run = max(options.memory_budget // linesize, 1)
+	else:
+		per_run = sys.maxsize # everything in one run
+	run_names = []
+	spill_count = [0]
+	def spill(lines):
+		name = '%s.%d.%%d' % (basename, spill_count[0],)
+		spill_count[0] += 1
+		write_run(lines, coltypes, name)
+		run_names.append(name)
+	def remove(names):
+		for name in names:
+			for ix in range(len(coltypes)):
+				unlink(name % (ix,))
+	chunk = sample + list(islice(lines, max(per_run - len(sample), 0)))
+	while True:
+		with status('Sorting run %d' % (len(run_names) + 1,)):
+			chunk.sort(key=key, reverse=reverse)
+		if len(chunk) < per_run:
+			break # the last run can stay in memory
+		with status('Writing run %d' % (len(run_names) + 1,)):
+			spill(chunk)
+		del chunk # so we don't use twice the memory
+		chunk = list(islice(lines, per_run))
+	# Every run needs one open file per column, so merge in several
+	# steps if there are too many.
+	max_runs = max(500 // len(coltypes), 2)
+	while len(run_names) >= max_runs:
+		with status('Merging %d runs' % (max_runs,)):
+			to_merge = run_names[:max_runs]
+			del run_names[:max_runs]
+			spill(line for _, line in merge([read_run(coltypes, name) for name in to_merge], key))
+			# The merged run goes first, it has the earliest lines.
+			run_names.insert(0, run_names.pop())
+			remove(to_merge)
+	with status('Merging %d runs' % (len(run_names) + 1,)):
+		for _, line in merge([read_run(coltypes, name) for name in run_names] + [chunk], key):
+			yield line
+	remove(run_names)
+
+def block_lines(expected):
+	# Skipping to a boundary within a block should be cheap compared to
+	# the memory_budget, so small budgets get small blocks. And there
+	# should be enough blocks to find even slice boundaries from.
+	per_block = max(expected // 64, 1)
+	if options.memory_budget:
+		per_block = min(per_block, max(options.memory_budget // 256, 1))
+	return min(per_block, BLOCK_LINES)
+
+def write_blocks(lines, expected, columns, dw, sliceno):
+	"""Write sorted lines (about expected many) with a separate gzip
+	stream for each block, and save (line number, sort key, {column: file
+	offset}) for the start of each block."""
+	key = mk_keyfunc(columns)
+	per_block = block_lines(expected)
+	fns = [dw.column_filename(column, sliceno) for column in columns]
+	mk_writers = [typed_writer(dw.columns[column][0]) for column in columns]
+	minmax = {}
+	blocks = []
+	writers = []
+	def close():
+		for column, w in izip(columns, writers):
+			# Closing forgets min and max.
+			if w.min is not None:
+				old_min, old_max = minmax.get(column, (w.min, w.max))
+				minmax[column] = (min(old_min, w.min), max(old_max, w.max))
+			w.close()
+	count = 0
+	for count, line in enumerate(lines, 1):
+		if (count - 1) % per_block == 0:
+			close()
+			mode = 'ab' if writers else 'wb'
+			blocks.append((count - 1, key(line), {column: getsize(fn) if writers else 0 for column, fn in izip(columns, fns)}))
+			writers = [mk(fn, mode) for mk, fn in izip(mk_writers, fns)]
+			write_funcs = [w.write for w in writers]
+		for w, v in izip(write_funcs, line):
+			w(v)
+	if not writers:
+		# Every slice needs files, even empty ones.
+		writers = [mk(fn) for mk, fn in izip(mk_writers, fns)]
+	close()
+	dw.set_lines(sliceno, count)
+	dw.set_minmax(sliceno, {column: minmax.get(column, (None, None)) for column in columns})
+	# Later sorts read these, so they are not temp.
+	blob.save(blocks, 'sort_blocks', sliceno=sliceno, temp=False)
+
+def part_blocks(ds, sliceno):
+	"""The saved block starts of one sorted part. If it wasn't written in
+	blocks its keys are read to make blocks without offsets."""
+	ds = Dataset(ds)
+	if exists(ds.jobid.filename('sort_blocks', sliceno)):
+		return blob.load('sort_blocks', jobid=ds.jobid, sliceno=sliceno)
+	columns = options.sort_columns
+	key = mk_keyfunc(columns)
+	per_block = block_lines(ds.lines[sliceno])
+	it = ds.iterate(sliceno, columns)
+	return [(ix, key(line), None) for ix, line in enumerate(it) if ix % per_block == 0]
+
+def order_key(key):
+	if options.sort_order == 'descending':
+		return Descending(key)
+	return key
+
+def slice_boundaries(parts, blocks, slices):
+	"""Where each output slice (except the first) starts, as (sort key,
+	part number, line number) of a block start. The blocks are weighed by
+	their length so the slices get about the same number of lines."""
+	samples = []
+	total = 0
+	for partno, (ds, sliceno) in enumerate(parts):
+		lines = Dataset(ds).lines[sliceno]
+		total += lines
+		ends = [b[0] for b in blocks[partno][1:]] + [lines]
+		for (start, key, _), end in izip(blocks[partno], ends):
+			samples.append((order_key(key), partno, start, key, end - start))
+	samples.sort()
+	starts = []
+	done = 0
+	for _, partno, start, key, length in samples:
+		starts.append((done, (key, partno, start)))
+		done += length
+	boundaries = []
+	ix = 0
+	for sliceno in range(1, slices):
+		target = total * sliceno / slices
+		while ix < len(starts) and starts[ix][0] < target:
+			ix += 1
+		# Use the block start closest to target.
+		if ix == len(starts) or (ix and target - starts[ix - 1][0] < starts[ix][0] - target):
+			pick = ix - 1
+		else:
+			pick = ix
+		if pick >= 0:
+			boundaries.append(starts[pick][1])
+	return boundaries
+
+def part_range(ds, sliceno, partno, blocks, columns, lower, upper):
+	"""The lines of one sorted part that are from lower up to upper in
+	the merged order (None for the ends). Starts reading at the last
+	block that starts before lower."""
+	ds = Dataset(ds)
+	key = mk_keyfunc(columns)
+	def before(line_pos, bound):
+		k = order_key(key(line_pos[0]))
+		return (k, partno, line_pos[1]) < (order_key(bound[0]), bound[1], bound[2])
+	start, _, offsets = blocks[0]
+	if lower:
+		for block in blocks:
+			if (order_key(block[1]), partno, block[0]) > (order_key(lower[0]), lower[1], lower[2]):
+				break
+			if block[2] is not None:
+				start, _, offsets = block
+	if offsets is None:
+		start = 0
+		lines = ds.iterate(sliceno, columns)
+	else:
+		def reader(column):
+			dc = ds.columns[column]
+			# Small slices get put together in one file after writing.
+			seek = offsets[column] + (dc.offsets[sliceno] if dc.offsets else 0)
+			return typed_reader(dc.backing_type)(ds.column_filename(column, sliceno), seek=seek, max_count=ds.lines[sliceno] - start)
+		lines = izip(*[reader(column) for column in columns])
+	for pos, line in enumerate(lines, start):
+		if upper and not before((line, pos), upper):
+			return
+		if not lower or not before((line, pos), lower):
+			yield line
+
+def incremental():
+	return options.incremental and datasets.previous
+
+def merge_sort():
+	# Sorted in runs that are merged (and written in blocks).
+	return bool(options.memory_budget or incremental() or options.write_blocks)
+
+def sort_in_c():
+	if merge_sort():
+		return False
+	info = datasets.source.columns
+	return all(info[column].backing_type in dataset_sort.argsortfuncs for column in options.sort_columns)
+
+def column_files(column, parts):
+	in_fns = []
+	offsets = []
+	max_counts = []
+	for ds, sliceno in parts:
+		ds = Dataset(ds)
+		in_fns.append(ds.column_filename(column, sliceno))
+		offsets.append(ds.columns[column].offsets[sliceno] if ds.columns[column].offsets else 0)
+		max_counts.append(ds.lines[sliceno])
+	return in_fns, len(in_fns), offsets, max_counts
+
+def c_argsort(parts, total, perm_fh):
+	# Stable sort on each column, starting with the last one.
+	flags = 1 # first
+	if options.sort_order == 'descending':
+		flags |= 2
+	for column in reversed(options.sort_columns):
+		c = getattr(cstuff.backend, dataset_sort.argsortfuncs[datasets.source.columns[column].backing_type])
+		res = c(*cstuff.bytesargs(*column_files(column, parts) + (total, perm_fh.fileno(), 0, 0, None, None, flags,)))
+		assert not res, 'Failed to sort on ' + column
+		flags &= ~1
+
+def c_permute(parts, total, perm_fh, start, count, dw, sliceno):
+	for ix, column in enumerate(sorted(datasets.source.columns), 1):
+		with status('Writing %r (%d/%d)' % (column, ix, len(datasets.source.columns),)):
+			c = getattr(cstuff.backend, dataset_sort.permutefuncs[datasets.source.columns[column].backing_type])
+			res = c(*cstuff.bytesargs(*column_files(column, parts) + (total, perm_fh.fileno(), start, count, dw.column_filename(column, sliceno), 'wb', 0,)))
+			assert not res, 'Failed to write ' + column
+
+def chain_minmax(ds_list):
+	# The values don't change, so neither does min/max. (All slices get
+	# the values for the whole dataset, they are merged in the end anyway.)
+	res = {}
+	for column in datasets.source.columns:
+		minmax = [(ds.columns[column].min, ds.columns[column].max) for ds in ds_list if ds.columns[column].min is not None]
+		if minmax:
+			res[column] = (min(mm[0] for mm in minmax), max(mm[1] for mm in minmax))
+		else:
+			res[column] = (None, None)
+	return res
+
+def slice_sizes(total, slices, sort_idx):
+	per_slice = [total // slices] * slices
+	extra = total % slices
+	if extra:
+		# spread the left over length over pseudo-randomly selected slices
+		# (using the start of sort_idx to select slices).
+		# this will always select the first slices if data is already sorted
+		# but at least it's deterministic.
+		selector = sorted(range(min(slices, total)), key=sort_idx.__getitem__)
+		for sliceno in selector[:extra]:
+			per_slice[sliceno] += 1
+	return per_slice
+
+def sort_within_slices(ds_list):
+	# Sort each dataset within slices (as subjobs). Ties go to the earlier
+	# dataset and slice, the same order the in memory version iterates in.
+	# (Sorted as a chain, so each subjob only sorts one dataset.)
+	res = []
+	previous = datasets.previous
+	for ds in ds_list:
+		sorted_ds = Dataset(subjobs.build(
+			'dataset_sort',
+			options=dict(
+				sort_columns=options.sort_columns,
+				sort_order=options.sort_order,
+				memory_budget=options.memory_budget,
+				# So the merge can seek to the blocks it needs.
+				write_blocks=True,
+			),
+			datasets=dict(source=ds, previous=previous),
+		))
+		previous = sorted_ds
+		res.append(sorted_ds)
+	return res
+
 def prepare(params):
 	d = datasets.source
 	ds_list = d.chain(stop_ds={datasets.previous: 'source'})
-	if options.sort_across_slices:
+	if incremental():
+		prev_options = job_params(datasets.previous.jobid).options
+		for name in ('sort_columns', 'sort_order', 'sort_across_slices',):
+			assert prev_options.get(name) == options[name], 'previous was sorted with %s=%r, not %r' % (name, prev_options.get(name), options[name],)
+		# Everything previous sorted is already sorted, so only the new
+		# datasets need sorting before all of it is merged.
+		sorted_list = datasets.previous.chain() + sort_within_slices(ds_list)
+	if options.sort_across_slices and sort_in_c():
+		parts = [(ds, sliceno) for ds in ds_list for sliceno in range(params.slices) if ds.lines[sliceno]]
+		total = sum(ds.lines[sliceno] for ds, sliceno in parts)
+		with status('Determining sort order'):
+			with open('sort_permutation', 'w+b') as perm_fh:
+				perm_fh.truncate(total * 8)
+				c_argsort(parts, total, perm_fh)
+				perm_fh.seek(0)
+				first = min(params.slices, total)
+				first = struct.unpack('=%dQ' % (first,), perm_fh.read(first * 8))
+		starts = [0]
+		for num in slice_sizes(total, params.slices, first):
+			starts.append(starts[-1] + num)
+		sort_idx = (parts, total, starts)
+	elif options.sort_across_slices and (options.memory_budget or incremental()):
+		# Sort each dataset within slices, then each slice merges its part
+		# of all of them.
+		if not incremental():
+			sorted_list = sort_within_slices(ds_list)
+		parts = [(ds, sliceno) for ds in sorted_list for sliceno in range(params.slices) if ds.lines[sliceno]]
+		with status('Finding slice boundaries'):
+			blocks = [part_blocks(ds, sliceno) for ds, sliceno in parts]
+			sort_idx = (parts, blocks, slice_boundaries(parts, blocks, params.slices))
+	elif options.sort_across_slices:
 		columniter = partial(Dataset.iterate_list, None, datasets=ds_list)
 		sort_idx = sort(columniter)
 		total = len(sort_idx)
-		per_slice = [total // params.slices] * params.slices
-		extra = total % params.slices
-		if extra:
-			# spread the left over length over pseudo-randomly selected slices
-			# (using the start of sort_idx to select slices).
-			# this will always select the first slices if data is already sorted
-			# but at least it's deterministic.
-			selector = sorted(range(min(params.slices, total)), key=sort_idx.__getitem__)
-			for sliceno in selector[:extra]:
-				per_slice[sliceno] += 1
+		per_slice = slice_sizes(total, params.slices, sort_idx)
 		# change per_slice to be the actual sort indexes
 		start = 0
 		for ix, num in enumerate(per_slice):
@@ -132,13 +540,23 @@ def prepare(params):
 		assert sum(len(part) for part in per_slice) == total # all rows used
 		assert len(set(len(part) for part in per_slice)) < 3 # only 1 or 2 lengths possible
 		sort_idx = per_slice
+	elif incremental():
+		# Each slice merges the same slice of all of them.
+		sort_idx = sorted_list
 	else:
 		sort_idx = None
 	if options.sort_across_slices:
 		hashlabel = None
+	elif incremental() and any(ds.hashlabel != d.hashlabel for ds in sorted_list):
+		hashlabel = None
 	else:
 		hashlabel = d.hashlabel
-	if len(ds_list) == 1:
+	if incremental():
+		# All lines are in the new dataset.
+		previous = None
+	else:
+		previous = datasets.previous
+	if len(ds_list) == 1 and not incremental():
 		filename = d.filename
 	else:
 		filename = None
@@ -147,12 +565,57 @@ def prepare(params):
 		caption=params.caption,
 		hashlabel=hashlabel,
 		filename=filename,
-		previous=datasets.previous,
+		previous=previous,
+		meta_only=sort_in_c() or merge_sort(),
 	)
 	return dw, ds_list, sort_idx
 
 def analysis(sliceno, params, prepare_res):
 	dw, ds_list, sort_idx = prepare_res
+	if sort_in_c():
+		if options.sort_across_slices:
+			parts, total, starts = sort_idx
+			with open('sort_permutation', 'rb') as perm_fh:
+				count = starts[sliceno + 1] - starts[sliceno]
+				c_permute(parts, total, perm_fh, starts[sliceno], count, dw, sliceno)
+		else:
+			parts = [(ds, sliceno) for ds in ds_list if ds.lines[sliceno]]
+			total = count = sum(ds.lines[sliceno] for ds in ds_list)
+			with TemporaryFile(dir='.') as perm_fh:
+				perm_fh.truncate(total * 8)
+				with status('Determining sort order'):
+					c_argsort(parts, total, perm_fh)
+				c_permute(parts, total, perm_fh, 0, total, dw, sliceno)
+		dw.set_lines(sliceno, count)
+		dw.set_minmax(sliceno, chain_minmax(ds_list))
+		return
+	if merge_sort():
+		columns = sorted(datasets.source.columns)
+		coltypes = [datasets.source.columns[column].backing_type for column in columns]
+		if options.sort_across_slices:
+			parts, blocks, boundaries = sort_idx
+			if sliceno > len(boundaries):
+				runs = [] # there were too few blocks to give this slice any lines
+			else:
+				lower = boundaries[sliceno - 1] if sliceno else None
+				upper = boundaries[sliceno] if sliceno < len(boundaries) else None
+				runs = [
+					part_range(ds, part_sliceno, partno, blocks[partno], columns, lower, upper)
+					for partno, (ds, part_sliceno) in enumerate(parts)
+				]
+			lines = (line for _, line in merge(runs, mk_keyfunc(columns)))
+			expected = sum(Dataset(ds).lines[part_sliceno] for ds, part_sliceno in parts) // params.slices
+		elif incremental():
+			runs = [ds.iterate(sliceno, columns) for ds in sort_idx]
+			lines = (line for _, line in merge(runs, mk_keyfunc(columns)))
+			expected = sum(ds.lines[sliceno] for ds in sort_idx)
+		else:
+			lines = Dataset.iterate_list(sliceno, columns, ds_list)
+			expected = sum(ds.lines[sliceno] for ds in ds_list)
+			lines = external_sort(lines, columns, coltypes, 'sortrun.%d' % (sliceno,))
+		with status('Writing sorted lines'):
+			write_blocks(lines, expected, columns, dw, sliceno)
+		return
 	if options.sort_across_slices:
 		columniter = partial(Dataset.iterate_list, None, datasets=ds_list)
 		sort_idx = sort_idx[sliceno]
@@ -169,3 +632,7 @@ def analysis(sliceno, params, prepare_res):
 				w(lst[idx])
 		# Delete the list before making a new one, so we use less memory.
 		del lst
+
+def synthesis():
+	if options.sort_across_slices and sort_in_c():
+		unlink('sort_permutation')
@@ -0,0 +1,254 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import division
+from __future__ import print_function
+from __future__ import absolute_import
+
+description = r'''
+Split a dataset chain into one dataset per value of options.column, in
+one pass over the data (instead of one filter job per value).
+
+By default the options.max_outputs most common values each get a
+dataset, all other values go in a dataset called "other". You can
+instead give the values in options.split_values (everything else goes in
+"other"), or bucket edges in options.buckets. Edges [a, b] give the
+buckets (..., a), [a, b) and [b, ...), and None and NaN go in "other".
+
+Datasets are named after their values, with characters that are not
+letters, digits, "_", "-" or "." replaced by "_" (and a number added
+if that is not unique). The result is DotDict(names={value: dataset
+name}, other=name or None, lines={dataset name: lines}). Bucket values
+are (low, high) with None for the open ends.
+
+The outputs keep the hashlabel of the source (lines stay in their
+slice). To find the most common values prepare first counts the values
+of the split column. Then each slice reads its lines once and writes
+each line to the files of its output, and synthesis moves those files
+into the datasets. So there are never more files than outputs, however
+many values the column has. At most 64 outputs have their files open
+at the same time in each slice. When another one is needed the one
+that was used the longest ago is closed, and appended to if it is
+needed again.
+
+With jobids.previous (an earlier dataset_split job) each output has
+the dataset with the same name in previous as its previous, so you can
+chain each output on its own.
+'''
+
+import re
+from os import rename
+from bisect import bisect_right
+from collections import Counter
+
+from accelerator.compat import uni, izip
+from accelerator.extras import DotDict
+from accelerator.dataset import DatasetWriter, Dataset, job_datasets
+from accelerator.gzwrite import typed_writer
+from accelerator.status import status
+
+options = dict(
+	column       = str,
+	split_values = [],
+	buckets      = [],
+	max_outputs  = 100, # most common values, the rest go in "other"
+	caption      = '%(caption)s (%(column)s %(value)s)',
+	length       = -1, # Go back at most this many datasets. You almost always want -1 (which goes until the source of previous)
+)
+
+datasets = ('source',)
+jobids = ('previous',)
+
+OTHER = 'other'
+# NaN is not equal to itself, so it can't be looked up. All NaNs are
+# counted as this instead (no column value is a tuple).
+NAN = ('NaN',)
+# Outputs with open files at the same time in each slice.
+MAX_OPEN = 64
+
+def dataset_name(value, used):
+	# uni(None) is None, but None is a value like any other here.
+	text = 'None' if value is None else uni(value)
+	base = re.sub(r'[^0-9A-Za-z_.-]', '_', text)[:64].lstrip('.') or '_'
+	name = base
+	ix = 0
+	while name in used:
+		ix += 1
+		name = '%s_%d' % (base, ix,)
+	used.add(name)
+	return name
+
+def bucket_values(edges):
+	lows = [None] + list(edges)
+	highs = list(edges) + [None]
+	return list(izip(lows, highs))
+
+def prepare():
+	d = datasets.source
+	ds_list = d.chain(stop_ds={jobids.previous: 'source'}, length=options.length)
+	if options.column not in d.columns:
+		raise Exception("Dataset %s doesn't have a column named %r" % (d, options.column,))
+	if d.columns[options.column].type == 'json':
+		raise Exception("Can't split on json column %r" % (options.column,))
+	if options.split_values and options.buckets:
+		raise Exception("Specify values or buckets, not both")
+	if options.buckets:
+		if sorted(options.buckets) != list(options.buckets) or len(set(options.buckets)) != len(options.buckets):
+			raise Exception("Buckets must be strictly increasing, not %r" % (options.buckets,))
+		values = bucket_values(options.buckets)
+	elif options.split_values:
+		values = list(options.split_values)
+		if len(set(values)) != len(values):
+			raise Exception("Duplicate values in %r" % (values,))
+	else:
+		return ds_list, find_values(ds_list)
+	return ds_list, (values, True)
+
+def find_values(ds_list):
+	# Only the split column is read, and no files are written.
+	with status('Counting values'):
+		counts = Counter(v if v == v else NAN for v in Dataset.iterate_list(None, options.column, ds_list))
+	nans = counts.pop(NAN, 0)
+	values = [v for v, _ in counts.most_common(options.max_outputs)]
+	need_other = bool(nans) or len(counts) > len(values) or not values
+	# Don't depend on the order of values with the same count.
+	try:
+		values.sort()
+	except TypeError:
+		values.sort(key=repr)
+	return values, need_other
+
+def make_lookup(values):
+	# Returns the output for the value of a line, which is the index in
+	# values (len(values) for "other").
+	other_ix = len(values)
+	if options.buckets:
+		edges = list(options.buckets)
+		def lookup(v):
+			if v is None or v != v:
+				return other_ix
+			return bisect_right(edges, v)
+		return lookup
+	ixes = {v: ix for ix, v in enumerate(values)}
+	get = ixes.get
+	return lambda v: get(v, other_ix)
+
+def output_filename(sliceno, ix, colno):
+	return 'split.%d.%d.%d' % (sliceno, ix, colno,)
+
+def analysis(sliceno, prepare_res):
+	ds_list, (values, _) = prepare_res
+	columns = datasets.source.columns
+	names = sorted(columns)
+	mk_writers = [typed_writer(columns[n].type) for n in names]
+	split_ix = names.index(options.column)
+	lookup = make_lookup(values)
+	# {output index: [lines, {column: (min, max)}]}
+	outputs = {}
+	open_writers = {}
+	write_funcs = {}
+	# {output index: line number when last used}, to close the least
+	# recently used.
+	last_used = {}
+	def close(ix):
+		info = outputs[ix]
+		writers = open_writers.pop(ix)
+		del write_funcs[ix]
+		for n, w in izip(names, writers):
+			# Closing forgets min and max.
+			if w.min is not None:
+				old_min, old_max = info[1].get(n, (w.min, w.max))
+				info[1][n] = (min(old_min, w.min), max(old_max, w.max))
+		info[0] += writers[0].count
+		for w in writers:
+			w.close()
+	def open_output(ix):
+		if len(open_writers) >= MAX_OPEN:
+			close(min(open_writers, key=last_used.get))
+		if ix in outputs:
+			mode = 'ab'
+		else:
+			outputs[ix] = [0, {}]
+			mode = 'wb'
+		writers = open_writers[ix] = [mk(output_filename(sliceno, ix, colno), mode) for colno, mk in enumerate(mk_writers)]
+		funcs = write_funcs[ix] = [w.write for w in writers]
+		return funcs
+	for lineno, line in enumerate(Dataset.iterate_list(sliceno, names, ds_list)):
+		ix = lookup(line[split_ix])
+		last_used[ix] = lineno
+		funcs = write_funcs.get(ix)
+		if funcs is None:
+			funcs = open_output(ix)
+		for w, v in izip(funcs, line):
+			w(v)
+	for ix in list(open_writers):
+		close(ix)
+	return outputs
+
+def move_files(ix, info, sliceno, dw, names):
+	# Put the files of this output in dw and set lines and minmax.
+	minmax = {}
+	for colno, n in enumerate(names):
+		target = dw.column_filename(n, sliceno)
+		if info:
+			rename(output_filename(sliceno, ix, colno), target)
+		else:
+			# Every slice needs files, even empty ones.
+			typed_writer(dw.columns[n][0])(target).close()
+		minmax[n] = info[1].get(n, (None, None)) if info else (None, None)
+	count = info[0] if info else 0
+	dw.set_lines(sliceno, count)
+	dw.set_minmax(sliceno, minmax)
+	return count
+
+def synthesis(prepare_res, analysis_res):
+	ds_list, (values, need_other) = prepare_res
+	d = datasets.source
+	analysis_res = list(analysis_res)
+	if jobids.previous:
+		previous = {ds.name: ds for ds in job_datasets(jobids.previous)}
+	else:
+		previous = {}
+	used = {OTHER}
+	names = [dataset_name('%s-%s' % v if options.buckets else v, used) for v in values]
+	captions = list(values)
+	if need_other:
+		names.append(OTHER)
+		captions.append(OTHER)
+	columns = {n: c.type for n, c in d.columns.items()}
+	colnames = sorted(columns)
+	lines = {}
+	with status('Moving files to datasets'):
+		for ix, (name, value) in enumerate(izip(names, captions)):
+			dw = DatasetWriter(
+				name=name,
+				columns=columns,
+				hashlabel=d.hashlabel,
+				caption=options.caption % dict(caption=d.caption, column=options.column, value=value),
+				previous=previous.get(name),
+				meta_only=True,
+			)
+			lines[name] = sum(move_files(ix, outputs.get(ix), sliceno, dw, colnames) for sliceno, outputs in enumerate(analysis_res))
+	res = DotDict(
+		names=dict(izip(values, names)),
+		other=OTHER if need_other else None,
+		lines=lines,
+	)
+	for name in names:
+		print('%s: %d lines' % (name, lines[name],))
+	return res
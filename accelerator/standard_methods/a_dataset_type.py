@@ -26,11 +26,15 @@ from mmap import mmap, PROT_READ
 from shutil import copyfileobj
 from struct import Struct
 import itertools
+from functools import partial
+from multiprocessing import cpu_count
+from multiprocessing.pool import ThreadPool
+from threading import current_thread
 
-from accelerator.compat import NoneType, unicode, imap, itervalues, PY2
+from accelerator.compat import NoneType, unicode, imap, PY2
 
 from accelerator.extras import OptionEnum, DotDict
-from accelerator.gzwrite import typed_writer, typed_reader
+from accelerator.gzwrite import typed_writer
 from accelerator.sourcedata import type2iter
 from . import dataset_type
 
@@ -43,7 +47,11 @@ Also rehashes if you type the hashlabel, or specify a new hashlabel.
 
 # Without filter_bad the method fails when a value fails to convert and
 # doesn't have a default. With filter_bad the value is filtered out
-# together with all other values on the same line.
+# together with all other values on the same line. This is done in a
+# single pass when possible, columns are only converted again if they were
+# converted before another column found a bad line. (So the bad line count
+# per column in the report only counts the first column a line was found
+# bad in.)
 #
 # With filter_bad, when rehashing or when typing a chain a new dataset is
 # produced, so any columns not in column2type that are not of a bytes-like
@@ -65,6 +73,7 @@ options = {
 	'length'                    : -1, # Go back at most this many datasets. You almost always want -1 (which goes until previous.source)
 	'as_chain'                  : False, # one dataset per slice if rehashing (avoids rewriting at the end)
 	'compression'               : 6,     # gzip level
+	'threads'                   : 0,     # columns converted at once in each slice, 0 for cpu count / slices
 }
 
 datasets = ('source', 'previous',)
@@ -245,20 +254,29 @@ def analysis(sliceno, slices, prepare_res):
 		lines=lines,
 		column2type=column2type,
 		rev_rename={v: k for k, v in options.rename.items() if k in datasets.source.columns and v in column2type},
+		sources=chain_sources,
+		defaults=options.defaults,
+		filter_bad=options.filter_bad,
+		compression=options.compression,
+		threads=options.threads or max(cpu_count() // slices, 1),
 	)
+	colnames = list(column2type)
+	if rehashing:
+		# The slicemap is built while converting the hashlabel, so do that first.
+		vars.slicemap_fd = map_init(vars, 'slicemap%d' % (sliceno,), 'slicemap_size')
+		colnames.remove(dw.hashlabel)
+		colnames.insert(0, dw.hashlabel)
+	convert = partial(convert_column, vars)
 	if options.filter_bad:
 		vars.badmap_fd = map_init(vars, 'badmap%d' % (sliceno,))
-		bad_count, default_count, minmax = analysis_lap(vars)
-		if sum(sum(c) for c in itervalues(bad_count)):
-			vars.first_lap = False
-			vars.res_bad_count = {}
-			final_bad_count, default_count, minmax = analysis_lap(vars)
-			final_bad_count = [max(c) for c in zip(*final_bad_count.values())]
-		else:
-			final_bad_count = [0] * slices
+		bad_count, final_bad_count = filter_bad_lap(vars, convert, colnames)
 	else:
-		bad_count, default_count, minmax = analysis_lap(vars)
+		if rehashing:
+			convert(colnames.pop(0))
+		convert_columns(vars, convert, colnames)
+		bad_count = vars.res_bad_count
 		final_bad_count = [0] * slices
+	default_count, minmax = vars.res_default_count, vars.res_minmax
 	for fh in vars.map_fhs:
 		fh.close()
 	if rehashing:
@@ -302,46 +320,94 @@ class Int16BytesWrapper(object):
 		return it()
 
 
-def analysis_lap(vars):
+def convert_column(vars, colname):
+	coltype = vars.column2type[colname]
 	if vars.rehashing:
-		if vars.first_lap:
-			out_fn = 'hashtmp.%d' % (vars.sliceno,)
-			colname = vars.rev_rename.get(vars.dw.hashlabel, vars.dw.hashlabel)
-			coltype = vars.column2type[options.rename.get(colname, colname)]
-			vars.rehashing = False
-			real_coltype = one_column(vars, colname, coltype, [out_fn], True)
-			vars.rehashing = True
-			assert vars.res_bad_count[colname] == [0] # imlicitly has a default
-			vars.slicemap_fd = map_init(vars, 'slicemap%d' % (vars.sliceno,), 'slicemap_size')
-			slicemap = mmap(vars.slicemap_fd, vars.slicemap_size)
-			slicemap = Int16BytesWrapper(slicemap)
-			hash = typed_writer(real_coltype).hash
-			slices = vars.slices
-			vars.hash_lines = hash_lines = [0] * slices
-			for ix, value in enumerate(typed_reader(real_coltype)(out_fn)):
-				dest_slice = hash(value) % slices
-				slicemap[ix] = dest_slice
-				hash_lines[dest_slice] += 1
-			unlink(out_fn)
-	for colname, coltype in vars.column2type.items():
-		if vars.rehashing:
-			out_fns = [vars.dw.column_filename(colname, sliceno=s) for s in range(vars.slices)]
+		out_fns = [vars.dw.column_filename(colname, sliceno=s) for s in range(vars.slices)]
+	else:
+		out_fns = [vars.dw.column_filename(colname)]
+	src_colname = vars.rev_rename.get(colname, colname)
+	one_column(vars, src_colname, coltype, out_fns)
+	return src_colname
+
+
+# Convert several columns at once on vars.threads threads. Most of the
+# C converters don't need the GIL, so this uses more cores when there are
+# fewer slices than cores.
+def convert_columns(vars, convert, colnames):
+	if vars.threads < 2 or len(colnames) < 2:
+		return [convert(colname) for colname in colnames]
+	pool = ThreadPool(min(vars.threads, len(colnames)))
+	try:
+		return pool.map(convert, colnames, chunksize=1)
+	finally:
+		pool.close()
+		pool.join()
+
+
+# Convert all columns with filter_bad in a single pass (unless there
+# are bad lines). Each column skips the lines earlier columns found bad
+# and records its own bad lines, so afterwards only the columns before
+# the last one that found new bad lines have to be converted again.
+# convert(colname) converts one column and returns the name the counts
+# are stored under in vars.
+# Returns ({name: bad lines first found in that column}, bad lines per slice).
+# (Also used by csvimport.)
+def filter_bad_lap(vars, convert, colnames):
+	vars.first_lap = True
+	names = [convert(colname) for colname in colnames]
+	if not names:
+		return {}, [0]
+	bad_count = {name: list(vars.res_bad_count[name]) for name in names}
+	new_bad_count = {}
+	redo_count = 0
+	prev = [0] * len(bad_count[names[0]])
+	for ix, name in enumerate(names):
+		# Counts include the skipped lines, so they only ever grow.
+		new_bad_count[name] = [a - b for a, b in zip(bad_count[name], prev)]
+		if sum(new_bad_count[name]):
+			redo_count = ix
+		prev = bad_count[name]
+	if redo_count:
+		# The badmap is complete now, so these can be done concurrently.
+		vars.first_lap = False
+		convert_columns(vars, convert, colnames[:redo_count])
+	return new_bad_count, prev
+
+
+def chain_sources(vars, colname):
+	# Returns (in_fns, offsets, max_counts) for the C converters and
+	# a function giving an iterator over the values for pyfuncs.
+	in_fns = []
+	offsets = []
+	max_counts = []
+	for d in vars.chain:
+		assert colname in d.columns, '%s not in %s' % (colname, d,)
+		assert d.columns[colname].type in byteslike_types, '%s has bad type in %s' % (colname, d,)
+		in_fns.append(d.column_filename(colname, vars.sliceno))
+		if d.columns[colname].offsets:
+			offsets.append(d.columns[colname].offsets[vars.sliceno])
+			max_counts.append(d.lines[vars.sliceno])
 		else:
-			out_fns = [vars.dw.column_filename(colname)]
-		one_column(vars, vars.rev_rename.get(colname, colname), coltype, out_fns)
-	return vars.res_bad_count, vars.res_default_count, vars.res_minmax
+			offsets.append(0)
+			max_counts.append(-1)
+	def values():
+		return itertools.chain.from_iterable(d._column_iterator(vars.sliceno, colname, _type='bytes') for d in vars.chain)
+	return in_fns, offsets, max_counts, values
 
 
-def one_column(vars, colname, coltype, out_fns, for_hasher=False):
-	if for_hasher:
-		record_bad = skip_bad = False
-	elif vars.first_lap:
-		record_bad = options.filter_bad
-		skip_bad = False
+# This is also used by csvimport (with column2type), so everything it
+# needs comes from vars and not from options.
+# When rehashing the first column converted (the hashlabel) builds the
+# slicemap the other columns use.
+def one_column(vars, colname, coltype, out_fns):
+	if vars.first_lap:
+		# Skip what earlier columns found too, see filter_bad_lap.
+		record_bad = skip_bad = vars.filter_bad
 	else:
 		record_bad = 0
-		skip_bad = options.filter_bad
-	minmax_fn = 'minmax%d' % (vars.sliceno,)
+		skip_bad = vars.filter_bad
+	minmax_fn = 'minmax%d.%d' % (vars.sliceno, current_thread().ident,)
 
 	fmt = fmt_b = None
 	if coltype in dataset_type.convfuncs:
@@ -368,27 +434,10 @@ def one_column(vars, colname, coltype, out_fns, for_hasher=False):
 		fmt = "int"
 	assert cfunc or pyfunc, coltype + " didn't have cfunc or pyfunc"
 	coltype = shorttype
-	in_fns = []
-	offsets = []
-	max_counts = []
-	for d in vars.chain:
-		assert colname in d.columns, '%s not in %s' % (colname, d,)
-		assert d.columns[colname].type in byteslike_types, '%s has bad type in %s' % (colname, d,)
-		in_fns.append(d.column_filename(colname, vars.sliceno))
-		if d.columns[colname].offsets:
-			offsets.append(d.columns[colname].offsets[vars.sliceno])
-			max_counts.append(d.lines[vars.sliceno])
-		else:
-			offsets.append(0)
-			max_counts.append(-1)
+	in_fns, offsets, max_counts, values = vars.sources(vars, colname)
+	build_slicemap = vars.rehashing and vars.hash_lines is None
 	if cfunc:
-		default_value = options.defaults.get(colname, cstuff.NULL)
-		if for_hasher and default_value is cstuff.NULL:
-			if coltype.startswith('bits'):
-				# No None-support.
-				default_value = '0'
-			else:
-				default_value = None
+		default_value = vars.defaults.get(colname, cstuff.NULL)
 		default_len = 0
 		if default_value is None:
 			default_value = cstuff.NULL
@@ -406,9 +455,17 @@ def one_column(vars, colname, coltype, out_fns, for_hasher=False):
 			c_slices = 1
 		bad_count = cstuff.mk_uint64(c_slices)
 		default_count = cstuff.mk_uint64(c_slices)
-		gzip_mode = "wb%d" % (options.compression,)
-		res = c(*cstuff.bytesargs(in_fns, len(in_fns), out_fns, gzip_mode, minmax_fn, default_value, default_len, default_value_is_None, fmt, fmt_b, record_bad, skip_bad, vars.badmap_fd, vars.badmap_size, c_slices, vars.slicemap_fd, vars.slicemap_size, bad_count, default_count, offsets, max_counts))
+		if build_slicemap:
+			# lines written to each slice
+			hash_count = cstuff.mk_uint64(c_slices)
+		else:
+			hash_count = None
+		gzip_mode = "wb%d" % (vars.compression,)
+		res = c(*cstuff.bytesargs(in_fns, len(in_fns), out_fns, gzip_mode, minmax_fn, default_value, default_len, default_value_is_None, fmt, fmt_b, record_bad, skip_bad, vars.badmap_fd, vars.badmap_size, c_slices, vars.slicemap_fd, vars.slicemap_size, hash_count, bad_count, default_count, offsets, max_counts))
 		assert not res, 'Failed to convert ' + colname
+		if build_slicemap:
+			# Bad lines are in slice 0 of the slicemap (and their bad_count).
+			vars.hash_lines = [h + b for h, b in zip(hash_count, bad_count)]
 		vars.res_bad_count[colname] = list(bad_count)
 		vars.res_default_count[colname] = sum(default_count)
 		coltype = coltype.split(':', 1)[0]
@@ -418,18 +475,18 @@ def one_column(vars, colname, coltype, out_fns, for_hasher=False):
 		unlink(minmax_fn)
 	else:
 		# python func
-		if for_hasher:
+		if build_slicemap:
 			raise Exception("Can't hash on column of type %s." % (coltype,))
 		nodefault = object()
-		if colname in options.defaults:
-			default_value = options.defaults[colname]
+		if colname in vars.defaults:
+			default_value = vars.defaults[colname]
 			if default_value is not None:
 				if isinstance(default_value, unicode):
 					default_value = default_value.encode('utf-8')
 				default_value = pyfunc(default_value)
 		else:
 			default_value = nodefault
-		if options.filter_bad:
+		if vars.filter_bad:
 			badmap = mmap(vars.badmap_fd, vars.badmap_size)
 			if PY2:
 				badmap = IntegerBytesWrapper(badmap)
@@ -447,8 +504,7 @@ def one_column(vars, colname, coltype, out_fns, for_hasher=False):
 		fhs = [typed_writer(real_coltype)(fn) for fn in out_fns]
 		write = fhs[0].write
 		col_min = col_max = None
-		it = itertools.chain.from_iterable(d._column_iterator(vars.sliceno, colname, _type='bytes') for d in vars.chain)
-		for ix, v in enumerate(it):
+		for ix, v in enumerate(values()):
 			if vars.rehashing:
 				chosen_slice = slicemap[ix]
 				write = fhs[chosen_slice].write
@@ -479,7 +535,7 @@ def one_column(vars, colname, coltype, out_fns, for_hasher=False):
 			fh.close()
 		if vars.rehashing:
 			slicemap.close()
-		if options.filter_bad:
+		if vars.filter_bad:
 			badmap.close()
 		vars.res_bad_count[colname] = bad_count
 		vars.res_default_count[colname] = default_count
@@ -37,7 +37,7 @@ _prologue_code_template = r'''
 
 static PyObject *nullmarker = 0;
 
-static int str_or_0(PyObject *obj, const char **res) {
+static inline int str_or_0(PyObject *obj, const char **res) {
 	if (obj == nullmarker) {
 		*res = 0;
 		return 0;
@@ -55,6 +55,187 @@ static PyObject *py_set_null(PyObject *dummy, PyObject *obj)
 }
 '''
 
+# SipHash-2-4 with the same key as gzutil uses for slicing, so methods
+# can compute the slice a value hashes to in C. (hash() is the same as
+# the bytes writer uses.) This is the reference implementation by
+# Jean-Philippe Aumasson and Daniel J. Bernstein (CC0), like in gzutil.
+siphash_code = r'''
+#define SIP_ROTL(x, b) (uint64_t)(((x) << (b)) | ((x) >> (64 - (b))))
+
+#define SIP_U8TO64_LE(p)                                                       \
+  (((uint64_t)((p)[0])) | ((uint64_t)((p)[1]) << 8) |                          \
+   ((uint64_t)((p)[2]) << 16) | ((uint64_t)((p)[3]) << 24) |                   \
+   ((uint64_t)((p)[4]) << 32) | ((uint64_t)((p)[5]) << 40) |                   \
+   ((uint64_t)((p)[6]) << 48) | ((uint64_t)((p)[7]) << 56))
+
+#define SIPROUND                                                               \
+  do {                                                                         \
+    v0 += v1;                                                                  \
+    v1 = SIP_ROTL(v1, 13);                                                     \
+    v1 ^= v0;                                                                  \
+    v0 = SIP_ROTL(v0, 32);                                                     \
+    v2 += v3;                                                                  \
+    v3 = SIP_ROTL(v3, 16);                                                     \
+    v3 ^= v2;                                                                  \
+    v0 += v3;                                                                  \
+    v3 = SIP_ROTL(v3, 21);                                                     \
+    v3 ^= v0;                                                                  \
+    v2 += v1;                                                                  \
+    v1 = SIP_ROTL(v1, 17);                                                     \
+    v1 ^= v2;                                                                  \
+    v2 = SIP_ROTL(v2, 32);                                                     \
+  } while (0)
+
+static uint64_t siphash24(const uint8_t *in, const uint64_t inlen, const uint8_t *k)
+{
+	uint64_t v0 = 0x736f6d6570736575ULL;
+	uint64_t v1 = 0x646f72616e646f6dULL;
+	uint64_t v2 = 0x6c7967656e657261ULL;
+	uint64_t v3 = 0x7465646279746573ULL;
+	uint64_t k0 = SIP_U8TO64_LE(k);
+	uint64_t k1 = SIP_U8TO64_LE(k + 8);
+	uint64_t m;
+	const uint8_t *end = in + inlen - (inlen % sizeof(uint64_t));
+	const int left = inlen & 7;
+	uint64_t b = ((uint64_t)inlen) << 56;
+	v3 ^= k1;
+	v2 ^= k0;
+	v1 ^= k1;
+	v0 ^= k0;
+	for (; in != end; in += 8) {
+		m = SIP_U8TO64_LE(in);
+		v3 ^= m;
+		SIPROUND;
+		SIPROUND;
+		v0 ^= m;
+	}
+	switch (left) {
+		case 7: b |= ((uint64_t)in[6]) << 48; /* fall through */
+		case 6: b |= ((uint64_t)in[5]) << 40; /* fall through */
+		case 5: b |= ((uint64_t)in[4]) << 32; /* fall through */
+		case 4: b |= ((uint64_t)in[3]) << 24; /* fall through */
+		case 3: b |= ((uint64_t)in[2]) << 16; /* fall through */
+		case 2: b |= ((uint64_t)in[1]) << 8; /* fall through */
+		case 1: b |= ((uint64_t)in[0]); break;
+		case 0: break;
+	}
+	v3 ^= b;
+	SIPROUND;
+	SIPROUND;
+	v0 ^= b;
+	v2 ^= 0xff;
+	SIPROUND;
+	SIPROUND;
+	SIPROUND;
+	SIPROUND;
+	// gzutil stores this little endian and then reads it as a uint64_t.
+	b = v0 ^ v1 ^ v2 ^ v3;
+	uint8_t out[8];
+	for (int i = 0; i < 8; i++) out[i] = (uint8_t)(b >> (i * 8));
+	memcpy(&b, out, 8);
+	return b;
+}
+
+static const uint8_t hash_k[16] = {94, 70, 175, 255, 152, 30, 237, 97, 252, 125, 174, 76, 165, 112, 16, 9};
+
+static uint64_t hash(const void *ptr, const uint64_t len)
+{
+	if (!len) return 0;
+	return siphash24(ptr, len, hash_k);
+}
+
+// These hash values like the typed writers do.
+static inline uint64_t hash_integer(const uint64_t i)
+{
+	if (!i) return 0;
+	return hash(&i, 8);
+}
+
+static inline uint64_t hash_double(const double d)
+{
+	const int64_t i = d;
+	if (i == d) return hash_integer(i);
+	return hash(&d, sizeof(d));
+}
+
+// A value as stored in a number column, length byte first.
+static inline uint64_t hash_number(const char *ptr, const int len)
+{
+	if (len == 1) return 0; // None
+	if (*ptr == 1) {
+		double d;
+		memcpy(&d, ptr + 1, 8);
+		return hash_double(d);
+	}
+	if (*ptr == 8) {
+		int64_t i;
+		memcpy(&i, ptr + 1, 8);
+		return hash_integer(i);
+	}
+	return hash(ptr + 1, *(const uint8_t *)ptr);
+}
+'''
+
+# Buffered reading of stored values from (gzipped) column files, for
+# backends that copy values without decoding them. Needs Z (the buffer
+# size) and <zlib.h>, <fcntl.h>, <unistd.h> and <string.h>.
+gzreader_code = r'''
+typedef struct {
+	gzFile fh;
+	int pos;
+	int len;
+	char buf[Z];
+} rd;
+
+static int rd_open(rd *r, const char *filename, off_t offset)
+{
+	r->pos = r->len = 0;
+	int fd = open(filename, O_RDONLY);
+	if (fd < 0) return 1;
+	if (lseek(fd, offset, 0) != offset) goto errfd;
+	r->fh = gzdopen(fd, "rb");
+	if (!r->fh) goto errfd;
+	return 0;
+errfd:
+	close(fd);
+	return 1;
+}
+
+static int rd_close(rd *r)
+{
+	int res = 0;
+	if (r->fh) res = gzclose(r->fh);
+	r->fh = 0;
+	return res;
+}
+
+// Copies len bytes to dst.
+// Returns -1 if the file ended before anything was read, 1 on other errors.
+static inline int rd_read(rd *r, char *dst, uint32_t len)
+{
+	int got_some = 0;
+	while (len) {
+		if (r->pos == r->len) {
+			r->len = gzread(r->fh, r->buf, Z);
+			r->pos = 0;
+			if (r->len <= 0) {
+				if (r->len < 0 || got_some) return 1;
+				r->len = 0;
+				return -1;
+			}
+		}
+		uint32_t avail = r->len - r->pos;
+		if (avail > len) avail = len;
+		memcpy(dst, r->buf + r->pos, avail);
+		r->pos += avail;
+		dst += avail;
+		len -= avail;
+		got_some = 1;
+	}
+	return 0;
+}
+'''
+
 _init_code_template = r'''
 static PyMethodDef module_methods[] = {
 	{"set_null", py_set_null, METH_O, 0},
@@ -118,7 +299,16 @@ def make_source(name, functions, protos, extra_functions, extra_method_defs, wra
 	code = ''.join(code)
 	return code, hash
 
+# Several methods (and dataset.py) can use the same backend in the same
+# process, and they all have to get the same NULL.
+_initialised = {}
+
 def init(name, hash, protos, extra_protos, functions):
+	if (name, hash) not in _initialised:
+		_initialised[(name, hash)] = _init(name, hash, protos, extra_protos, functions)
+	return _initialised[(name, hash)]
+
+def _init(name, hash, protos, extra_protos, functions):
 	backend = import_module('accelerator.standard_methods._' + name)
 	if hash == backend.source_hash:
 		NULL = object()
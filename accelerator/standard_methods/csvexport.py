@@ -0,0 +1,728 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+# This is a separate file from a_csvexport so setup.py can import
+# it and make the _csvexport module at install time.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+from . import c_backend_support
+from .dataset_type import noneval_data
+
+__all__ = ('native_types', 'FLAG_GZIP', 'FLAG_JSONL', 'FLAG_DECODE_BYTES', 'FLAG_REFUSE_NEWLINE', 'REFUSED',)
+
+# export reads col_count columns from each of ds_count datasets (in_fns
+# has col_count names per dataset) and writes each line as
+# prefixes[0] value0 prefixes[1] value1 ... suffix.
+# The values are formatted like a_csvexport formats them in python:
+# str() for most types, repr() for floats, None as "None" (or null in
+# jsonl), quoted with quote_char if it's not 0 (doubling any quote_char
+# in the value), or as JSON strings (in jsonl) for string-like types.
+#
+# Where the python version raises (None in a string column except in
+# jsonl, a newline in a value with FLAG_REFUSE_NEWLINE) export returns
+# REFUSED, so the caller can do it in python to get the same error.
+
+FLAG_GZIP = 1
+FLAG_JSONL = 2
+FLAG_DECODE_BYTES = 4 # utf-8 with invalid bytes as \xNN, like .decode('utf-8', 'backslashreplace')
+FLAG_REFUSE_NEWLINE = 8 # like GzWrite*Lines
+
+REFUSED = 2
+
+# type: type code in C
+native_types = {
+	'float64'  : 0,
+	'float32'  : 1,
+	'int64'    : 2,
+	'int32'    : 3,
+	'bits64'   : 4,
+	'bits32'   : 5,
+	'bool'     : 6,
+	'datetime' : 7,
+	'date'     : 8,
+	'time'     : 9,
+	'bytes'    : 10,
+	'ascii'    : 11,
+	'unicode'  : 12,
+	'number'   : 13,
+}
+
+protos = ['int export(const char **in_fns, off_t *offsets, int64_t *max_counts, int ds_count, int col_count, int *types, const char **prefixes, const char *suffix, const char *header, const char *out_fn, int flags, int quote_char);']
+
+all_c_functions = r'''
+#include <zlib.h>
+#include <stdlib.h>
+#include <stdio.h>
+#include <string.h>
+#include <math.h>
+#include <errno.h>
+#include <sys/types.h>
+#include <sys/stat.h>
+#include <fcntl.h>
+#include <unistd.h>
+
+#define err1(v) if (v) goto err
+#define Z (128 * 1024)
+#define GZNUMBER_MAX_BYTES 127
+
+#define T_FLOAT64  0
+#define T_FLOAT32  1
+#define T_INT64    2
+#define T_INT32    3
+#define T_BITS64   4
+#define T_BITS32   5
+#define T_BOOL     6
+#define T_DATETIME 7
+#define T_DATE     8
+#define T_TIME     9
+#define T_BYTES    10
+#define T_ASCII    11
+#define T_UNICODE  12
+#define T_NUMBER   13
+
+#define FLAG_GZIP           1
+#define FLAG_JSONL          2
+#define FLAG_DECODE_BYTES   4
+#define FLAG_REFUSE_NEWLINE 8
+
+#define REFUSED 2
+''' + noneval_data + c_backend_support.gzreader_code + r'''
+
+typedef struct {
+	gzFile gz;
+	int fd;
+	size_t len;
+	char buf[Z];
+} out;
+
+static int out_flush(out *o)
+{
+	const char *ptr = o->buf;
+	size_t len = o->len;
+	o->len = 0;
+	if (o->gz) {
+		if (len && gzwrite(o->gz, ptr, len) != (int)len) return 1;
+		return 0;
+	}
+	while (len) {
+		const ssize_t w = write(o->fd, ptr, len);
+		if (w < 0) {
+			if (errno == EINTR) continue;
+			return 1;
+		}
+		ptr += w;
+		len -= w;
+	}
+	return 0;
+}
+
+static inline int out_write(out *o, const char *ptr, size_t len)
+{
+	while (len) {
+		if (o->len == Z && out_flush(o)) return 1;
+		size_t avail = Z - o->len;
+		if (avail > len) avail = len;
+		memcpy(o->buf + o->len, ptr, avail);
+		o->len += avail;
+		ptr += avail;
+		len -= avail;
+	}
+	return 0;
+}
+
+static inline int out_char(out *o, const char c)
+{
+	if (o->len == Z && out_flush(o)) return 1;
+	o->buf[o->len++] = c;
+	return 0;
+}
+
+// Like repr() of a python float: the shortest string that reads back
+// as the same value, with an exponent only when python uses one.
+static int fmt_double(char *dst, const double v)
+{
+	if (isnan(v)) {
+		strcpy(dst, "nan");
+	} else if (isinf(v)) {
+		strcpy(dst, v > 0 ? "inf" : "-inf");
+	} else if (v == 0) {
+		strcpy(dst, signbit(v) ? "-0.0" : "0.0");
+	}
+	if (!isfinite(v) || v == 0) return strlen(dst);
+	char tmp[40];
+	char digits[24];
+	int ndigits = 0;
+	int exp = 0;
+	for (int prec = 1; prec <= 17; prec++) {
+		snprintf(tmp, sizeof(tmp), "%.*e", prec - 1, v);
+		int ok = (strtod(tmp, 0) == v);
+		char *e = strchr(tmp, 'e');
+		exp = atoi(e + 1);
+		ndigits = 0;
+		for (char *p = tmp; p < e; p++) {
+			if (*p >= '0' && *p <= '9') digits[ndigits++] = *p;
+		}
+		if (!ok && prec < 17) {
+			// The closest value with this many digits doesn't read
+			// back, but the one on the other side of v might (when v
+			// is a power of two, which is closer to the next lower
+			// value than the next higher).
+			uint64_t m = 0;
+			for (int i = 0; i < ndigits; i++) m = m * 10 + (digits[i] - '0');
+			if (fabs(strtod(tmp, 0)) < fabs(v)) {
+				m++;
+			} else {
+				m--;
+			}
+			if (m) {
+				snprintf(tmp, sizeof(tmp), "%s%llue%d", v < 0 ? "-" : "", (unsigned long long)m, exp - (ndigits - 1));
+				if (strtod(tmp, 0) == v) {
+					ndigits = sprintf(digits, "%llu", (unsigned long long)m);
+					// m may have gained a digit (99 + 1) or lost one (10 - 1)
+					exp += ndigits - prec;
+					ok = 1;
+				}
+			}
+		}
+		if (ok) break;
+	}
+	while (ndigits > 1 && digits[ndigits - 1] == '0') ndigits--;
+	char *p = dst;
+	if (v < 0) *p++ = '-';
+	const int decpt = exp + 1;
+	if (decpt <= -4 || decpt > 16) {
+		*p++ = digits[0];
+		if (ndigits > 1) {
+			*p++ = '.';
+			memcpy(p, digits + 1, ndigits - 1);
+			p += ndigits - 1;
+		}
+		p += sprintf(p, "e%c%02d", exp < 0 ? '-' : '+', exp < 0 ? -exp : exp);
+	} else if (decpt <= 0) {
+		*p++ = '0';
+		*p++ = '.';
+		for (int i = decpt; i < 0; i++) *p++ = '0';
+		memcpy(p, digits, ndigits);
+		p += ndigits;
+	} else if (decpt < ndigits) {
+		memcpy(p, digits, decpt);
+		p += decpt;
+		*p++ = '.';
+		memcpy(p, digits + decpt, ndigits - decpt);
+		p += ndigits - decpt;
+	} else {
+		memcpy(p, digits, ndigits);
+		p += ndigits;
+		for (int i = ndigits; i < decpt; i++) *p++ = '0';
+		*p++ = '.';
+		*p++ = '0';
+	}
+	*p = 0;
+	return p - dst;
+}
+
+// A little endian two's complement integer of len bytes, in decimal.
+static int fmt_bigint(char *dst, const unsigned char *src, const int len)
+{
+	uint32_t words[(GZNUMBER_MAX_BYTES + 3) / 4] = {0};
+	const int nwords = (len + 3) / 4;
+	const int neg = src[len - 1] >> 7;
+	for (int i = 0; i < nwords * 4; i++) {
+		const uint32_t b = (i < len ? src[i] : (neg ? 0xff : 0));
+		words[i / 4] |= b << (8 * (i % 4));
+	}
+	if (neg) { // negate (two's complement)
+		uint64_t carry = 1;
+		for (int i = 0; i < nwords; i++) {
+			const uint64_t v = (uint64_t)(uint32_t)~words[i] + carry;
+			words[i] = (uint32_t)v;
+			carry = v >> 32;
+		}
+	}
+	char rev[GZNUMBER_MAX_BYTES * 3 + 2];
+	int n = 0;
+	int top = nwords;
+	while (top && !words[top - 1]) top--;
+	while (top) {
+		uint64_t rem = 0;
+		for (int i = top - 1; i >= 0; i--) {
+			const uint64_t cur = (rem << 32) | words[i];
+			words[i] = (uint32_t)(cur / 1000000000);
+			rem = cur % 1000000000;
+		}
+		while (top && !words[top - 1]) top--;
+		for (int i = 0; i < 9; i++) {
+			rev[n++] = '0' + rem % 10;
+			rem /= 10;
+			if (!top && !rem) break;
+		}
+	}
+	if (!n) rev[n++] = '0';
+	char *p = dst;
+	if (neg) *p++ = '-';
+	while (n) *p++ = rev[--n];
+	*p = 0;
+	return p - dst;
+}
+
+static int fmt_time(char *dst, const uint32_t i0, const uint32_t i1)
+{
+	const int H = i0 & 0x1f;
+	const int M = i1 >> 26 & 0x3f;
+	const int S = i1 >> 20 & 0x3f;
+	const int u = i1 & 0xfffff;
+	if (u) return sprintf(dst, "%02d:%02d:%02d.%06d", H, M, S, u);
+	return sprintf(dst, "%02d:%02d:%02d", H, M, S);
+}
+
+// Length of the valid utf-8 sequence at ptr (strict, like python), or 0.
+static inline int utf8_len(const unsigned char *ptr, const size_t avail)
+{
+	const unsigned char c = ptr[0];
+	int len;
+	unsigned char lo = 0x80, hi = 0xbf;
+	if (c < 0x80) return 1;
+	if (c < 0xc2) return 0;
+	if (c < 0xe0) {
+		len = 2;
+	} else if (c < 0xf0) {
+		len = 3;
+		if (c == 0xe0) lo = 0xa0;
+		if (c == 0xed) hi = 0x9f; // no surrogates
+	} else if (c < 0xf5) {
+		len = 4;
+		if (c == 0xf0) lo = 0x90;
+		if (c == 0xf4) hi = 0x8f;
+	} else {
+		return 0;
+	}
+	if (avail < (size_t)len) return 0;
+	if (ptr[1] < lo || ptr[1] > hi) return 0;
+	for (int i = 2; i < len; i++) {
+		if (ptr[i] < 0x80 || ptr[i] > 0xbf) return 0;
+	}
+	return len;
+}
+
+// Writes a string value, quoted as needed.
+static int write_str(out *o, const char *ptr, size_t len, const int flags, const int quote_char)
+{
+	if (flags & FLAG_JSONL) {
+		static const char hex[] = "0123456789abcdef";
+		err1(out_char(o, '"'));
+		const char *start = ptr;
+		for (size_t i = 0; i < len; i++) {
+			const unsigned char c = ptr[i];
+			if (c >= 0x20 && c != '"' && c != '\\') continue;
+			err1(out_write(o, start, ptr + i - start));
+			start = ptr + i + 1;
+			char esc[6] = {'\\', 0};
+			int esclen = 2;
+			switch (c) {
+				case '"': esc[1] = '"'; break;
+				case '\\': esc[1] = '\\'; break;
+				case '\n': esc[1] = 'n'; break;
+				case '\r': esc[1] = 'r'; break;
+				case '\t': esc[1] = 't'; break;
+				case '\b': esc[1] = 'b'; break;
+				case '\f': esc[1] = 'f'; break;
+				default:
+					memcpy(esc + 1, "u00", 3);
+					esc[4] = hex[c >> 4];
+					esc[5] = hex[c & 15];
+					esclen = 6;
+			}
+			err1(out_write(o, esc, esclen));
+		}
+		err1(out_write(o, start, ptr + len - start));
+		return out_char(o, '"');
+	}
+	if (quote_char) {
+		err1(out_char(o, quote_char));
+		const char *start = ptr;
+		const char *end = ptr + len;
+		const char *q;
+		while ((q = memchr(start, quote_char, end - start))) {
+			err1(out_write(o, start, q + 1 - start));
+			err1(out_char(o, quote_char));
+			start = q + 1;
+		}
+		err1(out_write(o, start, end - start));
+		return out_char(o, quote_char);
+	}
+	return out_write(o, ptr, len);
+err:
+	return 1;
+}
+
+// Writes anything that isn't a string in jsonl.
+static inline int write_plain(out *o, const char *ptr, size_t len, const int flags, const int quote_char)
+{
+	if (flags & FLAG_JSONL) return out_write(o, ptr, len);
+	return write_str(o, ptr, len, flags, quote_char);
+}
+
+static inline int write_none(out *o, const int flags, const int quote_char)
+{
+	if (flags & FLAG_JSONL) return out_write(o, "null", 4);
+	return write_str(o, "None", 4, flags, quote_char);
+}
+
+static inline int write_double(out *o, const double v, const int flags, const int quote_char)
+{
+	char buf[48];
+	if ((flags & FLAG_JSONL) && !isfinite(v)) return out_write(o, "null", 4);
+	return write_plain(o, buf, fmt_double(buf, v), flags, quote_char);
+}
+
+static int grow(char **buf, size_t *size, size_t want)
+{
+	if (want <= *size) return 0;
+	while (want > *size) *size *= 2;
+	char *tmp = realloc(*buf, *size);
+	if (!tmp) return 1;
+	*buf = tmp;
+	return 0;
+}
+
+int export(const char **in_fns, off_t *offsets, int64_t *max_counts, int ds_count, int col_count, int *types, const char **prefixes, const char *suffix, const char *header, const char *out_fn, int flags, int quote_char)
+{
+	int res = 1;
+	out *o = malloc(sizeof(*o));
+	rd *r = calloc(col_count, sizeof(*r));
+	size_t size = Z;
+	char *val = malloc(size);
+	size_t dec_size = Z;
+	char *dec = malloc(dec_size);
+	const size_t suffix_len = strlen(suffix);
+	size_t *prefix_lens = malloc(col_count * sizeof(*prefix_lens) + 1);
+	if (o) {
+		o->gz = 0;
+		o->fd = -1;
+		o->len = 0;
+	}
+	err1(!o || !r || !val || !dec || !prefix_lens);
+	for (int i = 0; i < col_count; i++) prefix_lens[i] = strlen(prefixes[i]);
+	if (flags & FLAG_GZIP) {
+		o->gz = gzopen(out_fn, "wb");
+		err1(!o->gz);
+	} else {
+		o->fd = open(out_fn, O_WRONLY | O_CREAT | O_TRUNC, 0666);
+		err1(o->fd < 0);
+	}
+	if (header) {
+		err1(out_write(o, header, strlen(header)));
+	}
+	for (int dsno = 0; dsno < ds_count; dsno++) {
+		for (int i = 0; i < col_count; i++) {
+			const int ix = dsno * col_count + i;
+			err1(rd_open(&r[i], in_fns[ix], offsets[ix]));
+		}
+		for (int64_t n = 0; n < max_counts[dsno]; n++) {
+			for (int i = 0; i < col_count; i++) {
+				char buf[GZNUMBER_MAX_BYTES * 3 + 8];
+				err1(out_write(o, prefixes[i], prefix_lens[i]));
+				switch (types[i]) {
+					case T_FLOAT64: {
+						double v;
+						err1(rd_read(&r[i], buf, 8));
+						if (!memcmp(buf, noneval_float64, 8)) {
+							err1(write_none(o, flags, quote_char));
+						} else {
+							memcpy(&v, buf, 8);
+							err1(write_double(o, v, flags, quote_char));
+						}
+						break;
+					}
+					case T_FLOAT32: {
+						float v;
+						err1(rd_read(&r[i], buf, 4));
+						if (!memcmp(buf, noneval_float32, 4)) {
+							err1(write_none(o, flags, quote_char));
+						} else {
+							memcpy(&v, buf, 4);
+							err1(write_double(o, v, flags, quote_char));
+						}
+						break;
+					}
+					case T_INT64: {
+						int64_t v;
+						err1(rd_read(&r[i], (char *)&v, 8));
+						if (v == noneval_int64) {
+							err1(write_none(o, flags, quote_char));
+						} else {
+							err1(write_plain(o, buf, sprintf(buf, "%lld", (long long)v), flags, quote_char));
+						}
+						break;
+					}
+					case T_INT32: {
+						int32_t v;
+						err1(rd_read(&r[i], (char *)&v, 4));
+						if (v == noneval_int32) {
+							err1(write_none(o, flags, quote_char));
+						} else {
+							err1(write_plain(o, buf, sprintf(buf, "%d", (int)v), flags, quote_char));
+						}
+						break;
+					}
+					case T_BITS64: {
+						uint64_t v;
+						err1(rd_read(&r[i], (char *)&v, 8));
+						err1(write_plain(o, buf, sprintf(buf, "%llu", (unsigned long long)v), flags, quote_char));
+						break;
+					}
+					case T_BITS32: {
+						uint32_t v;
+						err1(rd_read(&r[i], (char *)&v, 4));
+						err1(write_plain(o, buf, sprintf(buf, "%u", (unsigned)v), flags, quote_char));
+						break;
+					}
+					case T_BOOL: {
+						uint8_t v;
+						err1(rd_read(&r[i], (char *)&v, 1));
+						if (v == noneval_bool) {
+							err1(write_none(o, flags, quote_char));
+						} else if (flags & FLAG_JSONL) {
+							err1(write_plain(o, v ? "true" : "false", v ? 4 : 5, flags, quote_char));
+						} else {
+							err1(write_plain(o, v ? "True" : "False", v ? 4 : 5, flags, quote_char));
+						}
+						break;
+					}
+					case T_DATETIME: {
+						uint32_t v[2];
+						err1(rd_read(&r[i], (char *)v, 8));
+						if (v[0] == (uint32_t)(noneval_datetime >> 32)) {
+							err1(write_none(o, flags, quote_char));
+						} else {
+							int len = sprintf(buf, "%04d-%02d-%02d ", v[0] >> 14, v[0] >> 10 & 0x0f, v[0] >> 5 & 0x1f);
+							len += fmt_time(buf + len, v[0], v[1]);
+							err1(write_str(o, buf, len, flags, quote_char));
+						}
+						break;
+					}
+					case T_DATE: {
+						uint32_t v;
+						err1(rd_read(&r[i], (char *)&v, 4));
+						if (v == noneval_date) {
+							err1(write_none(o, flags, quote_char));
+						} else {
+							err1(write_str(o, buf, sprintf(buf, "%04d-%02d-%02d", v >> 9, v >> 5 & 0x0f, v & 0x1f), flags, quote_char));
+						}
+						break;
+					}
+					case T_TIME: {
+						uint32_t v[2];
+						err1(rd_read(&r[i], (char *)v, 8));
+						if (v[0] == (uint32_t)(noneval_time >> 32)) {
+							err1(write_none(o, flags, quote_char));
+						} else {
+							err1(write_str(o, buf, fmt_time(buf, v[0], v[1]), flags, quote_char));
+						}
+						break;
+					}
+					case T_NUMBER: {
+						unsigned char len;
+						err1(rd_read(&r[i], (char *)&len, 1));
+						if (!len) {
+							err1(write_none(o, flags, quote_char));
+						} else if (len == 1) {
+							double v;
+							err1(rd_read(&r[i], (char *)&v, 8));
+							err1(write_double(o, v, flags, quote_char));
+						} else {
+							unsigned char num[GZNUMBER_MAX_BYTES];
+							err1(len < 8 || len >= GZNUMBER_MAX_BYTES);
+							err1(rd_read(&r[i], (char *)num, len));
+							err1(write_plain(o, buf, fmt_bigint(buf, num, len), flags, quote_char));
+						}
+						break;
+					}
+					default: { // bytes, ascii, unicode
+						uint8_t len8;
+						uint32_t len;
+						err1(rd_read(&r[i], (char *)&len8, 1));
+						len = len8;
+						if (len == 255) {
+							err1(rd_read(&r[i], (char *)&len, 4));
+							if (!len) {
+								if (!(flags & FLAG_JSONL)) {
+									res = REFUSED;
+									goto err;
+								}
+								err1(write_none(o, flags, quote_char));
+								break;
+							}
+							err1(len < 255);
+						}
+						err1(grow(&val, &size, len));
+						err1(rd_read(&r[i], val, len));
+						if ((flags & FLAG_REFUSE_NEWLINE) && memchr(val, '\n', len)) {
+							res = REFUSED;
+							goto err;
+						}
+						if (types[i] == T_BYTES && (flags & FLAG_DECODE_BYTES)) {
+							// invalid utf-8 bytes become \xNN
+							size_t declen = 0;
+							err1(grow(&dec, &dec_size, (size_t)len * 4));
+							for (uint32_t pos = 0; pos < len;) {
+								const int l = utf8_len((const unsigned char *)val + pos, len - pos);
+								if (l) {
+									memcpy(dec + declen, val + pos, l);
+									declen += l;
+									pos += l;
+								} else {
+									declen += sprintf(dec + declen, "\\x%02x", (unsigned char)val[pos]);
+									pos++;
+								}
+							}
+							err1(write_str(o, dec, declen, flags, quote_char));
+						} else {
+							err1(write_str(o, val, len, flags, quote_char));
+						}
+					}
+				}
+			}
+			err1(out_write(o, suffix, suffix_len));
+		}
+		for (int i = 0; i < col_count; i++) {
+			err1(rd_close(&r[i]));
+		}
+	}
+	err1(out_flush(o));
+	res = 0;
+err:
+	if (r) {
+		for (int i = 0; i < col_count; i++) {
+			if (rd_close(&r[i])) res = 1;
+		}
+	}
+	if (o) {
+		if (o->gz && gzclose(o->gz) != Z_OK) res = 1;
+		if (o->fd >= 0 && close(o->fd)) res = 1;
+	}
+	free(prefix_lens);
+	free(dec);
+	free(val);
+	free(r);
+	free(o);
+	return res;
+}
+'''
+
+c_module_wrapper_template = r'''
+static int str_list(PyObject *o_list, const int count, const char ***res)
+{
+	if (!PyList_Check(o_list)) return 1;
+	if (PyList_Size(o_list) != count) return 1;
+	*res = malloc(count * sizeof(**res) + 1);
+	if (!*res) return 1;
+	for (int i = 0; i < count; i++) {
+		(*res)[i] = PyBytes_AsString(PyList_GetItem(o_list, i));
+		if (!(*res)[i]) return 1;
+	}
+	return 0;
+}
+
+static PyObject *py_%s(PyObject *self, PyObject *args)
+{
+	PyObject *res = 0;
+	PyObject *o_in_fns;
+	const char **in_fns = 0;
+	PyObject *o_offsets;
+	off_t *offsets = 0;
+	PyObject *o_max_counts;
+	int64_t *max_counts = 0;
+	int ds_count;
+	int col_count;
+	PyObject *o_types;
+	int *types = 0;
+	PyObject *o_prefixes;
+	const char **prefixes = 0;
+	const char *suffix;
+	PyObject *o_header;
+	const char *header;
+	const char *out_fn;
+	int flags;
+	int quote_char;
+	int failed = 1;
+	if (!PyArg_ParseTuple(args, "OOOiiOOetOetii",
+		&o_in_fns,
+		&o_offsets,
+		&o_max_counts,
+		&ds_count,
+		&col_count,
+		&o_types,
+		&o_prefixes,
+		"utf-8", &suffix,
+		&o_header,
+		Py_FileSystemDefaultEncoding, &out_fn,
+		&flags,
+		&quote_char
+	)) {
+		return 0;
+	}
+	if (str_or_0(o_header, &header)) return 0;
+	const int fn_count = ds_count * col_count;
+	err1(str_list(o_in_fns, fn_count, &in_fns));
+	err1(str_list(o_prefixes, col_count, &prefixes));
+	err1(!PyList_Check(o_offsets) || PyList_Size(o_offsets) != fn_count);
+	err1(!PyList_Check(o_max_counts) || PyList_Size(o_max_counts) != ds_count);
+	err1(!PyList_Check(o_types) || PyList_Size(o_types) != col_count);
+	offsets = malloc(fn_count * sizeof(*offsets) + 1);
+	err1(!offsets);
+	for (int i = 0; i < fn_count; i++) {
+		offsets[i] = PyLong_AsLongLong(PyList_GetItem(o_offsets, i));
+		err1(PyErr_Occurred());
+	}
+	max_counts = malloc(ds_count * sizeof(*max_counts) + 1);
+	err1(!max_counts);
+	for (int i = 0; i < ds_count; i++) {
+		max_counts[i] = PyLong_AsLongLong(PyList_GetItem(o_max_counts, i));
+		err1(PyErr_Occurred());
+	}
+	types = malloc(col_count * sizeof(*types) + 1);
+	err1(!types);
+	for (int i = 0; i < col_count; i++) {
+		types[i] = PyLong_AsLong(PyList_GetItem(o_types, i));
+		err1(PyErr_Occurred());
+	}
+
+	Py_BEGIN_ALLOW_THREADS
+	failed = %s(in_fns, offsets, max_counts, ds_count, col_count, types, prefixes, suffix, header, out_fn, flags, quote_char);
+	Py_END_ALLOW_THREADS
+err:
+	if (!PyErr_Occurred()) res = PyLong_FromLong(failed);
+	if (types) free(types);
+	if (max_counts) free(max_counts);
+	if (offsets) free(offsets);
+	if (prefixes) free(prefixes);
+	if (in_fns) free(in_fns);
+	PyMem_Free((void *)out_fn);
+	PyMem_Free((void *)suffix);
+	return res;
+}
+'''
+
+c_module_code, c_module_hash = c_backend_support.make_source('csvexport', all_c_functions, protos, '', [], c_module_wrapper_template)
+
+def init():
+	return c_backend_support.init('csvexport', c_module_hash, protos, [], all_c_functions)
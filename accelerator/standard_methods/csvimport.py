@@ -30,13 +30,18 @@ all_c_functions = r'''
 #include <stdlib.h>
 #include <stdint.h>
 #include <pthread.h>
+#include <string.h>
+#include <unistd.h>
+#include <fcntl.h>
 #include <sys/types.h>
+#include <sys/stat.h>
+#include <sys/mman.h>
 #include <signal.h>
 
 #define err1(v) if (v) { perror("ERROR"); printf("ERROR! %s %d\n", __FILE__, __LINE__); goto err; }
 #define BIG_Z (1024 * 1024 * 16 - 64)
 #define SMALL_Z (1024 * 64)
-
+''' + c_backend_support.siphash_code + r'''
 // OS X has no pthread_barrier support, so we get to do this instead.
 static struct {
 	pthread_mutex_t mutex;
@@ -160,6 +165,8 @@ err:
 
 // smallest int32
 #define LABELS_DONE_MARKER -2147483648
+// next smallest, ends the lines of one file from hash_reader
+#define FILE_DONE_MARKER -2147483647
 
 int reader(const char *fn, const int slices, uint64_t skip_lines, const int outfds[], int labels_fd, int status_fd, const int comment_char, const int lf_char)
 {
@@ -341,50 +348,280 @@ static inline int bufread(const int fd, readbuf *buf, const uint32_t len, int *r
 	return 0;
 }
 
-int import_slice(const int fd, const int sliceno, const int slices, int field_count, const char *out_fns[], const char *gzip_mode, const int separator, uint64_t *r_num, const int quote_char, const int lf_char, const int allow_bad)
+typedef struct {
+	gzFile *outfh;
+	char **field_ptrs;
+	int32_t *field_lens;
+	char *qbuf;
+	char *fname; // constant value for the filename columns (or 0)
+	int32_t fname_len;
+	uint64_t *r_num;
+	int sliceno;
+	int parsing_labels;
+	int real_field_count;
+	int full_field_count;
+	int save_lineno;
+	int separator;
+	int quote_char;
+	int allow_bad;
+} import_state;
+
+// out_fns has field_count + extra_count names:
+// the fields, bad lineno, bad data, skipped lineno, skipped data, lineno,
+// and optionally (extra_count 8) filename for good, bad and skipped lines.
+// The fields are opened with label_mode, everything else with gzip_mode.
+static int import_open(import_state *st, const int sliceno, const int field_count, const int extra_count, const char *out_fns[], const char *gzip_mode, const char *label_mode, const int separator, uint64_t *r_num, const int quote_char, const int allow_bad)
 {
-	int res = 1;
-	uint64_t num = 0;
-	readbuf *buf = 0;
-	char *qbuf = 0;
-	const int parsing_labels = (field_count == -1);
-	const int real_field_count = (parsing_labels ? 1 : field_count);
-	const int full_field_count = (parsing_labels ? 1 : real_field_count + 5);
-	gzFile outfh[full_field_count];
-	char *field_ptrs[real_field_count];
-	int32_t field_lens[real_field_count];
-	const int save_lineno = !!out_fns[real_field_count + 4];
-	for (int i = 0; i < full_field_count; i++) {
-		outfh[i] = 0;
-	}
-	buf = malloc(sizeof(*buf));
-	err1(!buf);
-	buf->pos = buf->avail = 0;
+	st->parsing_labels = (field_count == -1);
+	st->real_field_count = (st->parsing_labels ? 1 : field_count);
+	st->full_field_count = (st->parsing_labels ? 1 : st->real_field_count + extra_count);
+	st->save_lineno = (!st->parsing_labels && out_fns[st->real_field_count + 4]);
+	st->sliceno = sliceno;
+	st->separator = separator;
+	st->quote_char = quote_char;
+	st->allow_bad = allow_bad;
+	st->r_num = r_num;
+	st->qbuf = 0;
+	st->fname = 0;
+	st->fname_len = 0;
+	st->field_ptrs = 0;
+	st->field_lens = 0;
+	st->outfh = calloc(st->full_field_count, sizeof(gzFile));
+	err1(!st->outfh);
+	st->field_ptrs = malloc(sizeof(char *) * st->real_field_count);
+	err1(!st->field_ptrs);
+	st->field_lens = malloc(sizeof(int32_t) * st->real_field_count);
+	err1(!st->field_lens);
 	if (quote_char < 257) {
 		// For storing unquoted fields (extra room for a short length)
-		qbuf = malloc(BIG_Z + 1);
-		err1(!qbuf);
-		qbuf++; // Room for a short length before
+		st->qbuf = malloc(BIG_Z + 1);
+		err1(!st->qbuf);
+		st->qbuf++; // Room for a short length before
 	}
-	for (int i = 0; i < full_field_count; i++) {
+	for (int i = 0; i < st->full_field_count; i++) {
 		if (out_fns[i]) {
-			outfh[i] = gzopen(out_fns[i], gzip_mode);
-			err1(!outfh[i]);
+			st->outfh[i] = gzopen(out_fns[i], (i < st->real_field_count ? label_mode : gzip_mode));
+			err1(!st->outfh[i]);
+		}
+	}
+	return 0;
+err:
+	return 1;
+}
+
+static int import_close(import_state *st)
+{
+	int res = 0;
+	if (st->outfh) {
+		for (int i = 0; i < st->full_field_count; i++) {
+			if (st->outfh[i] && gzclose(st->outfh[i])) res = 1;
+		}
+		free(st->outfh);
+	}
+	if (st->field_ptrs) free(st->field_ptrs);
+	if (st->field_lens) free(st->field_lens);
+	if (st->qbuf) free(st->qbuf - 1);
+	if (st->fname) free(st->fname - 1);
+	return res;
+}
+
+// Set the constant value for the filename columns (if filename is set).
+static int import_fname(import_state *st, const char *filename)
+{
+	if (!filename || st->parsing_labels) return 0;
+	st->fname_len = strlen(filename);
+	st->fname = malloc(st->fname_len + 1);
+	err1(!st->fname);
+	st->fname++; // Room for a short length before
+	memcpy(st->fname, filename, st->fname_len);
+	return 0;
+err:
+	return 1;
+}
+
+static inline int fname_write(import_state *st, const int ix)
+{
+	if (!st->fname || ix >= st->full_field_count || !st->outfh[ix]) return 0;
+	return field_write(st->outfh[ix], st->fname, st->fname_len);
+}
+
+// Parse one line (without the line ending) and write it.
+// There must be room for one byte before bufptr.
+static int import_line(import_state *st, char *bufptr, const int32_t len, const int skip_line, const uint64_t lineno)
+{
+	gzFile * const outfh = st->outfh;
+	char ** const field_ptrs = st->field_ptrs;
+	int32_t * const field_lens = st->field_lens;
+	uint64_t * const r_num = st->r_num;
+	char * const qbuf = st->qbuf;
+	const int real_field_count = st->real_field_count;
+	const int separator = st->separator;
+	const int quote_char = st->quote_char;
+	if (skip_line) {
+		err1(gzwrite(outfh[real_field_count + 2], &lineno, 8) != 8);
+		err1(field_write(outfh[real_field_count + 3], bufptr, len));
+		err1(fname_write(st, real_field_count + 7));
+		r_num[2]++;
+		return 0;
+	}
+	int32_t pos = 0;
+	int32_t qpos = 0;
+	int field = 0;
+	while (pos < len) {
+		int last = 0;
+		char *sep;
+		const int quote = bufptr[pos];
+		if (quote == quote_char || (quote_char == 256 && (quote == '"' || quote == '\''))) {
+			char *ptr = bufptr + pos + 1;
+			char *qptr = 0;
+			const char * const buf_end = bufptr + len;
+			field_ptrs[field] = ptr;
+			field_lens[field] = 0;
+			char *candidate;
+			while (1) {
+				candidate = memchr(ptr, quote, buf_end - ptr);
+				if (!candidate) goto bad_line;
+				if (candidate == buf_end - 1 || candidate[1] == separator) {
+					if (candidate == buf_end - 1) last = 1;
+					if (qptr) {
+						const int32_t partlen = candidate - ptr;
+						memcpy(qptr, ptr, partlen);
+						field_lens[field] += partlen;
+						qpos += field_lens[field] + 1;
+					} else {
+						field_lens[field] = candidate - (bufptr + pos) - 1;
+					}
+					break;
+				} else if (candidate[1] == quote) {
+					const int32_t partlen = candidate - ptr + 1;
+					if (qptr) {
+						field_lens[field] += partlen;
+					} else {
+						qptr = qbuf + qpos;
+						field_ptrs[field] = qptr;
+						field_lens[field] = partlen;
+					}
+					memcpy(qptr, ptr, partlen);
+					qptr += partlen;
+					ptr = candidate + 2;
+					if (ptr >= buf_end) goto bad_line;
+				} else {
+					goto bad_line;
+				}
+			}
+			pos = candidate - bufptr + 2;
+		} else {
+			field_ptrs[field] = bufptr + pos;
+			sep = memchr(bufptr + pos, separator, len - pos);
+			if (sep) {
+				field_lens[field] = sep - (bufptr + pos);
+			} else {
+				field_lens[field] = len - pos;
+				last = 1;
+			}
+			pos += field_lens[field] + 1;
 		}
+		if (st->parsing_labels) {
+			err1(field_write(outfh[field], field_ptrs[field], field_lens[field]));
+		} else {
+			field++;
+			if (last) {
+				if (field != real_field_count) {
+					if (!r_num[1]) {
+						printf("Not enough fields on line %llu\n", (unsigned long long)lineno);
+					}
+					goto bad_line;
+				}
+			} else {
+				if (field == real_field_count) {
+					if (!r_num[1]) {
+						printf("Too many fields on line %llu\n", (unsigned long long)lineno);
+					}
+					goto bad_line;
+				}
+			}
+		}
+	}
+	if (!st->parsing_labels) {
+		if (field == real_field_count - 1) {
+			// The last field was empty (we can't reach here if it was totally missing)
+			field_lens[field] = 0;
+			field_ptrs[field] = bufptr + len;
+			field++;
+		}
+		if (field != real_field_count) goto bad_line; // Happens if the line is empty
+		for (field = 0; field < real_field_count; field++) {
+			if (outfh[field]) {
+				err1(field_write(outfh[field], field_ptrs[field], field_lens[field]));
+			}
+		}
+		if (st->save_lineno) {
+			err1(gzwrite(outfh[real_field_count + 4], &lineno, 8) != 8);
+		}
+		err1(fname_write(st, real_field_count + 5));
+	}
+	r_num[0]++;
+	return 0;
+bad_line:
+	if (!r_num[1]) {
+		printf("Line %llu bad (further bad lines in slice %d not reported)\n", (unsigned long long)lineno, st->sliceno);
+	}
+	r_num[1]++;
+	if (st->allow_bad) {
+		if (outfh[real_field_count]) {
+			err1(gzwrite(outfh[real_field_count], &lineno, 8) != 8);
+			err1(field_write(outfh[real_field_count + 1], bufptr, len));
+			err1(fname_write(st, real_field_count + 6));
+		}
+		return 0;
+	}
+err:
+	return 1;
+}
+
+// What was left in the buffer after FILE_DONE_MARKER, for the next file.
+static readbuf *kept_buf = 0;
+
+// Lines from reader (or hash_reader if hashed) on fd.
+// If filename is set it is written to the filename columns (see import_open).
+// When hashed each line comes with its lineno, and the lines of each file
+// end with FILE_DONE_MARKER (so call this once per file).
+int import_slice(const int fd, const int sliceno, const int slices, int field_count, const char *out_fns[], const char *gzip_mode, const char *label_mode, const int separator, uint64_t *r_num, const int quote_char, const int lf_char, const int allow_bad, const char *filename, const int hashed)
+{
+	int res = 1;
+	readbuf *buf = 0;
+	import_state st;
+	err1(import_open(&st, sliceno, field_count, (filename ? 8 : 5), out_fns, gzip_mode, label_mode, separator, r_num, quote_char, allow_bad));
+	err1(import_fname(&st, filename));
+	if (kept_buf) {
+		buf = kept_buf;
+		kept_buf = 0;
+	} else {
+		buf = malloc(sizeof(*buf));
+		err1(!buf);
+		buf->pos = buf->avail = 0;
 	}
 	int eof = 0;
 	int32_t len;
 	uint64_t lineno = sliceno + 1;
-	int field;
-	int skip_line = 0;
+	int skip_line;
 	char *bufptr;
-keep_going:
 	while (1) {
 		if (bufread(fd, buf, 4, &eof, &bufptr)) {
 			if (eof) break;
 			goto err;
 		}
 		memcpy(&len, bufptr, 4);
+		if (hashed) {
+			if (len == FILE_DONE_MARKER) {
+				kept_buf = buf;
+				buf = 0;
+				break;
+			}
+			err1(bufread(fd, buf, 8, &eof, &bufptr));
+			memcpy(&lineno, bufptr, 8);
+		}
+		skip_line = 0;
 		if (len < 0) {
 			if (len == LABELS_DONE_MARKER) {
 				// labels are done, so we are now offset one line
@@ -395,135 +632,436 @@ keep_going:
 			skip_line = 1;
 		}
 		err1(bufread(fd, buf, len, &eof, &bufptr));
-		if (skip_line) {
-			err1(gzwrite(outfh[real_field_count + 2], &lineno, 8) != 8);
-			err1(field_write(outfh[real_field_count + 3], bufptr, len));
-			r_num[2]++;
-			skip_line = 0;
-			lineno += slices;
-			continue;
-		}
-		int32_t pos = 0;
-		int32_t qpos = 0;
-		field = 0;
-		while (pos < len) {
-			int last = 0;
-			char *sep;
-			const int quote = bufptr[pos];
-			if (quote == quote_char || (quote_char == 256 && (quote == '"' || quote == '\''))) {
-				char *ptr = bufptr + pos + 1;
-				char *qptr = 0;
-				const char * const buf_end = bufptr + len;
-				field_ptrs[field] = ptr;
-				field_lens[field] = 0;
-				char *candidate;
-				while (1) {
-					candidate = memchr(ptr, quote, buf_end - ptr);
-					if (!candidate) goto bad_line;
-					if (candidate == buf_end - 1 || candidate[1] == separator) {
-						if (candidate == buf_end - 1) last = 1;
-						if (qptr) {
-							const int32_t partlen = candidate - ptr;
-							memcpy(qptr, ptr, partlen);
-							field_lens[field] += partlen;
-							qpos += field_lens[field] + 1;
-						} else {
-							field_lens[field] = candidate - (bufptr + pos) - 1;
-						}
-						break;
-					} else if (candidate[1] == quote) {
-						const int32_t partlen = candidate - ptr + 1;
-						if (qptr) {
-							field_lens[field] += partlen;
-						} else {
-							qptr = qbuf + qpos;
-							field_ptrs[field] = qptr;
-							field_lens[field] = partlen;
-						}
-						memcpy(qptr, ptr, partlen);
-						qptr += partlen;
-						ptr = candidate + 2;
-						if (ptr >= buf_end) goto bad_line;
-					} else {
-						goto bad_line;
-					}
-				}
-				pos = candidate - bufptr + 2;
-			} else {
-				field_ptrs[field] = bufptr + pos;
-				sep = memchr(bufptr + pos, separator, len - pos);
-				if (sep) {
-					field_lens[field] = sep - (bufptr + pos);
-				} else {
-					field_lens[field] = len - pos;
-					last = 1;
-				}
-				pos += field_lens[field] + 1;
+		err1(import_line(&st, bufptr, len, skip_line, lineno));
+		if (!hashed) lineno += slices;
+	}
+	res = 0;
+err:
+	if (res) perror("import_slice");
+	if (import_close(&st)) res = 1;
+	if (buf) free(buf);
+	return res;
+}
+
+// Lines from a file, either mmaped (uncompressed files) or through a
+// buffer (gzip files, which can't be read directly).
+typedef struct {
+	gzFile fh;
+	char *map;
+	char *buf;
+	size_t size;
+	size_t pos;
+	int eof;
+} linesource;
+
+static int linesource_open(linesource *ls, const char *fn)
+{
+	int fd = -1;
+	unsigned char magic[2] = {0, 0};
+	ls->fh = 0;
+	ls->map = MAP_FAILED;
+	ls->buf = 0;
+	ls->size = ls->pos = 0;
+	ls->eof = 0;
+	fd = open(fn, O_RDONLY);
+	err1(fd == -1);
+	struct stat st_buf;
+	err1(fstat(fd, &st_buf));
+	if (st_buf.st_size >= 2) {
+		err1(pread(fd, magic, 2, 0) != 2);
+	}
+	if (magic[0] == 0x1f && magic[1] == 0x8b) {
+		ls->buf = malloc(BIG_Z);
+		err1(!ls->buf);
+		ls->fh = gzdopen(fd, "rb");
+		err1(!ls->fh);
+		fd = -1; // owned by ls->fh now
+		err1(gzbuffer(ls->fh, SMALL_Z));
+	} else {
+		ls->size = st_buf.st_size;
+		if (ls->size) {
+			ls->map = mmap(0, ls->size, PROT_READ, MAP_SHARED, fd, 0);
+			err1(ls->map == MAP_FAILED);
+			// failure here only makes things slower, so we don't care.
+			(void) madvise(ls->map, ls->size, MADV_SEQUENTIAL);
+		}
+		close(fd);
+	}
+	return 0;
+err:
+	if (fd != -1) close(fd);
+	return 1;
+}
+
+static void linesource_close(linesource *ls)
+{
+	if (ls->map != MAP_FAILED) munmap(ls->map, ls->size);
+	if (ls->fh) gzclose(ls->fh);
+	if (ls->buf) free(ls->buf);
+}
+
+// Returns 0 for a line (including the line ending), 1 at EOF and -1 on error.
+static int linesource_next(linesource *ls, const int lf_char, char **r_ptr, size_t *r_len)
+{
+	char *ptr;
+	char *lf;
+	if (ls->map != MAP_FAILED || !ls->fh) {
+		if (ls->pos == ls->size) return 1;
+		ptr = ls->map + ls->pos;
+		lf = memchr(ptr, lf_char, ls->size - ls->pos);
+	} else {
+		ptr = ls->buf + ls->pos;
+		lf = memchr(ptr, lf_char, ls->size - ls->pos);
+		if (!lf && !ls->eof) {
+			const size_t partial = ls->size - ls->pos;
+			memmove(ls->buf, ptr, partial);
+			ls->pos = 0;
+			ls->size = partial;
+			while (!ls->eof && ls->size < BIG_Z) {
+				const int got = gzread(ls->fh, ls->buf + ls->size, BIG_Z - ls->size);
+				if (got < 0) return -1;
+				if (got == 0) ls->eof = 1;
+				ls->size += got;
 			}
-			if (parsing_labels) {
-				err1(field_write(outfh[field], field_ptrs[field], field_lens[field]));
-			} else {
-				field++;
-				if (last) {
-					if (field != real_field_count) {
-						if (!r_num[1]) {
-							printf("Not enough fields on line %llu\n", (unsigned long long)lineno);
-						}
-						goto bad_line;
-					}
+			ptr = ls->buf;
+			lf = memchr(ptr + partial, lf_char, ls->size - partial);
+			if (!lf && !ls->eof) {
+				printf("Cannot handle lines longer than %d bytes\n", BIG_Z);
+				return -1;
+			}
+		}
+		if (ls->pos == ls->size) return 1;
+	}
+	*r_ptr = ptr;
+	*r_len = (lf ? (size_t)(lf - ptr) + 1 : ls->size - ls->pos);
+	ls->pos += *r_len;
+	return 0;
+}
+
+// Find field number field_ix in line (parsed like import_line does) and
+// hash it like the bytes writer would. Quoted fields are unquoted into
+// buf (at least len bytes). Returns 1 if the line doesn't have the field.
+static int field_hash(const int separator, const int quote_char, char *buf, const char *line, const int32_t len, const int field_ix, uint64_t *r_hash)
+{
+	const char * const end = line + len;
+	int32_t pos = 0;
+	for (int field = 0; ; field++) {
+		const char *value;
+		int32_t value_len;
+		const int quote = (pos < len ? line[pos] : -1);
+		if (pos < len && (quote == quote_char || (quote_char == 256 && (quote == '"' || quote == '\'')))) {
+			const char *ptr = line + pos + 1;
+			char *out = buf;
+			while (1) {
+				const char *candidate = memchr(ptr, quote, end - ptr);
+				if (!candidate) return 1;
+				memcpy(out, ptr, candidate - ptr);
+				out += candidate - ptr;
+				if (candidate == end - 1 || candidate[1] == separator) {
+					pos = candidate - line + 2;
+					break;
+				} else if (candidate[1] == quote) {
+					*(out++) = quote;
+					ptr = candidate + 2;
+					if (ptr >= end) return 1;
 				} else {
-					if (field == real_field_count) {
-						if (!r_num[1]) {
-							printf("Too many fields on line %llu\n", (unsigned long long)lineno);
-						}
-						goto bad_line;
-					}
+					return 1;
 				}
 			}
+			value = buf;
+			value_len = out - buf;
+		} else {
+			value = line + pos;
+			const char *sep = (pos < len ? memchr(value, separator, len - pos) : 0);
+			value_len = (sep ? sep - value : len - pos);
+			pos += value_len + 1;
 		}
-		if (!parsing_labels) {
-			if (field == real_field_count - 1) {
-				// The last field was empty (we can't reach here if it was totally missing)
-				field_lens[field] = 0;
-				field_ptrs[field] = bufptr + len;
-				field++;
-			}
-			if (field != real_field_count) goto bad_line; // Happens if the line is empty
-			for (field = 0; field < real_field_count; field++) {
-				if (outfh[field]) {
-					err1(field_write(outfh[field], field_ptrs[field], field_lens[field]));
+		if (field == field_ix) {
+			*r_hash = hash(value, value_len);
+			return 0;
+		}
+		if (pos > len) return 1;
+	}
+}
+
+static inline int hashed_write(const int fd, char *slicebuf, int32_t *slicebuf_len, const int32_t claim_len, const uint64_t lineno, const char *ptr, const int32_t len)
+{
+	if (len > SLICEBUF_THRESH) {
+		char header[12];
+		memcpy(header, &claim_len, 4);
+		memcpy(header + 4, &lineno, 8);
+		if (*slicebuf_len) {
+			if (writeall(fd, slicebuf, *slicebuf_len)) return 1;
+			*slicebuf_len = 0;
+		}
+		if (writeall(fd, header, 12)) return 1;
+		return writeall(fd, ptr, len);
+	}
+	if (*slicebuf_len + len + 12 > SLICEBUF_Z) {
+		if (writeall(fd, slicebuf, *slicebuf_len)) return 1;
+		*slicebuf_len = 0;
+	}
+	char *sptr = slicebuf + *slicebuf_len;
+	memcpy(sptr, &claim_len, 4);
+	memcpy(sptr + 4, &lineno, 8);
+	memcpy(sptr + 12, ptr, len);
+	*slicebuf_len += len + 12;
+	return 0;
+}
+
+// Read one file and send each line (with its lineno) to the slice the
+// hash of field hash_ix says, for import_slice with hashed set. Skipped
+// lines and lines without the field (which are bad) are dealt round
+// robin, continuing from *r_rr (which is updated, so several files can
+// share the round robin). labels_lineno is as for import_file. All
+// slices get a FILE_DONE_MARKER at the end.
+int hash_reader(const char *fn, const int slices, const uint64_t skip_lines, const int comment_char, const int64_t labels_lineno, const int outfds[], const int status_fd, const int separator, const int quote_char, const int lf_char, const int hash_ix, uint64_t *r_rr)
+{
+	int res = 1;
+	char *slicebufs[slices];
+	int32_t slicebuf_lens[slices];
+	char *hashbuf = 0;
+	linesource ls;
+	ls.map = MAP_FAILED;
+	ls.fh = 0;
+	ls.buf = 0;
+	const int rl_lf_char = (lf_char == 256 ? '\n' : lf_char);
+	uint64_t rr = *r_rr;
+	for (int i = 0; i < slices; i++) {
+		slicebufs[i] = 0;
+		slicebuf_lens[i] = 0;
+	}
+	for (int i = 0; i < slices; i++) {
+		slicebufs[i] = malloc(SLICEBUF_Z);
+		err1(!slicebufs[i]);
+	}
+	hashbuf = malloc(BIG_Z);
+	err1(!hashbuf);
+	err1(linesource_open(&ls, fn));
+	uint64_t lineno = 0;
+	while (labels_lineno != -1) {
+		char *ptr;
+		size_t line_len;
+		const int ls_res = linesource_next(&ls, rl_lf_char, &ptr, &line_len);
+		if (ls_res == 1) break;
+		err1(ls_res);
+		if ((++lineno % 1000000) == 0) {
+			// failure here only breaks status updating, so we don't care.
+			ssize_t ignore = write(status_fd, &lineno, 8);
+			(void) ignore;
+		}
+		if (lineno == (uint64_t)labels_lineno) continue;
+		if (line_len > BIG_Z) {
+			printf("Cannot handle lines longer than %d bytes\n", BIG_Z);
+			goto err;
+		}
+		int32_t len = line_len;
+		if (lf_char == 256) {
+			if (ptr[len - 1] == '\n') {
+				len--;
+				if (len && ptr[len - 1] == '\r') {
+					len--;
 				}
 			}
-			if (save_lineno) {
-				err1(gzwrite(outfh[real_field_count + 4], &lineno, 8) != 8);
-			}
+		} else if (ptr[len - 1] == lf_char) {
+			len--;
 		}
-		num++;
-		lineno += slices;
+		int32_t claim_len = len;
+		uint64_t h;
+		int sliceno;
+		if (lineno <= skip_lines || *ptr == comment_char) {
+			claim_len = -len - 1;
+			sliceno = rr++ % slices;
+		} else if (field_hash(separator, quote_char, hashbuf, ptr, len, hash_ix, &h)) {
+			sliceno = rr++ % slices;
+		} else {
+			sliceno = h % slices;
+		}
+		err1(hashed_write(outfds[sliceno], slicebufs[sliceno], &slicebuf_lens[sliceno], claim_len, lineno, ptr, len));
+	}
+	const int32_t file_done_marker = FILE_DONE_MARKER;
+	for (int i = 0; i < slices; i++) {
+		FLUSH_WRITES(i);
+		err1(writeall(outfds[i], &file_done_marker, 4));
 	}
-	*r_num = num;
+	*r_rr = rr % slices;
 	res = 0;
 err:
-	if (res) perror("import_slice");
-	for (int i = 0; i < full_field_count; i++) {
-		if (outfh[i] && gzclose(outfh[i])) res = 1;
+	if (res) perror("hash_reader");
+	linesource_close(&ls);
+	for (int i = 0; i < slices; i++) {
+		if (slicebufs[i]) free(slicebufs[i]);
 	}
+	if (hashbuf) free(hashbuf);
 	return res;
-bad_line:
-	if (!r_num[1]) {
-		printf("Line %llu bad (further bad lines in slice %d not reported)\n", (unsigned long long)lineno, sliceno);
+}
+
+typedef struct {
+	const char *ptr;
+	size_t len;
+	int lf_char;
+	uint64_t count;
+} line_counter;
+
+static void *count_lines_thread(void *args)
+{
+	line_counter *lc = args;
+	const char *ptr = lc->ptr;
+	const char * const end = ptr + lc->len;
+	uint64_t count = 0;
+	while (ptr < end) {
+		const char *lf = memchr(ptr, lc->lf_char, end - ptr);
+		if (!lf) break;
+		count++;
+		ptr = lf + 1;
 	}
-	r_num[1]++;
-	if (allow_bad) {
-		if (outfh[real_field_count]) {
-			err1(gzwrite(outfh[real_field_count], &lineno, 8) != 8);
-			err1(field_write(outfh[real_field_count + 1], bufptr, len));
+	lc->count = count;
+	return 0;
+}
+
+// Split an uncompressed file into one byte range per slice, each starting
+// on a line. r_starts gets slices + 1 offsets (the last is the file size)
+// and r_counts the number of lines starting in each range, so a slice
+// knows the line number of its first line. The lines are counted in one
+// thread per range.
+int file_ranges(const char *fn, const int slices, const int lf_char, uint64_t *r_starts, uint64_t *r_counts)
+{
+	int res = 1;
+	int fd = -1;
+	char *map = MAP_FAILED;
+	size_t size = 0;
+	pthread_t threads[slices];
+	line_counter counters[slices];
+	int started = 0;
+	const int rl_lf_char = (lf_char == 256 ? '\n' : lf_char);
+	fd = open(fn, O_RDONLY);
+	err1(fd == -1);
+	struct stat st_buf;
+	err1(fstat(fd, &st_buf));
+	size = st_buf.st_size;
+	if (size) {
+		map = mmap(0, size, PROT_READ, MAP_SHARED, fd, 0);
+		err1(map == MAP_FAILED);
+	}
+	r_starts[0] = 0;
+	for (int i = 1; i < slices; i++) {
+		size_t pos = size / slices * i;
+		if (pos < r_starts[i - 1]) pos = r_starts[i - 1];
+		if (pos > 0 && pos < size) {
+			// Start after the first line ending at or after pos - 1.
+			const char *lf = memchr(map + pos - 1, rl_lf_char, size - pos + 1);
+			pos = (lf ? (size_t)(lf - map) + 1 : size);
 		}
-		lineno += slices;
-		goto keep_going;
-	} else {
-		goto err;
+		r_starts[i] = pos;
+	}
+	r_starts[slices] = size;
+	for (int i = 0; i < slices; i++) {
+		// Lines start at 0 and after each line ending (that isn't last).
+		const size_t a = r_starts[i];
+		const size_t b = r_starts[i + 1];
+		counters[i].ptr = (a ? map + a - 1 : map);
+		counters[i].len = (b > a ? b - a - (a ? 0 : 1) : 0);
+		counters[i].lf_char = rl_lf_char;
+		counters[i].count = 0;
+	}
+	for (; started < slices; started++) {
+		err1(pthread_create(&threads[started], 0, count_lines_thread, &counters[started]));
 	}
+	res = 0;
+err:
+	for (int i = 0; i < started; i++) {
+		pthread_join(threads[i], 0);
+	}
+	for (int i = 0; i < slices && !res; i++) {
+		r_counts[i] = counters[i].count + (r_starts[i] == 0 && r_starts[i + 1] > 0);
+	}
+	if (res) perror("file_ranges");
+	if (map != MAP_FAILED) munmap(map, size);
+	if (fd != -1) close(fd);
+	return res;
+}
+
+// Like reader+import_slice, but the slice reads the file directly.
+// Uncompressed files are split in byte ranges (see file_ranges), start
+// and end are the range of this slice (end < 0 means to the end of the
+// file, which is the only way to read a gzip file here) and first_lineno
+// is the number of lines before start. skip_lines is the number of lines
+// to skip at the start of the whole file, so all ranges agree on it.
+// labels_lineno is the line number of the labels (which doesn't go to
+// any slice), 0 if there are no labels in the file or -1 if the labels
+// should be in the file but aren't (so nothing goes to any slice).
+// r_num is [good, bad, skipped].
+// When parsing labels (field_count == -1) labels_lineno is ignored and
+// r_num[0] is set to the line number the labels were on (0 if none).
+// If filename is set it is written to the filename columns (see import_open).
+int import_file(const char *fn, const int sliceno, const uint64_t start, const int64_t end, const uint64_t first_lineno, const uint64_t skip_lines, const int comment_char, const int64_t labels_lineno, const int status_fd, int field_count, const char *out_fns[], const char *gzip_mode, const char *label_mode, const int separator, uint64_t *r_num, const int quote_char, const int lf_char, const int allow_bad, const char *filename)
+{
+	int res = 1;
+	char *linebuf = 0;
+	import_state st;
+	linesource ls;
+	ls.map = MAP_FAILED;
+	ls.fh = 0;
+	ls.buf = 0;
+	const int rl_lf_char = (lf_char == 256 ? '\n' : lf_char);
+	err1(import_open(&st, sliceno, field_count, 8, out_fns, gzip_mode, label_mode, separator, r_num, quote_char, allow_bad));
+	err1(import_fname(&st, filename));
+	linebuf = malloc(BIG_Z + 16);
+	err1(!linebuf);
+	err1(linesource_open(&ls, fn));
+	if (ls.map != MAP_FAILED) {
+		ls.pos = (start < ls.size ? start : ls.size);
+	}
+	uint64_t lineno = first_lineno;
+	while (labels_lineno != -1) {
+		char *ptr;
+		size_t line_len;
+		if (ls.map != MAP_FAILED && end >= 0 && ls.pos >= (uint64_t)end) break;
+		const int ls_res = linesource_next(&ls, rl_lf_char, &ptr, &line_len);
+		if (ls_res == 1) break;
+		err1(ls_res);
+		if ((++lineno % 1000000) == 0 && status_fd != -1) {
+			// failure here only breaks status updating, so we don't care.
+			const uint64_t count = lineno - first_lineno;
+			ssize_t ignore = write(status_fd, &count, 8);
+			(void) ignore;
+		}
+		const int skip_line = (lineno <= skip_lines || *ptr == comment_char);
+		if (line_len > BIG_Z) {
+			printf("Cannot handle lines longer than %d bytes\n", BIG_Z);
+			goto err;
+		}
+		int32_t len = line_len;
+		if (lf_char == 256) {
+			if (ptr[len - 1] == '\n') {
+				len--;
+				if (len && ptr[len - 1] == '\r') {
+					len--;
+				}
+			}
+		} else if (ptr[len - 1] == lf_char) {
+			len--;
+		}
+		if (st.parsing_labels) {
+			if (skip_line) continue;
+		} else {
+			if (lineno == (uint64_t)labels_lineno) continue;
+		}
+		// copy so there is room for a length before each field
+		memcpy(linebuf + 16, ptr, len);
+		err1(import_line(&st, linebuf + 16, len, skip_line, lineno));
+		if (st.parsing_labels) {
+			r_num[0] = lineno;
+			break;
+		}
+	}
+	res = 0;
+err:
+	if (res) perror("import_file");
+	if (import_close(&st)) res = 1;
+	linesource_close(&ls);
+	if (linebuf) free(linebuf);
+	return res;
 }
 
 // This is easier than using a type of known signedness above.
@@ -589,27 +1127,209 @@ static PyObject *py_import_slice(PyObject *self, PyObject *args)
 	PyObject *o_out_fns;
 	const char **out_fns = 0;
 	const char *gzip_mode;
+	const char *label_mode;
 	int separator;
 	PyObject *o_r_num;
 	uint64_t r_num[3] = {0, 0, 0};
 	int quote_char;
 	int lf_char;
 	int allow_bad;
-	if (!PyArg_ParseTuple(args, "iiiiOetiOiii",
+	PyObject *o_filename;
+	const char *filename;
+	int hashed;
+	if (!PyArg_ParseTuple(args, "iiiiOetetiOiiiOi",
 		&fd,
 		&sliceno,
 		&slices,
 		&field_count,
 		&o_out_fns,
 		Py_FileSystemDefaultEncoding, &gzip_mode,
+		Py_FileSystemDefaultEncoding, &label_mode,
+		&separator,
+		&o_r_num,
+		&quote_char,
+		&lf_char,
+		&allow_bad,
+		&o_filename,
+		&hashed
+	)) {
+		return 0;
+	}
+	if (str_or_0(o_filename, &filename)) return 0;
+	err1(!PyList_Check(o_out_fns));
+	err1(!PyList_Check(o_r_num));
+	err1(PyList_Size(o_r_num) != 3);
+	Py_ssize_t cnt = PyList_Size(o_out_fns);
+	out_fns = malloc(sizeof(char *) * cnt);
+	err1(!out_fns);
+	for (Py_ssize_t i = 0; i < cnt; i++) {
+		PyObject *tmp = PyList_GET_ITEM(o_out_fns, i);
+		if (str_or_0(tmp, &out_fns[i])) {
+			free(out_fns);
+			return 0;
+		}
+	}
+	err1(import_slice(fd, sliceno, slices, field_count, out_fns, gzip_mode, label_mode, separator, r_num, quote_char, lf_char, allow_bad, filename, hashed));
+	for (int i = 0; i < 3; i++) {
+		err1(PyList_SetItem(o_r_num, i, PyLong_FromUnsignedLongLong(r_num[i])));
+	}
+	fail = 0;
+err:
+	if (out_fns) free(out_fns);
+	if (fail) Py_RETURN_TRUE;
+	Py_RETURN_FALSE;
+}
+
+static PyObject *py_hash_reader(PyObject *self, PyObject *args)
+{
+	int fail = 1;
+	const char *fn;
+	int slices;
+	unsigned PY_LONG_LONG skip_lines;
+	int comment_char;
+	PY_LONG_LONG labels_lineno;
+	PyObject *o_outfds;
+	int *outfds = 0;
+	int status_fd;
+	int separator;
+	int quote_char;
+	int lf_char;
+	int hash_ix;
+	PyObject *o_rr;
+	uint64_t rr;
+	if (!PyArg_ParseTuple(args, "etiKiLOiiiiiO",
+		Py_FileSystemDefaultEncoding, &fn,
+		&slices,
+		&skip_lines,
+		&comment_char,
+		&labels_lineno,
+		&o_outfds,
+		&status_fd,
+		&separator,
+		&quote_char,
+		&lf_char,
+		&hash_ix,
+		&o_rr
+	)) {
+		return 0;
+	}
+	err1(!PyList_Check(o_outfds));
+	err1(PyList_Size(o_outfds) != slices);
+	err1(!PyList_Check(o_rr));
+	err1(PyList_Size(o_rr) != 1);
+	rr = PyLong_AsUnsignedLongLong(PyList_GET_ITEM(o_rr, 0));
+	if (PyErr_Occurred()) return 0;
+	outfds = malloc(sizeof(int) * slices);
+	err1(!outfds);
+	for (int i = 0; i < slices; i++) {
+		PyObject *tmp = PyList_GET_ITEM(o_outfds, i);
+		outfds[i] = PyLong_AsLong(tmp);
+		if (PyErr_Occurred()) {
+			free(outfds);
+			return 0;
+		}
+	}
+	err1(hash_reader(fn, slices, skip_lines, comment_char, labels_lineno, outfds, status_fd, separator, quote_char, lf_char, hash_ix, &rr));
+	err1(PyList_SetItem(o_rr, 0, PyLong_FromUnsignedLongLong(rr)));
+	fail = 0;
+err:
+	if (outfds) free(outfds);
+	if (fail) Py_RETURN_TRUE;
+	Py_RETURN_FALSE;
+}
+
+static PyObject *py_file_ranges(PyObject *self, PyObject *args)
+{
+	int fail = 1;
+	const char *fn;
+	int slices;
+	int lf_char;
+	PyObject *o_starts;
+	PyObject *o_counts;
+	uint64_t *starts = 0;
+	uint64_t *counts = 0;
+	if (!PyArg_ParseTuple(args, "etiiOO",
+		Py_FileSystemDefaultEncoding, &fn,
+		&slices,
+		&lf_char,
+		&o_starts,
+		&o_counts
+	)) {
+		return 0;
+	}
+	err1(slices < 1);
+	err1(!PyList_Check(o_starts));
+	err1(!PyList_Check(o_counts));
+	err1(PyList_Size(o_starts) != slices + 1);
+	err1(PyList_Size(o_counts) != slices);
+	starts = malloc(sizeof(uint64_t) * (slices + 1));
+	err1(!starts);
+	counts = malloc(sizeof(uint64_t) * slices);
+	err1(!counts);
+	err1(file_ranges(fn, slices, lf_char, starts, counts));
+	for (int i = 0; i <= slices; i++) {
+		err1(PyList_SetItem(o_starts, i, PyLong_FromUnsignedLongLong(starts[i])));
+	}
+	for (int i = 0; i < slices; i++) {
+		err1(PyList_SetItem(o_counts, i, PyLong_FromUnsignedLongLong(counts[i])));
+	}
+	fail = 0;
+err:
+	if (starts) free(starts);
+	if (counts) free(counts);
+	if (fail) Py_RETURN_TRUE;
+	Py_RETURN_FALSE;
+}
+
+static PyObject *py_import_file(PyObject *self, PyObject *args)
+{
+	int fail = 1;
+	const char *fn;
+	int sliceno;
+	unsigned PY_LONG_LONG start;
+	PY_LONG_LONG end;
+	unsigned PY_LONG_LONG first_lineno;
+	unsigned PY_LONG_LONG skip_lines;
+	int comment_char;
+	PY_LONG_LONG labels_lineno;
+	int status_fd;
+	int field_count;
+	PyObject *o_out_fns;
+	const char **out_fns = 0;
+	const char *gzip_mode;
+	const char *label_mode;
+	int separator;
+	PyObject *o_r_num;
+	uint64_t r_num[3] = {0, 0, 0};
+	int quote_char;
+	int lf_char;
+	int allow_bad;
+	PyObject *o_filename;
+	const char *filename;
+	if (!PyArg_ParseTuple(args, "etiKLKKiLiiOetetiOiiiO",
+		Py_FileSystemDefaultEncoding, &fn,
+		&sliceno,
+		&start,
+		&end,
+		&first_lineno,
+		&skip_lines,
+		&comment_char,
+		&labels_lineno,
+		&status_fd,
+		&field_count,
+		&o_out_fns,
+		Py_FileSystemDefaultEncoding, &gzip_mode,
+		Py_FileSystemDefaultEncoding, &label_mode,
 		&separator,
 		&o_r_num,
 		&quote_char,
 		&lf_char,
-		&allow_bad
+		&allow_bad,
+		&o_filename
 	)) {
 		return 0;
 	}
+	if (str_or_0(o_filename, &filename)) return 0;
 	err1(!PyList_Check(o_out_fns));
 	err1(!PyList_Check(o_r_num));
 	err1(PyList_Size(o_r_num) != 3);
@@ -623,7 +1343,7 @@ static PyObject *py_import_slice(PyObject *self, PyObject *args)
 			return 0;
 		}
 	}
-	err1(import_slice(fd, sliceno, slices, field_count, out_fns, gzip_mode, separator, r_num, quote_char, lf_char, allow_bad));
+	err1(import_file(fn, sliceno, start, end, first_lineno, skip_lines, comment_char, labels_lineno, status_fd, field_count, out_fns, gzip_mode, label_mode, separator, r_num, quote_char, lf_char, allow_bad, filename));
 	for (int i = 0; i < 3; i++) {
 		err1(PyList_SetItem(o_r_num, i, PyLong_FromUnsignedLongLong(r_num[i])));
 	}
@@ -646,6 +1366,9 @@ static PyObject *py_char2int(PyObject *dummy, PyObject *o_charstr)
 extra_method_defs = [
 	'{"reader", py_reader, METH_VARARGS, 0}',
 	'{"import_slice", py_import_slice, METH_VARARGS, 0}',
+	'{"hash_reader", py_hash_reader, METH_VARARGS, 0}',
+	'{"file_ranges", py_file_ranges, METH_VARARGS, 0}',
+	'{"import_file", py_import_file, METH_VARARGS, 0}',
 	'{"char2int", py_char2int, METH_O, 0}',
 ]
 
@@ -655,7 +1378,10 @@ c_module_code, c_module_hash = c_backend_support.make_source('csvimport', all_c_
 def init():
 	protos = [
 		'int reader(const char *fn, const int slices, uint64_t skip_lines, const int outfds[], int labels_fd, int status_fd, const int comment_char, const int lf_char);',
-		'int import_slice(const int fd, const int sliceno, const int slices, const int field_count, const char *out_fns[], const char *gzip_mode, const int separator, uint64_t *r_num, const int quote_char, const int lf_char, const int allow_bad);',
+		'int import_slice(const int fd, const int sliceno, const int slices, const int field_count, const char *out_fns[], const char *gzip_mode, const char *label_mode, const int separator, uint64_t *r_num, const int quote_char, const int lf_char, const int allow_bad, const char *filename, const int hashed);',
+		'int hash_reader(const char *fn, const int slices, const uint64_t skip_lines, const int comment_char, const int64_t labels_lineno, const int outfds[], const int status_fd, const int separator, const int quote_char, const int lf_char, const int hash_ix, uint64_t *r_rr);',
+		'int file_ranges(const char *fn, const int slices, const int lf_char, uint64_t *r_starts, uint64_t *r_counts);',
+		'int import_file(const char *fn, const int sliceno, const uint64_t start, const int64_t end, const uint64_t first_lineno, const uint64_t skip_lines, const int comment_char, const int64_t labels_lineno, const int status_fd, int field_count, const char *out_fns[], const char *gzip_mode, const char *label_mode, const int separator, uint64_t *r_num, const int quote_char, const int lf_char, const int allow_bad, const char *filename);',
 		'int char2int(const char c);',
 	]
 	return c_backend_support.init('csvimport', c_module_hash, [], protos, all_c_functions)
@@ -0,0 +1,257 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+# This is a separate file from a_dataset_checksum so setup.py can import
+# it and make the _dataset_checksum module at install time. It also has
+# the per slice functions both a_dataset_checksum and
+# a_dataset_checksum_chain use.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+from hashlib import md5
+
+from accelerator.compat import PY2
+
+from . import c_backend_support
+
+__all__ = ('value_sizes', 'line_digests', 'hash_sum', 'digest_sum',)
+
+# linesum reads one slice of some columns (in_count files) in parallel
+# and hashes the stored values of each line (all columns together) to
+# 128 bits. These hashes are summed (modulo 2**128) into res[0] (the low
+# 64 bits) and res[1], so the order of the lines doesn't matter.
+
+# How a_dataset_checksum tells linesum how each value is stored:
+# the size for fixed size types, 0 for blobs and -1 for number.
+value_sizes = {
+	'float64'  : 8,
+	'float32'  : 4,
+	'int64'    : 8,
+	'int32'    : 4,
+	'bits64'   : 8,
+	'bits32'   : 4,
+	'bool'     : 1,
+	'datetime' : 8,
+	'date'     : 4,
+	'time'     : 8,
+	'bytes'    : 0,
+	'ascii'    : 0,
+	'unicode'  : 0,
+	'json'     : 0,
+	'number'   : -1,
+}
+
+protos = ['int linesum(const char **in_fns, int in_count, off_t *offsets, int *sizes, int64_t max_count, uint64_t *res);']
+
+all_c_functions = r'''
+#include <zlib.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/types.h>
+#include <sys/stat.h>
+#include <fcntl.h>
+#include <unistd.h>
+
+#define err1(v) if (v) goto err
+#define Z (128 * 1024)
+#define GZNUMBER_MAX_BYTES 127
+''' + c_backend_support.siphash_code + c_backend_support.gzreader_code + r'''
+
+// Two different keys make a 128 bit hash from two siphash24 calls.
+static const uint8_t linesum_k[2][16] = {
+	{115, 117, 109, 32, 111, 102, 32, 108, 105, 110, 101, 115, 32, 108, 111, 119},
+	{115, 117, 109, 32, 111, 102, 32, 108, 105, 110, 101, 115, 32, 104, 105, 103},
+};
+
+static int grow(char **line, size_t *size, size_t want)
+{
+	if (want <= *size) return 0;
+	while (want > *size) *size *= 2;
+	char *tmp = realloc(*line, *size);
+	if (!tmp) return 1;
+	*line = tmp;
+	return 0;
+}
+
+int linesum(const char **in_fns, int in_count, off_t *offsets, int *sizes, int64_t max_count, uint64_t *res)
+{
+	int ret = 1;
+	size_t size = Z;
+	char *line = malloc(size);
+	rd *r = calloc(in_count, sizeof(*r));
+	uint64_t lo = 0, hi = 0;
+	err1(!line || !r);
+	for (int i = 0; i < in_count; i++) {
+		err1(rd_open(&r[i], in_fns[i], offsets[i]));
+	}
+	for (int64_t n = 0; n < max_count; n++) {
+		// The stored values of all columns after each other.
+		size_t used = 0;
+		for (int i = 0; i < in_count; i++) {
+			if (sizes[i] > 0) {
+				err1(grow(&line, &size, used + sizes[i]));
+				err1(rd_read(&r[i], line + used, sizes[i]));
+				used += sizes[i];
+				continue;
+			}
+			err1(grow(&line, &size, used + 5));
+			err1(rd_read(&r[i], line + used, 1));
+			uint32_t len = *(uint8_t *)(line + used);
+			used++;
+			if (sizes[i] == 0) {
+				if (len == 255) {
+					// Long value (or None as length 0)
+					err1(rd_read(&r[i], line + used, 4));
+					memcpy(&len, line + used, 4);
+					used += 4;
+					err1(len && len < 255);
+				}
+			} else {
+				if (len == 1) {
+					len = 8;
+				} else if (len) {
+					err1(len < 8 || len >= GZNUMBER_MAX_BYTES);
+				}
+			}
+			err1(grow(&line, &size, used + len));
+			err1(rd_read(&r[i], line + used, len));
+			used += len;
+		}
+		const uint64_t h_lo = siphash24((const uint8_t *)line, used, linesum_k[0]);
+		const uint64_t h_hi = siphash24((const uint8_t *)line, used, linesum_k[1]);
+		lo += h_lo;
+		hi += h_hi + (lo < h_lo);
+	}
+	res[0] = lo;
+	res[1] = hi;
+	ret = 0;
+err:
+	if (r) {
+		for (int i = 0; i < in_count; i++) {
+			if (rd_close(&r[i])) ret = 1;
+		}
+	}
+	free(r);
+	free(line);
+	return ret;
+}
+'''
+
+c_module_wrapper_template = r'''
+static PyObject *py_%s(PyObject *self, PyObject *args)
+{
+	PyObject *res = 0;
+	PyObject *o_in_fns;
+	int in_count;
+	const char **in_fns = 0;
+	PyObject *o_offsets;
+	off_t *offsets = 0;
+	PyObject *o_sizes;
+	int *sizes = 0;
+	PY_LONG_LONG max_count;
+	PyObject *o_res;
+	uint64_t sum[2];
+	if (!PyArg_ParseTuple(args, "OiOOLO",
+		&o_in_fns,
+		&in_count,
+		&o_offsets,
+		&o_sizes,
+		&max_count,
+		&o_res
+	)) {
+		return 0;
+	}
+	if (!PyList_Check(o_res)) Py_RETURN_TRUE;
+	if (PyList_Size(o_res) != 2) Py_RETURN_TRUE;
+
+	if (!PyList_Check(o_in_fns)) Py_RETURN_TRUE;
+	if (!PyList_Check(o_offsets)) Py_RETURN_TRUE;
+	if (!PyList_Check(o_sizes)) Py_RETURN_TRUE;
+	if (PyList_Size(o_in_fns) != in_count) Py_RETURN_TRUE;
+	if (PyList_Size(o_offsets) != in_count) Py_RETURN_TRUE;
+	if (PyList_Size(o_sizes) != in_count) Py_RETURN_TRUE;
+	in_fns = malloc(in_count * sizeof(*in_fns) + 1);
+	err1(!in_fns);
+	offsets = malloc(in_count * sizeof(*offsets) + 1);
+	err1(!offsets);
+	sizes = malloc(in_count * sizeof(*sizes) + 1);
+	err1(!sizes);
+	for (int i = 0; i < in_count; i++) {
+		in_fns[i] = PyBytes_AS_STRING(PyList_GetItem(o_in_fns, i));
+		err1(!in_fns[i]);
+		offsets[i] = PyLong_AsLongLong(PyList_GetItem(o_offsets, i));
+		err1(PyErr_Occurred());
+		sizes[i] = PyLong_AsLong(PyList_GetItem(o_sizes, i));
+		err1(PyErr_Occurred());
+	}
+
+	int failed;
+	Py_BEGIN_ALLOW_THREADS
+	failed = %s(in_fns, in_count, offsets, sizes, max_count, sum);
+	Py_END_ALLOW_THREADS
+	if (failed) {
+		res = Py_True;
+		goto err;
+	}
+	for (int i = 0; i < 2; i++) {
+		err1(PyList_SetItem(o_res, i, PyLong_FromUnsignedLongLong(sum[i])));
+	}
+	res = Py_False;
+err:
+	if (sizes) free(sizes);
+	if (offsets) free(offsets);
+	if (in_fns) free(in_fns);
+	if (res) Py_INCREF(res);
+	return res;
+}
+'''
+
+c_module_code, c_module_hash = c_backend_support.make_source('dataset_checksum', all_c_functions, protos, '', [], c_module_wrapper_template)
+
+def init():
+	return c_backend_support.init('dataset_checksum', c_module_hash, protos, [], all_c_functions)
+
+def line_digests(ds, sliceno, columns):
+	# The md5 of repr() of each line, as a list.
+	if len(columns) == 1:
+		columns = columns[0]
+	src = ds.iterate(sliceno, columns)
+	if PY2:
+		return [md5(repr(line)).digest() for line in src]
+	else:
+		return [md5(repr(line).encode("utf-8")).digest() for line in src]
+
+def hash_sum(cstuff, ds, sliceno, columns):
+	# The sum of the line hashes from linesum, as an int.
+	if not ds.lines[sliceno]:
+		return 0
+	in_fns = [ds.column_filename(column, sliceno) for column in columns]
+	offsets = [ds.columns[column].offsets[sliceno] if ds.columns[column].offsets else 0 for column in columns]
+	sizes = [value_sizes[ds.columns[column].backing_type] for column in columns]
+	res = cstuff.mk_uint64(2)
+	failed = cstuff.backend.linesum(*cstuff.bytesargs(in_fns, len(in_fns), offsets, sizes, ds.lines[sliceno], res))
+	assert not failed, 'Failed to checksum slice %d of %s' % (sliceno, ds,)
+	return res[0] | (res[1] << 64)
+
+def digest_sum(digests, sort):
+	# The md5 of all line_digests (in order if not sort), as a hex string.
+	if sort:
+		digests = sorted(digests)
+	return md5(b''.join(digests)).hexdigest()
@@ -0,0 +1,481 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+# This is a separate file from a_dataset_rehash so setup.py can import
+# it and make the _dataset_rehash module at install time.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+from . import c_backend_support
+from .dataset_type import hashfuncs, noneval_data
+
+__all__ = ('rehashfuncs', 'hashable_types', 'skip_line',)
+
+# The values are copied as they are stored, without decoding them.
+# The hashlabel column is read first, and decides which slice each line
+# goes to (the slicemap). The other columns just follow the slicemap.
+# minmax_fn can be NULL if you don't need the min/max values.
+# Lines that are skip_line in a slicemap you made yourself are not
+# written anywhere (and not counted in min/max). This is how
+# dataset_sample keeps only some lines.
+
+skip_line = 0xffff
+
+_proto_template = 'int rehash_%s(const char **in_fns, int in_count, off_t *offsets, int64_t *max_counts, const char **out_fns, const char *gzip_mode, const char *minmax_fn, int slices, int slicemap_fd, size_t slicemap_size, int build_slicemap, uint64_t *line_count)'
+
+# type: (size, C type to compare as, value to compare, not None check)
+_fixed_types = {
+	'float64'  : (8, 'double'  , '*(const double *)ptr'  , 'memcmp(ptr, noneval_float64, 8)'),
+	'float32'  : (4, 'float'   , '*(const float *)ptr'   , 'memcmp(ptr, noneval_float32, 4)'),
+	'int64'    : (8, 'int64_t' , '*(const int64_t *)ptr' , '*(const int64_t *)ptr != noneval_int64'),
+	'int32'    : (4, 'int32_t' , '*(const int32_t *)ptr' , '*(const int32_t *)ptr != noneval_int32'),
+	'bits64'   : (8, 'uint64_t', '*(const uint64_t *)ptr', '1'),
+	'bits32'   : (4, 'uint32_t', '*(const uint32_t *)ptr', '1'),
+	'bool'     : (1, 'uint8_t' , '*(const uint8_t *)ptr' , '*(const uint8_t *)ptr != noneval_bool'),
+	'datetime' : (8, 'uint64_t', '(uint64_t)((const uint32_t *)ptr)[0] << 32 | ((const uint32_t *)ptr)[1]', '*(const uint64_t *)ptr != noneval_datetime'),
+	'date'     : (4, 'uint32_t', '*(const uint32_t *)ptr', '*(const uint32_t *)ptr != noneval_date'),
+	'time'     : (8, 'uint64_t', '(uint64_t)((const uint32_t *)ptr)[0] << 32 | ((const uint32_t *)ptr)[1]', '*(const uint64_t *)ptr != noneval_time'),
+}
+
+_blob_types = ('bytes', 'ascii', 'unicode', 'json',)
+
+# json has no hash in the writer, so you can't hash on it.
+hashable_types = set(_fixed_types) | {'number', 'bytes', 'ascii', 'unicode'}
+
+# Which function rehashes each type.
+rehashfuncs = dict((typ, 'rehash_' + typ) for typ in _fixed_types)
+rehashfuncs['number'] = 'rehash_number'
+rehashfuncs.update((typ, 'rehash_blob') for typ in _blob_types)
+
+_setup = r'''
+	rd r;
+	r.fh = 0;
+	gzFile outfhs[slices];
+	memset(outfhs, 0, sizeof(outfhs));
+	uint16_t *slicemap = 0;
+	int res = 1;
+	for (int i = 0; i < slices; i++) {
+		outfhs[i] = gzopen(out_fns[i], gzip_mode);
+		err1(!outfhs[i]);
+	}
+	slicemap = mmap(0, slicemap_size, PROT_READ | (build_slicemap ? PROT_WRITE : 0), MAP_NOSYNC | MAP_SHARED, slicemap_fd, 0);
+	if (slicemap == MAP_FAILED) {
+		slicemap = 0;
+		goto err;
+	}
+	int64_t i = 0;
+	for (int fileno = 0; fileno < in_count; fileno++) {
+		err1(rd_open(&r, in_fns[fileno], offsets[fileno]));
+		const int64_t max_count = (max_counts[fileno] < 0 ? INT64_MAX : max_counts[fileno]);
+		for (int64_t count = 0; count < max_count; count++, i++) {
+'''
+
+# The first read of each value, which is allowed to find the end of the file
+# (unless we know how many values there should be).
+_read_first = r'''
+			const int e = rd_read(&r, ptr, %(first_len)s);
+			if (e < 0 && max_counts[fileno] < 0) break;
+			err1(e);
+'''
+
+_choose_slice = r'''
+			int chosen_slice;
+			err1((size_t)i >= slicemap_size / 2);
+			if (build_slicemap) {
+				chosen_slice = (%(hash)s) %% slices;
+				slicemap[i] = chosen_slice;
+			} else {
+				chosen_slice = slicemap[i];
+				if (chosen_slice == SKIP_LINE) continue;
+				err1(chosen_slice >= slices);
+			}
+			line_count[chosen_slice]++;
+'''
+
+_cleanup = r'''
+		}
+		err1(rd_close(&r));
+	}
+	res = 0;
+err:
+	if (rd_close(&r)) res = 1;
+	for (int i = 0; i < slices; i++) {
+		if (outfhs[i] && gzclose(outfhs[i])) res = 1;
+	}
+	if (slicemap) munmap(slicemap, slicemap_size);
+'''
+
+_fixed_template = r'''
+%(proto)s
+{
+	uint64_t buf[1];
+	char * const ptr = (char *)buf;
+	%(cmptype)s col_min = 0, col_max = 0;
+	char buf_col_min[%(first_len)s];
+	char buf_col_max[%(first_len)s];
+	int minmax_seen = 0;
+''' + _setup + _read_first + _choose_slice + r'''
+			if (minmax_fn && %(not_none)s) {
+				const %(cmptype)s cand_value = %(cmp_value)s;
+				if (!minmax_seen || cand_value < col_min) {
+					col_min = cand_value;
+					memcpy(buf_col_min, ptr, %(first_len)s);
+				}
+				if (!minmax_seen || cand_value > col_max) {
+					col_max = cand_value;
+					memcpy(buf_col_max, ptr, %(first_len)s);
+				}
+				minmax_seen = 1;
+			}
+			err1(gzwrite(outfhs[chosen_slice], ptr, %(first_len)s) != %(first_len)s);
+''' + _cleanup + r'''
+	if (!res && minmax_seen) {
+		res = write_minmax(minmax_fn, gzip_mode, buf_col_min, %(first_len)s, buf_col_max, %(first_len)s);
+	}
+	return res;
+}
+'''
+
+_blob_template = r'''
+%(proto)s
+{
+	size_t bufsize = Z;
+	char *ptr = malloc(bufsize);
+	// The whole stored value, so it can be written as it is.
+	char *buf_col_min = 0;
+	char *buf_col_max = 0;
+	uint32_t minlen = 0;
+	uint32_t maxlen = 0;
+	if (!ptr) return 1;
+''' + _setup + _read_first + r'''
+			uint32_t len = *(uint8_t *)ptr;
+			int headlen = 1;
+			if (len == 255) {
+				// Long value (or None as length 0)
+				err1(rd_read(&r, ptr + 1, 4));
+				memcpy(&len, ptr + 1, 4);
+				headlen = 5;
+				err1(len && len < 255);
+			}
+			if (headlen + len > bufsize) {
+				while (headlen + len > bufsize) bufsize *= 2;
+				char *tmp = realloc(ptr, bufsize);
+				err1(!tmp);
+				ptr = tmp;
+			}
+			err1(rd_read(&r, ptr + headlen, len));
+''' + _choose_slice + r'''
+			// Comparing UTF-8 bytewise gives the same order as comparing
+			// the decoded strings, so this works for unicode too.
+			if (minmax_fn && (len || headlen == 1)) {
+				err1(blob_minmax(&buf_col_min, &minlen, ptr, headlen, len, -1));
+				err1(blob_minmax(&buf_col_max, &maxlen, ptr, headlen, len, 1));
+			}
+			err1(gzwrite(outfhs[chosen_slice], ptr, headlen + len) != (int)(headlen + len));
+''' + _cleanup + r'''
+	if (!res && buf_col_min) {
+		res = write_minmax(minmax_fn, gzip_mode, buf_col_min, minlen, buf_col_max, maxlen);
+	}
+	free(buf_col_min);
+	free(buf_col_max);
+	free(ptr);
+	return res;
+}
+'''
+
+_number_template = r'''
+%(proto)s
+{
+	char ptr[GZNUMBER_MAX_BYTES + 1];
+	char buf_col_min[GZNUMBER_MAX_BYTES + 1];
+	char buf_col_max[GZNUMBER_MAX_BYTES + 1];
+	int minlen = 0;
+	int maxlen = 0;
+	PyObject *o_col_min = 0;
+	PyObject *o_col_max = 0;
+	double d_col_min = 0;
+	double d_col_max = 0;
+	PyGILState_STATE gstate = PyGILState_Ensure();
+''' + _setup + _read_first + r'''
+			int len = *(uint8_t *)ptr;
+			if (len == 1) {
+				len = 8;
+			} else if (len) {
+				err1(len < 8 || len >= GZNUMBER_MAX_BYTES);
+			}
+			err1(rd_read(&r, ptr + 1, len));
+			len++;
+''' + _choose_slice + r'''
+			// minmax tracking, not done for None-values
+			if (minmax_fn && len > 1) {
+				double d_v = 0;
+				PyObject *o_v = 0;
+				if (*ptr == 1) { // It's a double
+					memcpy(&d_v, ptr + 1, 8);
+				} else if (*ptr == 8) { // It's an int64_t
+					int64_t tmp;
+					memcpy(&tmp, ptr + 1, 8);
+					if (tmp <= ((int64_t)1 << 53) && tmp >= -((int64_t)1 << 53)) {
+						// Fits in a double without precision loss
+						d_v = tmp;
+					} else {
+						o_v = PyLong_FromLongLong(tmp);
+						err1(!o_v);
+					}
+				} else { // It's a big number
+					o_v = _PyLong_FromByteArray((unsigned char *)ptr + 1, *ptr, 1, 1);
+					err1(!o_v);
+				}
+				if (!o_v && (o_col_min || o_col_max)) {
+					o_v = PyFloat_FromDouble(d_v);
+					err1(!o_v);
+				}
+				if (minlen) {
+					if (o_v) {
+						if (!o_col_min) {
+							o_col_min = PyFloat_FromDouble(d_col_min);
+						}
+						if (!o_col_max) {
+							o_col_max = PyFloat_FromDouble(d_col_max);
+						}
+						if (PyObject_RichCompareBool(o_v, o_col_min, Py_LT)) {
+							memcpy(buf_col_min, ptr, len);
+							minlen = len;
+							Py_INCREF(o_v);
+							Py_DECREF(o_col_min);
+							o_col_min = o_v;
+						}
+						if (PyObject_RichCompareBool(o_v, o_col_max, Py_GT)) {
+							memcpy(buf_col_max, ptr, len);
+							maxlen = len;
+							Py_INCREF(o_v);
+							Py_DECREF(o_col_max);
+							o_col_max = o_v;
+						}
+						Py_DECREF(o_v);
+					} else {
+						if (d_v < d_col_min) {
+							memcpy(buf_col_min, ptr, len);
+							minlen = len;
+							d_col_min = d_v;
+						}
+						if (d_v > d_col_max) {
+							memcpy(buf_col_max, ptr, len);
+							maxlen = len;
+							d_col_max = d_v;
+						}
+					}
+				} else {
+					memcpy(buf_col_min, ptr, len);
+					memcpy(buf_col_max, ptr, len);
+					minlen = maxlen = len;
+					d_col_min = d_col_max = d_v;
+					o_col_min = o_col_max = o_v;
+					if (o_v) Py_INCREF(o_v);
+				}
+			}
+			err1(gzwrite(outfhs[chosen_slice], ptr, len) != len);
+''' + _cleanup + r'''
+	if (!res && minlen) {
+		res = write_minmax(minmax_fn, gzip_mode, buf_col_min, minlen, buf_col_max, maxlen);
+	}
+	Py_XDECREF(o_col_min);
+	Py_XDECREF(o_col_max);
+	PyGILState_Release(gstate);
+	return res;
+}
+'''
+
+protos = []
+funcs = [noneval_data]
+
+for typ, (size, cmptype, cmp_value, not_none) in sorted(_fixed_types.items()):
+	proto = _proto_template % (typ,)
+	protos.append(proto + ';')
+	funcs.append(_fixed_template % dict(
+		proto=proto,
+		first_len=size,
+		cmptype=cmptype,
+		cmp_value=cmp_value,
+		not_none=not_none,
+		hash=hashfuncs[typ],
+	))
+
+proto = _proto_template % ('blob',)
+protos.append(proto + ';')
+funcs.append(_blob_template % dict(proto=proto, first_len=1, hash='len ? hash(ptr + headlen, len) : 0'))
+
+proto = _proto_template % ('number',)
+protos.append(proto + ';')
+funcs.append(_number_template % dict(proto=proto, first_len=1, hash='hash_number(ptr, len)'))
+
+all_c_functions = r'''
+#include <zlib.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/types.h>
+#include <sys/stat.h>
+#include <fcntl.h>
+#include <unistd.h>
+
+#ifndef MAP_NOSYNC
+#  define MAP_NOSYNC 0
+#endif
+
+#define err1(v) if (v) goto err
+#define Z (128 * 1024)
+#define GZNUMBER_MAX_BYTES 127
+#define SKIP_LINE %d
+''' % (skip_line,) + c_backend_support.siphash_code + r'''
+''' + c_backend_support.gzreader_code + r'''
+// Replace *r_buf with the stored value in ptr if this value sorts before
+// it (want_cmp -1) or after it (want_cmp 1), or if there isn't one yet.
+static int blob_minmax(char **r_buf, uint32_t *r_len, const char *ptr, const int headlen, const uint32_t len, const int want_cmp)
+{
+	if (*r_buf) {
+		const int old_headlen = (*(uint8_t *)*r_buf == 255 ? 5 : 1);
+		const uint32_t old_len = *r_len - old_headlen;
+		int cmp = memcmp(ptr + headlen, *r_buf + old_headlen, (len < old_len ? len : old_len));
+		if (!cmp) cmp = (len > old_len) - (len < old_len);
+		if ((cmp > 0) - (cmp < 0) != want_cmp) return 0;
+		free(*r_buf);
+	}
+	*r_buf = malloc(headlen + len);
+	if (!*r_buf) return 1;
+	memcpy(*r_buf, ptr, headlen + len);
+	*r_len = headlen + len;
+	return 0;
+}
+
+// Min and max as they would be stored in the column.
+static int write_minmax(const char *minmax_fn, const char *gzip_mode, const char *buf_col_min, int minlen, const char *buf_col_max, int maxlen)
+{
+	int res = 0;
+	gzFile minmaxfh = gzopen(minmax_fn, gzip_mode);
+	if (!minmaxfh) return 1;
+	if (gzwrite(minmaxfh, buf_col_min, minlen) != minlen) res = 1;
+	if (gzwrite(minmaxfh, buf_col_max, maxlen) != maxlen) res = 1;
+	if (gzclose(minmaxfh)) res = 1;
+	return res;
+}
+''' + ''.join(funcs)
+
+c_module_wrapper_template = r'''
+static PyObject *py_%s(PyObject *self, PyObject *args)
+{
+	PyObject *res = 0;
+	PyObject *o_in_fns;
+	int in_count;
+	const char **in_fns = 0;
+	PyObject *o_offsets;
+	off_t *offsets = 0;
+	PyObject *o_max_counts;
+	int64_t *max_counts = 0;
+	PyObject *o_out_fns;
+	const char **out_fns = 0;
+	const char *gzip_mode;
+	PyObject *o_minmax_fn;
+	const char *minmax_fn;
+	int slices;
+	int slicemap_fd;
+	PY_LONG_LONG slicemap_size;
+	int build_slicemap;
+	PyObject *o_line_count;
+	uint64_t *line_count = 0;
+	if (!PyArg_ParseTuple(args, "OiOOOetOiiLiO",
+		&o_in_fns,
+		&in_count,
+		&o_offsets,
+		&o_max_counts,
+		&o_out_fns,
+		Py_FileSystemDefaultEncoding, &gzip_mode,
+		&o_minmax_fn,
+		&slices,
+		&slicemap_fd,
+		&slicemap_size,
+		&build_slicemap,
+		&o_line_count
+	)) {
+		return 0;
+	}
+	if (str_or_0(o_minmax_fn, &minmax_fn)) return 0;
+	if (!PyList_Check(o_line_count)) Py_RETURN_TRUE;
+	if (PyList_Size(o_line_count) != slices) Py_RETURN_TRUE;
+
+	if (!PyList_Check(o_in_fns)) Py_RETURN_TRUE;
+	if (!PyList_Check(o_offsets)) Py_RETURN_TRUE;
+	if (!PyList_Check(o_max_counts)) Py_RETURN_TRUE;
+	if (PyList_Size(o_in_fns) != in_count) Py_RETURN_TRUE;
+	if (PyList_Size(o_offsets) != in_count) Py_RETURN_TRUE;
+	if (PyList_Size(o_max_counts) != in_count) Py_RETURN_TRUE;
+	in_fns = malloc(in_count * sizeof(*in_fns) + 1);
+	err1(!in_fns);
+	offsets = malloc(in_count * sizeof(*offsets) + 1);
+	err1(!offsets);
+	max_counts = malloc(in_count * sizeof(*max_counts) + 1);
+	err1(!max_counts);
+	for (int i = 0; i < in_count; i++) {
+		in_fns[i] = PyBytes_AS_STRING(PyList_GetItem(o_in_fns, i));
+		err1(!in_fns[i]);
+		offsets[i] = PyLong_AsLongLong(PyList_GetItem(o_offsets, i));
+		err1(PyErr_Occurred());
+		max_counts[i] = PyLong_AsLongLong(PyList_GetItem(o_max_counts, i));
+		err1(PyErr_Occurred());
+	}
+
+	if (!PyList_Check(o_out_fns)) Py_RETURN_TRUE;
+	if (PyList_Size(o_out_fns) != slices) Py_RETURN_TRUE;
+	out_fns = malloc(slices * sizeof(*out_fns));
+	err1(!out_fns);
+	line_count = calloc(slices, 8);
+	err1(!line_count);
+	for (int i = 0; i < slices; i++) {
+		out_fns[i] = PyBytes_AS_STRING(PyList_GetItem(o_out_fns, i));
+		err1(!out_fns[i]);
+	}
+
+	int failed;
+	Py_BEGIN_ALLOW_THREADS
+	failed = %s(in_fns, in_count, offsets, max_counts, out_fns, gzip_mode, minmax_fn, slices, slicemap_fd, slicemap_size, build_slicemap, line_count);
+	Py_END_ALLOW_THREADS
+	if (failed) {
+		res = Py_True;
+		goto err;
+	}
+	for (int i = 0; i < slices; i++) {
+		err1(PyList_SetItem(o_line_count, i, PyLong_FromUnsignedLongLong(line_count[i])));
+	}
+	res = Py_False;
+err:
+	if (line_count) free(line_count);
+	if (out_fns) free(out_fns);
+	if (max_counts) free(max_counts);
+	if (offsets) free(offsets);
+	if (in_fns) free(in_fns);
+	if (res) Py_INCREF(res);
+	return res;
+}
+'''
+
+c_module_code, c_module_hash = c_backend_support.make_source('dataset_rehash', all_c_functions, protos, '', [], c_module_wrapper_template)
+
+def init():
+	return c_backend_support.init('dataset_rehash', c_module_hash, protos, [], all_c_functions)
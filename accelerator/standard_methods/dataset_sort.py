@@ -0,0 +1,494 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+# This is a separate file from a_dataset_sort so setup.py can import
+# it and make the _dataset_sort module at install time.
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+from . import c_backend_support
+from .dataset_type import noneval_data
+
+__all__ = ('argsortfuncs', 'permutefuncs',)
+
+# argsort_* reads a sort column and does a stable sort of the lines
+# (a uint64_t permutation in perm_fd). Call it for the last sort column
+# first, with flags & 1 for that first call and flags & 2 for descending.
+# The values are turned into unsigned integers that sort like the values
+# do in python after a_dataset_sort has replaced None and NaN.
+#
+# permute_* writes lines perm[start:start + count] of a column to out_fn,
+# copying the values as they are stored.
+#
+# All functions take the same arguments, ignoring the ones they don't use.
+
+_proto_template = 'int %s(const char **in_fns, int in_count, off_t *offsets, int64_t *max_counts, uint64_t total, int perm_fd, uint64_t start, uint64_t count, const char *out_fn, const char *gzip_mode, int flags)'
+
+# type: (size, key function)
+_key_types = {
+	'float64'  : (8, 'key_float64'),
+	'float32'  : (4, 'key_float32'),
+	'int64'    : (8, 'key_int64'),
+	'int32'    : (4, 'key_int32'),
+	'bits64'   : (8, 'key_bits64'),
+	'bits32'   : (4, 'key_bits32'),
+	'bool'     : (1, 'key_bool'),
+	'datetime' : (8, 'key_datetime'),
+	'date'     : (4, 'key_date'),
+	'time'     : (8, 'key_time'),
+}
+
+argsortfuncs = dict((typ, 'argsort_' + typ) for typ in _key_types)
+
+permutefuncs = dict((typ, 'permute_fixed%d' % (size,)) for typ, (size, _) in _key_types.items())
+permutefuncs.update((typ, 'permute_blob') for typ in ('bytes', 'ascii', 'unicode', 'json',))
+permutefuncs['number'] = 'permute_number'
+
+_read_loop = r'''
+	for (int fileno = 0; fileno < in_count; fileno++) {
+		err1(rd_open(&r, in_fns[fileno], offsets[fileno]));
+		const int64_t max_count = (max_counts[fileno] < 0 ? INT64_MAX : max_counts[fileno]);
+		for (int64_t n = 0; n < max_count; n++, i++) {
+			const int e = rd_read(&r, %(dst)s, %(first_len)s);
+			if (e < 0 && max_counts[fileno] < 0) break;
+			err1(e);
+			err1(i >= total);
+'''
+
+_read_loop_end = r'''
+		}
+		err1(rd_close(&r));
+	}
+	err1(i != total);
+'''
+
+_argsort_template = r'''
+%(proto)s
+{
+	int res = 1;
+	char ptr[8];
+	uint64_t *perm = 0;
+	uint64_t *keys = 0;
+	uint64_t *keys_tmp = 0;
+	uint64_t *perm_tmp = 0;
+	rd r;
+	r.fh = 0;
+	uint64_t i = 0;
+	if (!total) return 0;
+	perm = mmap(0, total * 8, PROT_READ | PROT_WRITE, MAP_NOSYNC | MAP_SHARED, perm_fd, 0);
+	if (perm == MAP_FAILED) return 1;
+	keys = malloc(total * 8);
+	keys_tmp = malloc(total * 8);
+	perm_tmp = malloc(total * 8);
+	err1(!keys || !keys_tmp || !perm_tmp);
+''' + _read_loop % dict(dst='ptr', first_len='%(first_len)s') + r'''
+			keys[i] = %(key)s(ptr);
+''' + _read_loop_end + r'''
+	res = argsort(keys, keys_tmp, perm, perm_tmp, total, flags);
+err:
+	if (rd_close(&r)) res = 1;
+	free(perm_tmp);
+	free(keys_tmp);
+	free(keys);
+	munmap(perm, total * 8);
+	return res;
+}
+'''
+
+_permute_fixed_template = r'''
+%(proto)s
+{
+	int res = 1;
+	char *data = 0;
+	uint64_t *perm = 0;
+	gzFile outfh = 0;
+	rd r;
+	r.fh = 0;
+	uint64_t i = 0;
+	err1(start + count > total);
+	if (total) {
+		perm = mmap(0, total * 8, PROT_READ, MAP_NOSYNC | MAP_SHARED, perm_fd, 0);
+		if (perm == MAP_FAILED) {
+			perm = 0;
+			goto err;
+		}
+		data = malloc(total * %(first_len)s);
+		err1(!data);
+	}
+''' + _read_loop % dict(dst='data + i * %(first_len)s', first_len='%(first_len)s') + _read_loop_end + r'''
+	outfh = gzopen(out_fn, gzip_mode);
+	err1(!outfh);
+	for (uint64_t j = start; j < start + count; j++) {
+		err1(perm[j] >= total);
+		err1(gzwrite(outfh, data + perm[j] * %(first_len)s, %(first_len)s) != %(first_len)s);
+	}
+	res = 0;
+err:
+	if (rd_close(&r)) res = 1;
+	if (outfh && gzclose(outfh)) res = 1;
+	free(data);
+	if (perm) munmap(perm, total * 8);
+	return res;
+}
+'''
+
+# Values are stored whole (with the length) at pos[line] in data.
+_permute_varlen_template = r'''
+%(proto)s
+{
+	int res = 1;
+	char ptr[5];
+	size_t size = Z;
+	size_t used = 0;
+	char *data = malloc(size);
+	uint64_t *pos = malloc((total + 1) * 8);
+	uint64_t *perm = 0;
+	gzFile outfh = 0;
+	rd r;
+	r.fh = 0;
+	uint64_t i = 0;
+	err1(!data || !pos);
+	err1(start + count > total);
+	if (total) {
+		perm = mmap(0, total * 8, PROT_READ, MAP_NOSYNC | MAP_SHARED, perm_fd, 0);
+		if (perm == MAP_FAILED) {
+			perm = 0;
+			goto err;
+		}
+	}
+''' + _read_loop % dict(dst='ptr', first_len='1') + r'''
+			uint32_t len = *(uint8_t *)ptr;
+			int headlen = 1;
+%(get_len)s
+			if (used + headlen + len > size) {
+				while (used + headlen + len > size) size *= 2;
+				char *tmp = realloc(data, size);
+				err1(!tmp);
+				data = tmp;
+			}
+			memcpy(data + used, ptr, headlen);
+			err1(rd_read(&r, data + used + headlen, len));
+			pos[i] = used;
+			used += headlen + len;
+''' + _read_loop_end + r'''
+	pos[total] = used;
+	outfh = gzopen(out_fn, gzip_mode);
+	err1(!outfh);
+	for (uint64_t j = start; j < start + count; j++) {
+		const uint64_t k = perm[j];
+		err1(k >= total);
+		const int len = pos[k + 1] - pos[k];
+		err1(gzwrite(outfh, data + pos[k], len) != len);
+	}
+	res = 0;
+err:
+	if (rd_close(&r)) res = 1;
+	if (outfh && gzclose(outfh)) res = 1;
+	free(pos);
+	free(data);
+	if (perm) munmap(perm, total * 8);
+	return res;
+}
+'''
+
+_blob_get_len = r'''
+			if (len == 255) {
+				// Long value (or None as length 0)
+				err1(rd_read(&r, ptr + 1, 4));
+				memcpy(&len, ptr + 1, 4);
+				headlen = 5;
+				err1(len && len < 255);
+			}
+'''
+
+_number_get_len = r'''
+			if (len == 1) {
+				len = 8;
+			} else if (len) {
+				err1(len < 8 || len >= GZNUMBER_MAX_BYTES);
+			}
+'''
+
+protos = []
+funcs = []
+
+for typ, (size, key) in sorted(_key_types.items()):
+	proto = _proto_template % (argsortfuncs[typ],)
+	protos.append(proto + ';')
+	funcs.append(_argsort_template % dict(proto=proto, first_len=size, key=key))
+
+for size in sorted(set(size for size, _ in _key_types.values())):
+	proto = _proto_template % ('permute_fixed%d' % (size,),)
+	protos.append(proto + ';')
+	funcs.append(_permute_fixed_template % dict(proto=proto, first_len=size))
+
+for name, get_len in (('blob', _blob_get_len), ('number', _number_get_len)):
+	proto = _proto_template % ('permute_' + name,)
+	protos.append(proto + ';')
+	funcs.append(_permute_varlen_template % dict(proto=proto, get_len=get_len))
+
+all_c_functions = r'''
+#include <zlib.h>
+#include <stdlib.h>
+#include <string.h>
+#include <math.h>
+#include <sys/mman.h>
+#include <sys/types.h>
+#include <sys/stat.h>
+#include <fcntl.h>
+#include <unistd.h>
+
+#ifndef MAP_NOSYNC
+#  define MAP_NOSYNC 0
+#endif
+
+#define err1(v) if (v) goto err
+#define Z (128 * 1024)
+#define GZNUMBER_MAX_BYTES 127
+
+// What None sorts as in a_dataset_sort, as stored by gzutil.
+#define DATE_MAX ((9999u << 9) | (12u << 5) | 31u)
+#define DATETIME_MAX (((uint64_t)((9999u << 14) | (12u << 10) | (31u << 5) | 23u) << 32) | ((59u << 26) | (59u << 20) | 999999u))
+#define TIME_MAX (((uint64_t)(32277536u | 23u) << 32) | ((59u << 26) | (59u << 20) | 999999u))
+''' + noneval_data + c_backend_support.gzreader_code + r'''
+
+static inline uint64_t key_double(double v)
+{
+	uint64_t u;
+	if (isnan(v)) v = INFINITY; // NaN sorts last
+	if (v == 0) v = 0; // -0.0 is the same as 0.0
+	memcpy(&u, &v, 8);
+	// Flip negative values completely and positive values only the sign bit.
+	return (u >> 63) ? ~u : u | ((uint64_t)1 << 63);
+}
+
+static inline uint64_t key_float64(const char *ptr)
+{
+	double v;
+	if (!memcmp(ptr, noneval_float64, 8)) return key_double(-INFINITY);
+	memcpy(&v, ptr, 8);
+	return key_double(v);
+}
+
+static inline uint64_t key_float32(const char *ptr)
+{
+	float v;
+	if (!memcmp(ptr, noneval_float32, 4)) return key_double(-INFINITY);
+	memcpy(&v, ptr, 4);
+	return key_double(v);
+}
+
+static inline uint64_t key_int64(const char *ptr)
+{
+	int64_t v;
+	memcpy(&v, ptr, 8);
+	if (v == noneval_int64) return 0;
+	return (uint64_t)v ^ ((uint64_t)1 << 63);
+}
+
+static inline uint64_t key_int32(const char *ptr)
+{
+	int32_t v;
+	memcpy(&v, ptr, 4);
+	if (v == noneval_int32) return 0;
+	return (uint32_t)v ^ 0x80000000u;
+}
+
+static inline uint64_t key_bits64(const char *ptr)
+{
+	uint64_t v;
+	memcpy(&v, ptr, 8);
+	return v;
+}
+
+static inline uint64_t key_bits32(const char *ptr)
+{
+	uint32_t v;
+	memcpy(&v, ptr, 4);
+	return v;
+}
+
+static inline uint64_t key_bool(const char *ptr)
+{
+	const uint8_t v = *(const uint8_t *)ptr;
+	if (v == noneval_bool) return 0;
+	return v + 1;
+}
+
+static inline uint64_t key_date(const char *ptr)
+{
+	uint32_t v;
+	memcpy(&v, ptr, 4);
+	if (v == noneval_date) return DATE_MAX;
+	return v;
+}
+
+static inline uint64_t key_datetime(const char *ptr)
+{
+	uint32_t v[2];
+	memcpy(v, ptr, 8);
+	const uint64_t k = (uint64_t)v[0] << 32 | v[1];
+	if (k == noneval_datetime) return DATETIME_MAX;
+	return k;
+}
+
+static inline uint64_t key_time(const char *ptr)
+{
+	uint32_t v[2];
+	memcpy(v, ptr, 8);
+	const uint64_t k = (uint64_t)v[0] << 32 | v[1];
+	if (k == noneval_time) return TIME_MAX;
+	return k;
+}
+
+// Stable LSD radix sort of keys, moving perm along. perm starts as the
+// identity if (flags & 1), otherwise keys (in the original line order)
+// are first put in the order perm already has.
+static int argsort(uint64_t *keys, uint64_t *keys_tmp, uint64_t *perm, uint64_t *perm_tmp, const uint64_t total, const int flags)
+{
+	uint64_t * const perm_out = perm;
+	uint64_t (*counts)[256] = calloc(8, sizeof(*counts));
+	if (!counts) return 1;
+	if (flags & 2) { // descending
+		for (uint64_t i = 0; i < total; i++) keys[i] = ~keys[i];
+	}
+	if (flags & 1) {
+		for (uint64_t i = 0; i < total; i++) perm[i] = i;
+	} else {
+		for (uint64_t i = 0; i < total; i++) {
+			if (perm[i] >= total) {
+				free(counts);
+				return 1;
+			}
+			keys_tmp[i] = keys[perm[i]];
+		}
+		uint64_t *tmp = keys;
+		keys = keys_tmp;
+		keys_tmp = tmp;
+	}
+	for (uint64_t i = 0; i < total; i++) {
+		for (int b = 0; b < 8; b++) {
+			counts[b][(keys[i] >> (b * 8)) & 255]++;
+		}
+	}
+	for (int b = 0; b < 8; b++) {
+		// Nothing to do if all keys have the same value in this byte.
+		if (counts[b][(keys[0] >> (b * 8)) & 255] == total) continue;
+		uint64_t pos = 0;
+		for (int v = 0; v < 256; v++) {
+			const uint64_t c = counts[b][v];
+			counts[b][v] = pos;
+			pos += c;
+		}
+		for (uint64_t i = 0; i < total; i++) {
+			const uint64_t dst = counts[b][(keys[i] >> (b * 8)) & 255]++;
+			keys_tmp[dst] = keys[i];
+			perm_tmp[dst] = perm[i];
+		}
+		uint64_t *tmp = keys;
+		keys = keys_tmp;
+		keys_tmp = tmp;
+		tmp = perm;
+		perm = perm_tmp;
+		perm_tmp = tmp;
+	}
+	if (perm != perm_out) memcpy(perm_out, perm, total * 8);
+	free(counts);
+	return 0;
+}
+''' + ''.join(funcs)
+
+c_module_wrapper_template = r'''
+static PyObject *py_%s(PyObject *self, PyObject *args)
+{
+	PyObject *res = 0;
+	PyObject *o_in_fns;
+	int in_count;
+	const char **in_fns = 0;
+	PyObject *o_offsets;
+	off_t *offsets = 0;
+	PyObject *o_max_counts;
+	int64_t *max_counts = 0;
+	unsigned PY_LONG_LONG total;
+	int perm_fd;
+	unsigned PY_LONG_LONG start;
+	unsigned PY_LONG_LONG count;
+	PyObject *o_out_fn;
+	const char *out_fn;
+	PyObject *o_gzip_mode;
+	const char *gzip_mode;
+	int flags;
+	if (!PyArg_ParseTuple(args, "OiOOKiKKOOi",
+		&o_in_fns,
+		&in_count,
+		&o_offsets,
+		&o_max_counts,
+		&total,
+		&perm_fd,
+		&start,
+		&count,
+		&o_out_fn,
+		&o_gzip_mode,
+		&flags
+	)) {
+		return 0;
+	}
+	if (str_or_0(o_out_fn, &out_fn)) return 0;
+	if (str_or_0(o_gzip_mode, &gzip_mode)) return 0;
+
+	if (!PyList_Check(o_in_fns)) Py_RETURN_TRUE;
+	if (!PyList_Check(o_offsets)) Py_RETURN_TRUE;
+	if (!PyList_Check(o_max_counts)) Py_RETURN_TRUE;
+	if (PyList_Size(o_in_fns) != in_count) Py_RETURN_TRUE;
+	if (PyList_Size(o_offsets) != in_count) Py_RETURN_TRUE;
+	if (PyList_Size(o_max_counts) != in_count) Py_RETURN_TRUE;
+	in_fns = malloc(in_count * sizeof(*in_fns) + 1);
+	err1(!in_fns);
+	offsets = malloc(in_count * sizeof(*offsets) + 1);
+	err1(!offsets);
+	max_counts = malloc(in_count * sizeof(*max_counts) + 1);
+	err1(!max_counts);
+	for (int i = 0; i < in_count; i++) {
+		in_fns[i] = PyBytes_AS_STRING(PyList_GetItem(o_in_fns, i));
+		err1(!in_fns[i]);
+		offsets[i] = PyLong_AsLongLong(PyList_GetItem(o_offsets, i));
+		err1(PyErr_Occurred());
+		max_counts[i] = PyLong_AsLongLong(PyList_GetItem(o_max_counts, i));
+		err1(PyErr_Occurred());
+	}
+
+	int failed;
+	Py_BEGIN_ALLOW_THREADS
+	failed = %s(in_fns, in_count, offsets, max_counts, total, perm_fd, start, count, out_fn, gzip_mode, flags);
+	Py_END_ALLOW_THREADS
+	res = (failed ? Py_True : Py_False);
+err:
+	if (max_counts) free(max_counts);
+	if (offsets) free(offsets);
+	if (in_fns) free(in_fns);
+	if (res) Py_INCREF(res);
+	return res;
+}
+'''
+
+c_module_code, c_module_hash = c_backend_support.make_source('dataset_sort', all_c_functions, protos, '', [], c_module_wrapper_template)
+
+def init():
+	return c_backend_support.init('dataset_sort', c_module_hash, protos, [], all_c_functions)
@@ -34,10 +34,12 @@ from accelerator.compat import NoneType, iteritems
 
 from . import c_backend_support
 
-__all__ = ('convfuncs', 'typerename', 'typesizes', 'minmaxfuncs',)
+__all__ = ('convfuncs', 'typerename', 'typesizes', 'minmaxfuncs', 'hashfuncs',)
 
 def _resolve_datetime(coltype):
 	cfunc, fmt = coltype.split(':', 1)
+	if fmt in ('epoch_s', 'epoch_ms') and cfunc.startswith('datetime'):
+		return cfunc + '_' + fmt, None, None
 	if '%f' in fmt:
 		fmt, fmt_b = fmt.split('%f')
 	else:
@@ -248,6 +250,13 @@ _c_conv_unicode_specific_template = r'''
 	}
 '''
 
+# Formats using only %Y %m %d %H %M %S (and %f, which is handled here)
+# are first tried with fast_strptime, which only falls back to strptime
+# if the value isn't in exactly that layout.
+_c_conv_date_setup = r'''
+	const int fast_fmt = fast_fmt_ok(fmt);
+	const int fast_fmt_b = fast_fmt_ok(fmt_b);
+'''
 _c_conv_date_template = r'''
 	const char *pres;
 	struct tm tm;
@@ -255,7 +264,8 @@ _c_conv_date_template = r'''
 	tm.tm_year = 70;
 	tm.tm_mday = 1;
 	if (*fmt) {
-		pres = strptime(line, fmt, &tm);
+		pres = (fast_fmt ? fast_strptime(line, fmt, &tm) : 0);
+		if (!pres) pres = strptime(line, fmt, &tm);
 	} else {
 		pres = line;
 	}
@@ -284,7 +294,8 @@ _c_conv_date_template = r'''
 			if (pres == lres || f < 0) {
 				pres = 0;
 			} else if (*fmt_b) {
-				pres = strptime(lres, fmt_b, &tm);
+				pres = (fast_fmt_b ? fast_strptime(lres, fmt_b, &tm) : 0);
+				if (!pres) pres = strptime(lres, fmt_b, &tm);
 			} else {
 				pres = lres;
 			}
@@ -375,6 +386,49 @@ _c_conv_time = r'''
 		}
 '''
 
+# Seconds (or milliseconds) since 1970-01-01 00:00:00 UTC.
+_c_conv_epoch_template = r'''
+		(void) fmt;
+		char *endptr;
+		errno = 0;
+		const long long value = strtoll(line, &endptr, 10);
+#if %(whole)d
+		while (*endptr == 32 || (*endptr >= 9 && *endptr <= 13)) endptr++;
+		if (errno || endptr == line || *endptr) {
+#else
+		if (errno || endptr == line) {
+#endif
+			ptr = 0;
+		} else {
+			int64_t secs = value / %(per_sec)d;
+			int64_t frac = value %% %(per_sec)d;
+			if (frac < 0) {
+				frac += %(per_sec)d;
+				secs--;
+			}
+			int64_t days = secs / 86400;
+			int64_t daysecs = secs %% 86400;
+			if (daysecs < 0) {
+				daysecs += 86400;
+				days--;
+			}
+			// 0001-01-01 to 9999-12-31
+			if (days < -719162 || days > 2932896) {
+				ptr = 0;
+			} else {
+				uint32_t year, mon, mday;
+				civil_from_days(days, &year, &mon, &mday);
+				const uint32_t hour = daysecs / 3600;
+				const uint32_t min  = daysecs / 60 %% 60;
+				const uint32_t sec  = daysecs %% 60;
+				const uint32_t f    = frac * (1000000 / %(per_sec)d);
+				uint32_t *p = (uint32_t *)ptr;
+				p[0] = year << 14 | mon << 10 | mday << 5 | hour;
+				p[1] = min << 26 | sec << 20 | f;
+			}
+		}
+'''
+
 _c_conv_float_template = r'''
 		(void) fmt;
 		char *endptr;
@@ -569,6 +623,21 @@ minmaxfuncs = {
 	'time'     : _c_minmax_datetime,
 }
 
+# Hash of the value in ptr, the same as typed_writer(type).hash gives.
+# (Used to build the slicemap when rehashing.)
+hashfuncs = {
+	'float64'  : 'memcmp(ptr, noneval_float64, 8) ? hash_double(*(const double *)ptr) : 0',
+	'float32'  : 'memcmp(ptr, noneval_float32, 4) ? hash_double(*(const float *)ptr) : 0',
+	'int64'    : '*(const int64_t *)ptr == INT64_MIN ? 0 : hash_integer(*(const int64_t *)ptr)',
+	'int32'    : '*(const int32_t *)ptr == INT32_MIN ? 0 : hash_integer(*(const int32_t *)ptr)',
+	'bits64'   : 'hash_integer(*(const uint64_t *)ptr)',
+	'bits32'   : 'hash_integer(*(const uint32_t *)ptr)',
+	'bool'     : '*(const uint8_t *)ptr == 255 ? 0 : !!*(const uint8_t *)ptr',
+	'datetime' : '*(const uint64_t *)ptr ? hash(ptr, 8) : 0',
+	'date'     : '*(const uint32_t *)ptr ? hash(ptr, 4) : 0',
+	'time'     : '*(const uint64_t *)ptr ? hash(ptr, 8) : 0',
+}
+
 if len(struct.pack("@L", 0)) == 8:
 	strtol_f = 'strtol'
 	strtoul_f = 'strtoul'
@@ -671,12 +740,13 @@ convfuncs = {
 	'strbool'      : ConvTuple(1, _c_conv_strbool, None),
 	'floatbool'    : ConvTuple(1, _c_conv_floatbool_template % dict(whole=1)                   , None),
 	'floatbooli'   : ConvTuple(1, _c_conv_floatbool_template % dict(whole=0)                   , None),
-	'datetime:*'   : ConvTuple(8, _c_conv_date_template % dict(whole=1, conv=_c_conv_datetime,), _resolve_datetime),
-	'date:*'       : ConvTuple(4, _c_conv_date_template % dict(whole=1, conv=_c_conv_date,    ), None),
-	'time:*'       : ConvTuple(8, _c_conv_date_template % dict(whole=1, conv=_c_conv_time,    ), _resolve_datetime),
-	'datetimei:*'  : ConvTuple(8, _c_conv_date_template % dict(whole=0, conv=_c_conv_datetime,), _resolve_datetime),
-	'datei:*'      : ConvTuple(4, _c_conv_date_template % dict(whole=0, conv=_c_conv_date,    ), None),
-	'timei:*'      : ConvTuple(8, _c_conv_date_template % dict(whole=0, conv=_c_conv_time,    ), _resolve_datetime),
+	# datetime:epoch_s and datetime:epoch_ms parse integers since 1970 (UTC).
+	'datetime:*'   : ConvTuple(8, [_c_conv_date_setup, _c_conv_date_template % dict(whole=1, conv=_c_conv_datetime,), ''], _resolve_datetime),
+	'date:*'       : ConvTuple(4, [_c_conv_date_setup, _c_conv_date_template % dict(whole=1, conv=_c_conv_date,    ), ''], None),
+	'time:*'       : ConvTuple(8, [_c_conv_date_setup, _c_conv_date_template % dict(whole=1, conv=_c_conv_time,    ), ''], _resolve_datetime),
+	'datetimei:*'  : ConvTuple(8, [_c_conv_date_setup, _c_conv_date_template % dict(whole=0, conv=_c_conv_datetime,), ''], _resolve_datetime),
+	'datei:*'      : ConvTuple(4, [_c_conv_date_setup, _c_conv_date_template % dict(whole=0, conv=_c_conv_date,    ), ''], None),
+	'timei:*'      : ConvTuple(8, [_c_conv_date_setup, _c_conv_date_template % dict(whole=0, conv=_c_conv_time,    ), ''], _resolve_datetime),
 	'bytes'        : ConvTuple(0, _c_conv_bytes_template % dict(strip=0), None),
 	'bytesstrip'   : ConvTuple(0, _c_conv_bytes_template % dict(strip=1), None),
 	# unicode[strip]:encoding or unicode[strip]:encoding/errorhandling
@@ -708,6 +778,10 @@ hidden_convfuncs = {
 	'unicodestrip_latin1': ConvTuple(0, ['', _c_conv_unicode_specific_template % dict(strip=1, func='PyUnicode_DecodeLatin1'), _c_conv_unicode_cleanup], None),
 	'unicode_ascii'      : ConvTuple(0, ['', _c_conv_unicode_specific_template % dict(strip=0, func='PyUnicode_DecodeASCII'), _c_conv_unicode_cleanup], None),
 	'unicodestrip_ascii' : ConvTuple(0, ['', _c_conv_unicode_specific_template % dict(strip=1, func='PyUnicode_DecodeASCII'), _c_conv_unicode_cleanup], None),
+	'datetime_epoch_s'   : ConvTuple(8, _c_conv_epoch_template % dict(whole=1, per_sec=1), None),
+	'datetime_epoch_ms'  : ConvTuple(8, _c_conv_epoch_template % dict(whole=1, per_sec=1000), None),
+	'datetimei_epoch_s'  : ConvTuple(8, _c_conv_epoch_template % dict(whole=0, per_sec=1), None),
+	'datetimei_epoch_ms' : ConvTuple(8, _c_conv_epoch_template % dict(whole=0, per_sec=1000), None),
 }
 
 # The actual type produced, when it is not the same as the key in convfuncs
@@ -760,6 +834,10 @@ typerename = {
 	'float64i'     : 'float64',
 	'float32i'     : 'float32',
 	'datetimei'    : 'datetime',
+	'datetime_epoch_s'  : 'datetime',
+	'datetime_epoch_ms' : 'datetime',
+	'datetimei_epoch_s' : 'datetime',
+	'datetimei_epoch_ms': 'datetime',
 	'datei'        : 'date',
 	'timei'        : 'time',
 	'bytesstrip'   : 'bytes',
@@ -786,16 +864,21 @@ def _test():
 			assert isinstance(data.conv_code_str, (str, NoneType)), (key, data)
 		if data.conv_code_str and data.size:
 			assert typerename.get(key, key) in minmaxfuncs
+			assert typerename.get(key, key) in hashfuncs
 		assert data.pyfunc is None or callable(data.pyfunc), (key, data)
 	for key, mm in iteritems(minmaxfuncs):
 		for v in mm:
 			assert isinstance(v, str), key
 
 
+# The converters are called without the GIL (so several columns can be
+# converted at once), and only take it if the conversion uses Python.
 convert_template = r'''
 %(proto)s
 {
+#if %(need_gil)d
 	PyGILState_STATE gstate = PyGILState_Ensure();
+#endif
 	g g;
 	gzFile outfhs[slices];
 	memset(outfhs, 0, sizeof(outfhs));
@@ -819,9 +902,10 @@ convert_template = r'''
 		err1(!badmap);
 	}
 	if (slicemap_fd != -1) {
-		slicemap = mmap(0, slicemap_size, PROT_READ, MAP_NOSYNC | MAP_SHARED, slicemap_fd, 0);
+		slicemap = mmap(0, slicemap_size, PROT_READ | (hash_count ? PROT_WRITE : 0), MAP_NOSYNC | MAP_SHARED, slicemap_fd, 0);
 		err1(!slicemap);
 	}
+%(setup)s
 	if (default_value) {
 		err1(default_value_is_None);
 		char *ptr = defbuf;
@@ -871,6 +955,11 @@ more_infiles:
 			ptr = defbuf;
 			default_count[chosen_slice] += 1;
 		}
+		if (hash_count) {
+			chosen_slice = (%(hash)s) %% slices;
+			slicemap[i] = chosen_slice;
+			hash_count[chosen_slice] += 1;
+		}
 		%(minmax_code)s;
 		err1(gzwrite(outfhs[chosen_slice], ptr, %(datalen)s) != %(datalen)s);
 	}
@@ -892,7 +981,9 @@ err:
 	}
 	if (badmap) munmap(badmap, badmap_size);
 	if (slicemap) munmap(slicemap, slicemap_size);
+#if %(need_gil)d
 	PyGILState_Release(gstate);
+#endif
 	return res;
 }
 '''
@@ -1025,7 +1116,7 @@ err:
 		err1(!badmap);
 	}
 	if (slicemap_fd != -1) {
-		slicemap = mmap(0, slicemap_size, PROT_READ, MAP_NOSYNC | MAP_SHARED, slicemap_fd, 0);
+		slicemap = mmap(0, slicemap_size, PROT_READ | (hash_count ? PROT_WRITE : 0), MAP_NOSYNC | MAP_SHARED, slicemap_fd, 0);
 		err1(!slicemap);
 	}
 	if (default_value) {
@@ -1070,6 +1161,11 @@ more_infiles:
 			len = deflen;
 			default_count[chosen_slice] += 1;
 		}
+		if (hash_count) {
+			chosen_slice = hash_number(ptr, len) %% slices;
+			slicemap[i] = chosen_slice;
+			hash_count[chosen_slice] += 1;
+		}
 		// minmax tracking, not done for None-values
 		if (len > 1) {
 			double d_v = 0;
@@ -1170,7 +1266,7 @@ err:
 }
 '''
 
-proto_template = 'int convert_column_%s(const char **in_fns, int in_count, const char **out_fns, const char *gzip_mode, const char *minmax_fn, const char *default_value, uint32_t default_len, int default_value_is_None, const char *fmt, const char *fmt_b, int record_bad, int skip_bad, int badmap_fd, size_t badmap_size, int slices, int slicemap_fd, size_t slicemap_size, uint64_t *bad_count, uint64_t *default_count, off_t *offsets, int64_t *max_counts)'
+proto_template = 'int convert_column_%s(const char **in_fns, int in_count, const char **out_fns, const char *gzip_mode, const char *minmax_fn, const char *default_value, uint32_t default_len, int default_value_is_None, const char *fmt, const char *fmt_b, int record_bad, int skip_bad, int badmap_fd, size_t badmap_size, int slices, int slicemap_fd, size_t slicemap_size, uint64_t *hash_count, uint64_t *bad_count, uint64_t *default_count, off_t *offsets, int64_t *max_counts)'
 
 protos = []
 funcs = [noneval_data]
@@ -1183,13 +1279,16 @@ funcs.append(code)
 convert_blob_template = r'''
 %(proto)s
 {
+#if %(need_gil)d
 	PyGILState_STATE gstate = PyGILState_Ensure();
+#endif
 	g g;
 	gzFile outfhs[slices];
 	memset(outfhs, 0, sizeof(outfhs));
 	const char *line;
 	int res = 1;
 	uint8_t *defbuf = 0;
+	uint64_t default_hash = 0;
 	char *badmap = 0;
 	uint16_t *slicemap = 0;
 	int chosen_slice = 0;
@@ -1204,7 +1303,7 @@ convert_blob_template = r'''
 		err1(!badmap);
 	}
 	if (slicemap_fd != -1) {
-		slicemap = mmap(0, slicemap_size, PROT_READ, MAP_NOSYNC | MAP_SHARED, slicemap_fd, 0);
+		slicemap = mmap(0, slicemap_size, PROT_READ | (hash_count ? PROT_WRITE : 0), MAP_NOSYNC | MAP_SHARED, slicemap_fd, 0);
 		err1(!slicemap);
 	}
 %(setup)s
@@ -1214,6 +1313,7 @@ convert_blob_template = r'''
 		g.linelen = default_len;
 %(convert)s
 		err1(!ptr);
+		default_hash = hash(ptr, len);
 		defbuf = malloc((uint32_t)len + 5);
 		err1(!defbuf);
 		if (len < 255) {
@@ -1251,11 +1351,13 @@ more_infiles:
 			continue;
 		}
 		if (line == NoneMarker) {
+			if (hash_count) hash_count[chosen_slice] += 1; // slicemap[i] is already 0
 			err1(gzwrite(outfhs[chosen_slice], "\xff\0\0\0\0", 5) != 5);
 			continue;
 		}
 %(convert)s
 		if (ptr) {
+			if (hash_count) chosen_slice = hash(ptr, len) %% slices;
 			if (len > 254) {
 				uint8_t lenbuf[5];
 				lenbuf[0] = 255;
@@ -1278,8 +1380,13 @@ more_infiles:
 			}
 			ptr = (const uint8_t *)default_value;
 			len = default_len;
+			if (hash_count) chosen_slice = default_hash %% slices;
 			default_count[chosen_slice] += 1;
 		}
+		if (hash_count) {
+			slicemap[i] = chosen_slice;
+			hash_count[chosen_slice] += 1;
+		}
 		err1(gzwrite(outfhs[chosen_slice], ptr, len) != len);
 %(cleanup)s
 	}
@@ -1301,7 +1408,9 @@ err:
 	}
 	if (badmap) munmap(badmap, badmap_size);
 	if (slicemap) munmap(slicemap, slicemap_size);
+#if %(need_gil)d
 	PyGILState_Release(gstate);
+#endif
 	return res;
 }
 '''
@@ -1309,6 +1418,7 @@ err:
 for name, ct in sorted(list(convfuncs.items()) + list(hidden_convfuncs.items())):
 	if not ct.conv_code_str:
 		continue
+	need_gil = 'Py' in ''.join(ct.conv_code_str)
 	if ct.size:
 		if ':' in name:
 			shortname = name.split(':', 1)[0]
@@ -1319,10 +1429,14 @@ for name, ct in sorted(list(convfuncs.items()) + list(hidden_convfuncs.items()))
 		mm = minmaxfuncs[destname]
 		noneval_support = not destname.startswith('bits')
 		noneval_name = 'noneval_' + destname
-		code = convert_template % dict(proto=proto, datalen=ct.size, convert=ct.conv_code_str, minmax_setup=mm.setup, minmax_code=mm.code, noneval_support=noneval_support, noneval_name=noneval_name)
+		if isinstance(ct.conv_code_str, list):
+			setup, convert, _ = ct.conv_code_str
+		else:
+			setup, convert = '', ct.conv_code_str
+		code = convert_template % dict(proto=proto, datalen=ct.size, setup=setup, convert=convert, minmax_setup=mm.setup, minmax_code=mm.code, hash=hashfuncs[destname], noneval_support=noneval_support, noneval_name=noneval_name, need_gil=need_gil)
 	else:
 		proto = proto_template % (name.replace(':*', '').replace(':', '_'),)
-		args = dict(proto=proto, convert=ct.conv_code_str, setup='', cleanup='')
+		args = dict(proto=proto, convert=ct.conv_code_str, setup='', cleanup='', need_gil=need_gil)
 		if isinstance(ct.conv_code_str, list):
 			args['setup'], args['convert'], args['cleanup'] = ct.conv_code_str
 		code = convert_blob_template % args
@@ -1353,6 +1467,75 @@ all_c_functions = r'''
 
 #define err1(v) if (v) goto err
 #define Z (128 * 1024)
+''' + c_backend_support.siphash_code + r'''
+// Formats fast_strptime can handle.
+static int fast_fmt_ok(const char *fmt)
+{
+	if (!fmt) return 0;
+	for (; *fmt; fmt++) {
+		if (*fmt == '%') {
+			fmt++;
+			if (!*fmt || !strchr("YmdHMS%", *fmt)) return 0;
+		}
+	}
+	return 1;
+}
+
+// Parses exactly four digits for %Y, two for the others and other
+// characters literally, without looking at the locale. Anything this
+// accepts strptime parses the same way, so when it fails (returns 0,
+// not touching tm) the value is given to strptime instead.
+static const char *fast_strptime(const char *s, const char *fmt, struct tm *r_tm)
+{
+	struct tm tm = *r_tm;
+	for (; *fmt; fmt++) {
+		if (isspace(*fmt)) {
+			// Like strptime, whitespace matches any amount of whitespace.
+			while (isspace(*s)) s++;
+			continue;
+		}
+		if (*fmt != '%' || fmt[1] == '%') {
+			if (*fmt == '%') fmt++;
+			if (*s != *fmt) return 0;
+			s++;
+			continue;
+		}
+		fmt++;
+		const int width = (*fmt == 'Y' ? 4 : 2);
+		int v = 0;
+		for (int i = 0; i < width; i++) {
+			if (s[i] < '0' || s[i] > '9') return 0;
+			v = v * 10 + s[i] - '0';
+		}
+		s += width;
+		switch (*fmt) {
+			case 'Y': tm.tm_year = v - 1900; break;
+			case 'm': if (v < 1 || v > 12) return 0; tm.tm_mon = v - 1; break;
+			case 'd': if (v < 1 || v > 31) return 0; tm.tm_mday = v; break;
+			case 'H': if (v > 23) return 0; tm.tm_hour = v; break;
+			case 'M': if (v > 59) return 0; tm.tm_min = v; break;
+			case 'S': if (v > 59) return 0; tm.tm_sec = v; break;
+			default: return 0;
+		}
+	}
+	*r_tm = tm;
+	return s;
+}
+
+// Days since 1970-01-01 to year, month, day (proleptic Gregorian).
+// This is civil_from_days from Howard Hinnant's date algorithms.
+static void civil_from_days(int64_t z, uint32_t *r_year, uint32_t *r_mon, uint32_t *r_mday)
+{
+	z += 719468;
+	const int64_t era = (z >= 0 ? z : z - 146096) / 146097;
+	const uint32_t doe = (uint32_t)(z - era * 146097);
+	const uint32_t yoe = (doe - doe / 1460 + doe / 36524 - doe / 146096) / 365;
+	const uint32_t doy = doe - (365 * yoe + yoe / 4 - yoe / 100);
+	const uint32_t mp = (5 * doy + 2) / 153;
+	*r_mday = doy - (153 * mp + 2) / 5 + 1;
+	*r_mon = (mp < 10 ? mp + 3 : mp - 9);
+	*r_year = (uint32_t)(yoe + era * 400) + (*r_mon <= 2);
+}
 
 typedef struct {
 	gzFile fh;
@@ -1565,6 +1748,8 @@ static PyObject *py_%s(PyObject *self, PyObject *args)
 	int slices;
 	int slicemap_fd;
 	PY_LONG_LONG slicemap_size;
+	PyObject *o_hash_count;
+	uint64_t *hash_count = 0;
 	PyObject *o_bad_count;
 	uint64_t *bad_count = 0;
 	PyObject *o_default_count;
@@ -1573,7 +1758,7 @@ static PyObject *py_%s(PyObject *self, PyObject *args)
 	off_t *offsets = 0;
 	PyObject *o_max_counts;
 	int64_t *max_counts = 0;
-	if (!PyArg_ParseTuple(args, "OiOetetOiiOOiiiLiiLOOOO",
+	if (!PyArg_ParseTuple(args, "OiOetetOiiOOiiiLiiLOOOOO",
 		&o_in_fns,
 		&in_count,
 		&o_out_fns,
@@ -1591,6 +1776,7 @@ static PyObject *py_%s(PyObject *self, PyObject *args)
 		&slices,
 		&slicemap_fd,
 		&slicemap_size,
+		&o_hash_count,
 		&o_bad_count,
 		&o_default_count,
 		&o_offsets,
@@ -1605,6 +1791,10 @@ static PyObject *py_%s(PyObject *self, PyObject *args)
 	if (PyList_Size(o_bad_count) != slices) Py_RETURN_TRUE;
 	if (!PyList_Check(o_default_count)) Py_RETURN_TRUE;
 	if (PyList_Size(o_default_count) != slices) Py_RETURN_TRUE;
+	if (o_hash_count != nullmarker) {
+		if (!PyList_Check(o_hash_count)) Py_RETURN_TRUE;
+		if (PyList_Size(o_hash_count) != slices) Py_RETURN_TRUE;
+	}
 
 	if (!PyList_Check(o_in_fns)) Py_RETURN_TRUE;
 	if (!PyList_Check(o_offsets)) Py_RETURN_TRUE;
@@ -1636,23 +1826,35 @@ static PyObject *py_%s(PyObject *self, PyObject *args)
 	err1(!default_count);
 	bad_count = malloc(slices * 8);
 	err1(!bad_count);
+	if (o_hash_count != nullmarker) {
+		hash_count = calloc(slices, 8);
+		err1(!hash_count);
+	}
 	for (int i = 0; i < slices; i++) {
 		out_fns[i] = PyBytes_AS_STRING(PyList_GetItem(o_out_fns, i));
 		err1(!out_fns[i]);
 		default_count[i] = bad_count[i] = 0;
 	}
 
-	if (%s(in_fns, in_count, out_fns, gzip_mode, minmax_fn, default_value, default_len, default_value_is_None, fmt, fmt_b, record_bad, skip_bad, badmap_fd, badmap_size, slices, slicemap_fd, slicemap_size, bad_count, default_count, offsets, max_counts)) {
+	int failed;
+	Py_BEGIN_ALLOW_THREADS
+	failed = %s(in_fns, in_count, out_fns, gzip_mode, minmax_fn, default_value, default_len, default_value_is_None, fmt, fmt_b, record_bad, skip_bad, badmap_fd, badmap_size, slices, slicemap_fd, slicemap_size, hash_count, bad_count, default_count, offsets, max_counts);
+	Py_END_ALLOW_THREADS
+	if (failed) {
 		res = Py_True;
 		goto err;
 	}
 	for (int i = 0; i < slices; i++) {
 		err1(PyList_SetItem(o_default_count, i, PyLong_FromUnsignedLongLong(default_count[i])));
 		err1(PyList_SetItem(o_bad_count, i, PyLong_FromUnsignedLongLong(bad_count[i])));
+		if (hash_count) {
+			err1(PyList_SetItem(o_hash_count, i, PyLong_FromUnsignedLongLong(hash_count[i])));
+		}
 	}
 	res = Py_False;
 err:
 	if (bad_count) free(bad_count);
+	if (hash_count) free(hash_count);
 	if (default_count) free(default_count);
 	if (out_fns) free(out_fns);
 	if (max_counts) free(max_counts);
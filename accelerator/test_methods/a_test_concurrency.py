@@ -0,0 +1,45 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+description = r'''
+Sleep for a second in synthesis and return when that started and ended.
+build_tests builds several of these without waiting, to see that they
+run at the same time when the daemon concurrency allows it.
+'''
+
+import time
+
+options = dict(
+	n=0,
+	when=0.0,
+)
+
+jobids = ('previous',)
+
+def synthesis():
+	if jobids.previous:
+		# Only built when previous is done.
+		start, end = jobids.previous.load()
+		assert start < end
+	start = time.time()
+	time.sleep(1)
+	return start, time.time()
@@ -0,0 +1,251 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+description = r'''
+Test that csvexport formats all types the same way in C as in python,
+for csv (quoted and not), tsv and jsonl, compressed or not, sliced or not.
+Also that None in string columns (except in jsonl) and newlines in
+compressed csv are still errors.
+'''
+
+from datetime import date, time, datetime
+from random import Random
+from struct import pack, unpack
+from math import isnan, isinf
+import gzip
+import json
+from ujson import dumps
+
+from accelerator.dataset import DatasetWriter
+from accelerator.compat import PY3
+from accelerator.dispatch import JobError
+from accelerator import subjobs
+
+columns = {
+	'float64': 'float64',
+	'float32': 'float32',
+	'int64': 'int64',
+	'int32': 'int32',
+	'bits64': 'bits64',
+	'bits32': 'bits32',
+	'bool': 'bool',
+	'datetime': 'datetime',
+	'date': 'date',
+	'time': 'time',
+	'bytes': 'bytes',
+	'ascii': 'ascii',
+	'unicode': 'unicode',
+	'number': 'number',
+}
+
+def floats():
+	yield 0.0
+	yield -0.0
+	yield float('nan')
+	yield float('inf')
+	yield float('-inf')
+	yield 1e16
+	yield 1e15
+	yield 0.0001
+	yield 0.00001
+	yield 1 / 3
+	yield 5e-324
+	yield 1.7976931348623157e308
+	for exp in range(-1074, 1024, 7):
+		yield 2.0 ** exp
+		yield -(2.0 ** exp)
+	rnd = Random(42)
+	for _ in range(2000):
+		v, = unpack('=d', pack('=Q', rnd.getrandbits(64)))
+		if not isnan(v):
+			yield v
+	for _ in range(200):
+		yield rnd.uniform(-1000, 1000)
+		yield round(rnd.uniform(-1000, 1000), rnd.randint(0, 6))
+
+def float32(v):
+	v, = unpack('=f', pack('=f', v))
+	return v
+
+def mklines():
+	rnd = Random(17)
+	strings = ['', 'a', 'with "quotes"', "with 'quotes'", 'tab\there', 'comma, here', '\xe5\xe4\xf6', 'x' * 300, 'ctrl\x01\x1f\\']
+	byte_strings = [b'', b'plain', b'\xff\xfe', b'ok \xc3\xa5 \xc3', b'\xed\xa0\x80', b'\xf0\x9f\x98\x80', b'\xe2\x82', b'\xf4\x90\x80\x80', b'"\\']
+	numbers = [0, 1, -1, 2 ** 63 - 1, -2 ** 63 + 1, 2 ** 63, -2 ** 63 - 1, 2 ** 64, 10 ** 100, -10 ** 100, 2 ** 1000 - 1, 0.5, -1e-300, float('inf'), None]
+	for ix, f in enumerate(floats()):
+		none = (ix % 23 == 5)
+		yield (
+			None if none else f,
+			None if ix % 19 == 3 else float32(f) if abs(f) < 3e38 or isinf(f) or isnan(f) else 1.5,
+			None if none else rnd.randint(-2 ** 63 + 1, 2 ** 63 - 1),
+			None if none else rnd.randint(-2 ** 31 + 1, 2 ** 31 - 1),
+			rnd.randint(0, 2 ** 64 - 1),
+			rnd.randint(0, 2 ** 32 - 1),
+			None if none else bool(ix % 2),
+			None if none else datetime(rnd.randint(1, 9999), rnd.randint(1, 12), rnd.randint(1, 28), rnd.randint(0, 23), rnd.randint(0, 59), rnd.randint(0, 59), rnd.choice((0, rnd.randint(0, 999999)))),
+			None if none else date(rnd.randint(1, 9999), rnd.randint(1, 12), rnd.randint(1, 28)),
+			None if none else time(rnd.randint(0, 23), rnd.randint(0, 59), rnd.randint(0, 59), rnd.choice((0, rnd.randint(0, 999999)))),
+			byte_strings[ix % len(byte_strings)],
+			'ascii %d' % (ix,) if ix % 3 else "'\"",
+			strings[ix % len(strings)],
+			numbers[ix % len(numbers)] if ix % 2 else f,
+		)
+
+# the order mklines makes them in
+order = ['float64', 'float32', 'int64', 'int32', 'bits64', 'bits32', 'bool', 'datetime', 'date', 'time', 'bytes', 'ascii', 'unicode', 'number']
+
+names = ['bits32', 'bits64', 'bool', 'bytes', 'date', 'datetime', 'float32', 'float64', 'int32', 'int64', 'number', 'time', 'unicode', 'ascii']
+
+def fmt_csv(name, v):
+	if v is None:
+		return 'None'
+	if name == 'bytes':
+		if PY3:
+			return v.decode('utf-8', errors='backslashreplace')
+		return v
+	if isinstance(v, float) or name == 'number':
+		return repr(v) # so python2 longs get an L
+	return str(v)
+
+def fmt_json(name, v):
+	# what json.loads should give
+	if v is None:
+		return None
+	if isinstance(v, float) and (isnan(v) or isinf(v)):
+		return None
+	if name == 'bytes':
+		return v.decode('utf-8', errors='backslashreplace') if PY3 else v.decode('utf-8', 'replace')
+	if name in ('date', 'datetime', 'time'):
+		return str(v)
+	return v
+
+def prepare(params):
+	dws = []
+	previous = None
+	for name in ('a', 'b'):
+		dw = DatasetWriter(name=name, columns=columns, previous=previous)
+		dws.append(dw)
+		previous = dw
+	# c has a json column, so it has to be exported in python.
+	dw = DatasetWriter(name='c', columns=dict(columns, json='json'), previous=previous)
+	dws.append(dw)
+	return dws
+
+def analysis(sliceno, params, prepare_res):
+	a, b, c = prepare_res
+	for ix, line in enumerate(mklines()):
+		if ix % params.slices == sliceno:
+			line = dict(zip(order, line))
+			if ix % 3 == 0:
+				a.write_dict(line)
+			elif ix % 3 == 1 and sliceno != 1: # an empty slice in b
+				b.write_dict(line)
+			else:
+				c.write_dict(dict(line, json={'ix': ix}))
+
+def read(job, filename):
+	filename = job.filename(filename)
+	if filename.endswith('.gz'):
+		fh = gzip.open(filename, 'rb')
+	else:
+		fh = open(filename, 'rb')
+	with fh:
+		data = fh.read()
+	return data.decode('utf-8').split('\n')
+
+def synthesis(job, params, prepare_res):
+	for dw in prepare_res:
+		dw.finish()
+	c = job.dataset('c')
+	b = job.dataset('b')
+	# only c has the json column, so that is exported on its own.
+	chains = {False: b.chain(), True: [c]}
+	for quote in ('', '"', "'"):
+		for sep in (',', '\t', ';'):
+			for filename in ('out.csv', 'out.tsv.gz'):
+				for use_json in (False, True):
+					labels = names + ['json'] if use_json else names
+					source = [c] if use_json else [b]
+					res = subjobs.build('csvexport', options=dict(filename=filename, separator=sep, quote_fields=quote, labels=labels, chain_source=not use_json), datasets=dict(source=source))
+					got = read(res, filename)
+					assert got[-1] == '', 'missing newline at end of file'
+					got = got[:-1]
+					def q(v):
+						return quote + v.replace(quote, quote + quote) + quote if quote else v
+					want = [sep.join(q(n) for n in labels)]
+					for sliceno in range(params.slices):
+						for ds in chains[use_json]:
+							for line in ds.iterate(sliceno, labels):
+								want.append(sep.join(q(dumps(v) if name == 'json' else fmt_csv(name, v)) for name, v in zip(labels, line)))
+					assert len(got) == len(want), '%s (sep %r, quote %r, json %r): %d lines, not %d' % (filename, sep, quote, use_json, len(got), len(want),)
+					for g, w in zip(got, want):
+						assert g == w, '%s (sep %r, quote %r, json %r): %r != %r' % (filename, sep, quote, use_json, g, w,)
+	for filename in ('out.jsonl', 'out.jsonl.gz'):
+		for use_json in (False, True):
+			for sliced in (False, True):
+				labels = names + ['json'] if use_json else names
+				source = [c] if use_json else [b]
+				fn = filename.replace('out', 'out%d') if sliced else filename
+				res = subjobs.build('csvexport', options=dict(filename=fn, format='jsonl', labels=labels, chain_source=not use_json, sliced=sliced), datasets=dict(source=source))
+				if sliced:
+					got = [line for sliceno in range(params.slices) for line in read(res, fn % (sliceno,))[:-1]]
+				else:
+					got = read(res, fn)[:-1]
+				want = []
+				for sliceno in range(params.slices):
+					for ds in chains[use_json]:
+						for line in ds.iterate(sliceno, labels):
+							want.append(dict((name, fmt_json(name, v)) for name, v in zip(labels, line)))
+				assert len(got) == len(want), '%s (json %r): %d lines, not %d' % (filename, use_json, len(got), len(want),)
+				for g, w in zip(got, want):
+					assert g.startswith('{"bits32": '), g
+					g = json.loads(g)
+					assert g == w, '%s (json %r): %r != %r' % (filename, use_json, g, w,)
+
+	check_errors()
+
+def check_errors():
+	def export(values, filename, **options):
+		dw = DatasetWriter(name='errors %d' % (export.count,), columns={k: columns[k] for k in values})
+		export.count += 1
+		dw.get_split_write_dict()(values)
+		ds = dw.finish()
+		res = subjobs.build('csvexport', options=dict(options, filename=filename, labelsonfirstline=False), datasets=dict(source=ds))
+		return read(res, filename)
+	export.count = 0
+	for values in (dict(unicode=None, int64=1), dict(bytes=None, ascii='a')):
+		for filename in ('out.csv', 'out.csv.gz'):
+			try:
+				export(values, filename)
+				raise Exception('csvexport of %r to %s did not fail' % (values, filename,))
+			except JobError:
+				pass
+		got = json.loads(export(values, 'out.jsonl.gz', format='jsonl')[0])
+		assert got == {k: v if isinstance(v, (int, type(None))) else fmt_json(k, v) for k, v in values.items()}, got
+	values = dict(unicode='two\nlines', int64=1)
+	assert export(values, 'out.csv') == ['1,two', 'lines', '']
+	try:
+		export(values, 'out.csv.gz')
+		raise Exception('csvexport of a newline to .gz did not fail')
+	except JobError:
+		pass
+	assert json.loads(export(values, 'out.jsonl.gz', format='jsonl')[0]) == values
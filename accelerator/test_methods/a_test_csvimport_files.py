@@ -0,0 +1,103 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+description = r'''
+Verify importing several files in one csvimport job.
+'''
+
+import os
+from gzip import GzipFile
+
+from accelerator import subjobs
+from accelerator import blob
+from accelerator.dispatch import JobError
+from accelerator.dataset import Dataset
+
+def write(filename, data):
+	if filename.endswith(".gz"):
+		fh = GzipFile(filename, "wb")
+	else:
+		fh = open(filename, "wb")
+	with fh:
+		fh.write(data)
+
+def synthesis(job, slices):
+	os.mkdir("files")
+	want = {}
+	for fileno in range(6):
+		filename = "files/%d.%s" % (fileno, "gz" if fileno % 3 == 2 else "txt",)
+		lines = [b"a,b"]
+		for ix in range(fileno * 7):
+			if ix % 5 == 4:
+				lines.append(b"#comment")
+			lines.append(b"%d,%d" % (fileno, ix,))
+		want[job.filename(filename)] = lines
+		write(filename, b"\n".join(lines) + b"\n")
+	write("other labels.txt", b"a,c\n1,2\n")
+	def got(ds, columns=("a", "b", "fn", "lineno")):
+		return sorted(ds.iterate(None, columns))
+	def expected(filenames):
+		res = []
+		for filename in filenames:
+			for lineno, line in enumerate(want[filename], 1):
+				if lineno > 1 and not line.startswith(b"#"):
+					a, b = line.split(b",")
+					res.append((a, b, filename, lineno))
+		return sorted(res)
+	all_files = sorted(want)
+
+	opts = dict(filename=job.filename("files/*"), comment="#", lineno_label="lineno", filename_column="fn")
+	jid = subjobs.build("csvimport", options=opts)
+	ds = Dataset(jid)
+	assert ds.chain() == [ds]
+	assert got(ds) == expected(all_files)
+	skipped = list(Dataset(jid, "skipped").iterate(None, "filename"))
+	assert sorted(skipped) == sorted(fn for fn, lines in want.items() for line in lines if line.startswith(b"#"))
+	res = blob.load("import", jobid=jid)
+	assert [f.filename for f in res.files] == all_files
+	assert [f.num_lines for f in res.files] == [len(want[fn]) - 1 - f.num_skipped_lines for fn, f in zip(all_files, res.files)]
+	assert res.num_lines == sum(ds.lines)
+	# The uncompressed files are split over all slices (continuing where the last file stopped).
+	assert max(ds.lines) - min(ds.lines) <= 1 + sum(len(want[fn]) for fn in all_files if fn.endswith(".gz"))
+
+	jid = subjobs.build("csvimport", options=dict(opts, as_chain=True))
+	chain = Dataset(jid).chain()
+	assert len(chain) == len(all_files)
+	assert sorted(Dataset(jid).iterate_chain(None, ["a", "b", "fn", "lineno"])) == expected(all_files)
+	for ds, filename in zip(chain, all_files):
+		assert ds.filename == filename
+		assert got(ds) == expected([filename])
+		if filename.endswith(".gz"):
+			# Compressed files are in a single slice.
+			assert sorted(ds.lines)[:-1] == [0] * (slices - 1)
+
+	jid = subjobs.build("csvimport", options=dict(opts, filename=all_files[0], extra_filenames=all_files[-1:], filename_column=""))
+	assert got(Dataset(jid), ("a", "b")) == [t[:2] for t in expected([all_files[0], all_files[-1]])]
+
+	try:
+		subjobs.build("csvimport", options=dict(opts, extra_filenames=[job.filename("other labels.txt")]))
+	except JobError:
+		pass
+	else:
+		raise Exception("Importing files with different labels did not fail")
+	jid = subjobs.build("csvimport", options=dict(opts, extra_filenames=[job.filename("other labels.txt")], labels=["a", "b"]))
+	assert (b"1", b"2", job.filename("other labels.txt"), 2) in got(Dataset(jid))
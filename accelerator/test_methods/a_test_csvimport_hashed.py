@@ -0,0 +1,94 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+description = r'''
+Verify csvimport with hashlabel puts lines in the slice the bytes writer
+hashes them to.
+'''
+
+from gzip import GzipFile
+
+from accelerator import subjobs
+from accelerator.dataset import Dataset
+from accelerator.gzwrite import typed_writer
+
+def check(slices, jid, want_lines, hashlabel="h"):
+	ds = Dataset(jid)
+	assert ds.hashlabel == hashlabel
+	hash = typed_writer("bytes").hash
+	got_lines = []
+	for sliceno in range(slices):
+		for line in ds.iterate(sliceno, ["h", "v"]):
+			assert hash(line[0]) % slices == sliceno, "%r is in slice %d of %s" % (line, sliceno, ds,)
+			got_lines.append(line)
+	assert sorted(got_lines) == sorted(want_lines), "%s doesn't have the right lines" % (ds,)
+
+def synthesis(job, slices):
+	lines = [b"v,h"]
+	want = []
+	for ix in range(1000):
+		h = b"%d" % (ix % 37,)
+		if ix % 7 == 0:
+			lines.append(b'%d,"%s"' % (ix, h,))
+		elif ix % 11 == 0:
+			h = b'q"' + h
+			lines.append(b'%d,"q""%s"' % (ix, h[2:],))
+		elif ix % 13 == 0:
+			h = b""
+			lines.append(b"%d," % (ix,))
+		else:
+			lines.append(b"%d,%s" % (ix, h,))
+		want.append((h, b"%d" % (ix,)))
+	lines.append(b"bad line")
+	lines.append(b"#comment")
+	data = b"\n".join(lines) + b"\n"
+	with open("data.txt", "wb") as fh:
+		fh.write(data)
+	with GzipFile("data.gz", "wb") as fh:
+		fh.write(data)
+	opts = dict(hashlabel="h", quotes=True, allow_bad=True, comment="#")
+	for filename in ("data.txt", "data.gz"):
+		jid = subjobs.build("csvimport", options=dict(opts, filename=job.filename(filename)))
+		check(slices, jid, want)
+		assert sum(Dataset(jid, "bad").lines) == 1
+		assert sum(Dataset(jid, "skipped").lines) == 1
+	jid = subjobs.build("csvimport", options=dict(opts, filename=job.filename("data.txt"), extra_filenames=[job.filename("data.gz")], lineno_label="lineno", filename_column="fn"))
+	check(slices, jid, want + want)
+	# Each line keeps its lineno and file, in order within each slice.
+	for sliceno in range(slices):
+		prev = {}
+		for v, lineno, fn in Dataset(jid).iterate(sliceno, ["v", "lineno", "fn"]):
+			assert lineno == int(v) + 2, "%s has line %s on lineno %d" % (jid, v, lineno,)
+			assert lineno > prev.get(fn, 0), "%s has lines out of order in slice %d" % (jid, sliceno,)
+			prev[fn] = lineno
+	for dsname, lineno in (("bad", 1002), ("skipped", 1003)):
+		got = sorted(Dataset(jid, dsname).iterate(None, ["lineno", "filename"]))
+		assert got == [(lineno, job.filename("data.gz")), (lineno, job.filename("data.txt"))], "%s/%s has %r" % (jid, dsname, got,)
+	# Works with renames and other columns typed too.
+	jid = subjobs.build("csvimport", options=dict(opts, filename=job.filename("data.txt"), rename=dict(h="x"), hashlabel="x", column2type=dict(v="int32_10")))
+	ds = Dataset(jid)
+	assert ds.hashlabel == "x"
+	hash = typed_writer("bytes").hash
+	for sliceno in range(slices):
+		for h in ds.iterate(sliceno, "x"):
+			assert hash(h) % slices == sliceno
+	assert sorted(ds.iterate(None, "v")) == list(range(1000))
@@ -0,0 +1,90 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+description = r'''
+Verify that csvimport gets the same lines (with the same lineno) when
+splitting an uncompressed file between the slices as when reading a
+compressed file through the reader process. Each slice should have
+consecutive lines from the uncompressed file.
+'''
+
+from gzip import GzipFile
+
+from accelerator import subjobs
+from accelerator.dataset import Dataset
+
+def import_both(job, name, data, **options):
+	with open(name + ".txt", "wb") as fh:
+		fh.write(data)
+	with GzipFile(name + ".gz", "wb") as fh:
+		fh.write(data)
+	res = []
+	for ext in (".txt", ".gz"):
+		opts = dict(options, filename=job.filename(name + ext))
+		res.append(Dataset(subjobs.build("csvimport", options=opts)))
+	return res
+
+def compare(a, b, columns):
+	# The slicing differs (ranges vs round robin), but not the lines.
+	assert sorted(a.columns) == sorted(b.columns), "%s and %s have different columns" % (a, b)
+	a_data = sorted(a.iterate(None, columns))
+	b_data = sorted(b.iterate(None, columns))
+	assert a_data == b_data, "%s and %s differ:\n%r\n%r" % (a, b, a_data, b_data)
+
+def check_consecutive(ds, lineno_label):
+	linenos = list(ds.iterate(None, lineno_label))
+	assert linenos == sorted(linenos), "%s doesn't have consecutive lines in each slice: %r" % (ds, linenos,)
+
+def check(job, name, data, **options):
+	plain, compressed = import_both(job, name, data, **options)
+	compare(plain, compressed, sorted(plain.columns))
+	if options.get("lineno_label"):
+		check_consecutive(plain, options["lineno_label"])
+	for dsname in ("bad", "skipped"):
+		if options.get("allow_bad" if dsname == "bad" else "comment") or (dsname == "skipped" and options.get("skip_lines")):
+			compare(Dataset(plain.jobid, dsname), Dataset(compressed.jobid, dsname), ["lineno", "data"])
+			check_consecutive(Dataset(plain.jobid, dsname), "lineno")
+	return plain
+
+def synthesis(job, slices):
+	lines = [b"# leading comment", b"#another", b"a,b"]
+	for ix in range(1, 1000):
+		if ix % 17 == 0:
+			lines.append(b"#" + str(ix).encode("ascii"))
+		elif ix % 23 == 0:
+			lines.append(b"bad")
+		else:
+			lines.append(str(ix).encode("ascii") + b",\"x\"\"" + str(ix).encode("ascii") + b"\"")
+	data = b"\n".join(lines) + b"\n"
+	ds = check(job, "everything", data, comment="#", allow_bad=True, quotes=True, lineno_label="lineno")
+	got = sorted(int(a) for a in ds.iterate(None, "a"))
+	want = [ix for ix in range(1, 1000) if ix % 17 and ix % 23]
+	assert got == want, "%s has the wrong lines" % (ds,)
+	if slices > 1:
+		assert len([n for n in ds.lines if n]) > 1, "%s has all lines in one slice: %r" % (ds, ds.lines,)
+	for a, lineno in ds.iterate(None, ["a", "lineno"]):
+		assert int(a) + 3 == lineno, "%s has line %s on lineno %d" % (ds, a, lineno,)
+	check(job, "skip_lines", data, skip_lines=5, comment="#", allow_bad=True, quotes=True, lineno_label="lineno")
+	check(job, "no labels", b"\r\n".join(lines[3:]), labelsonfirstline=False, labels=["a", "b"], allow_bad=True, lineno_label="lineno")
+	check(job, "only comments", b"#a\n#b\n#c\n", comment="#", labels=["a"])
+	check(job, "no final newline", b"a\n1\n2\n3", lineno_label="lineno")
+	check(job, "other newline", b"a;1;2;3;4;5;", newline=";", lineno_label="lineno")
@@ -0,0 +1,96 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+description = r'''
+Verify csvimport with column2type against csvimport + dataset_type.
+'''
+
+from gzip import GzipFile
+
+from accelerator import subjobs
+from accelerator import blob
+from accelerator.dispatch import JobError
+from accelerator.dataset import Dataset
+
+column2type = {"a": "int32_10", "b": "float64", "c": "date:%Y-%m-%d", "j": "json"}
+
+def compare(slices, a, b):
+	columns = sorted(a.columns)
+	assert columns == sorted(b.columns), "%s and %s have different columns" % (a, b,)
+	for colname in columns:
+		a_col, b_col = a.columns[colname], b.columns[colname]
+		assert (a_col.type, a_col.min, a_col.max) == (b_col.type, b_col.min, b_col.max), "%s and %s differ in column %s" % (a, b, colname,)
+	assert a.lines == b.lines, "%s and %s have different lines" % (a, b,)
+	for sliceno in range(slices):
+		a_data = list(a.iterate(sliceno, columns))
+		b_data = list(b.iterate(sliceno, columns))
+		assert a_data == b_data, "Slice %d differs between %s and %s" % (sliceno, a, b,)
+
+def check(job, slices, filename, **options):
+	filename = job.filename(filename)
+	typeopts = dict(column2type=column2type)
+	for k in ("defaults", "filter_bad"):
+		if k in options:
+			typeopts[k] = options.pop(k)
+	typed = subjobs.build("csvimport", options=dict(options, filename=filename, **typeopts))
+	imported = subjobs.build("csvimport", options=dict(options, filename=filename))
+	want = subjobs.build("dataset_type", datasets=dict(source=imported), options=typeopts)
+	compare(slices, Dataset(typed), Dataset(want))
+	return typed
+
+def synthesis(job, slices):
+	lines = [b"a,b,c,d,j"]
+	for ix in range(2000):
+		lines.append(b"%d,%d.5,2019-%02d-%02d,x%d,[%d]" % (ix, ix, ix % 12 + 1, ix % 28 + 1, ix, ix,))
+	data = b"\n".join(lines) + b"\n"
+	with open("good.txt", "wb") as fh:
+		fh.write(data)
+	with GzipFile("good.gz", "wb") as fh:
+		fh.write(data)
+	check(job, slices, "good.txt", lineno_label="lineno")
+	check(job, slices, "good.gz", lineno_label="lineno")
+	bad_lines = list(lines)
+	bad_lines[10] = b"bad,1,2019-01-01,x,[]"
+	bad_lines[20] = b"20,1.5,not a date,x,[]"
+	bad_lines[30] = b"30,1.5,2019-01-01,x,[unterminated"
+	with open("bad.txt", "wb") as fh:
+		fh.write(b"\n".join(bad_lines) + b"\n")
+	try:
+		subjobs.build("csvimport", options=dict(filename=job.filename("bad.txt"), column2type=column2type))
+	except JobError:
+		pass
+	else:
+		raise Exception("csvimport with unconvertible values did not fail")
+	jid = check(job, slices, "bad.txt", filter_bad=True)
+	assert blob.load("import", jobid=jid).num_filtered_lines == 3
+	ds = Dataset(subjobs.build("csvimport", options=dict(filename=job.filename("bad.txt"), column2type=column2type, filter_bad=True, lineno_label="lineno", filename_column="fn")))
+	got = sorted(ds.iterate(None, ["lineno", "a", "fn"]))
+	assert got == [(ix + 2, ix, job.filename("bad.txt")) for ix in range(2000) if ix + 1 not in (10, 20, 30)], "Filtering lost track of lineno"
+	check(job, slices, "bad.txt", defaults={"a": "-1", "c": "1970-01-01", "j": "null"})
+	# Several files, with different labels as separate datasets.
+	with open("other.txt", "wb") as fh:
+		fh.write(b"j,b,a,c\n[1],2,3,2019-12-31\n")
+	ds = Dataset(subjobs.build("csvimport", options=dict(filename=job.filename("good.txt"), extra_filenames=[job.filename("other.txt")], column2type=column2type, as_chain=True)))
+	assert list(ds.iterate(None, ["a", "b", "j"])) == [(3, 2.0, [1])]
+	first = Dataset(ds.previous)
+	assert first.columns["a"].type == "int32"
+	assert sum(first.lines) == 2000
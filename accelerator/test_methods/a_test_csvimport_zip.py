@@ -103,3 +103,19 @@ def synthesis():
 	verify('named default.zip', {}, {'default': list_b})
 	# Use inside_filenames to test this again in a different way.
 	verify('a.zip', {'a': 'default'}, {'default': list_a})
+	# All files as one dataset.
+	jid = subjobs.build('csvimport_zip', options=dict(filename=g.job.filename('both, b compressed.zip'), one_dataset=True))
+	assert sorted(Dataset(jid).iterate(None, '0')) == sorted(list_a + list_b)
+	assert Dataset(jid).previous is None
+	# Chained files can have different labels.
+	with ZipFile('different labels.zip', 'w') as z:
+		z.writestr('a', file_a)
+		z.writestr('c', compress(b'1\nbaz\n'))
+	jid = subjobs.build('csvimport_zip', options=dict(filename=g.job.filename('different labels.zip')))
+	a, c = Dataset(jid, 'a'), Dataset(jid, 'c')
+	assert c.chain() == [a, c]
+	assert Dataset(jid).chain() == [a, Dataset(jid)]
+	assert list(a.iterate(None, '0')) == list_a
+	assert list(c.iterate(None, '1')) == [b'baz']
+	jid = subjobs.build('csvimport_zip', options=dict(filename=g.job.filename('different labels.zip'), chaining='off'))
+	assert Dataset(jid, 'c').chain() == [Dataset(jid, 'c')]
@@ -26,7 +26,9 @@ Test dataset_checksum[_chain].
 
 from accelerator.dataset import DatasetWriter
 from accelerator import subjobs
+from accelerator.dispatch import JobError
 from accelerator import blob
+from .test_data import data as type_data, not_none_capable
 
 test_data = [
 	(b"a", 0.42, 18, [1, 2, 3], u"a"),
@@ -68,7 +70,71 @@ def ck(jid, method="dataset_checksum", **kw):
 	jid = subjobs.build(method, datasets=dict(source=jid), options=kw)
 	return blob.load(jobid=jid).sum
 
-def synthesis(prepare_res):
+def check_incremental_chain(a, b, c, slices):
+	# c is not part of the a, b chain, so make a longer chain with it.
+	dw = DatasetWriter(name="d", columns={k: v.type for k, v in c.columns.items()}, previous=b)
+	for sliceno in range(slices):
+		dw.set_slice(sliceno)
+		for line in c.iterate(sliceno, sorted(c.columns)):
+			dw.write_list(line)
+	d = dw.finish()
+	for kw in (dict(), dict(sort=False), dict(hash_sum=True), dict(columns={"int"})):
+		want = ck(d, "dataset_checksum_chain", **kw)
+		prev = subjobs.build("dataset_checksum_chain", datasets=dict(source=a), options=kw)
+		assert blob.load(jobid=prev).sum == ck(a, **kw)
+		prev = subjobs.build("dataset_checksum_chain", datasets=dict(source=b), jobids=dict(previous=prev), options=kw)
+		assert blob.load(jobid=prev).sum == ck(b, "dataset_checksum_chain", **kw)
+		jid = subjobs.build("dataset_checksum_chain", datasets=dict(source=d), jobids=dict(previous=prev), options=kw)
+		res = blob.load(jobid=jid)
+		assert res.sum == want, "incremental chain checksum %r differs" % (kw,)
+		assert res.sources == [a, b, d]
+		assert res.sum == ck(a, **kw) ^ ck(b, **kw) ^ ck(d, **kw)
+	# the source of previous must be in the chain
+	prev = subjobs.build("dataset_checksum_chain", datasets=dict(source=c))
+	try:
+		subjobs.build("dataset_checksum_chain", datasets=dict(source=d), jobids=dict(previous=prev))
+		raise Exception("incremental chain checksum with unrelated previous did not fail")
+	except JobError:
+		pass
+	# previous must have been made with the same options
+	try:
+		subjobs.build("dataset_checksum_chain", datasets=dict(source=d), jobids=dict(previous=jid), options=dict(sort=False))
+		raise Exception("incremental chain checksum with other options did not fail")
+	except JobError:
+		pass
+
+def check_hash_sum(a, b, c, slices):
+	a_sum = ck(a, hash_sum=True)
+	b_sum = ck(b, hash_sum=True)
+	c_sum = ck(c, hash_sum=True)
+	assert a_sum == b_sum # only order differs
+	assert c_sum == a_sum * 2 % (1 << 128) # each line twice in c
+	assert a_sum != ck(a) # not the same kind of sum
+	assert ck(a, hash_sum=True, columns={"int", "json"}) != a_sum
+	res = blob.load(jobid=subjobs.build("dataset_checksum", datasets=dict(source=c), options=dict(hash_sum=True)))
+	assert len(res.slice_sums) == slices
+	assert res.slice_sums[2:] == [0] * (slices - 2) # empty slices
+	assert sum(res.slice_sums) % (1 << 128) == c_sum
+	# all types, with differing slicing and order
+	columns = {k: k for k in type_data}
+	lines = list(zip(*[type_data[k] for k in sorted(columns)]))
+	lines += [tuple(None if k not in not_none_capable else v for k, v in zip(sorted(columns), lines[0]))]
+	x = DatasetWriter(name="types_x", columns=columns)
+	y = DatasetWriter(name="types_y", columns=columns)
+	for sliceno in range(slices):
+		x.set_slice(sliceno)
+		for line in lines[sliceno::slices]:
+			x.write_list(line)
+		y.set_slice(sliceno)
+		if sliceno == slices - 1:
+			for line in reversed(lines):
+				y.write_list(line)
+	x = x.finish()
+	y = y.finish()
+	assert ck(x, hash_sum=True) == ck(y, hash_sum=True)
+	assert ck(x, hash_sum=True) != ck(x, hash_sum=True, columns=set(columns) - {"number"})
+
+def synthesis(prepare_res, params):
 	a, b, c = prepare_res
 	a = a.finish()
 	b = b.finish()
@@ -87,3 +153,5 @@ def synthesis(prepare_res):
 	a_uns_sum = ck(a, sort=False)
 	b_uns_sum = ck(b, sort=False)
 	assert a_uns_sum != b_uns_sum # they are not the same order
+	check_hash_sum(a, b, c, params.slices)
+	check_incremental_chain(a, b, c, params.slices)
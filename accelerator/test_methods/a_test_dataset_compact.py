@@ -0,0 +1,86 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+description = r'''
+Verify the dataset_compact method, both with merged (small) and
+separate (big) slice files in the chain.
+'''
+
+from random import Random
+
+from accelerator import subjobs
+from accelerator.dataset import DatasetWriter, Dataset
+from accelerator.dispatch import JobError
+
+def write(name, previous, columns, rows):
+	dw = DatasetWriter(name=name, columns=columns, previous=previous, hashlabel="num")
+	w = dw.get_split_write_dict()
+	names = ["num", "txt", "data", "extra"]
+	for row in rows:
+		w(dict(zip(names, row)))
+	return dw.finish()
+
+def check(source, previous=None, **options):
+	jid = subjobs.build("dataset_compact", datasets=dict(source=source, previous=previous), options=options)
+	return Dataset(jid)
+
+def synthesis(params):
+	r = Random(42)
+	small = [(ix, str(ix), b"small") for ix in range(1000)]
+	# Random data doesn't compress, so this is too big to be merged.
+	big = [(ix, str(ix), bytes(bytearray(r.randrange(256) for _ in range(200)))) for ix in range(-10000, 0)]
+	columns = {"num": "int32", "txt": "ascii", "data": "bytes"}
+	a = write("a", None, columns, small)
+	b = write("b", a, columns, big)
+	assert a.columns["data"].offsets, "%s should have merged slices" % (a,)
+	assert not b.columns["data"].offsets, "%s should not have merged slices" % (b,)
+	c_columns = dict(columns, extra="int64")
+	c = write("c", b, c_columns, [(7, "7", b"c", 7)])
+	ds = check(c)
+	assert sorted(ds.columns) == ["data", "num", "txt"], ds.columns
+	assert ds.hashlabel == "num"
+	assert ds.previous is None
+	assert ds.lines == [sum(lines) for lines in zip(a.lines, b.lines, c.lines)]
+	assert ds.columns["num"].min == -10000 and ds.columns["num"].max == 999
+	names = ["num", "txt", "data"]
+	for sliceno in range(params.slices):
+		want = list(c.iterate_chain(sliceno, names))
+		got = list(ds.iterate(sliceno, names))
+		assert got == want, "Slice %d of %s differs from %s" % (sliceno, ds, c)
+	# Only the part after previous
+	prev = check(b)
+	ds = check(c, prev)
+	assert ds.chain() == [prev, ds], ds.chain()
+	assert ds.lines == c.lines
+	assert list(ds.iterate(None, "extra")) == [7]
+	# When the hashlabel is one of the dropped columns there is no hashlabel
+	d = write("d", c, dict(columns, num="int64"), [(8, "8", b"d")])
+	ds = check(d)
+	assert sorted(ds.columns) == ["data", "txt"], ds.columns
+	assert ds.hashlabel is None
+	assert sorted(ds.iterate(None, "txt")) == sorted(d.iterate_chain(None, "txt"))
+	# Mismatching columns are an error with column_mismatch=fail
+	try:
+		check(c, column_mismatch="fail")
+	except JobError:
+		return
+	raise Exception("dataset_compact with column_mismatch=fail did not fail on mismatching columns")
@@ -0,0 +1,97 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+description = r'''
+Verify the dataset_dedup method, on the hashlabel and on other columns
+(rehashing), keeping first and last, with a tiny memory_budget, and
+with previous (also two steps back).
+'''
+
+from json import dumps
+
+from accelerator import subjobs
+from accelerator.dataset import DatasetWriter, Dataset
+
+columns = {"id": "int64", "name": "unicode", "val": "float64", "j": "json"}
+names = sorted(columns)
+
+def write(name, previous, lines):
+	dw = DatasetWriter(name=name, columns=columns, previous=previous, hashlabel="id")
+	w = dw.get_split_write_dict()
+	for line in lines:
+		w(dict(zip(["id", "name", "val", "j"], line)))
+	return dw.finish()
+
+def mklines(start, count):
+	for ix in range(start, start + count):
+		# -1 and -2 have the same hash in CPython.
+		yield (ix % 300 - 2, "name %d" % (ix % 70,), float(ix % 3), {"a": ix % 2})
+
+def dedup(source, previous=None, **options):
+	jid = subjobs.build("dataset_dedup", datasets=dict(source=source, previous=previous), options=options)
+	return Dataset(jid)
+
+def fmt(line):
+	return tuple(dumps(v, sort_keys=True) if n == "j" else v for n, v in zip(names, line))
+
+def expected(ds_list, slices, key, keep, already=()):
+	"""The unique lines, in the order dedup sees them (per dataset, per slice)."""
+	ixes = [names.index(n) for n in sorted(key or names)]
+	res = {}
+	for ds in ds_list:
+		for sliceno in range(slices):
+			for line in ds.iterate(sliceno, names):
+				line = fmt(line)
+				k = tuple(line[ix] for ix in ixes)
+				if k in already:
+					continue
+				if keep == "last" or k not in res:
+					res[k] = line
+	return sorted(res.values())
+
+def check(ds, want, hashlabel):
+	got = sorted(fmt(line) for line in ds.iterate(None, names))
+	assert got == want, "%s: %d lines, expected %d (or different ones)" % (ds, len(got), len(want),)
+	assert ds.hashlabel == hashlabel, "%s hashed on %s, not %s" % (ds, ds.hashlabel, hashlabel,)
+
+def synthesis(params):
+	a = write("a", None, mklines(0, 1000))
+	b = write("b", a, mklines(1000, 1000))
+	ds_list = [a, b]
+	for key, hashlabel in (({"id"}, "id"), ({"name"}, "name"), (set(), "id"), ({"name", "j"}, "name"), ({"val", "j"}, "val")):
+		for keep in ("first", "last"):
+			want = expected(ds_list, params.slices, key, keep)
+			check(dedup(b, columns=key, keep=keep), want, hashlabel)
+			check(dedup(b, columns=key, keep=keep, memory_budget=64 * 7), want, hashlabel)
+	c = write("c", b, mklines(500, 2000))
+	for key, hashlabel in (({"id"}, "id"), ({"name"}, "name"), ({"name", "j"}, "name")):
+		for memory_budget in (0, 64 * 7):
+			prev = dedup(a, columns=key, memory_budget=memory_budget)
+			ds = dedup(b, previous=prev, columns=key, memory_budget=memory_budget)
+			ixes = [names.index(n) for n in sorted(key)]
+			already = set(tuple(fmt(line)[ix] for ix in ixes) for line in prev.iterate(None, names))
+			check(ds, expected([b], params.slices, key, "first", already), hashlabel)
+			assert Dataset(ds.previous) == prev
+			# This one uses the keys ds saved (which includes those from prev).
+			ds2 = dedup(c, previous=ds, columns=key, memory_budget=memory_budget)
+			already.update(tuple(fmt(line)[ix] for ix in ixes) for line in ds.iterate(None, names))
+			check(ds2, expected([c], params.slices, key, "first", already), hashlabel)
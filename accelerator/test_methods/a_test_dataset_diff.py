@@ -0,0 +1,101 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+description = r'''
+Verify the dataset_diff method, keyed (on the hashlabel and rehashed)
+and on whole lines.
+'''
+
+from accelerator import subjobs, blob
+from accelerator.dataset import DatasetWriter, Dataset
+from accelerator.dispatch import JobError
+
+columns = {"id": "int64", "name": "unicode", "price": "float64"}
+names = sorted(columns)
+
+def write(name, lines, hashlabel="id"):
+	dw = DatasetWriter(name=name, columns=columns, hashlabel=hashlabel)
+	w = dw.get_split_write_dict()
+	for line in lines:
+		w(dict(zip(["id", "name", "price"], line)))
+	return dw.finish()
+
+def lines(ds):
+	return sorted(ds.iterate(None, names))
+
+def diff(old, new, **options):
+	jid = subjobs.build("dataset_diff", datasets=dict(old=old, new=new), options=options)
+	return blob.load(jobid=jid), {name: Dataset(jid, name) for name in ("added", "removed", "changed")}
+
+def synthesis(params):
+	old_lines = [(ix, "item %d" % (ix,), ix * 1.5) for ix in range(1000)]
+	new_lines = []
+	for ix, name, price in old_lines:
+		if ix % 10 == 3:
+			continue # removed
+		if ix % 10 == 5:
+			price += 1 # changed
+		if ix % 10 == 7:
+			name = name.upper() # changed
+		new_lines.append((ix, name, price))
+	new_lines.extend((ix, "new %d" % (ix,), 0.5) for ix in range(1000, 1100)) # added
+	by_id = lambda lst: {line[0]: line for line in lst}
+	old_by_id, new_by_id = by_id(old_lines), by_id(new_lines)
+	want_added = sorted(line for ix, line in new_by_id.items() if ix not in old_by_id)
+	want_removed = sorted(line for ix, line in old_by_id.items() if ix not in new_by_id)
+	want_changed = sorted(line for ix, line in new_by_id.items() if ix in old_by_id and old_by_id[ix] != line)
+
+	old = write("old", old_lines)
+	new = write("new", new_lines)
+	old_name = write("old_name", old_lines, hashlabel="name")
+	for key, old_ds, hashlabel in (({"id"}, old, "id"), ({"id"}, old_name, "id"), ({"name"}, old, "name")):
+		res, ds = diff(old_ds, new, key=key)
+		for name in ("added", "removed", "changed"):
+			assert ds[name].hashlabel == hashlabel, "%s hashed on %s, not %s" % (ds[name], ds[name].hashlabel, hashlabel,)
+		if key == {"name"}:
+			# renames are removed + added, price changes are changed
+			assert res.changed == 100 and res.added == 200 and res.removed == 200, res
+			continue
+		assert lines(ds["added"]) == want_added
+		assert lines(ds["removed"]) == want_removed
+		assert lines(ds["changed"]) == want_changed
+		assert res == dict(added=len(want_added), removed=len(want_removed), changed=len(want_changed), unchanged=len(new_lines) - len(want_added) - len(want_changed)), res
+
+	# Only comparing price, so name changes don't count.
+	res, ds = diff(old, new, key={"id"}, columns={"price"})
+	assert res.changed == 100 and res.removed == 100 and res.added == 100, res
+
+	# Whole lines, with a duplicate line in new.
+	new_dup = write("new_dup", new_lines + new_lines[:1])
+	res, ds = diff(old, new_dup)
+	assert lines(ds["added"]) == sorted(want_added + want_changed + new_lines[:1])
+	assert lines(ds["removed"]) == sorted(want_removed + [line for line in old_lines if line[0] % 10 in (5, 7)])
+	assert sum(ds["changed"].lines) == 0
+	assert res == dict(added=301, removed=300, changed=0, unchanged=700), res
+
+	# Duplicate keys are an error.
+	try:
+		diff(old, new_dup, key={"id"})
+	except JobError:
+		pass
+	else:
+		raise Exception("dataset_diff accepted duplicate keys")
@@ -0,0 +1,111 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+description = r'''
+Verify the dataset_sample method, in all modes, stratified or not,
+with and without previous.
+'''
+
+from collections import Counter
+
+from accelerator import subjobs
+from accelerator.dataset import DatasetWriter, Dataset
+
+columns = {"ix": "int64", "group": "ascii", "f": "float64", "txt": "unicode", "num": "number", "j": "json"}
+
+def write(name, previous, start, count):
+	dw = DatasetWriter(name=name, columns=columns, previous=previous, hashlabel="ix")
+	w = dw.get_split_write_dict()
+	for ix in range(start, start + count):
+		line = dict(ix=ix, group="g%d" % (ix % 5 if ix % 3 else 5,), f=ix / 7, txt="\xe5 %d" % (ix,), num=ix * 10 ** 20 if ix % 2 else ix, j=[ix])
+		w(line)
+	return dw.finish()
+
+def sample(source, previous=None, **options):
+	jid = subjobs.build("dataset_sample", datasets=dict(source=source, previous=previous), options=options)
+	return Dataset(jid)
+
+def check(ds, source, slices):
+	"""ds has lines from source (chain), in the same slice and order."""
+	names = sorted(columns)
+	src_lines = {}
+	for sliceno in range(slices):
+		for line in source.iterate_chain(sliceno, names, stop_ds={Dataset(ds.previous).jobid: 'source'} if ds.previous else None):
+			src_lines[line[names.index("ix")]] = (sliceno, line)
+	got = []
+	for sliceno in range(slices):
+		prev_ix = None
+		for line in ds.iterate(sliceno, names):
+			ix = line[names.index("ix")]
+			assert src_lines[ix] == (sliceno, line), "%s: line %r from the wrong slice or changed" % (ds, line,)
+			if prev_ix is not None:
+				assert prev_ix < ix, "%s: lines out of order in slice %d" % (ds, sliceno,)
+			prev_ix = ix
+			got.append(line)
+	for n in names:
+		if n == "j":
+			continue
+		values = [line[names.index(n)] for line in got]
+		want = (min(values), max(values)) if values else (None, None)
+		assert (ds.columns[n].min, ds.columns[n].max) == want, "%s: bad minmax for %s: %r != %r" % (ds, n, (ds.columns[n].min, ds.columns[n].max), want,)
+	return got
+
+def groups(lines):
+	return Counter(line[sorted(columns).index("group")] for line in lines)
+
+def synthesis(params):
+	a = write("a", None, 0, 3000)
+	b = write("b", a, 3000, 7000)
+	# with only two lines most slices are empty
+	c = write("c", b, 10000, 2)
+	total = 10002
+
+	ds = sample(c, fraction=0.1)
+	lines = check(ds, c, params.slices)
+	assert 0.07 * total < len(lines) < 0.13 * total, "%d lines sampled with fraction=0.1 of %d" % (len(lines), total,)
+	assert ds.hashlabel == "ix"
+	assert sample(c, fraction=0.1) == ds, "Not the same job"
+	assert sum(sample(c, fraction=0).lines) == 0
+	assert len(check(sample(c, fraction=0), c, params.slices)) == 0
+	assert len(check(sample(c, fraction=1), c, params.slices)) == total
+	# 1.0 - fraction is 1.0 for these, and the gaps don't fit in an int.
+	for fraction in (1e-17, 1e-300):
+		assert len(check(sample(c, fraction=fraction), c, params.slices)) == 0
+
+	for count in (0, 1, 100, 2000, total, total + 10):
+		ds = sample(c, mode="reservoir", count=count)
+		assert sum(ds.lines) == min(count, total), "%s: %d lines, not %d" % (ds, sum(ds.lines), min(count, total),)
+		check(ds, c, params.slices)
+
+	in_source = groups(line for sliceno in range(params.slices) for line in c.iterate_chain(sliceno, sorted(columns)))
+	ds = sample(c, mode="reservoir", count=100, stratify="group")
+	assert groups(check(ds, c, params.slices)) == {k: min(v, 100) for k, v in in_source.items()}
+	ds = sample(c, fraction=0.01, stratify="group")
+	assert groups(check(ds, c, params.slices)) == {k: int(round(v * 0.01)) for k, v in in_source.items() if int(round(v * 0.01))}
+
+	# Only the lines in b with previous.
+	prev = sample(a, mode="reservoir", count=50)
+	ds = sample(b, previous=prev, mode="reservoir", count=50)
+	assert Dataset(ds.previous) == prev
+	lines = check(ds, b, params.slices)
+	assert len(lines) == 50
+	assert all(line[sorted(columns).index("ix")] >= 3000 for line in lines)
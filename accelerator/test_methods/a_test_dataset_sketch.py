@@ -0,0 +1,126 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+description = r'''
+Verify the dataset_sketch method (and accelerator.sketch), grouped and
+not, against exact quantiles and counts.
+'''
+
+from random import Random
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict
+from datetime import date
+
+from accelerator import subjobs, blob
+from accelerator.dataset import DatasetWriter
+from accelerator.sketch import QuantileSketch, TopK
+
+columns = {"x": "float64", "n": "int64", "g": "ascii", "d": "date", "s": "unicode", "j": "json"}
+
+def write(name, previous, rnd, count):
+	dw = DatasetWriter(name=name, columns=columns, previous=previous)
+	w = dw.get_split_write_dict()
+	for ix in range(count):
+		g = rnd.choice("aab")
+		w(dict(
+			x=rnd.gauss(10 if g == "a" else -10, 1) if ix % 100 else None,
+			n=int(1 / (rnd.random() ** 1.2)),
+			g=g,
+			d=date(2019, rnd.randint(1, 12), rnd.randint(1, 28)),
+			s=rnd.choice(["common"] * 20 + ["x%d" % (rnd.randint(0, 10000),)]),
+			j={"ix": ix},
+		))
+	return dw.finish()
+
+def check_quantiles(sketch, values, k):
+	values = sorted(v for v in values if v is not None)
+	assert sketch.count == len(values), "%r: count %d != %d" % (sketch, sketch.count, len(values),)
+	assert sketch.min == values[0] and sketch.max == values[-1], "%r: bad min/max" % (sketch,)
+	assert sketch.quantile(0) == values[0] and sketch.quantile(1) == values[-1]
+	for q in (0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99):
+		v = sketch.quantile(q)
+		# With many equal values any rank in the range is right.
+		lo = bisect_left(values, v) / len(values)
+		hi = bisect_right(values, v) / len(values)
+		err = max(lo - q, q - hi, 0)
+		assert err < 4 / k, "%r: quantile(%r) = %r has rank %r-%r" % (sketch, q, v, lo, hi,)
+
+def check_top(top, values, counters):
+	want = Counter(values)
+	total = sum(want.values())
+	assert top.count == total
+	assert top.error <= total / (counters + 1)
+	got = dict(top.top())
+	for v, c in want.items():
+		if c > total / (counters + 1):
+			assert v in got, "%r: %r (%d times) missing" % (top, v, c,)
+		if v in got:
+			assert c - top.error <= got[v] <= c, "%r: %r counted as %d, not %d" % (top, v, got[v], c,)
+
+def check(res, lines, k, counters):
+	for n in ("x", "n", "d", "s"):
+		values = [line[n] for line in lines]
+		check_quantiles(res[n].quantiles, values, k)
+		check_top(res[n].top, values, counters)
+	assert res.x.quantiles.skipped == sum(1 for line in lines if line["x"] is None)
+
+def synthesis(params):
+	rnd = Random(17)
+	a = write("a", None, rnd, 20000)
+	b = write("b", a, rnd, 30000)
+	names = sorted(columns)
+	lines = [dict(zip(names, line)) for line in b.iterate_chain(None, names)]
+
+	for k, counters in ((200, 100), (50, 20)):
+		jid = subjobs.build("dataset_sketch", datasets=dict(source=b), options=dict(k=k, counters=counters))
+		res = blob.load(jobid=jid)
+		assert sorted(res) == ["d", "g", "n", "s", "x"], sorted(res)
+		check(res, lines, k, counters)
+
+	jid = subjobs.build("dataset_sketch", datasets=dict(source=b, stop=a), options=dict(columns={"x", "n"}))
+	res = blob.load(jobid=jid)
+	assert sorted(res) == ["n", "x"]
+	assert res.x.quantiles.count + res.x.quantiles.skipped == sum(b.lines)
+
+	jid = subjobs.build("dataset_sketch", datasets=dict(source=b), options=dict(group_by="g", columns={"x", "n", "d", "s"}))
+	res = blob.load(jobid=jid)
+	groups = defaultdict(list)
+	for line in lines:
+		groups[line["g"]].append(line)
+	assert sorted(res) == sorted(groups)
+	for g, group_lines in groups.items():
+		check(res[g], group_lines, 200, 100)
+	assert res["a"].x.quantiles.quantile(0.5) > 5 and res["b"].x.quantiles.quantile(0.5) < -5
+
+	# Merging sketches of different parts gives about the same as one sketch.
+	values = [rnd.random() for _ in range(50000)]
+	merged = QuantileSketch(100)
+	merged_top = TopK(10)
+	for start in range(0, len(values), 7000):
+		part = QuantileSketch(100, start)
+		part.update(values[start:start + 7000])
+		merged.merge(part)
+		part = TopK(10)
+		part.update(int(v * 20) for v in values[start:start + 7000])
+		merged_top.merge(part)
+	check_quantiles(merged, values, 100)
+	check_top(merged_top, [int(v * 20) for v in values], 10)
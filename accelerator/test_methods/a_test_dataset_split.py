@@ -0,0 +1,126 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+description = r'''
+Verify the dataset_split method, with found values, given values,
+buckets, more values than open files and chained on previous.
+'''
+
+from collections import defaultdict
+
+from accelerator import subjobs, blob
+from accelerator.dataset import DatasetWriter, Dataset
+
+columns = {"id": "int64", "country": "unicode", "price": "float64"}
+names = sorted(columns)
+countries = ["se", "no", "dk", "fi", "is", "other", "a/b", ""]
+
+def write(name, previous, start, count):
+	dw = DatasetWriter(name=name, columns=columns, hashlabel="id", previous=previous)
+	w = dw.get_split_write_dict()
+	for ix in range(start, start + count):
+		# "se" is the most common, "" the least common.
+		country = countries[min(ix % 37, len(countries) - 1)] if ix % 37 < 8 else "se"
+		price = ix / 10 if ix % 50 else None
+		w(dict(id=ix, country=country, price=price))
+	return dw.finish()
+
+def lines(ds_list):
+	return sorted(Dataset.iterate_list(None, names, ds_list))
+
+def split(source, **options):
+	previous = options.pop("previous", None)
+	jid = subjobs.build("dataset_split", datasets=dict(source=source), jobids=dict(previous=previous), options=options)
+	return jid, blob.load(jobid=jid)
+
+def check(jid, res, want):
+	got = {}
+	for value, name in res.names.items():
+		got[value] = lines([Dataset(jid, name)])
+	if res.other:
+		got["OTHER"] = lines([Dataset(jid, res.other)])
+	want = {k: sorted(v) for k, v in want.items() if v or k != "OTHER"}
+	assert set(got) == set(want), "%r != %r" % (set(got), set(want),)
+	for k, v in want.items():
+		assert got[k] == v, "Wrong lines for %r" % (k,)
+	for name, count in res.lines.items():
+		ds = Dataset(jid, name)
+		assert sum(ds.lines) == count
+		assert ds.hashlabel == "id"
+		if count:
+			assert ds.columns["id"].min == min(line[1] for line in lines([ds]))
+
+def synthesis():
+	a = write("a", None, 0, 3000)
+	b = write("b", a, 3000, 2000)
+	all_lines = lines(b.chain())
+	by_country = defaultdict(list)
+	for line in all_lines:
+		by_country[line[0]].append(line)
+
+	# All values found.
+	jid, res = split(b, column="country")
+	assert res.other is None
+	assert res.names["a/b"] == "a_b" and res.names[""] == "_" and res.names["other"] == "other_1", res.names
+	check(jid, res, by_country)
+
+	# Only the three most common get their own dataset.
+	jid, res = split(b, column="country", max_outputs=3)
+	assert sorted(res.names) == ["dk", "no", "se"], res.names
+	want = {k: v for k, v in by_country.items() if k in res.names}
+	want["OTHER"] = [line for line in all_lines if line[0] not in res.names]
+	check(jid, res, want)
+
+	# Given values.
+	jid, res = split(b, column="country", split_values=["fi", "xx"])
+	want = dict(fi=by_country["fi"], xx=[])
+	want["OTHER"] = [line for line in all_lines if line[0] != "fi"]
+	check(jid, res, want)
+
+	# Buckets, with None in other.
+	jid, res = split(b, column="price", buckets=[100, 250.5])
+	assert sorted(res.names.values()) == ["100-250.5", "250.5-None", "None-100"], res.names
+	want = {
+		(None, 100): [line for line in all_lines if line[2] is not None and line[2] < 100],
+		(100, 250.5): [line for line in all_lines if line[2] is not None and 100 <= line[2] < 250.5],
+		(250.5, None): [line for line in all_lines if line[2] is not None and line[2] >= 250.5],
+		"OTHER": [line for line in all_lines if line[2] is None],
+	}
+	check(jid, res, want)
+
+	# More values than files that are kept open, so files are closed
+	# and appended to later (None is the most common price).
+	jid, res = split(a, column="price", max_outputs=70)
+	assert None in res.names and len(res.names) == 70, res.names
+	a_lines = lines([a])
+	want = {v: [line for line in a_lines if line[2] == v] for v in res.names}
+	want["OTHER"] = [line for line in a_lines if line[2] not in res.names]
+	check(jid, res, want)
+
+	# Chained on previous, each output is its own chain.
+	jid_a, res_a = split(a, column="country")
+	jid_b, res_b = split(b, column="country", previous=jid_a)
+	for value, name in res_b.names.items():
+		ds = Dataset(jid_b, name)
+		chain = ds.chain()
+		assert chain == [Dataset(jid_a, name), ds], chain
+		assert lines(chain) == sorted(by_country[value])
@@ -253,6 +253,12 @@ def test_datetimes():
 		('datetime mmmmmmDD', 'datetime:%f%d', [b'00030030', b'00000006', b'00003003', b'99999999', b'99999911'], [datetime(1970, 1, 30, microsecond=300), datetime(1970, 1, 6), datetime(1970, 1, 3, microsecond=30), None, datetime(1970, 1, 11, microsecond=999999)], None, False,),
 		('datetime mmmmmm.DD', 'datetime:%f.%d', [b'30.30', b'0.06', b'00030.03', b'999999.99', b'999999.11'], [datetime(1970, 1, 30, microsecond=300000), datetime(1970, 1, 6), datetime(1970, 1, 3, microsecond=300), None, datetime(1970, 1, 11, microsecond=999999)], None, False,),
 		('datetime unix.f', 'datetime:%s.%f', [b'30.30', b'1558662853.847211', b''], [datetime(1970, 1, 1, 0, 0, 30, 300000), datetime(2019, 5, 24, 1, 54, 13, 847211), datetime(1970, 1, 1, microsecond=100000)], '0.1', False,),
+		# These use the fast parser, but not always successfully.
+		('datetime ISO', 'datetime:%Y-%m-%dT%H:%M:%S', [b'2019-05-21T18:52:06', b'2019-5-21T18:52:06', b'2019-05-21T24:00:00', b'2019-05-21 18:52:06'], [datetime(2019, 5, 21, 18, 52, 6), datetime(2019, 5, 21, 18, 52, 6), datetime(1970, 1, 1), datetime(1970, 1, 1)], '1970-01-01T00:00:00', True,),
+		('datetime ISO.fZ', 'datetime:%Y-%m-%dT%H:%M:%S.%fZ', [b'2019-05-21T18:52:06.5Z', b'2019-05-21T18:52:06.123456Z', b'2019-05-21T18:52:06Z', b'2019-05-21T18:52:06.1'], [datetime(2019, 5, 21, 18, 52, 6, 500000), datetime(2019, 5, 21, 18, 52, 6, 123456), datetime(1970, 1, 1), datetime(1970, 1, 1)], '1970-01-01T00:00:00.0Z', False,),
+		('datetime epoch_s', 'datetime:epoch_s', [b'0', b'1558662853', b'-1', b' 253402300799 ', b'-62135596800', b'253402300800', b'1.5', b''], [datetime(1970, 1, 1), datetime(2019, 5, 24, 1, 54, 13), datetime(1969, 12, 31, 23, 59, 59), datetime(9999, 12, 31, 23, 59, 59), datetime(1, 1, 1), None, None, None], None, True,),
+		('datetime epoch_ms', 'datetime:epoch_ms', [b'1558662853847', b'-1', b'0', b'999'], [datetime(2019, 5, 24, 1, 54, 13, 847000), datetime(1969, 12, 31, 23, 59, 59, 999000), datetime(1970, 1, 1), datetime(1970, 1, 1, 0, 0, 0, 999000)], None, False,),
+		('datetime epoch_ms i', 'datetimei:epoch_ms', [b'1558662853847x', b'-1 ms'], [datetime(2019, 5, 24, 1, 54, 13, 847000), datetime(1969, 12, 31, 23, 59, 59, 999000)], None, False,),
 	]
 	if sys.version_info >= (3, 6):
 		todo.extend((
@@ -312,14 +318,21 @@ def test_filter_bad_across_types():
 	# Once with just filter_bad, once with some defaults too.
 	defaults = {}
 	for _ in range(2):
-		jid = subjobs.build(
-			'dataset_type',
-			datasets=dict(source=source_ds),
-			options=dict(column2type={t: t for t in columns}, filter_bad=True, defaults=defaults),
-		)
-		typed_ds = Dataset(jid)
-		got = list(typed_ds.iterate(0, ['int32_10', 'bytes', 'json', 'unicode:utf-8']))
-		assert got == want, "Exptected %r, got %r from %s (from %r%s)" % (want, got, typed_ds, source_ds, ' with defaults' if defaults else '')
+		# Both converting one column at a time and several at once.
+		for threads in (1, 4):
+			jid = subjobs.build(
+				'dataset_type',
+				datasets=dict(source=source_ds),
+				options=dict(column2type={t: t for t in columns}, filter_bad=True, defaults=defaults, threads=threads),
+			)
+			typed_ds = Dataset(jid)
+			got = list(typed_ds.iterate(0, ['int32_10', 'bytes', 'json', 'unicode:utf-8']))
+			assert got == want, "Exptected %r, got %r from %s (from %r%s)" % (want, got, typed_ds, source_ds, ' with defaults' if defaults else '')
+			# All columns must have lost the same lines, whichever column found them bad.
+			for colname in columns:
+				assert len(list(typed_ds.iterate(0, colname))) == len(want), "%s has the wrong number of lines in %s" % (colname, typed_ds,)
+			int_col = typed_ds.columns['int32_10']
+			assert (int_col.min, int_col.max) == (min(v[0] for v in want), max(v[0] for v in want)), "Bad minmax in %s" % (typed_ds,)
 		# make more lines "ok" for the second lap
 		defaults = {'number:int': '0', 'float64': '0', 'json': '"replacement"'}
 		add_want(data[3])
@@ -98,6 +98,8 @@ def synthesis(job):
 		'date:%Y%m%d': ['2019%02d%02d' % (t % 12 + 1, t % 28 + 1,) for t in range(1000)],
 		'time:%H:%M': ['%02d:%02d' % (t // 60, t % 60) for t in range(1000)],
 		'timei:%H:%M': ['%02d:%02d%c' % (t // 60, t % 60, chr(t % 26 + 65)) for t in range(1000)],
+		'unicode:utf-8': cycle(['x%d' % (t,) for t in range(77)] + ['']),
+		'bits64_10': ['%d' % (t * 7919 ** 4,) for t in range(1000)],
 	}
 	gens = []
 	for coltype, gen in cols.items():
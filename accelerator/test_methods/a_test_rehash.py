@@ -22,9 +22,11 @@ from __future__ import unicode_literals
 
 description = r'''
 Verify the dataset_rehash method with various options.
+Also verify that all column types are copied correctly, with correct
+min/max, hashing on all types that can be hashed on.
 '''
 
-from datetime import date
+from datetime import date, datetime, time
 
 from accelerator import subjobs
 from accelerator.dataset import DatasetWriter, Dataset
@@ -107,3 +109,81 @@ def synthesis(params):
 	a = verify(params.slices, data, ds, hashlabel="date")
 	b = verify(params.slices, data + bonus_data, bonus_ds, hashlabel="date", previous=a)
 	assert b.chain() == [a, b], "chain of %s is not [%s, %s] as expected" % (b, a, b)
+
+	verify_all_types(params.slices)
+
+all_types = {
+	"number": "number",
+	"float64": "float64",
+	"float32": "float32",
+	"int64": "int64",
+	"int32": "int32",
+	"bits64": "bits64",
+	"bits32": "bits32",
+	"bool": "bool",
+	"datetime": "datetime",
+	"date": "date",
+	"time": "time",
+	"bytes": "bytes",
+	"ascii": "ascii",
+	"unicode": "unicode",
+	"json": "json",
+}
+
+def all_types_row(ix):
+	none = (ix % 17 == 0) # (except for bits, they can't be None)
+	return {
+		"number": None if none else [ix, ix + 0.5, 2 ** 100 + ix, -ix * 2 ** 60][ix % 4],
+		"float64": None if none else ix / 7,
+		"float32": None if none else ix / 4,
+		"int64": None if none else ix * 2 ** 40 - 2 ** 50,
+		"int32": None if none else 1000 - ix * 3,
+		"bits64": ix * 2 ** 50,
+		"bits32": ix * 3,
+		"bool": None if none else bool(ix % 3),
+		"datetime": None if none else datetime(2019, 1 + ix % 12, 1 + ix % 28, ix % 24, ix % 60, ix % 60, ix),
+		"date": None if none else date(1900 + ix, 1 + ix % 12, 1 + ix % 28),
+		"time": None if none else time(ix % 24, ix % 60, ix % 60, ix * 3),
+		"bytes": None if none else b"b%d" % (ix,) * (ix % 50),
+		"ascii": None if none else "a%d" % (ix,),
+		"unicode": None if none else "\xe5%d" % (ix,) * (ix % 30),
+		"json": None if none else {"ix": [ix, "%d" % (ix,)]},
+	}
+
+def verify_all_types(slices):
+	rows = [all_types_row(ix) for ix in range(500)]
+	dw = DatasetWriter(columns=all_types, name="all types")
+	w = dw.get_split_write_dict()
+	for row in rows[:300]:
+		w(row)
+	first = dw.finish()
+	dw = DatasetWriter(columns=all_types, name="all types again", previous=first)
+	w = dw.get_split_write_dict()
+	for row in rows[300:]:
+		w(row)
+	source = dw.finish()
+	names = sorted(all_types)
+	def minmax(values):
+		values = [v for v in values if v is not None]
+		return (min(values), max(values)) if values else (None, None)
+	for hl in sorted(all_types):
+		if hl == "json":
+			continue
+		for as_chain in (False, True):
+			ds = Dataset(subjobs.build("dataset_rehash", datasets=dict(source=source), options=dict(hashlabel=hl, as_chain=as_chain)))
+			h = typed_writer(all_types[hl]).hash
+			for sliceno in range(slices):
+				got = list(ds.iterate_chain(sliceno, names))
+				for row in got:
+					assert h(row[names.index(hl)]) % slices == sliceno, "%s has %r in the wrong slice" % (ds, row,)
+				want = list(source.iterate_chain(sliceno, names, hashlabel=hl, rehash=True))
+				assert sorted(map(repr, got)) == sorted(map(repr, want)), "%s (rehashed on %s) has the wrong lines in slice %d" % (ds, hl, sliceno,)
+			for part in ds.chain():
+				for colname in names:
+					if colname == "json":
+						continue
+					col = part.columns[colname]
+					assert col.type == all_types[colname]
+					want = minmax(part.iterate(None, colname))
+					assert (col.min, col.max) == want, "%s (rehashed on %s) has min/max %r for %s, wanted %r" % (part, hl, (col.min, col.max), colname, want,)
+			assert sum(sum(part.lines) for part in ds.chain()) == len(rows)
@@ -0,0 +1,96 @@
+############################################################################
+#                                                                          #
+# Copyright (c) 2019 Carl Drougge                                          #
+#                                                                          #
+# Licensed under the Apache License, Version 2.0 (the "License");          #
+# you may not use this file except in compliance with the License.         #
+# You may obtain a copy of the License at                                  #
+#                                                                          #
+#  http://www.apache.org/licenses/LICENSE-2.0                              #
+#                                                                          #
+# Unless required by applicable law or agreed to in writing, software      #
+# distributed under the License is distributed on an "AS IS" BASIS,        #
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. #
+# See the License for the specific language governing permissions and      #
+# limitations under the License.                                           #
+#                                                                          #
+############################################################################
+
+from __future__ import print_function
+from __future__ import division
+from __future__ import unicode_literals
+
+description = r'''
+Verify that iterating with rehash=True in analysis (where the slices
+share the work of splitting each source slice) gives the same lines in
+the same order as filtering the whole dataset in every slice does.
+'''
+
+from glob import glob
+
+from accelerator.dataset import DatasetWriter
+from accelerator.extras import DotDict
+
+columns = ["f", "j", "k", "n", "u"]
+
+def mkrow(ix):
+	return (
+		ix / 3.0,
+		{"ix": ix},
+		None if ix % 17 == 0 else "%d" % (ix % 113,),
+		ix % 7 if ix % 5 else 2 ** 70 + ix,
+		"\xe5" * (ix % 300),
+	)
+
+def prepare(params):
+	dws = DotDict()
+	previous = None
+	for name in ("first", "second"):
+		dw = DatasetWriter(name=name, previous=previous)
+		dw.add("f", "float64")
+		dw.add("j", "json")
+		dw.add("k", "unicode")
+		dw.add("n", "number")
+		dw.add("u", "unicode")
+		dws[name] = dw
+		previous = dw
+	for sliceno in range(params.slices):
+		for dw in dws.values():
+			dw.set_slice(sliceno)
+		for ix in range(sliceno * 1000, sliceno * 1000 + 300 + sliceno * 50):
+			dws.first.write(*mkrow(ix))
+			if sliceno != 1: # an empty slice in the chain
+				dws.second.write(*mkrow(-ix))
+	return dws
+
+def old_style(ds, sliceno, hashlabel, cols):
+	# What iteration did before sharing the rehash.
+	return list(ds._hashfilter(sliceno, hashlabel, zip(*ds._iterator(None, cols))))
+
+def analysis(sliceno, job):
+	first = job.dataset("first")
+	second = job.dataset("second")
+	res = {}
+	for hashlabel in ("k", "n", "f"):
+		for ds in (first, second):
+			want = old_style(ds, sliceno, hashlabel, columns)
+			got = list(ds.iterate(sliceno, columns, hashlabel=hashlabel, rehash=True))
+			assert got == want, "Rehashing %s on %s differs in slice %d" % (ds, hashlabel, sliceno,)
+			# Only some of the columns, so the rest are split later.
+			got = list(ds.iterate(sliceno, ["u", hashlabel], hashlabel=hashlabel, rehash=True))
+			assert got == [(line[4], line[columns.index(hashlabel)]) for line in want], "Rehashing %s on %s with fewer columns differs in slice %d" % (ds, hashlabel, sliceno,)
+		# (second only has negative f, so the range only keeps lines from first.)
+		got = list(second.iterate_chain(sliceno, "j", hashlabel=hashlabel, rehash=True, range={"f": (10, 2000)}))
+		want = [j for f, j in old_style(first, sliceno, hashlabel, ["f", "j"]) if 10 <= f < 2000]
+		assert got == want, "Rehashing chain on %s with range differs in slice %d" % (hashlabel, sliceno,)
+		res[hashlabel] = list(second.iterate_chain(sliceno, "j", hashlabel=hashlabel, rehash=True))
+	return res
+
+def synthesis(analysis_res, job):
+	all_j = sorted(job.dataset("second").iterate_chain(None, "j"), key=lambda j: j["ix"])
+	analysis_res = list(analysis_res)
+	for hashlabel in ("k", "n", "f"):
+		got = [j for part in analysis_res for j in part[hashlabel]]
+		assert sorted(got, key=lambda j: j["ix"]) == all_j, "Rehashing on %s lost or duplicated lines" % (hashlabel,)
+	# The temp files are removed when the job finishes.
+	assert glob(job.filename("rehash-*")), "Rehashing was not shared between slices"
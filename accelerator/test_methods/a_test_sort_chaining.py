@@ -23,12 +23,60 @@ from __future__ import unicode_literals
 description = r'''
 Test dataset_sort as a chain, across a chain and as a chain merging
 only two datasets of the original chain.
+
+Also test incremental sorting, which should give the same result as
+sorting everything again.
 '''
 
+from os.path import exists
+
 from accelerator import subjobs
+from accelerator.job import Job
 from accelerator.dataset import Dataset, DatasetWriter
 
-def synthesis():
+def check_incremental(params):
+	previous = None
+	for ix in range(3):
+		dw = DatasetWriter(name='incr%d' % (ix,), columns={'num': 'int32', 'ix': 'int32', 'txt': 'ascii'}, hashlabel='ix', previous=previous)
+		w = dw.get_split_write()
+		for v in range(ix * 100, ix * 100 + 97):
+			w(v * 7919 % 37 if v % 13 else None, v, 'line %d' % (v,))
+		previous = dw.finish()
+	for sort_across_slices in (False, True):
+		for memory_budget in (0, 1):
+			opts = dict(
+				sort_columns=['num', 'txt'] if memory_budget else 'num',
+				sort_order='descending',
+				sort_across_slices=sort_across_slices,
+				memory_budget=memory_budget,
+			)
+			jid = None
+			for ix in range(3):
+				jid = subjobs.build('dataset_sort', options=dict(opts, incremental=True), datasets=dict(source=params.jobid.dataset('incr%d' % (ix,)), previous=jid))
+				# compare to sorting it all
+				all_jid = subjobs.build('dataset_sort', options=opts, datasets=dict(source=params.jobid.dataset('incr%d' % (ix,)), previous=None))
+				ds = jid.dataset()
+				all_ds = all_jid.dataset()
+				assert ds.previous is None
+				if sort_across_slices:
+					# the lines may be sliced differently
+					got = list(ds.iterate(None, ['num', 'ix', 'txt']))
+					want = list(all_ds.iterate(None, ['num', 'ix', 'txt']))
+					assert got == want, 'incremental sort %r of incr%d differs' % (opts, ix,)
+					# The slice boundaries come from block starts, so the slices are only about even.
+					assert sum(ds.lines) == sum(all_ds.lines), 'incremental sort %r of incr%d lost lines' % (opts, ix,)
+					# The new part is sorted in blocks (as a subjob), so the merge can seek in it.
+					for sub in jid.post.subjobs:
+						for sliceno in range(params.slices):
+							assert exists(Job(sub).filename('sort_blocks', sliceno)), 'incremental sort %r of incr%d has no blocks in %s' % (opts, ix, sub,)
+					continue
+				assert ds.hashlabel == 'ix'
+				for sliceno in range(params.slices):
+					got = list(ds.iterate(sliceno, ['num', 'ix', 'txt']))
+					want = list(all_ds.iterate(sliceno, ['num', 'ix', 'txt']))
+					assert got == want, 'incremental sort %r of incr%d differs in slice %d' % (opts, ix, sliceno,)
+
+def synthesis(params):
 	dw_a = DatasetWriter(name='a', columns={'num': 'int32'})
 	dw_b = DatasetWriter(name='b', columns={'num': 'int32'}, previous=dw_a)
 	dw_c = DatasetWriter(name='c', columns={'num': 'int32'}, previous=dw_b)
@@ -61,9 +109,14 @@ def synthesis():
 	# sort all as a single dataset
 	jid = subjobs.build('dataset_sort', options=opts, datasets=dict(source=c, previous=None))
 	assert list(Dataset(jid).iterate_chain(None, 'num')) == [0, 1, 2, 2, 3]
+	# and with the external sort
+	jid = subjobs.build('dataset_sort', options=dict(opts, memory_budget=1), datasets=dict(source=c, previous=None))
+	assert list(Dataset(jid).iterate_chain(None, 'num')) == [0, 1, 2, 2, 3]
 
 	# merge b and c but not a
 	jid = subjobs.build('dataset_sort', options=opts, datasets=dict(source=c, previous=sorted_a))
 	# test with new style job.dataset
 	assert list(jid.dataset().iterate(None, 'num')) == [0, 1, 2]
 	assert list(jid.dataset().iterate_chain(None, 'num')) == [2, 3, 0, 1, 2]
+
+	check_incremental(params)
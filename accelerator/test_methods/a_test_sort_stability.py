@@ -58,16 +58,19 @@ def analysis(sliceno, prepare_res):
 def synthesis(params, prepare_res):
 	dw = prepare_res
 	source = dw.finish()
-	jid = subjobs.build(
-		"dataset_sort",
-		options=dict(
-			sort_columns="num",
-			sort_across_slices=True,
-		),
-		datasets=dict(source=source),
-	)
-	ds = Dataset(jid)
-	data = list(ds.iterate(None, "str"))
 	good = list("cghjabdefi") + \
 	       [str(sliceno) for sliceno in range(params.slices)] * 64
-	assert data == good
+	# Also with the external sort, both in memory sized runs and merged.
+	for memory_budget in (0, 1, 4000):
+		jid = subjobs.build(
+			"dataset_sort",
+			options=dict(
+				sort_columns="num",
+				sort_across_slices=True,
+				memory_budget=memory_budget,
+			),
+			datasets=dict(source=source),
+		)
+		ds = Dataset(jid)
+		data = list(ds.iterate(None, "str"))
+		assert data == good, "Unstable sort with memory_budget=%d" % (memory_budget,)
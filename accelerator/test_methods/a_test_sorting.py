@@ -46,12 +46,13 @@ def unnan(l):
 		tuple('NaN' if isinstance(v, float) and isnan(v) else v for v in t)
 	for t in l]
 
-def check_one(slices, key, source, reverse=False):
+def check_one(slices, key, source, reverse=False, memory_budget=0):
 	jid = subjobs.build(
 		"dataset_sort",
 		options=dict(
 			sort_columns=key,
 			sort_order="descending" if reverse else "ascending",
+			memory_budget=memory_budget,
 		),
 		datasets=dict(source=source),
 	)
@@ -93,22 +94,36 @@ def synthesis(params):
 	# Test that all datatypes work for sorting
 	for key in test_data.data:
 		check_one(params.slices, key, source)
+	# And with the external sort, with one line per run (so the runs
+	# are merged in several steps) and with a few lines per run.
+	for key in test_data.data:
+		check_one(params.slices, key, source, memory_budget=1)
+	for key in ("ascii", "float64", "int64", "datetime"):
+		check_one(params.slices, key, source, memory_budget=20000)
 	# Check reverse sorting
 	check_one(params.slices, "int32", source, reverse=True)
+	check_one(params.slices, "int32", source, reverse=True, memory_budget=20000)
 	# Check that sorting across slices and by two columns works
-	jid = subjobs.build(
-		"dataset_sort",
-		options=dict(
-			sort_columns=["int64", "int32"],
-			sort_order="descending",
-			sort_across_slices=True,
-		),
-		datasets=dict(source=source),
-	)
 	int64_off = sorted(test_data.data).index("int64")
 	int32_off = sorted(test_data.data).index("int32")
-	all_data = chain.from_iterable(test_data.sort_data_for_slice(sliceno) for sliceno in range(params.slices))
+	all_data = list(chain.from_iterable(test_data.sort_data_for_slice(sliceno) for sliceno in range(params.slices)))
 	good = sorted(all_data, key=lambda t: (noneninf(t[int64_off]), noneninf(t[int32_off]),), reverse=True)
-	ds = Dataset(jid)
-	check = list(ds.iterate(None))
-	assert unnan(check) == unnan(good), "Sorting across slices on [int64, int32] bad (%s)" % (jid,)
+	for memory_budget in (0, 1, 20000):
+		jid = subjobs.build(
+			"dataset_sort",
+			options=dict(
+				sort_columns=["int64", "int32"],
+				sort_order="descending",
+				sort_across_slices=True,
+				memory_budget=memory_budget,
+			),
+			datasets=dict(source=source),
+		)
+		ds = Dataset(jid)
+		check = list(ds.iterate(None))
+		assert unnan(check) == unnan(good), "Sorting across slices on [int64, int32] bad (%s)" % (jid,)
+		lines = ds.lines
+		# The external sort picks the slice boundaries from where blocks
+		# start, so those slices are only about even.
+		allowed = sum(lines) // 20 if memory_budget else 1
+		assert max(lines) - min(lines) <= allowed, "Sorting across slices gave uneven slices (%s)" % (jid,)
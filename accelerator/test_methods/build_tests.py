@@ -20,6 +20,8 @@ from __future__ import print_function
 from __future__ import division
 from __future__ import unicode_literals
 
+import time
+
 from accelerator.dataset import Dataset
 from accelerator.build import JobError
 
@@ -42,6 +44,7 @@ def main(urd):
 	reimp_csv_quoted = urd.build("csvimport", options=dict(filename=csv_quoted.filename(csvname), quotes=True))
 	urd.build("test_compare_datasets", datasets=dict(a=reimp_csv, b=reimp_csv_uncompressed))
 	urd.build("test_compare_datasets", datasets=dict(a=reimp_csv, b=reimp_csv_quoted))
+	urd.build("test_csvexport")
 	urd.build("test_dataset_column_names")
 	urd.build("test_dataset_merge")
 
@@ -49,6 +52,10 @@ def main(urd):
 	print("Testing csvimport with more difficult files")
 	urd.build("test_csvimport_corner_cases")
 	urd.build("test_csvimport_separators")
+	urd.build("test_csvimport_slicing")
+	urd.build("test_csvimport_files")
+	urd.build("test_csvimport_typed")
+	urd.build("test_csvimport_hashed")
 
 	print()
 	print("Testing subjobs and dataset typing")
@@ -79,6 +86,13 @@ def main(urd):
 	urd.build("test_sort_stability")
 	urd.build("test_sort_chaining")
 	urd.build("test_rehash")
+	urd.build("test_rehash_iterate")
+	urd.build("test_dataset_compact")
+	urd.build("test_dataset_sample")
+	urd.build("test_dataset_dedup")
+	urd.build("test_dataset_sketch")
+	urd.build("test_dataset_diff")
+	urd.build("test_dataset_split")
 	urd.build("test_dataset_type_hashing")
 	urd.build("test_dataset_type_chaining")
 
@@ -112,3 +126,16 @@ def main(urd):
 	urd.build("test_json")
 	urd.build("test_jobwithfile")
 	urd.build("test_report")
+
+	print()
+	print("Test building without waiting")
+	when = time.time() # always new jobs
+	jobs = [urd.build("test_concurrency", options=dict(n=n, when=when), wait=False) for n in range(3)]
+	urd.build("test_concurrency", options=dict(n=3, when=when), jobids=dict(previous=jobs[-1]))
+	times = sorted(job.load() for job in jobs)
+	if (urd.info.concurrency or urd.info.slices) >= 2 * urd.info.slices:
+		assert times[1][0] < times[0][1], "Jobs built without waiting didn't run at the same time: %r" % (times,)
+	else:
+		# Only room for one job at a time
+		for a, b in zip(times, times[1:]):
+			assert a[1] <= b[0], "Jobs ran at the same time without room for it: %r" % (times,)
@@ -49,6 +49,10 @@ def method_mod(name):
 
 dataset_typemodule = method_mod('dataset_type')
 csvimportmodule = method_mod('csvimport')
+dataset_rehashmodule = method_mod('dataset_rehash')
+dataset_sortmodule = method_mod('dataset_sort')
+dataset_checksummodule = method_mod('dataset_checksum')
+csvexportmodule = method_mod('csvexport')
 
 setup(
 	name="accelerator",
@@ -67,7 +71,7 @@ setup(
 		'bottle>=0.12.7',
 	],
 
-	ext_modules=[gzutilmodule, dataset_typemodule, csvimportmodule],
+	ext_modules=[gzutilmodule, dataset_typemodule, csvimportmodule, dataset_rehashmodule, dataset_sortmodule, dataset_checksummodule, csvexportmodule],
 
 	package_data={
 		'': ['*.txt', 'methods.conf'],